@@ -405,6 +405,48 @@ DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 API_LOG_ENABLE = True
 # API_LOG_METHODS = 'ALL' # ['POST', 'DELETE']
 API_LOG_METHODS = ["POST", "UPDATE", "DELETE", "PUT"]  # ['POST', 'DELETE']
+# 文档全文检索后端：auto（按数据库自动选择）/ fts5 / mysql_fulltext / inverted / 自定义后端类导入路径
+DOCUMENT_SEARCH_BACKEND = locals().get("DOCUMENT_SEARCH_BACKEND", "auto")
+# 文档派生数据（预览、字数、目录大纲）超过该字符数时提交 Celery 异步计算
+DOCUMENT_DERIVATIVE_ASYNC_THRESHOLD = locals().get("DOCUMENT_DERIVATIVE_ASYNC_THRESHOLD", 200 * 1024)
+# 文档正文内容存储：None（关闭，正文保存在 detail_text）/ local（本地文件）/ s3（S3 兼容对象存储）/ 自定义后端类导入路径
+DOCUMENT_CONTENT_STORE = locals().get("DOCUMENT_CONTENT_STORE", None)
+# 内容存储本地目录（local 存储及 s3 本地模拟使用）
+DOCUMENT_CONTENT_ROOT = locals().get("DOCUMENT_CONTENT_ROOT", os.path.join(BASE_DIR, "content_store"))
+# 内容压缩方式：None / zlib / zstd（需安装 zstandard）
+DOCUMENT_CONTENT_COMPRESSION = locals().get("DOCUMENT_CONTENT_COMPRESSION", None)
+# S3 兼容对象存储配置（endpoint_url 为空时使用本地模拟）
+DOCUMENT_CONTENT_S3 = locals().get("DOCUMENT_CONTENT_S3", {
+    "endpoint_url": "", "bucket": "documents", "access_key": "", "secret_key": "", "prefix": ""
+})
+# 文档语义检索索引目录（每个知识库一个子目录，向量分段为 .npy 文件）与向量维度
+DOCUMENT_SEMANTIC_INDEX_ROOT = locals().get("DOCUMENT_SEMANTIC_INDEX_ROOT", os.path.join(BASE_DIR, "semantic_index"))
+DOCUMENT_SEMANTIC_DIMENSIONS = locals().get("DOCUMENT_SEMANTIC_DIMENSIONS", 100)
+# 编辑器自动保存草稿落库间隔（秒），草稿先写缓存，每个用户每篇文档至多每 N 秒写一次数据库
+DOCUMENT_DRAFT_FLUSH_INTERVAL = locals().get("DOCUMENT_DRAFT_FLUSH_INTERVAL", 30)
+# Git 同步本地工作区目录（每个知识库一个子目录）与同步生成的文档类型ID
+GIT_SYNC_ROOT = locals().get("GIT_SYNC_ROOT", os.path.join(BASE_DIR, "git_sync"))
+GIT_SYNC_DOCUMENT_TYPE_ID = locals().get("GIT_SYNC_DOCUMENT_TYPE_ID", 1)
+# Git 同步允许的仓库地址协议（scp 形式 user@host:path 视为 ssh；本地路径为 file，默认不允许）
+GIT_SYNC_ALLOWED_SCHEMES = locals().get("GIT_SYNC_ALLOWED_SCHEMES", ("https", "ssh"))
+# 文档阅读排行统计天数、排行保留条数、按天阅读统计保留天数
+DOCUMENT_POPULAR_DAYS = locals().get("DOCUMENT_POPULAR_DAYS", 7)
+DOCUMENT_POPULAR_SIZE = locals().get("DOCUMENT_POPULAR_SIZE", 50)
+DOCUMENT_VIEW_RETENTION_DAYS = locals().get("DOCUMENT_VIEW_RETENTION_DAYS", 90)
+# 知识库变更日志（客户端增量同步）保留天数
+REPOSITORY_CHANGE_RETENTION_DAYS = locals().get("REPOSITORY_CHANGE_RETENTION_DAYS", 30)
+# 变更日志安全水位（秒）：只返回写入超过该时间的日志，避免序号提交乱序时客户端跳过变更
+REPOSITORY_CHANGE_SAFE_LAG = locals().get("REPOSITORY_CHANGE_SAFE_LAG", 2)
+# 归档知识库静态文件目录；配置 nginx 内部 location 前缀后由 nginx 返回静态文件（X-Accel-Redirect）
+STATIC_SITE_ROOT = locals().get("STATIC_SITE_ROOT", os.path.join(BASE_DIR, "static_site"))
+STATIC_SITE_ACCEL_REDIRECT = locals().get("STATIC_SITE_ACCEL_REDIRECT", None)
+# 归档静态文件访问地址的有效期（秒）
+STATIC_SITE_URL_MAX_AGE = locals().get("STATIC_SITE_URL_MAX_AGE", 60 * 60)
+# 回收站知识库保留天数，超过后由定时任务分批彻底删除（每批文档数、批次间暂停秒数、每次执行的时间上限秒数）
+REPOSITORY_RECYCLE_RETENTION_DAYS = locals().get("REPOSITORY_RECYCLE_RETENTION_DAYS", 30)
+REPOSITORY_PURGE_BATCH_SIZE = locals().get("REPOSITORY_PURGE_BATCH_SIZE", 500)
+REPOSITORY_PURGE_PAUSE = locals().get("REPOSITORY_PURGE_PAUSE", 0.5)
+REPOSITORY_PURGE_MAX_SECONDS = locals().get("REPOSITORY_PURGE_MAX_SECONDS", 60 * 10)
 API_MODEL_MAP = {
     "/token/": "登录模块",
     "/api/login/": "登录模块",
@@ -413,6 +455,39 @@ API_MODEL_MAP = {
 
 DJANGO_CELERY_BEAT_TZ_AWARE = False
 CELERY_TIMEZONE = "Asia/Shanghai"  # celery 时区问题
+# 内置定时任务（django_celery_beat 启动时同步到数据库）
+CELERY_BEAT_SCHEDULE = locals().get("CELERY_BEAT_SCHEDULE", {
+    # 每天压缩一次文档修订历史
+    "compact_document_revisions": {
+        "task": "dvadmin.system.tasks.compact_document_revisions",
+        "schedule": 60 * 60 * 24,
+    },
+    # 每 5 分钟重放未落库的自动保存草稿（落库任务丢失时兜底）
+    "replay_document_drafts": {
+        "task": "dvadmin.system.tasks.replay_document_drafts",
+        "schedule": 60 * 5,
+    },
+    # 每 5 分钟合并缓存中的文档阅读计数
+    "flush_document_views": {
+        "task": "dvadmin.system.tasks.flush_document_views",
+        "schedule": 60 * 5,
+    },
+    # 每天压缩一次知识库变更日志
+    "compact_repository_changes": {
+        "task": "dvadmin.system.tasks.compact_repository_changes",
+        "schedule": 60 * 60 * 24,
+    },
+    # 每小时清理一次回收站中超过保留天数的知识库（单次限时，未完成的下次继续）
+    "purge_recycled_repositories": {
+        "task": "dvadmin.system.tasks.purge_recycled_repositories",
+        "schedule": 60 * 60,
+    },
+    # 每天清理一次不再被引用的正文内容（内容存储）
+    "collect_content_garbage": {
+        "task": "dvadmin.system.tasks.collect_content_garbage",
+        "schedule": 60 * 60 * 24,
+    },
+})
 # 静态页面压缩
 STATICFILES_STORAGE = "whitenoise.storage.CompressedStaticFilesStorage"
 
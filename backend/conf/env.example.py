@@ -48,3 +48,49 @@ LOGIN_NO_CAPTCHA_AUTH = True
 ALLOWED_HOSTS = ["*"]
 # 列权限中排除App应用
 COLUMN_EXCLUDE_APPS = []
+# ================================================= #
+# **************** 文档正文内容存储  **************** #
+# ================================================= #
+# None 关闭（正文保存在数据库 detail_text）/ local 本地文件 / s3 S3兼容对象存储（MinIO）
+# 开启后执行 python manage.py migrate_document_content 迁移已有正文
+DOCUMENT_CONTENT_STORE = None
+# 压缩方式：None / zlib / zstd（需安装 zstandard）
+DOCUMENT_CONTENT_COMPRESSION = None
+# ================================================= #
+# ****************** 文档语义检索  ****************** #
+# ================================================= #
+# 索引目录（默认 backend/semantic_index），执行 python manage.py build_semantic_index 构建
+# DOCUMENT_SEMANTIC_INDEX_ROOT = "/data/semantic_index"
+DOCUMENT_SEMANTIC_DIMENSIONS = 100
+# ================================================= #
+# ****************** Git 仓库同步  ****************** #
+# ================================================= #
+# 本地工作区目录（默认 backend/git_sync），执行 python manage.py sync_git_repository 同步
+# GIT_SYNC_ROOT = "/data/git_sync"
+GIT_SYNC_DOCUMENT_TYPE_ID = 1
+# 允许的仓库地址协议（https、ssh；不允许 file、ext 等可访问服务器本地文件或执行命令的地址）
+GIT_SYNC_ALLOWED_SCHEMES = ("https", "ssh")
+# ================================================= #
+# ****************** 文档阅读排行  ****************** #
+# ================================================= #
+# 排行统计最近 N 天、排行保留条数、按天阅读统计保留天数
+DOCUMENT_POPULAR_DAYS = 7
+DOCUMENT_POPULAR_SIZE = 50
+DOCUMENT_VIEW_RETENTION_DAYS = 90
+# ================================================= #
+# **************** 归档知识库静态化  **************** #
+# ================================================= #
+# 静态文件目录（默认 backend/static_site），执行 python manage.py build_static_sites 重新生成
+# STATIC_SITE_ROOT = "/data/static_site"
+# 由 nginx 返回静态文件：配置内部 location 后填写其前缀，如
+# location /static_site_internal/ { internal; alias /data/static_site/; gzip_static on; }
+STATIC_SITE_ACCEL_REDIRECT = None
+# ================================================= #
+# **************** 回收站知识库清理  **************** #
+# ================================================= #
+# 回收超过保留天数的知识库由定时任务彻底删除（不可恢复）
+REPOSITORY_RECYCLE_RETENTION_DAYS = 30
+# 每批删除的文档数、批次之间暂停的秒数、每次执行的时间上限（秒）
+REPOSITORY_PURGE_BATCH_SIZE = 500
+REPOSITORY_PURGE_PAUSE = 0.5
+REPOSITORY_PURGE_MAX_SECONDS = 600
@@ -0,0 +1,47 @@
+import logging
+
+from django.db import transaction
+from django.db.models import Max, Min, Value
+from django.db.models.functions import Concat
+from django.core.management.base import BaseCommand
+
+from dvadmin.system.models import Category, MmDocument
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    tree_path 编码升级: python manage.py backfill_tree_path
+    将旧格式“101,102”按主键区间分批改写为首尾带分隔符的新格式“,101,102,”（可重复执行，已转换的行会跳过）
+    例如：python manage.py backfill_tree_path --batch_size 5000
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch_size", type=int, default=5000, help="每批处理的主键区间大小")
+
+    def backfill(self, model, batch_size):
+        bounds = model.objects.aggregate(min_id=Min("id"), max_id=Max("id"))
+        if bounds["min_id"] is None:
+            return 0
+        total = 0
+        for start in range(bounds["min_id"], bounds["max_id"] + 1, batch_size):
+            with transaction.atomic():
+                total += model.objects.filter(
+                    id__gte=start, id__lt=start + batch_size
+                ).exclude(tree_path__isnull=True).exclude(tree_path="").exclude(tree_path__startswith=",").update(
+                    tree_path=Concat(Value(","), "tree_path", Value(","))
+                )
+        return total
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        print("正在转换目录路径编码...")
+        categories = self.backfill(Category, batch_size)
+        print(f"目录路径转换完成，共 {categories} 条")
+        documents = self.backfill(MmDocument, batch_size)
+        print(f"文档路径转换完成，共 {documents} 条")
+        if categories:
+            from dvadmin.utils.category_tree import bump_tree_version
+            bump_tree_version(*Category.objects.values_list("repository_id", flat=True).distinct().order_by())
+        print("tree_path 编码升级完成！")
@@ -0,0 +1,74 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from dvadmin.system.models import MmDocument, MmDocumentDerivative
+from dvadmin.utils.document_derivatives import compute_derivatives, content_hash, strip_markup
+from dvadmin.utils.document_minhash import refresh_signature
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    回填文档派生数据（预览、字数、目录大纲）及近似重复检测签名: python manage.py build_document_derivatives
+    例如：
+    回填全部缺失/过期的派生数据：python manage.py build_document_derivatives
+    只处理某个知识库：python manage.py build_document_derivatives --repository_id 1
+    全部强制重新计算：python manage.py build_document_derivatives --force
+    提交到 Celery 异步计算：python manage.py build_document_derivatives --async
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repository_id", type=int, default=None, help="知识库ID，不传则处理全部")
+        parser.add_argument("--batch_size", type=int, default=200, help="每批处理的文档数")
+        parser.add_argument("--force", action="store_true", help="正文未变化也重新计算")
+        parser.add_argument("--async", action="store_true", dest="async_", help="提交 Celery 任务异步计算")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        queryset = MmDocument.objects.all()
+        if options["repository_id"]:
+            queryset = queryset.filter(category__repository_id=options["repository_id"])
+        print("正在回填文档派生数据...")
+        last_id, total, changed = None, 0, 0
+        while True:
+            # 按主键分批，避免一次载入全部正文
+            batch = queryset.order_by("id")
+            if last_id is not None:
+                batch = batch.filter(id__gt=last_id)
+            # 通过模型实例读取正文（正文可能在内容存储中）
+            rows = [{"id": document.id, "detail_text": document.detail_text}
+                    for document in batch.only("id", "detail_text", "content_hash")[:batch_size]]
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+            total += len(rows)
+            hashes = dict(MmDocumentDerivative.objects.filter(document_id__in=[row["id"] for row in rows]).values_list(
+                "document_id", "content_hash"))
+            pending = [row for row in rows if options["force"] or hashes.get(row["id"]) != content_hash(row["detail_text"])]
+            if options["async_"]:
+                from dvadmin.system.tasks import async_build_document_derivatives
+                for row in pending:
+                    async_build_document_derivatives.delay(row["id"])
+            else:
+                creates, updates, signatures = [], [], []
+                now = timezone.now()
+                for row in pending:
+                    plain_text = strip_markup(row["detail_text"] or "")
+                    derivative = MmDocumentDerivative(document_id=row["id"], update_time=now,
+                                                      **compute_derivatives(row["detail_text"], plain_text))
+                    (updates if row["id"] in hashes else creates).append(derivative)
+                    signatures.append((row["id"], plain_text, derivative.content_hash))
+                MmDocumentDerivative.objects.bulk_create(creates, batch_size=batch_size)
+                MmDocumentDerivative.objects.bulk_update(updates, fields=[
+                    "content_hash", "text_length", "preview", "plain_length", "char_count", "word_count", "toc",
+                    "update_time"
+                ], batch_size=batch_size)
+                # 与逐个保存时一致，同时更新近似重复检测签名
+                for document_id, plain_text, text_hash in signatures:
+                    refresh_signature(document_id, plain_text, text_hash)
+            changed += len(pending)
+            print(f"已处理 {total} 个文档，更新 {changed} 个")
+        print(f"文档派生数据回填完成，共处理 {total} 个文档，更新 {changed} 个！")
@@ -0,0 +1,36 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.system.models import MmRepository
+from dvadmin.utils.semantic_index import refresh_index
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    构建/更新文档语义检索索引: python manage.py build_semantic_index
+    索引基于文档派生数据中的纯文本，历史文档需先执行 build_document_derivatives
+    例如：
+    增量更新全部知识库（未建立索引的知识库整体构建）：python manage.py build_semantic_index
+    只处理某个知识库：python manage.py build_semantic_index --repository_id 1
+    整体重建（重新拟合词表与 SVD）：python manage.py build_semantic_index --full
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repository_id", type=int, default=None, help="知识库ID，不传则处理全部")
+        parser.add_argument("--full", action="store_true", help="整体重建")
+
+    def handle(self, *args, **options):
+        repository_ids = [options["repository_id"]] if options["repository_id"] else list(
+            MmRepository.objects.values_list("id", flat=True))
+        for repository_id in repository_ids:
+            print(f"正在更新知识库[{repository_id}]语义索引...")
+            result = refresh_index(repository_id, full=options["full"])
+            if result is None:
+                print(f"知识库[{repository_id}]语义索引正在被其他进程更新，已跳过")
+                continue
+            rebuilt, count = result
+            print(f"知识库[{repository_id}]语义索引{'整体重建' if rebuilt else '增量更新'}完成，处理 {count} 个文档")
+        print("语义索引更新完成！")
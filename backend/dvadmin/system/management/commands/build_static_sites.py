@@ -0,0 +1,29 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.system.models import MmRepository
+from dvadmin.utils.static_site import build_site
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    生成归档知识库的静态文件: python manage.py build_static_sites
+    例如：
+    全部归档知识库：python manage.py build_static_sites
+    指定知识库：python manage.py build_static_sites --repository_id 1
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repository_id", type=int, default=None, help="知识库ID（默认全部已归档的知识库）")
+
+    def handle(self, *args, **options):
+        queryset = MmRepository.objects.filter(status="archived")
+        if options["repository_id"]:
+            queryset = queryset.filter(id=options["repository_id"])
+        for repository_id in queryset.values_list("id", flat=True):
+            manifest = build_site(repository_id)
+            if manifest:
+                print(f"知识库[{repository_id}]静态化完成：{manifest['documents']} 篇文档，版本 {manifest['build']}")
@@ -0,0 +1,28 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.utils.content_store import collect_garbage
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    清理内容存储中不再被引用的正文内容: python manage.py collect_content_garbage
+    不被任何文档、内容存储快照修订引用的内容及其元数据被删除
+    例如：
+    全部检查：python manage.py collect_content_garbage
+    限时10分钟：python manage.py collect_content_garbage --max_seconds 600
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch_size", type=int, default=500, help="每批检查的内容数")
+        parser.add_argument("--max_seconds", type=int, default=None, help="本次执行的时间上限（秒）")
+
+    def handle(self, *args, **options):
+        print("正在清理不再被引用的正文内容...")
+        checked, deleted, finished = collect_garbage(options["batch_size"], options["max_seconds"])
+        print(f"已检查 {checked} 个，删除 {deleted} 个")
+        if not finished:
+            print("已达到时间上限，剩余部分再次执行时继续")
@@ -0,0 +1,33 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.utils.document_revisions import COMPACT_AFTER_DAYS, COMPACT_KEEP_RECENT, compact_all_revisions, \
+    compact_revisions
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    压缩文档修订历史: python manage.py compact_document_revisions
+    最近的版本全部保留，较早的版本每天只保留最后一个，并重新生成快照/增量链
+    例如：
+    压缩全部文档：python manage.py compact_document_revisions
+    只压缩某个文档：python manage.py compact_document_revisions --document_id 1
+    自定义保留策略：python manage.py compact_document_revisions --keep_recent 20 --older_than_days 7
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--document_id", type=int, default=None, help="文档ID，不传则处理全部")
+        parser.add_argument("--keep_recent", type=int, default=COMPACT_KEEP_RECENT, help="每个文档保留的最近版本数")
+        parser.add_argument("--older_than_days", type=int, default=COMPACT_AFTER_DAYS, help="超过多少天的版本按天抽稀")
+
+    def handle(self, *args, **options):
+        kwargs = {"keep_recent": options["keep_recent"], "older_than_days": options["older_than_days"]}
+        print("正在压缩文档修订历史...")
+        if options["document_id"]:
+            removed = compact_revisions(options["document_id"], **kwargs)
+        else:
+            removed = compact_all_revisions(**kwargs)
+        print(f"文档修订历史压缩完成，共清理 {removed} 个版本！")
@@ -0,0 +1,65 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from dvadmin.system.models import MmDocument
+from dvadmin.utils.content_store import get_content_store, load_text, store_text
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    文档正文迁移到内容存储: python manage.py migrate_document_content
+    需先配置 settings.DOCUMENT_CONTENT_STORE
+    例如：
+    全部迁移：python manage.py migrate_document_content
+    只迁移某个知识库：python manage.py migrate_document_content --repository_id 1
+    迁回数据库 detail_text（关闭内容存储前执行）：python manage.py migrate_document_content --restore
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repository_id", type=int, default=None, help="知识库ID，不传则处理全部")
+        parser.add_argument("--batch_size", type=int, default=200, help="每批处理的文档数")
+        parser.add_argument("--restore", action="store_true", help="将正文从内容存储迁回 detail_text")
+
+    def handle(self, *args, **options):
+        store = get_content_store()
+        if store is None:
+            raise CommandError("未开启内容存储，请先配置 DOCUMENT_CONTENT_STORE")
+        queryset = MmDocument.objects.all()
+        if options["repository_id"]:
+            queryset = queryset.filter(category__repository_id=options["repository_id"])
+        if options["restore"]:
+            queryset = queryset.filter(content_hash__isnull=False)
+        else:
+            queryset = queryset.filter(content_hash__isnull=True, detail_text__isnull=False)
+        print(f"正在{'迁回' if options['restore'] else '迁移'}文档正文（内容存储：{store.name}）...")
+        last_id, total = None, 0
+        while True:
+            # 按主键分批，每批一个事务；已处理的文档不再满足筛选条件，中断后可重复执行
+            batch = queryset.order_by("id")
+            if last_id is not None:
+                batch = batch.filter(id__gt=last_id)
+            if options["restore"]:
+                rows = list(batch.values_list("id", "content_hash")[:options["batch_size"]])
+            else:
+                rows = list(batch.values_list("id", "detail_text")[:options["batch_size"]])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            with transaction.atomic():
+                for document_id, value in rows:
+                    # 使用 update 不触发 save，不改变文档更新时间
+                    if options["restore"]:
+                        MmDocument.objects.filter(id=document_id).update(
+                            detail_text=load_text(value), content_hash=None
+                        )
+                    else:
+                        MmDocument.objects.filter(id=document_id).update(
+                            content_hash=store_text(value), content_length=len(value), detail_text=None
+                        )
+            total += len(rows)
+            print(f"已处理 {total} 个文档")
+        print(f"文档正文{'迁回' if options['restore'] else '迁移'}完成，共处理 {total} 个文档！")
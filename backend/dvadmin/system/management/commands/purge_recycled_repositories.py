@@ -0,0 +1,33 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.utils.repository_purge import BATCH_PAUSE, BATCH_SIZE, MAX_SECONDS, RETENTION_DAYS, purge_recycled
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    彻底删除回收站中超过保留天数的知识库: python manage.py purge_recycled_repositories
+    与定时任务相同，分批删除、超过时间上限后停止，再次执行时继续
+    例如：
+    默认配置：python manage.py purge_recycled_repositories
+    回收超过7天、不暂停：python manage.py purge_recycled_repositories --days 7 --pause 0
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=RETENTION_DAYS, help="回收站保留天数")
+        parser.add_argument("--batch_size", type=int, default=BATCH_SIZE, help="每批删除的文档数")
+        parser.add_argument("--pause", type=float, default=BATCH_PAUSE, help="批次之间暂停的秒数")
+        parser.add_argument("--max_seconds", type=int, default=MAX_SECONDS, help="本次执行的时间上限（秒）")
+
+    def handle(self, *args, **options):
+        print("正在清理回收站知识库...")
+        result = purge_recycled(options["days"], options["batch_size"], options["pause"], options["max_seconds"])
+        if result is None:
+            print("其他进程正在清理，请稍后再试")
+            return
+        print(f"已删除知识库 {result['repositories']}，文档 {result['documents']} 个，目录 {result['categories']} 个")
+        if not result["finished"]:
+            print("已达到时间上限，剩余部分再次执行时继续")
@@ -0,0 +1,22 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.utils.rank import rebalance_legacy_ranks
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    重新平衡仍使用早期 62 进制排序键（含大写字母）的同级目录/文档: python manage.py rebalance_legacy_ranks
+    排序键改为数字 + 小写字母后执行一次，保证 MySQL 大小写不敏感排序规则下的顺序正确
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch_size", type=int, default=2000, help="每批读取的排序键数")
+
+    def handle(self, *args, **options):
+        print("正在检查排序键...")
+        total = rebalance_legacy_ranks(options["batch_size"])
+        print(f"排序键重新平衡完成，共处理 {total} 个同级")
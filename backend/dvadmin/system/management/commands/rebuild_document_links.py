@@ -0,0 +1,26 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.utils.document_links import rebuild_links
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    重建文档链接邻接表（反向链接/链接图）: python manage.py rebuild_document_links
+    历史文档初始化，或目录跨知识库移动后重新解析名称链接时执行；链接未变化的文档不写入
+    例如：
+    全部知识库：python manage.py rebuild_document_links
+    指定知识库：python manage.py rebuild_document_links --repository_id 1
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repository_id", type=int, default=None, help="知识库ID，不传则处理全部知识库")
+        parser.add_argument("--batch_size", type=int, default=200, help="每批读取的文档数")
+
+    def handle(self, *args, **options):
+        print("正在重建文档链接...")
+        total = rebuild_links(options["repository_id"], options["batch_size"])
+        print(f"文档链接重建完成，共处理 {total} 个文档")
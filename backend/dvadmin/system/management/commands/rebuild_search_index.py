@@ -0,0 +1,30 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.system.models import MmDocument
+from dvadmin.utils.search_engine import get_search_backend
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    重建文档全文索引: python manage.py rebuild_search_index
+    例如：
+    全部重建：python manage.py rebuild_search_index
+    只重建某个知识库：python manage.py rebuild_search_index --repository_id 1
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repository_id", type=int, default=None, help="知识库ID，不传则重建全部")
+        parser.add_argument("--batch_size", type=int, default=500, help="每批处理的文档数")
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        queryset = MmDocument.objects.all()
+        if options["repository_id"]:
+            queryset = queryset.filter(category__repository_id=options["repository_id"])
+        print(f"正在使用[{backend.name}]后端重建全文索引...")
+        total = backend.rebuild(queryset, batch_size=options["batch_size"])
+        print(f"全文索引重建完成，共处理 {total} 个文档！")
@@ -0,0 +1,24 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.utils.document_stats import recompute_rollups
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    按文档表重算文档统计汇总: python manage.py recompute_document_stats
+    例如：
+    全部重算：python manage.py recompute_document_stats
+    只重算某个知识库：python manage.py recompute_document_stats --repository_id 1
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repository_id", type=int, default=None, help="知识库ID，不传则重算全部")
+
+    def handle(self, *args, **options):
+        print("正在重算文档统计汇总...")
+        total = recompute_rollups(options["repository_id"])
+        print(f"文档统计汇总重算完成，共写入 {total} 条汇总记录！")
@@ -0,0 +1,31 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.system.models import Category
+from dvadmin.utils.category_tree import repair_repository_paths
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    修复目录及文档的路径冗余字段(tree_path/dimension): python manage.py repair_category_paths
+    例如：
+    修复全部知识库：python manage.py repair_category_paths
+    只修复某个知识库：python manage.py repair_category_paths --repository_id 1
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repository_id", type=int, default=None, help="知识库ID，不传则修复全部")
+        parser.add_argument("--batch_size", type=int, default=1000, help="每批更新的目录数")
+
+    def handle(self, *args, **options):
+        if options["repository_id"]:
+            repository_ids = [options["repository_id"]]
+        else:
+            repository_ids = Category.objects.values_list("repository_id", flat=True).distinct().order_by()
+        for repository_id in repository_ids:
+            categories, documents = repair_repository_paths(repository_id, batch_size=options["batch_size"])
+            print(f"知识库[{repository_id}]路径修复完成：修复目录 {categories} 个，同步文档 {documents} 个")
+        print("目录路径修复完成！")
@@ -0,0 +1,25 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.utils.document_drafts import replay_drafts
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    重放未落库的自动保存草稿: python manage.py replay_document_drafts
+    用于服务重启、Celery 任务丢失后将缓存中的草稿写入数据库（发生冲突的草稿保留在缓存中，由用户处理）
+    例如：
+    重放等待超过落库间隔的草稿：python manage.py replay_document_drafts
+    立即重放全部待落库草稿：python manage.py replay_document_drafts --max_age 0
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max_age", type=int, default=None, help="只重放登记超过该秒数的草稿，默认为落库间隔")
+
+    def handle(self, *args, **options):
+        print("正在重放自动保存草稿...")
+        saved = replay_drafts(options["max_age"])
+        print(f"自动保存草稿重放完成，共落库 {saved} 篇文档！")
@@ -0,0 +1,44 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.system.models import MmDocument
+from dvadmin.utils.document_minhash import DEFAULT_THRESHOLD, build_signatures, duplicate_groups
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    知识库近似重复文档报告: python manage.py report_duplicate_documents --repository_id 1
+    先为缺少签名的文档计算 MinHash 签名（全部知识库，已有签名的跳过；基于派生数据的纯文本，历史文档需先执行
+    build_document_derivatives），再按 LSH 分桶找出该知识库文档与全部知识库文档中的近似重复分组
+    例如：
+    默认阈值：python manage.py report_duplicate_documents --repository_id 1
+    自定义阈值：python manage.py report_duplicate_documents --repository_id 1 --threshold 0.9
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repository_id", type=int, required=True, help="知识库ID")
+        parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="相似度阈值（0~1）")
+        parser.add_argument("--limit", type=int, default=100, help="最多输出的分组数")
+
+    def handle(self, *args, **options):
+        repository_id = options["repository_id"]
+        print("正在计算文档签名...")
+        built = build_signatures(MmDocument.objects.values("id"))
+        print(f"签名计算完成，更新 {built} 个文档，正在查找近似重复文档...")
+        groups = duplicate_groups(repository_id, options["threshold"])
+        names = MmDocument.objects.select_related("category").only(
+            "id", "name", "category__name", "category__repository_id"
+        ).in_bulk({document_id for ids, _ in groups[:options["limit"]] for document_id in ids})
+        for index, (ids, pairs) in enumerate(groups[:options["limit"]], start=1):
+            print(f"第 {index} 组（{len(ids)} 个文档）：")
+            for document_id in ids:
+                document = names.get(document_id)
+                if document is not None:
+                    print(f"    [{document.id}] {document.name}（知识库 {document.category.repository_id} / "
+                          f"{document.category.name}）")
+            for x, y, score in sorted(pairs, key=lambda pair: -pair[2]):
+                print(f"    {x} ~ {y}：相似度 {score:.2f}")
+        print(f"近似重复文档报告完成，共 {len(groups)} 组！")
@@ -0,0 +1,47 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from dvadmin.system.models import MmRepositoryGitSync
+from dvadmin.utils.git_sync import sync_repository
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    同步知识库的 Git 仓库: python manage.py sync_git_repository --repository_id 1
+    首次同步需指定仓库地址，之后只应用上次同步的提交之后变更的 Markdown 文件
+    例如：
+    配置并同步：python manage.py sync_git_repository --repository_id 1 --repo_url https://example.com/docs.git --branch main
+    全量对比：python manage.py sync_git_repository --repository_id 1 --full
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repository_id", type=int, required=True, help="知识库ID")
+        parser.add_argument("--repo_url", type=str, default=None, help="Git仓库地址（首次同步必传）")
+        parser.add_argument("--branch", type=str, default=None, help="分支，默认master")
+        parser.add_argument("--full", action="store_true", help="全量对比（默认只同步上次同步后的变更）")
+
+    def handle(self, *args, **options):
+        repository_id = options["repository_id"]
+        config = MmRepositoryGitSync.objects.filter(repository_id=repository_id).first()
+        if options["repo_url"] or options["branch"]:
+            if config is None:
+                if not options["repo_url"]:
+                    print("首次同步请指定 --repo_url")
+                    return
+                config = MmRepositoryGitSync(repository_id=repository_id)
+            config.repo_url = options["repo_url"] or config.repo_url
+            config.branch = options["branch"] or config.branch
+            config.save()
+        elif config is None:
+            print(f"知识库[{repository_id}]未配置Git同步，请指定 --repo_url")
+            return
+        print(f"正在同步知识库[{repository_id}]: {config.repo_url} ({config.branch})...")
+        result = sync_repository(repository_id, options["full"])
+        if result is None:
+            print("该知识库正在同步中，当前同步结束后将自动补做一次")
+            return
+        print(f"同步完成，提交 {result['commit'][:12]}：新增 {result['created']}，更新 {result['updated']}，"
+              f"删除 {result['deleted']}")
@@ -4,11 +4,12 @@ from time import time
 from pathlib import PurePosixPath
 
 from django.contrib.auth.models import AbstractUser, UserManager
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from application import dispatch
 from dvadmin.utils.models import CoreModel, table_prefix, get_custom_app_models
+from dvadmin.utils.content_store import StoredContentTextField, offload_document_content
 
 
 class Role(CoreModel):
@@ -834,6 +835,7 @@ class MmRepository(models.Model):
     RECYCLE_CHOICES = (
         (0, '未回收'),
         (1, '已回收'),
+        (2, '清理中'),
     )
 
     name = models.TextField(verbose_name='仓库名称')
@@ -927,6 +929,8 @@ class Category(models.Model):
         default=0,  # 默认排序值设为0，便于新目录默认排在后面
         verbose_name="排序值"
     )
+    # 分数排序键（62进制字符串，按字典序排序，拖拽时插入相邻键之间只需更新一行；为空时按 sort 排序）
+    rank = models.CharField(max_length=64, default="", blank=True, verbose_name="排序键")
 
     # 9. 目录深度：对应表中 dimension（非空，最小值1，顶级目录为1，子目录=父目录深度+1）
     # 注：建议通过信号（signals）自动维护深度，避免手动输入错误
@@ -938,12 +942,13 @@ class Category(models.Model):
         verbose_name="目录深度"
     )
 
-    # 10. 上级目录路径：对应表中 tree_path（格式如“101,102,103”，顶级目录留空）
-    # 注：建议通过信号自动维护路径，例如父目录路径 + 当前ID，避免手动拼接错误
+    # 10. 上级目录路径：对应表中 tree_path（格式如“,101,102,103,”，首尾带分隔符，顶级目录留空）
+    # 注：首尾分隔符使“某目录下的所有后代”可以走索引前缀查询（LIKE ',101,102,%'），且不会误匹配“,1011,”
     tree_path = models.CharField(
         max_length=255,
         null=True,
         blank=True,
+        db_index=True,
         verbose_name="上级目录路径"
     )
 
@@ -953,7 +958,7 @@ class Category(models.Model):
         """
         # 数据库表名：强制指定为 "category"，与原始表结构一致（避免 Django 自动加后缀）
         db_table = "category"
-        ordering = ["repository_id", "parent_category_id", "sort"]  # 仅依赖自身/无依赖字段
+        ordering = ["repository_id", "parent_category_id", "rank", "sort"]  # 仅依赖自身/无依赖字段
         indexes = [models.Index(fields=["repository_id", "parent_category_id"])]
 
         # 后台管理界面显示的模型名称（中文友好）
@@ -976,13 +981,17 @@ class Category(models.Model):
             self.dimension = 1
             self.tree_path = ""  # 顶级目录路径为空
         else:
+            from dvadmin.utils.category_tree import child_tree_path
             self.dimension = self.parent_category.dimension + 1
-            # 拼接路径：父目录路径 + 父目录ID + 逗号（如父路径“101”，则当前路径“101,102”）
-            parent_path = self.parent_category.tree_path or ""
-            self.tree_path = f"{parent_path},{self.parent_category.id}" if parent_path else str(
-                self.parent_category.id)
+            # 拼接路径：父目录路径 + 父目录ID + 逗号（如父路径“,101,”，则当前路径“,101,102,”）
+            self.tree_path = child_tree_path(self.parent_category.tree_path, self.parent_category.id)
+
+        # 2. 新建目录：同级已使用排序键时排在最后
+        if self._state.adding and not self.rank:
+            from dvadmin.utils.rank import append_rank
+            self.rank = append_rank(self)
 
-        # 2. 调用父类 save 方法，完成数据入库
+        # 3. 调用父类 save 方法，完成数据入库
         super().save(*args, **kwargs)
 
 
@@ -1050,12 +1059,29 @@ class MmDocument(models.Model):
 
     # 8. 文档文本内容：对应表中 detail_text（允许为空，仅存储文本类文档内容）
     # 用 TextField 存储大文本（无长度限制，满足长文档需求）
-    detail_text = models.TextField(
+    # 开启内容存储（settings.DOCUMENT_CONTENT_STORE）后正文写入内容存储，该列置空，读取时按 content_hash 透明加载
+    detail_text = StoredContentTextField(
         null=True,
         blank=True,
         verbose_name="文档文本内容"
     )
 
+    # 正文内容摘要：对应内容存储中的对象（SHA-256），为空表示正文保存在 detail_text 列
+    content_hash = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        db_index=True,
+        verbose_name="正文内容摘要"
+    )
+
+    # 正文长度（字符数）：正文不在 detail_text 列时用于统计
+    content_length = models.IntegerField(
+        null=True,
+        blank=True,
+        verbose_name="正文长度"
+    )
+
     # 9. 排序值：对应表中 sort（非空，默认0，同目录下按此值升序排列）
     sort = models.IntegerField(
         null=False,
@@ -1063,6 +1089,8 @@ class MmDocument(models.Model):
         default=0,
         verbose_name="排序值"
     )
+    # 分数排序键（同目录下按字典序排序，为空时按 sort 排序，见 dvadmin.utils.rank）
+    rank = models.CharField(max_length=64, default="", blank=True, verbose_name="排序键")
 
     # 10. 所属目录深度：对应表中 dimension（非空，最小值1，冗余字段，与目录表一致）
     # 冗余存储目的：减少查询时关联目录表的开销，通过信号/重写save自动维护
@@ -1074,21 +1102,23 @@ class MmDocument(models.Model):
     )
 
     # 11. 所属目录路径：对应表中 tree_path（允许为空，冗余字段，与目录表一致）
-    # 冗余存储目的：快速筛选某目录及其子目录下的所有文档，无需递归查询
+    # 冗余存储目的：快速筛选某目录及其子目录下的所有文档，无需递归查询（索引前缀查询）
     tree_path = models.CharField(
         max_length=512,
         null=True,
         blank=True,
+        db_index=True,
         verbose_name="所属目录路径（冗余）"
     )
 
     class Meta:
         db_table = "mm_document"
         # 用 category_id（自身存储的外键ID，整数类型）替代 category（关联模型对象）
-        ordering = ["category_id", "sort", "-update_time"]
+        ordering = ["category_id", "rank", "sort", "-update_time"]
         # 同步更新索引：用 category_id 替代 category，确保索引与排序字段一致
         indexes = [
             models.Index(fields=["category_id", "sort"]),  # 优化同目录下文档排序的查询效率
+            models.Index(fields=["category_id", "rank"]),
             models.Index(fields=["master"]),
             models.Index(fields=["type_id"]),
         ]
@@ -1107,9 +1137,370 @@ class MmDocument(models.Model):
         重写保存方法：自动维护冗余字段（dimension、tree_path）
         确保与关联目录的字段完全一致，避免手动维护错误
         """
-        # 从关联的目录表中同步“目录深度”和“目录路径”
-        self.dimension = self.category.dimension
-        self.tree_path = self.category.tree_path
+        # 从关联的目录表中同步“目录深度”和“目录路径”（指定 update_fields 且不含目录时无需同步，省去目录查询）
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or {"category", "category_id"} & set(update_fields):
+            self.dimension = self.category.dimension
+            self.tree_path = self.category.tree_path
+
+        # 调用父类 save 方法，完成数据入库；统计汇总在同一事务内增量更新
+        from dvadmin.utils.document_stats import record_document_saved
+        original_category_id = (getattr(self, "_stats_original", None) or (None,))[0]
+        if self._state.adding and not self.rank:
+            # 新建文档：同目录已使用排序键时排在最后
+            from dvadmin.utils.rank import append_rank
+            self.rank = append_rank(self)
+        with transaction.atomic():
+            # 开启内容存储时正文写入内容存储，仅保存摘要（内容在事务提交前保持锁定，不会被清理）
+            offload_document_content(self)
+            created = self._state.adding
+            super().save(*args, **kwargs)
+            record_document_saved(self, created)
+            # 正文变化时记录修订版本
+            from dvadmin.utils.document_revisions import record_revision
+            self._revision = record_revision(self)
+        # 增量更新全文索引
+        from dvadmin.utils.search_engine import get_search_backend
+        get_search_backend().index_document(self)
+        # 预览、纯文本、字数、目录大纲等派生数据
+        from dvadmin.utils.document_derivatives import schedule_derivatives
+        schedule_derivatives(self)
+        # 派生数据（纯文本）更新后，延迟增量更新语义索引；跨知识库移动时两个知识库都需更新
+        from dvadmin.utils.semantic_index import schedule_update
+        repository_ids = {self.category.repository_id}
+        if original_category_id not in (None, self.category_id):
+            repository_ids.add(Category.objects.filter(id=original_category_id).values_list(
+                "repository_id", flat=True).first())
+        transaction.on_commit(lambda: [schedule_update(repository_id) for repository_id in repository_ids])
+
+    def delete(self, using=None, keep_parents=False):
+        document_id = self.id
+        from dvadmin.utils.document_stats import record_document_deleted
+        with transaction.atomic():
+            record_document_deleted(self, self.category.repository_id)
+            res = super().delete(using, keep_parents)
+            MmDocumentRevision.objects.filter(document_id=document_id).delete()
+            MmDocumentLshBucket.objects.filter(document_id=document_id).delete()
+        from dvadmin.utils.search_engine import get_search_backend
+        get_search_backend().remove_document(document_id)
+        from dvadmin.utils.semantic_index import schedule_update
+        repository_id = self.category.repository_id
+        transaction.on_commit(lambda: schedule_update(repository_id))
+        return res
+
+
+class MmDocumentSearchTerm(models.Model):
+    """
+    文档全文检索-倒排索引词条表（内置倒排索引后端使用）
+    每行对应“词条-文档”的一条倒排记录，doc_length 冗余存储用于 BM25 打分
+    """
+    term = models.CharField(max_length=64, verbose_name="词条")
+    document_id = models.IntegerField(verbose_name="文档ID")
+    repository_id = models.IntegerField(verbose_name="所属知识库ID（冗余）")
+    tf = models.IntegerField(default=0, verbose_name="词频")
+    doc_length = models.IntegerField(default=0, verbose_name="文档词条总数（冗余）")
+
+    class Meta:
+        db_table = "mm_document_search_term"
+        indexes = [
+            models.Index(fields=["term", "repository_id"]),
+            models.Index(fields=["document_id"]),
+        ]
+        unique_together = ["term", "document_id"]
+        verbose_name = "文档检索词条"
+        verbose_name_plural = verbose_name
+
+
+class MmDocumentSearchStat(models.Model):
+    """
+    文档全文检索-文档长度表（用于计算文档总数与平均长度）
+    """
+    document_id = models.IntegerField(primary_key=True, verbose_name="文档ID")
+    repository_id = models.IntegerField(db_index=True, verbose_name="所属知识库ID（冗余）")
+    length = models.IntegerField(default=0, verbose_name="文档词条总数")
+
+    class Meta:
+        db_table = "mm_document_search_stat"
+        verbose_name = "文档检索统计"
+        verbose_name_plural = verbose_name
+
+
+class MmDocumentDerivative(models.Model):
+    """
+    文档派生数据表：文档保存时预先计算，列表/预览接口直接读取，避免每次请求解析正文
+    content_hash 为正文摘要，正文未变化时不重复计算
+    """
+    document = models.OneToOneField(
+        to="MmDocument",
+        primary_key=True,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name="derivative",
+        verbose_name="文档",
+    )
+    content_hash = models.CharField(max_length=32, default="", verbose_name="正文摘要")
+    text_length = models.IntegerField(default=0, verbose_name="正文长度")
+    preview = models.TextField(default="", blank=True, verbose_name="预览（纯文本前500字）")
+    plain_length = models.IntegerField(default=0, verbose_name="纯文本长度")
+    char_count = models.IntegerField(default=0, verbose_name="字符数（不含空白）")
+    word_count = models.IntegerField(default=0, verbose_name="字数")
+    toc = models.JSONField(default=list, blank=True, verbose_name="目录大纲")
+    update_time = models.DateTimeField(auto_now=True, verbose_name="计算时间")
+
+    class Meta:
+        db_table = "mm_document_derivative"
+        verbose_name = "文档派生数据"
+        verbose_name_plural = verbose_name
+
+
+class MmDocumentRollup(models.Model):
+    """
+    文档统计汇总表：按 知识库-目录-文档类型 维护文档数、正文总长度、最近更新时间
+    category_id=0 的行为知识库级汇总；文档增删改、目录跨知识库移动时增量更新
+    """
+    repository_id = models.IntegerField(verbose_name="知识库ID")
+    category_id = models.IntegerField(default=0, verbose_name="目录ID（0 表示知识库级汇总）")
+    type_id = models.IntegerField(verbose_name="文档类型ID")
+    document_count = models.IntegerField(default=0, verbose_name="文档数")
+    total_size = models.BigIntegerField(default=0, verbose_name="正文总长度")
+    latest_update = models.DateTimeField(null=True, blank=True, verbose_name="最近更新时间")
+
+    class Meta:
+        db_table = "mm_document_rollup"
+        unique_together = ["repository_id", "category_id", "type_id"]
+        verbose_name = "文档统计汇总"
+        verbose_name_plural = verbose_name
+
+
+class MmContentBlob(models.Model):
+    """
+    内容存储元数据表：内容按 SHA-256 寻址，相同内容只存一份
+    """
+    hash = models.CharField(max_length=64, primary_key=True, verbose_name="内容摘要（SHA-256）")
+    size = models.BigIntegerField(default=0, verbose_name="原始大小（字节）")
+    stored_size = models.BigIntegerField(default=0, verbose_name="存储大小（字节）")
+    compression = models.CharField(max_length=8, default="", blank=True, verbose_name="压缩方式")
+    create_time = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
 
-        # 调用父类 save 方法，完成数据入库
-        super().save(*args, **kwargs)
\ No newline at end of file
+    class Meta:
+        db_table = "mm_content_blob"
+        verbose_name = "内容存储"
+        verbose_name_plural = verbose_name
+
+
+class MmDocumentRevision(models.Model):
+    """
+    文档修订历史表：每次保存正文变化时记录一个版本
+    kind=快照 时 data 为全文（或正文在内容存储中），kind=增量 时 data 为相对上一版本的行级增量（JSON）
+    base_version 为所在链的快照版本，重建时取出 base_version ~ version 的整条链
+    """
+    KIND_SNAPSHOT = 0
+    KIND_DELTA = 1
+    KIND_STORED_SNAPSHOT = 2
+    KIND_CHOICES = (
+        (KIND_SNAPSHOT, "快照"),
+        (KIND_DELTA, "增量"),
+        (KIND_STORED_SNAPSHOT, "快照（内容存储）"),
+    )
+    document_id = models.IntegerField(verbose_name="文档ID")
+    version = models.IntegerField(verbose_name="版本号")
+    kind = models.SmallIntegerField(choices=KIND_CHOICES, default=KIND_SNAPSHOT, verbose_name="存储方式")
+    content_hash = models.CharField(max_length=64, db_index=True, verbose_name="正文摘要（SHA-256）")
+    data = models.TextField(default="", blank=True, verbose_name="快照全文或增量")
+    length = models.IntegerField(default=0, verbose_name="正文长度")
+    base_version = models.IntegerField(verbose_name="所在链的快照版本号")
+    chain_length = models.IntegerField(default=0, verbose_name="距快照的增量个数")
+    chain_size = models.IntegerField(default=0, verbose_name="距快照的增量总大小")
+    creator = models.IntegerField(null=True, blank=True, verbose_name="编辑人ID")
+    create_time = models.DateTimeField(default=timezone.now, verbose_name="保存时间")
+
+    class Meta:
+        db_table = "mm_document_revision"
+        unique_together = ["document_id", "version"]
+        indexes = [models.Index(fields=["document_id", "create_time"])]
+        verbose_name = "文档修订历史"
+        verbose_name_plural = verbose_name
+
+
+class MmDocumentSignature(models.Model):
+    """
+    文档 MinHash 签名表：正文纯文本的 MinHash 签名（NUM_PERM 个 uint32 按字节存储），用于近似重复检测
+    content_hash 与派生数据的正文摘要一致，正文未变化时不重复计算
+    """
+    document = models.OneToOneField(
+        to="MmDocument",
+        primary_key=True,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name="signature",
+        verbose_name="文档",
+    )
+    content_hash = models.CharField(max_length=32, default="", verbose_name="正文摘要")
+    shingle_count = models.IntegerField(default=0, verbose_name="片段数")
+    signature = models.BinaryField(verbose_name="MinHash 签名")
+    update_time = models.DateTimeField(auto_now=True, verbose_name="计算时间")
+
+    class Meta:
+        db_table = "mm_document_signature"
+        verbose_name = "文档相似度签名"
+        verbose_name_plural = verbose_name
+
+
+class MmDocumentLshBucket(models.Model):
+    """
+    文档 LSH 分桶表：签名每一段对应一行，同一 (band, bucket) 下的文档互为近似重复候选
+    """
+    document_id = models.IntegerField(verbose_name="文档ID")
+    band = models.SmallIntegerField(verbose_name="分段序号")
+    bucket = models.BigIntegerField(verbose_name="桶编号")
+
+    class Meta:
+        db_table = "mm_document_lsh_bucket"
+        indexes = [models.Index(fields=["band", "bucket"]), models.Index(fields=["document_id"])]
+        verbose_name = "文档相似度分桶"
+        verbose_name_plural = verbose_name
+
+
+class MmDocumentLink(models.Model):
+    """
+    文档链接邻接表：每行为 源文档 -> 目标 的一种链接（相同目标、相同链接文本合并计数）
+    target_id 为空表示悬空链接（目标文档不存在），target_key 为链接中的文档ID或文档名称
+    """
+    KIND_CHOICES = (
+        (0, "文档ID"),
+        (1, "文档名称"),
+    )
+    source_id = models.IntegerField(verbose_name="源文档ID")
+    repository_id = models.IntegerField(verbose_name="源文档所属知识库ID")
+    kind = models.SmallIntegerField(choices=KIND_CHOICES, default=0, verbose_name="链接方式")
+    target_key = models.CharField(max_length=255, verbose_name="链接目标（文档ID或名称）")
+    target_id = models.IntegerField(null=True, blank=True, verbose_name="目标文档ID（悬空链接为空）")
+    link_text = models.CharField(max_length=255, default="", blank=True, verbose_name="链接文本")
+    count = models.IntegerField(default=1, verbose_name="出现次数")
+
+    class Meta:
+        db_table = "mm_document_link"
+        indexes = [
+            models.Index(fields=["source_id"]),
+            models.Index(fields=["target_id"]),
+            models.Index(fields=["repository_id", "kind", "target_key"]),
+        ]
+        verbose_name = "文档链接"
+        verbose_name_plural = verbose_name
+
+
+class MmRepositoryGitSync(models.Model):
+    """
+    知识库 Git 同步配置与状态：将 Git 仓库中的 Markdown 文件同步为知识库的目录与文档
+    last_commit 为上次同步完成的提交，之后只应用该提交与最新提交之间变更的文件
+    """
+    STATUS_CHOICES = (
+        ("idle", "未同步"),
+        ("running", "同步中"),
+        ("success", "同步成功"),
+        ("failed", "同步失败"),
+    )
+    repository_id = models.IntegerField(unique=True, verbose_name="知识库ID")
+    repo_url = models.CharField(max_length=512, verbose_name="Git仓库地址")
+    branch = models.CharField(max_length=100, default="master", verbose_name="分支")
+    last_commit = models.CharField(max_length=64, null=True, blank=True, verbose_name="上次同步的提交")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="idle", verbose_name="同步状态")
+    message = models.TextField(null=True, blank=True, verbose_name="同步结果/错误信息")
+    last_sync_time = models.DateTimeField(null=True, blank=True, verbose_name="上次同步时间")
+
+    class Meta:
+        db_table = "mm_repository_git_sync"
+        verbose_name = "知识库Git同步"
+        verbose_name_plural = verbose_name
+
+
+class MmRepositoryGitFile(models.Model):
+    """
+    Git 同步路径映射：仓库中的目录/Markdown 文件 -> 知识库目录/文档，blob 为文件上次同步时的 Git 对象哈希
+    """
+    KIND_CHOICES = (
+        (0, "目录"),
+        (1, "文档"),
+    )
+    repository_id = models.IntegerField(verbose_name="知识库ID")
+    kind = models.SmallIntegerField(choices=KIND_CHOICES, verbose_name="类型")
+    path = models.CharField(max_length=512, verbose_name="仓库内路径")
+    object_id = models.IntegerField(verbose_name="目录/文档ID")
+    blob = models.CharField(max_length=64, default="", blank=True, verbose_name="文件对象哈希")
+
+    class Meta:
+        db_table = "mm_repository_git_file"
+        unique_together = ["repository_id", "kind", "path"]
+        verbose_name = "Git同步路径映射"
+        verbose_name_plural = verbose_name
+
+
+class MmDocumentViewStat(models.Model):
+    """
+    文档阅读统计（按天）：阅读计数先累加在缓存中，由定时任务批量合并到该表
+    """
+    document_id = models.IntegerField(verbose_name="文档ID")
+    repository_id = models.IntegerField(verbose_name="知识库ID（冗余）")
+    date = models.DateField(verbose_name="日期")
+    views = models.IntegerField(default=0, verbose_name="阅读次数")
+    last_view_time = models.DateTimeField(null=True, blank=True, verbose_name="最近阅读时间")
+
+    class Meta:
+        db_table = "mm_document_view_stat"
+        unique_together = ["document_id", "date"]
+        indexes = [
+            models.Index(fields=["repository_id", "date"]),
+            models.Index(fields=["date"]),
+        ]
+        verbose_name = "文档阅读统计"
+        verbose_name_plural = verbose_name
+
+
+class MmRepositoryChange(models.Model):
+    """
+    知识库变更日志（只追加）：知识库、目录、文档的新增/修改/移动/删除，自增ID即变更序号
+    客户端按序号增量同步本地缓存；action=reset 表示批量变更，客户端需整体重新加载
+    """
+    ACTION_CHOICES = (
+        ("create", "新增"),
+        ("update", "修改"),
+        ("move", "移动"),
+        ("delete", "删除"),
+        ("reset", "整体重新加载"),
+    )
+    id = models.BigAutoField(primary_key=True, verbose_name="变更序号")
+    repository_id = models.IntegerField(verbose_name="知识库ID")
+    object_type = models.CharField(max_length=16, verbose_name="对象类型（repository/category/document）")
+    object_id = models.IntegerField(default=0, verbose_name="对象ID")
+    action = models.CharField(max_length=8, choices=ACTION_CHOICES, verbose_name="变更类型")
+    create_time = models.DateTimeField(auto_now_add=True, verbose_name="变更时间")
+
+    class Meta:
+        db_table = "mm_repository_change"
+        indexes = [
+            models.Index(fields=["repository_id", "id"]),
+            models.Index(fields=["object_type", "object_id"]),
+            models.Index(fields=["create_time"]),
+        ]
+        verbose_name = "知识库变更日志"
+        verbose_name_plural = verbose_name
+
+
+class MmRepositorySnapshotMap(models.Model):
+    """
+    快照导入ID映射：快照中（源环境）的目录/文档ID -> 本环境知识库的目录/文档ID，增量快照据此更新已导入的数据
+    """
+    KIND_CHOICES = (
+        (0, "目录"),
+        (1, "文档"),
+    )
+    repository_id = models.IntegerField(verbose_name="知识库ID")
+    kind = models.SmallIntegerField(choices=KIND_CHOICES, verbose_name="类型")
+    source_id = models.IntegerField(verbose_name="源目录/文档ID")
+    object_id = models.IntegerField(verbose_name="目录/文档ID")
+
+    class Meta:
+        db_table = "mm_repository_snapshot_map"
+        unique_together = ["repository_id", "kind", "source_id"]
+        verbose_name = "快照导入ID映射"
+        verbose_name_plural = verbose_name
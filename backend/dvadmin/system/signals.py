@@ -1,9 +1,16 @@
 import time
 
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, post_init, pre_save
 from django.dispatch import Signal, receiver
 from django.core.cache import cache
-from dvadmin.system.models import MessageCenterTargetUser
+from django.db import transaction
+from dvadmin.system.models import MessageCenterTargetUser, Category, MmRepository, MmDocument
+from dvadmin.utils import change_feed
+from dvadmin.utils.category_tree import bump_tree_version
+from dvadmin.utils.document_links import body_loaded, document_deleted, document_renamed, refresh_links
+from dvadmin.utils.document_stats import remember_document
+from dvadmin.utils.id_allocator import advance_to, allocate_ids
+from dvadmin.utils.typeahead import KIND_CATEGORY, KIND_DOCUMENT, record_change
 
 # 初始化信号
 pre_init_complete = Signal()
@@ -25,3 +32,158 @@ last_db_change_time = time.time()
 @receiver(post_delete, sender=MessageCenterTargetUser)
 def update_last_change_time(sender, **kwargs):
     cache.set('last_db_change_time', time.time(), timeout=None)  # 设置永不超时的键值对
+
+
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=MmDocument)
+def allocate_primary_key(sender, instance, **kwargs):
+    # 主键为普通整数列：新建时由计数器分配，与批量写入共用同一计数器，避免预先分配的ID被占用
+    if not instance._state.adding:
+        return
+    if instance.pk is None:
+        instance.pk = allocate_ids(sender, 1)[0]
+    else:
+        advance_to(sender, instance.pk)
+
+
+@receiver(post_init, sender=Category)
+def remember_category_repository(sender, instance, **kwargs):
+    # 记录加载时的知识库ID，跨知识库移动时需同时使旧知识库的目录树失效
+    instance._original_repository_id = instance.repository_id
+    instance._typeahead_original = (instance.__dict__.get("name"), instance.__dict__.get("parent_category_id"))
+
+
+@receiver(post_init, sender=MmDocument)
+def remember_document_stats(sender, instance, **kwargs):
+    # 记录加载时的目录/类型/正文长度，保存时据此增量更新统计汇总
+    remember_document(instance)
+    instance._typeahead_original = (instance.__dict__.get("name"), instance.__dict__.get("category_id"))
+
+
+def record_typeahead_change(repository_ids, kind, item_id):
+    transaction.on_commit(lambda: [record_change(repository_id, kind, item_id) for repository_id in set(repository_ids)])
+
+
+@receiver(post_save, sender=Category)
+def record_category_change(sender, instance, created, **kwargs):
+    # 变更日志（需在 update_category_typeahead 之前执行，读取原上级目录与原知识库ID）
+    old_repository_id = getattr(instance, '_original_repository_id', None)
+    old_parent_id = (getattr(instance, '_typeahead_original', None) or (None, None))[1]
+    entries = []
+    if created:
+        entries.append((instance.repository_id, change_feed.OBJECT_CATEGORY, instance.id, change_feed.ACTION_CREATE))
+    elif old_repository_id not in (None, instance.repository_id):
+        entries.append((old_repository_id, change_feed.OBJECT_CATEGORY, instance.id, change_feed.ACTION_DELETE))
+        entries.append((instance.repository_id, change_feed.OBJECT_CATEGORY, instance.id, change_feed.ACTION_CREATE))
+    else:
+        action = change_feed.ACTION_MOVE if old_parent_id != instance.parent_category_id else change_feed.ACTION_UPDATE
+        entries.append((instance.repository_id, change_feed.OBJECT_CATEGORY, instance.id, action))
+    change_feed.record_changes(entries)
+
+
+@receiver(post_delete, sender=Category)
+def record_category_delete(sender, instance, **kwargs):
+    change_feed.record_change(instance.repository_id, change_feed.OBJECT_CATEGORY, instance.id,
+                              change_feed.ACTION_DELETE)
+
+
+@receiver(post_save, sender=Category)
+def update_category_typeahead(sender, instance, created, **kwargs):
+    # 名称/上级目录/知识库变化时更新快速跳转索引（需在 invalidate_category_tree 之前执行，读取原知识库ID）
+    current = (instance.name, instance.parent_category_id)
+    old_repository_id = getattr(instance, '_original_repository_id', None)
+    if created or getattr(instance, '_typeahead_original', None) != current or old_repository_id != instance.repository_id:
+        record_typeahead_change((instance.repository_id, old_repository_id), KIND_CATEGORY, instance.id)
+    instance._typeahead_original = current
+
+
+@receiver(post_delete, sender=Category)
+def remove_category_typeahead(sender, instance, **kwargs):
+    record_typeahead_change((instance.repository_id,), KIND_CATEGORY, instance.id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree(sender, instance, **kwargs):
+    bump_tree_version(instance.repository_id, getattr(instance, '_original_repository_id', None))
+    instance._original_repository_id = instance.repository_id
+
+
+@receiver(post_save, sender=MmRepository)
+def invalidate_repository_tree(sender, instance, created, **kwargs):
+    # 目录树节点中包含知识库名称
+    if not created:
+        bump_tree_version(instance.id)
+
+
+@receiver(post_save, sender=MmRepository)
+def record_repository_change(sender, instance, created, **kwargs):
+    action = change_feed.ACTION_CREATE if created else change_feed.ACTION_UPDATE
+    change_feed.record_change(instance.id, change_feed.OBJECT_REPOSITORY, instance.id, action)
+
+
+@receiver(post_delete, sender=MmRepository)
+def record_repository_delete(sender, instance, **kwargs):
+    change_feed.record_change(instance.id, change_feed.OBJECT_REPOSITORY, instance.id, change_feed.ACTION_DELETE)
+
+
+@receiver(post_save, sender=MmDocument)
+def update_document_links(sender, instance, created, **kwargs):
+    # 正文变化时重新解析出链；名称/所属目录变化时更新指向该文档的名称链接（需在 update_document_typeahead 之前执行，读取原名称）
+    original_name, original_category_id = getattr(instance, '_typeahead_original', None) or (None, None)
+    repository_id = instance.category.repository_id
+    moved = original_category_id not in (None, instance.category_id)
+    if body_loaded(instance) or moved:
+        refresh_links(instance, repository_id)
+    if created or moved or original_name != instance.name:
+        document_renamed(instance.id, repository_id, instance.name, original_name)
+
+
+@receiver(post_delete, sender=MmDocument)
+def remove_document_links(sender, instance, **kwargs):
+    document_deleted(instance.id)
+
+
+@receiver(post_save, sender=MmDocument)
+def record_document_change(sender, instance, created, **kwargs):
+    # 变更日志（需在 update_document_typeahead 之前执行，读取原所属目录）
+    original_category_id = (getattr(instance, '_typeahead_original', None) or (None, None))[1]
+    repository_id = instance.category.repository_id
+    entries = []
+    if created:
+        entries.append((repository_id, change_feed.OBJECT_DOCUMENT, instance.id, change_feed.ACTION_CREATE))
+    elif original_category_id not in (None, instance.category_id):
+        old_repository_id = Category.objects.filter(id=original_category_id).values_list(
+            'repository_id', flat=True).first()
+        if old_repository_id not in (None, repository_id):
+            entries.append((old_repository_id, change_feed.OBJECT_DOCUMENT, instance.id, change_feed.ACTION_DELETE))
+            entries.append((repository_id, change_feed.OBJECT_DOCUMENT, instance.id, change_feed.ACTION_CREATE))
+        else:
+            entries.append((repository_id, change_feed.OBJECT_DOCUMENT, instance.id, change_feed.ACTION_MOVE))
+    else:
+        entries.append((repository_id, change_feed.OBJECT_DOCUMENT, instance.id, change_feed.ACTION_UPDATE))
+    change_feed.record_changes(entries)
+
+
+@receiver(post_delete, sender=MmDocument)
+def record_document_delete(sender, instance, **kwargs):
+    change_feed.record_change(instance.category.repository_id, change_feed.OBJECT_DOCUMENT, instance.id,
+                              change_feed.ACTION_DELETE)
+
+
+@receiver(post_save, sender=MmDocument)
+def update_document_typeahead(sender, instance, created, **kwargs):
+    # 名称/所属目录变化时更新快速跳转索引（自动保存等只修改正文的保存不产生变更）
+    current = (instance.name, instance.category_id)
+    original = getattr(instance, '_typeahead_original', None)
+    if created or original != current:
+        repository_ids = [instance.category.repository_id]
+        if original and original[1] not in (None, instance.category_id):
+            repository_ids.append(Category.objects.filter(id=original[1]).values_list('repository_id', flat=True).first())
+        record_typeahead_change(repository_ids, KIND_DOCUMENT, instance.id)
+    instance._typeahead_original = current
+
+
+@receiver(post_delete, sender=MmDocument)
+def remove_document_typeahead(sender, instance, **kwargs):
+    record_typeahead_change((instance.category.repository_id,), KIND_DOCUMENT, instance.id)
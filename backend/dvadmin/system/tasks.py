@@ -105,3 +105,122 @@ def async_export_data(data: list, filename: str, dcid: int, export_field_label:
         instance.task_status = 3
         instance.description = str(e)[:250]
     instance.save()
+
+
+@app.task
+def async_build_document_derivatives(document_id: int):
+    """异步计算大文档的派生数据（预览、纯文本、字数、目录大纲）"""
+    from dvadmin.system.models import MmDocument
+    from dvadmin.utils.document_derivatives import refresh_derivatives
+
+    document = MmDocument.objects.select_related("category").filter(id=document_id).first()
+    if document is not None and refresh_derivatives(document):
+        # 纯文本更新后刷新语义索引（保存时调度的更新可能早于异步计算完成）
+        from dvadmin.utils.semantic_index import schedule_update
+        schedule_update(document.category.repository_id)
+
+
+@app.task
+def compact_document_revisions():
+    """定时压缩文档修订历史（较早的版本按天抽稀并重建快照/增量链）"""
+    from dvadmin.utils.document_revisions import compact_all_revisions
+
+    return compact_all_revisions()
+
+
+@app.task
+def flush_document_draft(document_id: int, user_id: int):
+    """自动保存草稿落库（自首次变更起延迟 DOCUMENT_DRAFT_FLUSH_INTERVAL 秒执行）"""
+    from dvadmin.utils.document_drafts import flush_draft
+
+    status, _ = flush_draft(document_id, user_id)
+    return status
+
+
+@app.task
+def replay_document_drafts():
+    """定时重放未落库的自动保存草稿"""
+    from dvadmin.utils.document_drafts import replay_drafts
+
+    return replay_drafts()
+
+
+@app.task
+def update_semantic_index(repository_id: int):
+    """增量更新知识库语义索引（文档变更后延迟执行，期间的多次变更合并）"""
+    from dvadmin.utils.semantic_index import PENDING_KEY, refresh_index
+    from django.core.cache import cache
+
+    cache.delete(PENDING_KEY.format(repository_id=repository_id))
+    result = refresh_index(repository_id)
+    if result is None:
+        # 正在构建/更新中，稍后重试
+        update_semantic_index.apply_async((repository_id,), countdown=60)
+    return result
+
+
+@app.task
+def sync_git_repository(repository_id: int, full: bool = False):
+    """同步知识库的 Git 仓库（同一知识库同时只执行一个，其余触发在当前同步结束后补做）"""
+    from dvadmin.utils.git_sync import sync_repository
+
+    result = sync_repository(repository_id, full)
+    return result["status"] if result else "locked"
+
+
+@app.task
+def rebalance_sibling_ranks(kind: str, parent_id: int, repository_id: int = None):
+    """同级排序键过长时重新生成均匀分布的排序键"""
+    from dvadmin.utils.rank import rebalance
+
+    return rebalance(kind, parent_id, repository_id)
+
+
+@app.task
+def clone_repository_task(source_id: int, repository_id: int, master: int):
+    """从模板知识库克隆目录与文档（进度写入缓存，见 clone_progress 接口）"""
+    from dvadmin.utils.repository_clone import clone_repository
+
+    return clone_repository(source_id, repository_id, master)
+
+
+@app.task
+def flush_document_views():
+    """定时将缓存中的文档阅读计数合并到按天统计表，并刷新阅读排行"""
+    from dvadmin.utils.document_views import flush_views
+
+    return flush_views()
+
+
+@app.task
+def compact_repository_changes():
+    """定时压缩知识库变更日志（删除已被后续变更覆盖的记录与超过保留天数的记录）"""
+    from dvadmin.utils.change_feed import compact_changes
+
+    compacted, expired = compact_changes()
+    return {"compacted": compacted, "expired": expired}
+
+
+@app.task
+def build_static_site(repository_id: int):
+    """生成归档知识库的静态文件（目录树、文档、检索索引）"""
+    from dvadmin.utils.static_site import build_site
+
+    manifest = build_site(repository_id)
+    return manifest["build"] if manifest else None
+
+
+@app.task
+def purge_recycled_repositories():
+    """定时彻底删除回收超过保留天数的知识库（分批、限时，未完成的下次继续）"""
+    from dvadmin.utils.repository_purge import purge_recycled
+
+    return purge_recycled()
+
+
+@app.task
+def collect_content_garbage():
+    """定时清理内容存储中不再被文档、修订历史引用的正文内容"""
+    from dvadmin.utils.content_store import collect_garbage
+
+    return collect_garbage()
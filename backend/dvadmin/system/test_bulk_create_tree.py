@@ -0,0 +1,44 @@
+from dvadmin.system.models import Category
+from dvadmin.system.testing import KnowledgeTestCase
+
+URL = "/api/system/knowledge_category/bulk_create_tree/"
+
+
+class BulkCreateTreeTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.repository = self.make_repository(1000)
+        self.root = self.make_category(1000, self.repository)
+
+    def post(self, data):
+        return self.client.post(URL, data, format="json").json()
+
+    def test_creates_nested_tree(self):
+        response = self.post({"repository_id": 1000, "parent_category": 1000, "tree": [
+            {"name": "手册", "key": "manual", "children": [{"name": "安装"}, {"name": "配置", "key": "config"}]},
+            {"name": "附录"},
+        ]})
+        self.assertEqual(response["msg"], "成功创建 4 个目录")
+        ids = response["data"]
+        self.assertEqual(set(ids), {"manual", "0/0", "config", "1"})
+        categories = Category.objects.in_bulk(list(ids.values()))
+        manual, config = categories[ids["manual"]], categories[ids["config"]]
+        self.assertEqual((manual.parent_category_id, manual.dimension, manual.tree_path), (1000, 2, ",1000,"))
+        self.assertEqual((config.parent_category_id, config.dimension, config.tree_path),
+                         (manual.id, 3, f",1000,{manual.id},"))
+        self.assertEqual({category.repository_id for category in categories.values()}, {1000})
+
+    def test_rejects_invalid_ids(self):
+        tree = [{"name": "目录"}]
+        message = "参数错误：请提供有效的 repository_id（所属知识库ID）"
+        self.assertEqual(self.post({"repository_id": "abc", "tree": tree})["msg"], message)
+        self.assertEqual(self.post({"tree": tree})["msg"], message)
+        self.assertEqual(self.post({"repository_id": 9999, "tree": tree})["msg"], message)
+        self.assertEqual(self.post({"repository_id": 1000, "parent_category": "x", "tree": tree})["msg"],
+                         "参数错误：parent_category 必须为整数")
+        other = self.make_category(1010, self.make_repository(1001))
+        self.assertEqual(self.post({"repository_id": 1000, "parent_category": other.id, "tree": tree})["msg"],
+                         "父目录ID=1010不存在或不属于该知识库")
+        self.assertEqual(self.post({"repository_id": 1000, "tree": [{"name": ""}]})["msg"], "节点 0 缺少目录名称")
+        self.assertEqual(Category.objects.count(), 2)
@@ -0,0 +1,66 @@
+from unittest import mock
+
+from django.core.cache import cache
+
+from dvadmin.system.models import MmDocument, MmDocumentViewStat
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils import cache_registry, document_drafts, document_views
+from dvadmin.utils.cache_registry import get_members
+
+URL = "/api/system/document/"
+
+
+class CacheRegistryTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.document = self.make_document(1000, self.make_category(1000, self.make_repository(1000)), text="正文")
+
+    def hold_lock(self, key):
+        """模拟其他进程持有登记表锁"""
+        cache.set(f"{key}:lock", "other", timeout=60)
+        patcher = mock.patch.object(cache_registry, "LOCK_WAIT", 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_draft_save_fails_while_registry_locked(self):
+        self.hold_lock(document_drafts.PENDING_KEY)
+        response = self.client.post(f"{URL}1000/draft/", {"text": "草稿"}, format="json")
+        self.assertEqual(response.json()["msg"], "自动保存繁忙，请稍后重试")
+        self.assertIsNone(document_drafts.get_draft(1000, self.user.id))
+        # 其他进程持有的锁不被删除
+        self.assertEqual(cache.get(f"{document_drafts.PENDING_KEY}:lock"), "other")
+
+    def test_draft_registered_until_flushed(self):
+        with mock.patch.object(document_drafts, "schedule_flush"):
+            document_drafts.save_draft(1000, self.user.id, "草稿")
+        self.assertEqual(set(get_members(document_drafts.PENDING_KEY)), {f"1000:{self.user.id}"})
+        self.assertEqual(document_drafts.replay_drafts(max_age=0), 1)
+        self.assertEqual(MmDocument.objects.get(id=1000).detail_text, "草稿")
+        self.assertEqual(get_members(document_drafts.PENDING_KEY), {})
+
+    def test_view_counter_dropped_when_registration_fails(self):
+        self.hold_lock(document_views.PENDING_KEY)
+        document_views.record_view(1000)
+        self.assertEqual(get_members(document_views.PENDING_KEY), {})
+        cache.delete(f"{document_views.PENDING_KEY}:lock")
+        document_views.record_view(1000)
+        document_views.record_view(1000)
+        self.assertEqual(document_views.flush_views(), 2)
+        self.assertEqual(MmDocumentViewStat.objects.get(document_id=1000).views, 2)
+
+    def test_view_flush_keeps_lock_taken_over_by_other_worker(self):
+        document_views.record_view(1000)
+        flush_batch = document_views.flush_batch
+
+        def slow_flush_batch(*args):
+            # 合并超过锁超时时间，锁过期后被其他进程获取
+            cache.set(document_views.FLUSH_LOCK_KEY, "other", timeout=60)
+            return flush_batch(*args)
+
+        with mock.patch.object(document_views, "flush_batch", side_effect=slow_flush_batch):
+            self.assertEqual(document_views.flush_views(), 1)
+        self.assertEqual(cache.get(document_views.FLUSH_LOCK_KEY), "other")
+        self.assertIsNone(document_views.flush_views())
+        cache.delete(document_views.FLUSH_LOCK_KEY)
+        self.assertEqual(document_views.flush_views(), 0)
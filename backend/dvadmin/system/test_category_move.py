@@ -0,0 +1,48 @@
+from dvadmin.system.models import Category, MmRepository
+from dvadmin.system.testing import KnowledgeTestCase
+
+URL = "/api/system/knowledge_category/"
+
+
+class CategoryMoveTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.repository = self.make_repository(1000)
+        self.other = self.make_repository(1001)
+        self.category = self.make_category(1000, self.repository)
+        self.parent = self.make_category(1001, self.repository)
+        self.foreign = self.make_category(1002, self.other)
+
+    def post(self, action, data):
+        return self.client.post(f"{URL}{self.category.id}/{action}/", data, format="json").json()
+
+    def assertNotMoved(self):
+        category = Category.objects.get(id=self.category.id)
+        self.assertEqual((category.parent_category_id, category.repository_id), (None, 1000))
+
+    def test_move_validates_ids(self):
+        self.assertEqual(self.post("move", {"parent_category": "abc"})["msg"], "参数错误：parent_category 必须为整数")
+        self.assertEqual(self.post("move", {"repository_id": "abc"})["msg"], "参数错误：repository_id 必须为整数")
+        self.assertEqual(self.post("move_between", {"before_id": "abc"})["msg"], "参数错误：before_id 必须为整数")
+        self.assertNotMoved()
+
+    def test_move_applies_data_permission(self):
+        self.hide_objects(Category, self.foreign.id)
+        self.hide_objects(MmRepository, self.other.id)
+        self.assertEqual(self.post("move", {"parent_category": self.foreign.id})["msg"],
+                         f"目标父目录ID={self.foreign.id}不存在或无权访问")
+        self.assertEqual(self.post("move", {"repository_id": self.other.id})["msg"],
+                         f"目标知识库ID={self.other.id}不存在或无权访问")
+        self.assertEqual(self.post("move_between", {"after_id": self.foreign.id})["msg"],
+                         f"目录ID={self.foreign.id}不存在或无权访问")
+        self.assertNotMoved()
+        self.post("move", {"parent_category": self.parent.id})
+        self.assertEqual(Category.objects.get(id=self.category.id).parent_category_id, self.parent.id)
+
+    def test_move_between_into_hidden_repository(self):
+        # 相邻目录可见但所属知识库无权访问
+        self.hide_objects(MmRepository, self.other.id)
+        self.assertEqual(self.post("move_between", {"after_id": self.foreign.id})["msg"],
+                         f"目标知识库ID={self.other.id}不存在或无权访问")
+        self.assertNotMoved()
@@ -0,0 +1,46 @@
+from dvadmin.system.models import Category
+from dvadmin.system.testing import KnowledgeTestCase
+
+URL = "/api/system/knowledge_category/"
+
+
+class CategoryTreeTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.repository = self.make_repository(1000)
+        root = self.make_category(1000, self.repository)
+        self.make_category(1001, self.repository, root)
+        other = self.make_category(1010, self.make_repository(1001))
+        # 父目录属于其他知识库的目录（及其子目录）不在树上
+        orphan = self.make_category(1002, self.repository, other)
+        self.make_category(1003, self.repository, orphan)
+
+    def tree(self):
+        return self.client.get(f"{URL}tree_by_repo/", {"repository_id": self.repository.id}).json()["data"]
+
+    def test_tree_drops_categories_with_missing_parent(self):
+        tree = self.tree()
+        self.assertEqual([(node["id"], [child["id"] for child in node["children"]]) for node in tree],
+                         [(1000, [1001])])
+
+    def test_tree_applies_data_permission(self):
+        self.assertTrue(self.tree())
+        self.login("guest")
+        self.assertEqual(self.tree(), [])
+        self.assertTrue(Category.objects.filter(repository_id=self.repository.id).exists())
+
+    def test_etag_changes_with_data_permission(self):
+        url = f"{URL}tree_by_repo/"
+        etag = self.client.get(url, {"repository_id": self.repository.id})["ETag"]
+        self.assertEqual(self.client.get(url, {"repository_id": self.repository.id},
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.hide_objects(Category, 1001)
+        response = self.client.get(url, {"repository_id": self.repository.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([child["id"] for child in response.json()["data"][0]["children"]], [])
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_repository_id_must_be_integer(self):
+        response = self.client.get(f"{URL}tree_by_repo/", {"repository_id": "abc"}).json()
+        self.assertEqual(response["msg"], "参数错误：repository_id 必须为整数")
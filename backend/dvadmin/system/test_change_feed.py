@@ -0,0 +1,44 @@
+import datetime
+
+from django.utils import timezone
+
+from dvadmin.system.models import MmRepositoryChange
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils.change_feed import read_changes
+
+
+class ChangeFeedTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.repository = self.make_repository(1000)
+        self.category = self.make_category(1000, self.repository)
+        MmRepositoryChange.objects.all().delete()
+
+    def change(self, object_id, seconds_ago):
+        change = MmRepositoryChange.objects.create(repository_id=self.repository.id, object_type="category",
+                                                   object_id=object_id, action="update")
+        MmRepositoryChange.objects.filter(id=change.id).update(
+            create_time=timezone.now() - datetime.timedelta(seconds=seconds_ago))
+        return change.id
+
+    def test_recent_changes_held_back(self):
+        first = self.change(self.category.id, 60)
+        recent = self.change(self.category.id, 0)
+        self.change(self.category.id, 60)
+        result = read_changes(self.repository.id, since=first - 1)
+        # 较新的日志之后的记录即使写入较早也不返回，游标停在其之前
+        self.assertEqual(result["cursor"], first)
+        self.assertEqual([change["seq"] for change in result["changes"]], [first])
+        self.assertFalse(result["has_more"])
+
+        MmRepositoryChange.objects.filter(id=recent).update(create_time=timezone.now() - datetime.timedelta(seconds=60))
+        result = read_changes(self.repository.id, since=first)
+        self.assertEqual(result["cursor"], recent + 1)
+        self.assertEqual(result["changes"][0]["data"]["id"], self.category.id)
+
+    def test_initial_cursor_below_recent_changes(self):
+        old = self.change(self.category.id, 60)
+        self.change(self.category.id, 0)
+        result = read_changes(self.repository.id)
+        self.assertEqual((result["reset"], result["cursor"]), (True, old))
@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.db import transaction
+from django.test import override_settings
+
+from dvadmin.system.models import MmContentBlob, MmDocument, MmDocumentRevision
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils import content_store
+
+
+class ContentGarbageTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings = override_settings(DOCUMENT_CONTENT_STORE="local", DOCUMENT_CONTENT_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        content_store._store = None
+        self.addCleanup(setattr, content_store, "_store", None)
+        content_store.blob_compression.cache_clear()
+        self.repository = self.make_repository(1000)
+        self.category = self.make_category(1000, self.repository)
+
+    def stored(self, digest):
+        store = content_store.get_content_store()
+        return (MmContentBlob.objects.filter(hash=digest).exists()
+                and store.exists(content_store.blob_key(digest, content_store.blob_compression(digest))))
+
+    def test_superseded_content_collected(self):
+        document = self.make_document(1000, self.category, text="旧正文")
+        old_digest = document.content_hash
+        document.detail_text = "新正文"
+        document.save()
+        # 修订历史的快照引用旧内容时保留
+        MmDocumentRevision.objects.filter(document_id=document.id).exclude(content_hash=document.content_hash).update(
+            kind=MmDocumentRevision.KIND_SNAPSHOT)
+        checked, deleted, finished = content_store.collect_garbage(batch_size=1)
+        self.assertTrue(finished)
+        self.assertEqual((checked, deleted), (2, 1))
+        self.assertFalse(MmContentBlob.objects.filter(hash=old_digest).exists())
+        self.assertTrue(self.stored(document.content_hash))
+        self.assertEqual(MmDocument.objects.get(id=document.id).detail_text, "新正文")
+
+    def test_referenced_by_revision_or_other_document_kept(self):
+        first = self.make_document(1000, self.category, text="共用正文")
+        self.make_document(1001, self.category, text="共用正文")
+        digest = first.content_hash
+        first.delete()
+        self.assertEqual(content_store.delete_unreferenced_blobs([digest]), 0)
+        MmDocument.objects.all().delete()
+        MmDocumentRevision.objects.create(document_id=1000, version=1, kind=MmDocumentRevision.KIND_STORED_SNAPSHOT,
+                                          content_hash=digest, base_version=1)
+        self.assertEqual(content_store.delete_unreferenced_blobs([digest]), 0)
+        self.assertTrue(self.stored(digest))
+        MmDocumentRevision.objects.all().delete()
+        self.assertEqual(content_store.delete_unreferenced_blobs([digest]), 1)
+        self.assertFalse(MmContentBlob.objects.filter(hash=digest).exists())
+
+    def test_files_left_by_rollback_collected(self):
+        store = content_store.get_content_store()
+        try:
+            with transaction.atomic():
+                digest = content_store.store_text("回滚的正文")
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        key = content_store.blob_key(digest)
+        self.assertFalse(MmContentBlob.objects.filter(hash=digest).exists())
+        self.assertTrue(store.exists(key))
+        kept = self.make_document(1000, self.category, text="保留的正文").content_hash
+        # 宽限期内的文件可能属于尚未提交的事务，保留
+        self.assertEqual(content_store.collect_garbage()[1:], (0, True))
+        self.assertTrue(store.exists(key))
+        with mock.patch.object(content_store, "ORPHAN_GRACE_SECONDS", 0):
+            self.assertEqual(content_store.collect_garbage()[1:], (1, True))
+        self.assertFalse(store.exists(key))
+        self.assertTrue(self.stored(kept))
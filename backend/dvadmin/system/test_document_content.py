@@ -0,0 +1,50 @@
+import gzip
+import hashlib
+
+from dvadmin.system.testing import KnowledgeTestCase
+
+URL = "/api/system/document/"
+
+
+class DocumentContentTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        category = self.make_category(1000, self.make_repository(1000))
+        self.text = "知识库正文" * 300
+        self.data = self.text.encode("utf-8")
+        self.etag = f'"{hashlib.sha256(self.data).hexdigest()}"'
+        self.make_document(1000, category, text=self.text)
+
+    def get(self, **headers):
+        return self.client.get(f"{URL}1000/content/", **headers)
+
+    def test_list_omits_text(self):
+        item = self.client.get(URL).json()["data"][0]
+        self.assertNotIn("detail_text", item)
+        self.assertEqual(item["detail_length"], len(self.text))
+
+    def test_full_content_and_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], self.etag)
+        self.assertEqual(b"".join(response.streaming_content), self.data)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=self.etag).status_code, 304)
+
+    def test_range(self):
+        response = self.get(HTTP_RANGE="bytes=3-8")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 3-8/{len(self.data)}")
+        self.assertEqual(b"".join(response.streaming_content), self.data[3:9])
+        response = self.get(HTTP_RANGE="bytes=-6")
+        self.assertEqual(b"".join(response.streaming_content), self.data[-6:])
+        response = self.get(HTTP_RANGE=f"bytes={len(self.data)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.data)}")
+
+    def test_gzip(self):
+        response = self.get(HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), self.data)
+        # 压缩表示的 ETag 同样可用于协商缓存
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
@@ -0,0 +1,42 @@
+from django.core.management import call_command
+
+from dvadmin.system.models import MmDocumentDerivative, MmDocumentLshBucket, MmDocumentSignature
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils.document_derivatives import PREVIEW_LENGTH
+from dvadmin.utils.document_minhash import find_similar
+from dvadmin.utils.semantic_index import load_documents
+
+URL = "/api/system/document/"
+TEXT = "# 标题\n\n" + " ".join(f"word{index}" for index in range(200))
+
+
+class DocumentDerivativesTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.category = self.make_category(1000, self.make_repository(1000))
+        self.first = self.make_document(1000, self.category, text=TEXT)
+        self.second = self.make_document(1001, self.category, text=TEXT + " tail")
+
+    def test_preview_without_stored_plain_text(self):
+        derivative = MmDocumentDerivative.objects.get(document_id=1000)
+        self.assertGreater(derivative.plain_length, PREVIEW_LENGTH)
+        data = self.client.get(f"{URL}1000/text_preview/").json()["data"]
+        self.assertTrue(data["has_more"])
+        self.assertTrue(data["preview_text"].endswith("..."))
+        self.assertEqual(data["toc"][0]["title"], "标题")
+
+    def test_bulk_backfill_refreshes_signatures(self):
+        MmDocumentDerivative.objects.all().delete()
+        MmDocumentSignature.objects.all().delete()
+        MmDocumentLshBucket.objects.all().delete()
+        call_command("build_document_derivatives")
+        self.assertEqual(MmDocumentDerivative.objects.count(), 2)
+        self.assertEqual(set(MmDocumentSignature.objects.values_list("document_id", flat=True)), {1000, 1001})
+        self.assertEqual([document_id for document_id, _ in find_similar(1000)], [1001])
+
+    def test_semantic_index_reads_plain_text_from_body(self):
+        documents = dict(load_documents(1000))
+        self.assertEqual(set(documents), {1000, 1001})
+        self.assertNotIn("#", documents[1000])
+        self.assertIn("word199", documents[1000])
@@ -0,0 +1,53 @@
+from unittest import mock
+
+from django.core.cache import cache
+
+from dvadmin.system.models import MmDocument
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils import cache_registry, document_drafts
+from dvadmin.utils.cache_registry import RegistryLockError
+
+
+class DocumentDraftTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.document = self.make_document(1000, self.make_category(1000, self.make_repository(1000)), text="正文")
+        patcher = mock.patch.object(document_drafts, "schedule_flush")
+        self.schedule_flush = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_autosave_during_flush_is_kept(self):
+        document_drafts.save_draft(1000, self.user.id, "第一版")
+
+        def autosave(*args):
+            document_drafts.save_draft(1000, self.user.id, "第二版")
+
+        with mock.patch("dvadmin.utils.document_revisions.assign_revision_creator", side_effect=autosave):
+            status, draft = document_drafts.flush_draft(1000, self.user.id)
+        self.assertEqual(status, "saved")
+        self.assertEqual(MmDocument.objects.get(id=1000).detail_text, "第一版")
+        self.assertEqual((draft["text"], draft["seq"], draft["flushed_seq"], draft["pending"]), ("第二版", 2, 1, True))
+        self.assertEqual(document_drafts.get_draft(1000, self.user.id)["text"], "第二版")
+        # 新的自动保存被安排落库
+        self.assertEqual(self.schedule_flush.call_count, 2)
+
+        status, draft = document_drafts.flush_draft(1000, self.user.id)
+        self.assertEqual((status, draft["pending"]), ("saved", False))
+        self.assertEqual(MmDocument.objects.get(id=1000).detail_text, "第二版")
+
+    def test_autosave_waits_for_draft_lock(self):
+        document_drafts.save_draft(1000, self.user.id, "第一版")
+        key = document_drafts.draft_key(1000, self.user.id)
+        cache.set(f"{key}:lock", "other", timeout=60)
+        with mock.patch.object(cache_registry, "LOCK_WAIT", 0.05), self.assertRaises(RegistryLockError):
+            document_drafts.save_draft(1000, self.user.id, "第二版")
+        self.assertEqual(document_drafts.get_draft(1000, self.user.id)["text"], "第一版")
+
+    def test_discard_keeps_newer_draft(self):
+        draft = document_drafts.save_draft(1000, self.user.id, "第一版")
+        document_drafts.save_draft(1000, self.user.id, "第二版")
+        self.assertFalse(document_drafts.discard_draft(1000, self.user.id, seq=draft["seq"]))
+        self.assertEqual(document_drafts.get_draft(1000, self.user.id)["text"], "第二版")
+        self.assertTrue(document_drafts.discard_draft(1000, self.user.id))
+        self.assertIsNone(document_drafts.get_draft(1000, self.user.id))
@@ -0,0 +1,48 @@
+from dvadmin.system.models import MmDocument, MmDocumentLshBucket
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils.document_minhash import band_buckets, get_signature
+
+URL = "/api/system/document/"
+TEXT = " ".join(f"word{index}" for index in range(200))
+OTHER = " ".join(f"other{index}" for index in range(200))
+
+
+class DocumentMinhashTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        category = self.make_category(1000, self.make_repository(1000))
+        self.make_document(1000, category, text=TEXT)
+        self.make_document(1001, category, text=f"{TEXT} tail")
+        self.make_document(1002, category, text=OTHER)
+
+    def similar(self, document_id, **params):
+        data = self.client.get(f"{URL}{document_id}/similar/", params).json()["data"]
+        return {item["id"]: item["similarity"] for item in data}
+
+    def buckets(self, document_id):
+        return set(MmDocumentLshBucket.objects.filter(document_id=document_id).values_list("band", "bucket"))
+
+    def test_near_duplicates_found(self):
+        results = self.similar(1000)
+        self.assertEqual(list(results), [1001])
+        self.assertGreaterEqual(results[1001], 0.8)
+        self.assertEqual(self.similar(1002), {})
+        # 降低阈值也不会返回不相关的文档（不同桶，不进入候选）
+        self.assertNotIn(1002, self.similar(1000, threshold=0.1))
+
+    def test_edit_updates_buckets(self):
+        old_buckets = self.buckets(1002)
+        document = MmDocument.objects.get(id=1002)
+        document.detail_text = f"{TEXT} other"
+        document.save()
+        new_buckets = self.buckets(1002)
+        self.assertNotEqual(new_buckets, old_buckets)
+        self.assertEqual(new_buckets, set(band_buckets(get_signature(1002))))
+        self.assertEqual(set(self.similar(1000)), {1001, 1002})
+
+        document = MmDocument.objects.get(id=1001)
+        document.detail_text = OTHER
+        document.save()
+        self.assertEqual(set(self.similar(1000)), {1002})
+        self.assertEqual(set(self.similar(1001)), set())
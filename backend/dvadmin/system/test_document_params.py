@@ -0,0 +1,34 @@
+from dvadmin.system.testing import KnowledgeTestCase
+
+URL = "/api/system/document/"
+
+
+class DocumentParamsTest(KnowledgeTestCase):
+    """非整数参数返回明确的错误信息"""
+
+    def setUp(self):
+        super().setUp()
+        self.document = self.make_document(1000, self.make_category(1000, self.make_repository(1000)), text="正文")
+
+    def assertParamError(self, url, params, msg):
+        self.assertEqual(self.client.get(url, params).json()["msg"], msg)
+
+    def test_popular(self):
+        self.assertParamError(f"{URL}popular/", {"repository_id": "abc"}, "参数错误：repository_id 必须为整数")
+        self.assertEqual(self.client.get(f"{URL}popular/", {"repository_id": 1000}).json()["code"], 2000)
+
+    def test_graph(self):
+        self.assertParamError(f"{URL}graph/", {"repository_id": "²"}, "参数错误：repository_id 必须为整数")
+        self.assertParamError(f"{URL}graph/", {"document_id": "1a"}, "参数错误：document_id 必须为整数")
+        self.assertParamError(f"{URL}graph/", {"document_id": 1000, "depth": "x"}, "参数错误：depth 必须为整数")
+        self.assertParamError(f"{URL}graph/", {}, "参数缺失：请提供 repository_id（所属知识库ID）或 document_id（文档ID）")
+        self.assertEqual(self.client.get(f"{URL}graph/", {"repository_id": 1000}).json()["code"], 2000)
+
+    def test_revisions(self):
+        url = f"{URL}1000/"
+        self.assertParamError(f"{url}revisions/", {"page": "x"}, "参数错误：page、limit 必须为整数")
+        self.assertParamError(f"{url}revision/", {"version": "x"}, "参数错误：version 必须为整数")
+        message = "参数错误：from_version、to_version、context 必须为整数"
+        self.assertParamError(f"{url}diff/", {"context": "all"}, message)
+        self.assertParamError(f"{url}diff/", {"to_version": "latest"}, message)
+        self.assertEqual(self.client.get(f"{url}diff/", {"context": -1}).json()["code"], 2000)
@@ -0,0 +1,65 @@
+import tempfile
+
+from django.test import override_settings
+
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils.semantic_index import remove_index
+
+URL = "/api/system/document/"
+TEXT = " ".join(f"word{index}" for index in range(200))
+
+
+class DocumentPermissionTest(KnowledgeTestCase):
+    """相似文档、语义检索、反向链接、链接图只返回数据权限范围内的文档"""
+
+    def setUp(self):
+        super().setUp()
+        self.repository = self.make_repository(1000)
+        self.category = self.make_category(1000, self.repository)
+
+    def ids(self, url, params=None):
+        return [item["id"] for item in self.client.get(url, params).json()["data"]]
+
+    def test_similar(self):
+        for document_id in (1000, 1001, 1002):
+            self.make_document(document_id, self.category, text=f"{TEXT} tail{document_id}")
+        self.assertEqual(sorted(self.ids(f"{URL}1000/similar/")), [1001, 1002])
+        self.hide_documents(1001)
+        self.assertEqual(self.ids(f"{URL}1000/similar/"), [1002])
+
+    def test_semantic_search(self):
+        self.make_document(1000, self.category, text="apple banana cherry orchard fruit harvest")
+        self.make_document(1001, self.category, text="apple banana cherry fruit market")
+        self.make_document(1002, self.category, text="zebra lion savanna safari")
+        params = {"repository_id": 1000, "q": "apple banana fruit"}
+        with tempfile.TemporaryDirectory() as root, override_settings(DOCUMENT_SEMANTIC_INDEX_ROOT=root):
+            # 在临时目录内移除进程内索引（清理时 index_root 已恢复为默认目录）
+            self.addCleanup(override_settings(DOCUMENT_SEMANTIC_INDEX_ROOT=root)(remove_index), 1000)
+            response = self.client.get(f"{URL}semantic_search/", params).json()
+            self.assertIn(1001, [item["id"] for item in response["data"][0]["results"]])
+            self.hide_documents(1001)
+            response = self.client.get(f"{URL}semantic_search/", params).json()
+            results = [item["id"] for item in response["data"][0]["results"]]
+            self.assertIn(1000, results)
+            self.assertNotIn(1001, results)
+
+    def make_linked_documents(self):
+        self.make_document(1000, self.category, text="目标")
+        self.make_document(1001, self.category, text="见 doc://1000")
+        self.make_document(1002, self.category, text="见 doc://1000 与 doc://1001 以及 doc://9999")
+
+    def test_backlinks(self):
+        self.make_linked_documents()
+        self.assertEqual(sorted(self.ids(f"{URL}1000/backlinks/")), [1001, 1002])
+        self.hide_documents(1001)
+        self.assertEqual(self.ids(f"{URL}1000/backlinks/"), [1002])
+
+    def test_graph(self):
+        self.make_linked_documents()
+        self.hide_documents(1001)
+        for params in ({"repository_id": 1000}, {"document_id": 1000, "depth": 2}):
+            data = self.client.get(f"{URL}graph/", params).json()["data"]
+            self.assertEqual([node["id"] for node in data["nodes"]], [1000, 1002])
+            self.assertEqual([(edge["source"], edge["target"]) for edge in data["edges"]], [(1002, 1000)])
+            self.assertEqual([(item["source"], item["target"]) for item in data["dangling"]], [(1002, "9999")])
+        self.assertEqual(self.client.get(f"{URL}graph/", {"document_id": 1001}).json()["msg"], "文档不存在")
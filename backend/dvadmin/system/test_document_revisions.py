@@ -0,0 +1,88 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import override_settings
+
+from dvadmin.system.models import MmDocument, MmDocumentRevision
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils import content_store, document_revisions
+
+URL = "/api/system/document/"
+
+TEXTS = [
+    "第一行\n第二行\n第三行\n",
+    "第一行\n第二行（修改）\n第三行\n",
+    "第一行\n第二行（修改）\n第三行\n第四行\n",
+    "标题\n第一行\n第二行（修改）\n第三行\n第四行\n",
+    "标题\n第一行\n第三行\n第四行",
+    "标题\n第一行\n第三行\n第四行\nlast line without newline",
+    "标题\r\n第一行\r\n第三行\n",
+    "标题\n",
+    "标题\n新的正文 with english words\n",
+    "标题\n新的正文 with english words\n结尾\n",
+]
+
+
+class DocumentRevisionTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # 每 3 个增量保存一次快照，使版本链跨越多个快照
+        patcher = mock.patch.object(document_revisions, "SNAPSHOT_INTERVAL", 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.category = self.make_category(1000, self.make_repository(1000))
+
+    def save_edits(self, document_id):
+        document = self.make_document(document_id, self.category, text=TEXTS[0])
+        for text in TEXTS[1:]:
+            document = MmDocument.objects.get(id=document_id)
+            document.detail_text = text
+            document.save()
+
+    def assertRevisionsRebuilt(self, document_id):
+        revisions = MmDocumentRevision.objects.filter(document_id=document_id).order_by("version")
+        self.assertEqual([revision.version for revision in revisions], list(range(1, len(TEXTS) + 1)))
+        snapshots = [revision.version for revision in revisions if revision.kind != MmDocumentRevision.KIND_DELTA]
+        self.assertEqual(snapshots, [1, 5, 9])
+        for version, text in enumerate(TEXTS, 1):
+            data = self.client.get(f"{URL}{document_id}/revision/", {"version": version}).json()["data"]
+            self.assertEqual(data["detail_text"].encode("utf-8"), text.encode("utf-8"), f"版本{version}")
+            self.assertEqual(data["content_hash"], document_revisions.text_hash(text))
+
+    def test_delta_chain_rebuilt(self):
+        self.save_edits(1000)
+        self.assertRevisionsRebuilt(1000)
+
+    def test_delta_chain_rebuilt_with_stored_snapshots(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings = override_settings(DOCUMENT_CONTENT_STORE="local", DOCUMENT_CONTENT_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        content_store._store = None
+        self.addCleanup(setattr, content_store, "_store", None)
+        content_store.blob_compression.cache_clear()
+        self.save_edits(1000)
+        kinds = set(MmDocumentRevision.objects.filter(document_id=1000).values_list("kind", flat=True))
+        self.assertEqual(kinds, {MmDocumentRevision.KIND_STORED_SNAPSHOT, MmDocumentRevision.KIND_DELTA})
+        self.assertRevisionsRebuilt(1000)
+
+    def test_diff(self):
+        self.save_edits(1000)
+        data = self.client.get(f"{URL}1000/diff/", {"from_version": 1, "to_version": 3, "context": -1}).json()["data"]
+        self.assertEqual((data["from_version"], data["to_version"], data["inserted"], data["deleted"]), (1, 3, 2, 1))
+        lines = {op: [line for block in data["changes"] if block["op"] == op for line in block["lines"]]
+                 for op in ("equal", "insert", "delete")}
+        self.assertEqual(lines["insert"], ["第二行（修改）\n", "第四行\n"])
+        self.assertEqual(lines["delete"], ["第二行\n"])
+        # 默认与上一版本比较
+        data = self.client.get(f"{URL}1000/diff/", {"to_version": 10, "mode": "word"}).json()["data"]
+        self.assertEqual((data["from_version"], data["inserted"], data["deleted"]), (9, 2, 0))
+        self.assertEqual("".join(part["text"] for part in data["changes"] if part["op"] != "delete"), TEXTS[9])
+        self.assertEqual("".join(part["text"] for part in data["changes"] if part["op"] != "insert"), TEXTS[8])
+        # 折叠相同内容
+        data = self.client.get(f"{URL}1000/diff/", {"from_version": 3, "to_version": 4, "context": 1}).json()["data"]
+        self.assertEqual([block["op"] for block in data["changes"]], ["insert", "equal", "skip"])
+        self.assertEqual(data["changes"][-1]["count"], 3)
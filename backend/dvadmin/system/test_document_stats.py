@@ -0,0 +1,70 @@
+import datetime
+
+from django.utils import timezone
+
+from dvadmin.system.models import MmDocument, MmDocumentRollup
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils.document_stats import REPOSITORY_ROW, recompute_rollups
+
+URL = "/api/system/document/"
+
+
+class DocumentStatsTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.repository = self.make_repository(1000)
+        category = self.make_category(1000, self.repository)
+        self.make_document(1000, category, text="正文")
+        self.make_document(1001, category, text="正文正文")
+
+    def test_stats_read_rollups(self):
+        data = self.client.get(f"{URL}document_stats/", {"repository_id": 1000}).json()["data"]
+        self.assertEqual((data["total_count"], data["total_size"]), (2, 6))
+
+    def test_stats_apply_data_permission(self):
+        self.login("guest")
+        data = self.client.get(f"{URL}document_stats/").json()["data"]
+        self.assertEqual(data["total_count"], 0)
+
+    def test_recompute_requires_superuser(self):
+        MmDocumentRollup.objects.all().delete()
+        # GET 不再触发重算
+        self.client.get(f"{URL}document_stats/", {"recompute": 1})
+        self.assertFalse(MmDocumentRollup.objects.exists())
+        self.login("guest")
+        response = self.client.post(f"{URL}recompute_stats/")
+        self.assertEqual(response.json()["msg"], "仅超级管理员可重算文档统计")
+        self.assertFalse(MmDocumentRollup.objects.exists())
+        self.client.force_authenticate(self.user)
+        self.client.post(f"{URL}recompute_stats/", {"repository_id": 1000})
+        data = self.client.get(f"{URL}document_stats/").json()["data"]
+        self.assertEqual(data["total_count"], 2)
+
+    def latest_update(self, category_id):
+        return MmDocumentRollup.objects.get(repository_id=1000, category_id=category_id, type_id=1).latest_update
+
+    def set_update_times(self):
+        older = timezone.now() - datetime.timedelta(days=2)
+        MmDocument.objects.filter(id=1000).update(update_time=older)
+        MmDocument.objects.filter(id=1001).update(update_time=older + datetime.timedelta(days=1))
+        recompute_rollups(1000)
+        return older
+
+    def test_latest_update_recomputed_after_delete(self):
+        older = self.set_update_times()
+        MmDocument.objects.get(id=1001).delete()
+        self.assertEqual(self.latest_update(1000), older)
+        self.assertEqual(self.latest_update(REPOSITORY_ROW), older)
+        MmDocument.objects.get(id=1000).delete()
+        self.assertIsNone(self.latest_update(REPOSITORY_ROW))
+
+    def test_latest_update_recomputed_after_move(self):
+        older = self.set_update_times()
+        other = self.make_category(1001, self.repository)
+        document = MmDocument.objects.get(id=1001)
+        document.category = other
+        document.save()
+        self.assertEqual(self.latest_update(1000), older)
+        self.assertEqual(self.latest_update(1001), MmDocument.objects.get(id=1001).update_time)
+        self.assertEqual(self.latest_update(REPOSITORY_ROW), MmDocument.objects.get(id=1001).update_time)
@@ -0,0 +1,175 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from git import Actor
+from git.repo import Repo
+
+from dvadmin.system.models import Category, MmDocument, MmRepositoryGitFile, MmRepositoryGitSync
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils import git_sync
+from dvadmin.utils.git_sync import KIND_CATEGORY, KIND_DOCUMENT, GitSyncError, sync_repository, validate_repo_url
+
+AUTHOR = Actor("tester", "tester@example.com")
+URL = "/api/system/knowledge_edit/"
+
+
+class GitSyncTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        patcher = mock.patch.object(git_sync, "SYNC_ROOT", os.path.join(root, "sync"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 测试使用本地裸仓库作为远程
+        patcher = mock.patch.object(git_sync, "ALLOWED_SCHEMES", ("https", "ssh", "file"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 本地裸仓库作为远程，工作区提交后推送
+        self.remote = os.path.join(root, "remote.git")
+        Repo.init(self.remote, bare=True, initial_branch="master")
+        self.work = Repo.init(os.path.join(root, "work"), initial_branch="master")
+        self.work.create_remote("origin", self.remote)
+        self.repository = self.make_repository(1000, "同步知识库")
+        MmRepositoryGitSync.objects.create(repository_id=self.repository.id, repo_url=self.remote, branch="master")
+
+    def commit(self, files=None, removes=(), moves=None, message="更新"):
+        index = self.work.index
+        for old, new in (moves or {}).items():
+            os.makedirs(os.path.dirname(os.path.join(self.work.working_dir, new)), exist_ok=True)
+            index.move([old, new])
+        for path in removes:
+            index.remove([path], working_tree=True)
+        for path, text in (files or {}).items():
+            full_path = os.path.join(self.work.working_dir, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            index.add([path])
+        index.commit(message, author=AUTHOR, committer=AUTHOR)
+        self.work.remote("origin").push("master:master")
+
+    def documents(self):
+        """{仓库内路径: (目录路径, 文档名称, 正文)}"""
+        names = dict(Category.objects.filter(repository_id=self.repository.id).values_list("id", "name"))
+        parents = dict(Category.objects.filter(repository_id=self.repository.id).values_list(
+            "id", "parent_category_id"))
+
+        def category_path(category_id):
+            path = []
+            while category_id:
+                path.insert(0, names[category_id])
+                category_id = parents[category_id]
+            return "/".join(path)
+
+        mappings = dict(MmRepositoryGitFile.objects.filter(
+            repository_id=self.repository.id, kind=KIND_DOCUMENT).values_list("object_id", "path"))
+        documents = MmDocument.objects.filter(category__repository_id=self.repository.id)
+        self.assertEqual(set(mappings), {document.id for document in documents})
+        return {mappings[document.id]: (category_path(document.category_id), document.name, document.detail_text)
+                for document in documents}
+
+    def category_paths(self):
+        return set(MmRepositoryGitFile.objects.filter(repository_id=self.repository.id, kind=KIND_CATEGORY)
+                   .values_list("path", flat=True))
+
+    def test_full_then_incremental_sync(self):
+        self.commit({"README.md": "说明", "guide/intro.md": "入门", "guide/setup.md": "安装",
+                     "api/users.md": "用户接口", "image.png": "不是文档"})
+        result = sync_repository(self.repository.id)
+        self.assertEqual((result["status"], result["created"]), ("synced", 4))
+        self.assertEqual(self.documents(), {
+            "README.md": ("同步知识库", "README", "说明"),
+            "guide/intro.md": ("guide", "intro", "入门"),
+            "guide/setup.md": ("guide", "setup", "安装"),
+            "api/users.md": ("api", "users", "用户接口"),
+        })
+        self.assertEqual(MmRepositoryGitSync.objects.get(repository_id=self.repository.id).last_commit,
+                         self.work.head.commit.hexsha)
+        intro_id = MmRepositoryGitFile.objects.get(repository_id=self.repository.id, path="guide/intro.md").object_id
+
+        # 新增、修改、重命名（跨目录）、删除
+        self.commit({"guide/faq.md": "常见问题", "guide/setup.md": "安装步骤"}, removes=["api/users.md"],
+                    moves={"guide/intro.md": "start/intro.md"})
+        result = sync_repository(self.repository.id)
+        self.assertEqual((result["created"], result["updated"], result["deleted"]), (1, 2, 1))
+        self.assertEqual(self.documents(), {
+            "README.md": ("同步知识库", "README", "说明"),
+            "guide/faq.md": ("guide", "faq", "常见问题"),
+            "guide/setup.md": ("guide", "setup", "安装步骤"),
+            "start/intro.md": ("start", "intro", "入门"),
+        })
+        # 重命名保留原文档，清空的目录被删除
+        self.assertEqual(MmRepositoryGitFile.objects.get(
+            repository_id=self.repository.id, path="start/intro.md").object_id, intro_id)
+        self.assertNotIn("api", self.category_paths())
+        self.assertFalse(Category.objects.filter(repository_id=self.repository.id, name="api").exists())
+
+        self.assertEqual(sync_repository(self.repository.id)["status"], "unchanged")
+
+    def test_manual_document_with_same_name_kept(self):
+        root = self.make_category(1000, self.repository, name=self.repository.name)
+        manual = self.make_document(1000, root, "README", "手写说明")
+        self.commit({"README.md": "同步说明"})
+        self.assertEqual(sync_repository(self.repository.id)["created"], 1)
+        manual.refresh_from_db()
+        self.assertEqual((manual.name, manual.detail_text), ("README", "手写说明"))
+        self.assertFalse(MmRepositoryGitFile.objects.filter(object_id=manual.id, kind=KIND_DOCUMENT).exists())
+        synced = MmDocument.objects.get(id=MmRepositoryGitFile.objects.get(
+            repository_id=self.repository.id, path="README.md").object_id)
+        self.assertEqual((synced.category_id, synced.name, synced.detail_text), (root.id, "README.md", "同步说明"))
+
+    def test_full_sync_after_history_rewrite(self):
+        self.commit({"guide/intro.md": "入门"})
+        sync_repository(self.repository.id)
+        MmRepositoryGitSync.objects.filter(repository_id=self.repository.id).update(last_commit="0" * 40)
+        self.commit({"guide/intro.md": "入门（修订）", "guide/faq.md": "常见问题"})
+        result = sync_repository(self.repository.id)
+        self.assertEqual((result["created"], result["updated"]), (1, 1))
+        self.assertEqual(self.documents(), {
+            "guide/intro.md": ("guide", "intro", "入门（修订）"),
+            "guide/faq.md": ("guide", "faq", "常见问题"),
+        })
+
+    def test_repo_url_allowlist(self):
+        with mock.patch.object(git_sync, "ALLOWED_SCHEMES", ("https", "ssh")):
+            for url in ("https://example.com/team/docs.git", "git@example.com:team/docs.git",
+                        "ssh://git@example.com/team/docs.git"):
+                self.assertEqual(validate_repo_url(url), url)
+            for url in (self.remote, "file:///etc", "ext::sh -c id", "./docs", "https:///docs.git",
+                        "-oProxyCommand=id:docs", "git@-oProxyCommand=id:docs"):
+                with self.assertRaises(GitSyncError):
+                    validate_repo_url(url)
+            # 已保存的本地路径配置在拉取前同样被拒绝
+            with self.assertRaises(GitSyncError):
+                sync_repository(self.repository.id)
+            response = self.client.post(f"{URL}{self.repository.id}/git_sync/", {"repo_url": "file:///etc"},
+                                        format="json").json()
+            self.assertEqual(response["msg"], "不支持的仓库地址：仅允许 https、ssh 协议")
+            self.assertEqual(MmRepositoryGitSync.objects.get(repository_id=self.repository.id).repo_url, self.remote)
+
+    def test_commit_history_pages(self):
+        self.assertEqual(self.client.get(f"{URL}{self.repository.id}/git_commits/").json()["msg"],
+                         "仓库尚未进行Git同步")
+        for number in range(3):
+            self.commit({"guide/intro.md": f"入门{number}"}, message=f'第{number}次 "更新"\n\n详细说明')
+        self.work.create_tag("v1.0")
+        self.work.remote("origin").push("refs/tags/v1.0")
+        sync_repository(self.repository.id)
+        url = f"{URL}{self.repository.id}/git_commits/"
+        data = self.client.get(url, {"page": 1, "limit": 2}).json()["data"]
+        self.assertEqual((data["head"], data["has_more"]), (self.work.head.commit.hexsha, True))
+        self.assertEqual([item["summary"] for item in data["results"]], ['第2次 "更新"', '第1次 "更新"'])
+        self.assertEqual(data["results"][0]["author"], "tester")
+        self.assertEqual((data["branches"], data["tags"]), (["master"], ["v1.0"]))
+        data = self.client.get(url, {"page": 2, "limit": 2}).json()["data"]
+        self.assertEqual(([item["summary"] for item in data["results"]], data["has_more"]), (['第0次 "更新"'], False))
+        # 新提交同步后 HEAD 变化，分页缓存随之失效
+        self.commit({"guide/intro.md": "入门3"}, message="第3次")
+        sync_repository(self.repository.id)
+        data = self.client.get(url, {"page": 1, "limit": 2}).json()["data"]
+        self.assertEqual(data["results"][0]["summary"], "第3次")
+        self.assertEqual(self.client.get(url, {"page": "x"}).json()["msg"], "参数错误：page、limit 必须为整数")
@@ -0,0 +1,28 @@
+from dvadmin.system.models import Category, MmDocument
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils.id_allocator import allocate_ids
+
+
+class IdAllocatorTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.repository = self.make_repository(1000)
+        self.category = self.make_category(1000, self.repository)
+
+    def test_single_saves_use_allocator(self):
+        reserved = allocate_ids(Category, 5)
+        self.assertEqual(reserved.start, 1001)
+        category = self.make_category(None, self.repository)
+        document = self.make_document(None, category)
+        self.assertGreater(category.id, reserved[-1])
+        # 预先分配的ID在单条保存之后批量写入不冲突
+        Category.objects.bulk_create([Category(id=category_id, name=f"目录{category_id}", repository_id=1000,
+                                               master=self.user.id) for category_id in reserved])
+        self.assertEqual(Category.objects.filter(repository_id=1000).count(), 7)
+        self.assertGreater(allocate_ids(MmDocument, 1)[0], document.id)
+
+    def test_explicit_ids_advance_counter(self):
+        allocate_ids(Category, 1)
+        self.make_category(5000, self.repository)
+        self.assertEqual(allocate_ids(Category, 2), range(5001, 5003))
@@ -0,0 +1,49 @@
+import hashlib
+
+from dvadmin.system.models import MmDocument
+from dvadmin.system.testing import KnowledgeTestCase
+
+URL = "/api/system/document/"
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PatchContentTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        category = self.make_category(1000, self.make_repository(1000))
+        self.make_document(1000, category, text="第一段。第二段。第三段。")
+
+    def patch(self, base_hash, patches):
+        return self.client.post(f"{URL}1000/patch_content/", {"base_hash": base_hash, "patches": patches},
+                                format="json").json()
+
+    def test_patches_applied(self):
+        response = self.patch(text_hash("第一段。第二段。第三段。"), [
+            {"offset": 0, "delete": 3, "insert": "开头"},
+            {"offset": 8, "delete": 0, "insert": "插入"},
+        ])
+        self.assertEqual(response["msg"], "保存成功")
+        text = MmDocument.objects.get(id=1000).detail_text
+        self.assertEqual(text, "开头。第二段。插入第三段。")
+        self.assertEqual((response["data"]["content_hash"], response["data"]["length"]), (text_hash(text), len(text)))
+        # 返回的摘要可作为下一次补丁的 base_hash
+        response = self.patch(response["data"]["content_hash"], [{"offset": len(text), "insert": "结尾"}])
+        self.assertEqual(MmDocument.objects.get(id=1000).detail_text, text + "结尾")
+
+    def test_stale_base_hash_rejected(self):
+        response = self.patch(text_hash("旧正文"), [{"offset": 0, "insert": "覆盖"}])
+        self.assertEqual(response["code"], 409)
+        self.assertEqual(response["data"]["content_hash"], text_hash("第一段。第二段。第三段。"))
+        self.assertEqual(MmDocument.objects.get(id=1000).detail_text, "第一段。第二段。第三段。")
+
+    def test_invalid_patches_rejected(self):
+        base_hash = text_hash("第一段。第二段。第三段。")
+        response = self.patch(base_hash, [{"offset": 10, "delete": 5}])
+        self.assertTrue(response["msg"].startswith("补丁应用失败："))
+        response = self.patch(base_hash, [{"offset": 0, "delete": 4}, {"offset": 2, "insert": "重叠"}])
+        self.assertTrue(response["msg"].startswith("补丁应用失败："))
+        self.assertEqual(MmDocument.objects.get(id=1000).detail_text, "第一段。第二段。第三段。")
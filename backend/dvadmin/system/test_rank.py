@@ -0,0 +1,63 @@
+from dvadmin.system.models import MmDocument
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils.rank import DIGITS, even_keys, key_between, move_between, rebalance_legacy_ranks
+
+
+def casefold_sorted(keys):
+    """模拟 MySQL utf8mb4_0900_ai_ci 等大小写不敏感排序规则"""
+    return sorted(keys, key=str.lower)
+
+
+class RankOrderingTest(KnowledgeTestCase):
+
+    def test_alphabet_sorts_same_case_insensitively(self):
+        self.assertEqual(list(DIGITS), sorted(DIGITS))
+        self.assertEqual(list(DIGITS), casefold_sorted(DIGITS))
+
+    def test_even_keys_order(self):
+        for count in (1, 5, 35, 36, 200):
+            keys = even_keys(count)
+            self.assertEqual(len(set(keys)), count)
+            self.assertEqual(keys, sorted(keys))
+            self.assertEqual(keys, casefold_sorted(keys))
+
+    def test_key_between_order(self):
+        keys = even_keys(5)
+        for _ in range(40):
+            keys.insert(1, key_between(keys[0], keys[1]))
+            keys.insert(len(keys), key_between(keys[-1], None))
+            keys.insert(0, key_between("", keys[0]))
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(keys, casefold_sorted(keys))
+
+    def test_move_between_database_order(self):
+        repository = self.make_repository(1000)
+        category = self.make_category(1000, repository)
+        documents = [self.make_document(1000 + index, category, sort=index) for index in range(6)]
+        move_between(documents[5], before=documents[0], after=documents[1])
+        move_between(documents[0])
+        move_between(documents[3], after=documents[1])
+        order = list(MmDocument.objects.filter(category=category).order_by("rank").values_list("id", flat=True))
+        self.assertEqual(order, [1005, 1003, 1001, 1002, 1004, 1000])
+
+    def test_legacy_keys_rebalanced(self):
+        repository = self.make_repository(1000)
+        category = self.make_category(1000, repository)
+        documents = [self.make_document(1000 + index, category) for index in range(5)]
+        for document, rank in zip(documents, ["A", "K", "U", "e", "o"]):
+            MmDocument.objects.filter(id=document.id).update(rank=rank)
+        self.assertEqual(rebalance_legacy_ranks(), 1)
+        ranks = list(MmDocument.objects.filter(category=category).order_by("id").values_list("rank", flat=True))
+        self.assertEqual(ranks, sorted(ranks))
+        self.assertEqual(ranks, casefold_sorted(ranks))
+        self.assertTrue(all(char in DIGITS for rank in ranks for char in rank))
+
+    def test_move_next_to_legacy_key(self):
+        repository = self.make_repository(1000)
+        category = self.make_category(1000, repository)
+        documents = [self.make_document(1000 + index, category) for index in range(3)]
+        for document, rank in zip(documents, ["A", "Z", "a"]):
+            MmDocument.objects.filter(id=document.id).update(rank=rank)
+        move_between(documents[2], before=documents[0], after=documents[1])
+        order = list(MmDocument.objects.filter(category=category).order_by("rank").values_list("id", flat=True))
+        self.assertEqual(order, [1000, 1002, 1001])
@@ -0,0 +1,59 @@
+import re
+from unittest import mock
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from dvadmin.system.models import Category, MmDocument, MmRepository
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils.category_tree import child_tree_path
+from dvadmin.utils import repository_clone
+from dvadmin.utils.repository_clone import clone_repository
+
+URL = "/api/system/knowledge_edit/"
+
+re_self_update = re.compile(r'^UPDATE "(\w+)" .*\(SELECT .* FROM "\1"', re.S)
+
+
+class RepositoryCloneTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source = self.make_repository(1000, "模板")
+        root = self.make_category(1000, self.source)
+        child = self.make_category(1001, self.source, root)
+        grandchild = self.make_category(1002, self.source, child)
+        self.make_document(1000, root, "根文档", "根")
+        self.make_document(1001, grandchild, "深层文档", "深")
+        self.target = self.make_repository(1001, "副本")
+
+    def test_clone_rewrites_paths(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = clone_repository(self.source.id, self.target.id, self.user.id)
+        self.assertEqual(result, {"categories": 3, "documents": 2})
+        # MySQL 不允许 UPDATE 的子查询读取被更新的表（错误 1093）
+        self.assertFalse([query["sql"] for query in queries.captured_queries if re_self_update.match(query["sql"])])
+
+        categories = {category.id: category for category in Category.objects.filter(repository_id=self.target.id)}
+        self.assertEqual(len(categories), 3)
+        for category in categories.values():
+            parent = categories.get(category.parent_category_id)
+            if parent is None:
+                self.assertIsNone(category.parent_category_id)
+                self.assertEqual((category.tree_path, category.dimension), ("", 1))
+            else:
+                self.assertEqual(category.tree_path, child_tree_path(parent.tree_path, parent.id))
+                self.assertEqual(category.dimension, parent.dimension + 1)
+        for document in MmDocument.objects.filter(category__repository_id=self.target.id).select_related("category"):
+            self.assertEqual((document.tree_path, document.dimension),
+                             (document.category.tree_path, document.category.dimension))
+        self.assertEqual(Category.objects.filter(repository_id=self.source.id).count(), 3)
+
+    def test_failed_clone_leaves_no_repository(self):
+        repository_ids = set(MmRepository.objects.values_list("id", flat=True))
+        with mock.patch.object(repository_clone, "refresh_clone", side_effect=RuntimeError("索引重建失败")):
+            response = self.client.post(f"{URL}{self.source.id}/clone/", {"name": "克隆"}, format="json").json()
+        self.assertEqual(response["msg"], "克隆失败：索引重建失败")
+        self.assertEqual(set(MmRepository.objects.values_list("id", flat=True)), repository_ids)
+        self.assertEqual(Category.objects.count(), 3)
+        self.assertEqual(MmDocument.objects.count(), 2)
@@ -0,0 +1,82 @@
+import datetime
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import override_settings
+from django.utils import timezone
+
+from dvadmin.system.models import Category, MmContentBlob, MmDocument, MmDocumentLink, MmRepository
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils import content_store, repository_purge
+from dvadmin.utils.repository_purge import PURGING, purge_recycled
+
+URL = "/api/system/knowledge_edit/"
+
+
+class RepositoryPurgeTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings = override_settings(DOCUMENT_CONTENT_STORE="local", DOCUMENT_CONTENT_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        content_store._store = None
+        self.addCleanup(setattr, content_store, "_store", None)
+        content_store.blob_compression.cache_clear()
+
+        recycle_time = timezone.now() - datetime.timedelta(days=60)
+        self.repository = self.make_repository(1000, "回收的知识库", recycle=1, recycle_time=recycle_time)
+        root_category = self.make_category(1000, self.repository)
+        child = self.make_category(1001, self.repository, root_category)
+        self.documents = [self.make_document(1000 + index, child, text=f"正文{index}") for index in range(3)]
+        self.shared = self.make_document(1003, root_category, text="共用正文")
+        other = self.make_repository(1001, "其他知识库")
+        self.other_document = self.make_document(1010, self.make_category(1010, other), text="共用正文")
+        MmDocumentLink.objects.create(source_id=self.other_document.id, repository_id=other.id,
+                                      target_key=str(self.documents[0].id), target_id=self.documents[0].id)
+
+    def test_purge_resumes_and_keeps_shared_content(self):
+        # 第一批提交后进程中断
+        purge_documents = repository_purge.purge_documents
+        batches = []
+
+        def interrupted(ids):
+            if batches:
+                raise RuntimeError("中断")
+            batches.append(ids)
+            return purge_documents(ids)
+
+        with mock.patch.object(repository_purge, "purge_documents", interrupted):
+            with self.assertRaises(RuntimeError):
+                purge_recycled(batch_size=2, pause=0)
+        self.assertEqual(MmRepository.objects.get(id=1000).recycle, PURGING)
+        self.assertEqual(MmDocument.objects.filter(category__repository_id=1000).count(), 2)
+
+        # 清理中不可恢复
+        response = self.client.post(f"{URL}1000/restore_recycle/")
+        self.assertEqual(response.json()["msg"], "仓库正在从回收站清理，无法恢复")
+
+        result = purge_recycled(batch_size=2, pause=0)
+        self.assertTrue(result["finished"])
+        self.assertEqual(result["repositories"], [1000])
+        self.assertFalse(MmRepository.objects.filter(id=1000).exists())
+        self.assertFalse(Category.objects.filter(repository_id=1000).exists())
+        # 其他知识库共用的正文保留，其余删除
+        self.assertEqual(list(MmContentBlob.objects.values_list("hash", flat=True)), [self.other_document.content_hash])
+        self.assertEqual(MmDocument.objects.get(id=1010).detail_text, "共用正文")
+        self.assertIsNone(MmDocumentLink.objects.get(source_id=1010).target_id)
+
+    def test_restored_before_purge_is_kept(self):
+        response = self.client.post(f"{URL}1000/restore_recycle/")
+        self.assertEqual(response.json()["msg"], "恢复成功")
+        result = purge_recycled(pause=0)
+        self.assertEqual(result["repositories"], [])
+        self.assertEqual(MmDocument.objects.filter(category__repository_id=1000).count(), 4)
+
+    def test_within_retention_not_purged(self):
+        MmRepository.objects.filter(id=1000).update(recycle_time=timezone.now())
+        self.assertEqual(purge_recycled(pause=0)["repositories"], [])
+        self.assertEqual(MmRepository.objects.get(id=1000).recycle, repository_purge.RECYCLED)
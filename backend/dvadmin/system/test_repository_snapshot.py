@@ -0,0 +1,68 @@
+import io
+
+from dvadmin.system.models import Category, MmDocument, MmRepository
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils.repository_snapshot import (MAGIC, RECORD_END, RECORD_HEADER, VERSION, compress_stream,
+                                               export_snapshot, import_snapshot, pack_json)
+from dvadmin.utils.validator import CustomValidationError
+
+URL = "/api/system/knowledge_edit/"
+
+
+class RepositorySnapshotTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.repository = self.make_repository(1000, "源知识库")
+        root = self.make_category(1000, self.repository)
+        child = self.make_category(1001, self.repository, root)
+        self.make_document(1000, root, "文档A", "正文A")
+        self.make_document(1001, child, "文档B", "正文B")
+
+    def snapshot_file(self, repository=None):
+        data = b"".join(export_snapshot(repository or self.repository))
+        file = io.BytesIO(data)
+        file.name = "snapshot.ksnap"
+        return file
+
+    def crafted_file(self, repository_fields):
+        header = {"version": VERSION, "repository_id": 1, "repository": repository_fields, "since": None}
+        records = [MAGIC + bytes([VERSION]), pack_json(RECORD_HEADER, header),
+                   pack_json(RECORD_END, {"categories": 0, "documents": 0})]
+        file = io.BytesIO(b"".join(compress_stream(records)))
+        file.name = "crafted.ksnap"
+        return file
+
+    def test_round_trip(self):
+        result = import_snapshot(self.snapshot_file(), master=self.user.id, name="副本")
+        repository = MmRepository.objects.get(id=result["repository_id"])
+        self.assertEqual(repository.name, "副本")
+        self.assertEqual(Category.objects.filter(repository_id=repository.id).count(), 2)
+        self.assertEqual(sorted(MmDocument.objects.filter(category__repository_id=repository.id).values_list(
+            "name", "detail_text")), [("文档A", "正文A"), ("文档B", "正文B")])
+
+    def test_header_cannot_set_status_or_recycle(self):
+        fields = {"name": "x", "type_id": 1, "limits": 0, "icon_url": None, "description": None,
+                  "status": "archived", "recycle": 1, "unknown": "ignored"}
+        result = import_snapshot(self.crafted_file(fields), master=self.user.id)
+        repository = MmRepository.objects.get(id=result["repository_id"])
+        self.assertEqual((repository.status, repository.recycle), ("normal", 0))
+
+    def test_header_field_types_validated(self):
+        fields = {"name": "x", "type_id": "1; drop", "limits": 0, "icon_url": None, "description": None}
+        with self.assertRaises(CustomValidationError):
+            import_snapshot(self.crafted_file(fields), master=self.user.id)
+        self.assertEqual(MmRepository.objects.count(), 1)
+
+    def test_import_into_inaccessible_repository_refused(self):
+        target = self.make_repository(1001, "目标")
+        self.login("guest")
+        response = self.client.post(f"{URL}import_snapshot/", {"file": self.snapshot_file(),
+                                                                "repository_id": target.id}, format="multipart")
+        self.assertEqual(response.json()["msg"], "知识库不存在或无权访问")
+        self.assertFalse(Category.objects.filter(repository_id=target.id).exists())
+
+    def test_repository_id_must_be_integer(self):
+        response = self.client.post(f"{URL}import_snapshot/", {"file": self.snapshot_file(), "repository_id": "abc"},
+                                    format="multipart")
+        self.assertEqual(response.json()["msg"], "参数错误：repository_id 必须为整数")
@@ -0,0 +1,81 @@
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from dvadmin.system.models import MmDocumentSearchTerm
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils.search_engine import InvertedIndexBackend, SqliteFts5Backend
+
+URL = "/api/system/document/"
+
+
+class SearchTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.category = self.make_category(1000, self.make_repository(1000))
+
+    def test_search_applies_data_permission(self):
+        self.make_document(1000, self.category, "检索文档", "全文检索正文")
+        response = self.client.get(f"{URL}search/", {"keyword": "检索"})
+        self.assertEqual([item["id"] for item in response.json()["data"]], [1000])
+        self.login("guest")
+        response = self.client.get(f"{URL}search/", {"keyword": "检索"})
+        self.assertEqual(response.json()["data"], [])
+
+    def test_total_excludes_hidden_documents(self):
+        for document_id in range(1000, 1003):
+            self.make_document(document_id, self.category, f"检索文档{document_id}", "全文检索正文")
+        self.hide_documents(1001)
+        response = self.client.get(f"{URL}search/", {"keyword": "检索", "limit": 1, "page": 2}).json()
+        self.assertEqual(response["total"], 2)
+        self.assertEqual(len(response["data"]), 1)
+        self.assertNotEqual(response["data"][0]["id"], 1001)
+        response = self.client.get(f"{URL}search/", {"keyword": "检索", "repository_id": "abc"}).json()
+        self.assertEqual(response["msg"], "参数错误：repository_id 必须为整数")
+
+    def test_inverted_index_updates_postings_in_bulk(self):
+        backend = InvertedIndexBackend()
+        document = self.make_document(1000, self.category, "标题", "alpha beta gamma delta")
+        backend.index_document(document)
+        document.detail_text = "alpha alpha beta beta gamma gamma epsilon"
+        with CaptureQueriesContext(connection) as queries:
+            backend.index_document(document)
+        updates = [query["sql"] for query in queries if query["sql"].startswith('UPDATE "mm_document_search_term"')]
+        # 文档长度变化一次 + 词频变化一次批量更新
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(dict(MmDocumentSearchTerm.objects.filter(document_id=1000, term__in=[
+            "alpha", "beta", "gamma", "epsilon"]).values_list("term", "tf")),
+            {"alpha": 2, "beta": 2, "gamma": 2, "epsilon": 1})
+        self.assertFalse(MmDocumentSearchTerm.objects.filter(document_id=1000, term="delta").exists())
+
+    def test_fts5_schema_survives_rollback(self):
+        if not SqliteFts5Backend.is_available():
+            self.skipTest("数据库不是 SQLite 或未编译 FTS5")
+        backend = SqliteFts5Backend()
+        document = self.make_document(1000, self.category, "标题", "回滚之后仍可索引")
+        SqliteFts5Backend._schema_ready = False
+        try:
+            with transaction.atomic():
+                backend.index_document(document)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # 建表随事务回滚，不会留下已建表的标记
+        self.assertFalse(SqliteFts5Backend._schema_ready)
+        backend.index_document(document)
+        self.assertEqual(backend.search("回滚")[0], 1)
+
+    def test_fts5_recovers_from_stale_schema_flag(self):
+        if not SqliteFts5Backend.is_available():
+            self.skipTest("数据库不是 SQLite 或未编译 FTS5")
+        backend = SqliteFts5Backend()
+        document = self.make_document(1000, self.category, "标题", "索引表被删除")
+        backend.index_document(document)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {SqliteFts5Backend.table}")
+        # 标记仍为已建立：检索与写入失败后重新建表并重试
+        SqliteFts5Backend._schema_ready = True
+        self.assertEqual(backend.search("删除"), (0, []))
+        SqliteFts5Backend._schema_ready = True
+        backend.index_document(document)
+        self.assertEqual(backend.search("删除")[0], 1)
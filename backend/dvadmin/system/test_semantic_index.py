@@ -0,0 +1,63 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from dvadmin.system import tasks
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils import semantic_index
+from dvadmin.utils.semantic_index import LOCK_KEY, MANIFEST, index_dir, refresh_index, remove_index
+
+URL = "/api/system/document/"
+
+
+class SemanticIndexTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = override_settings(DOCUMENT_SEMANTIC_INDEX_ROOT=root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # 在临时目录内移除进程内索引（先于 settings.disable 执行）
+        self.addCleanup(remove_index, 1000)
+        self.category = self.make_category(1000, self.make_repository(1000))
+        self.make_document(1000, self.category, text="apple banana cherry orchard fruit harvest")
+        self.make_document(1001, self.category, text="zebra lion savanna safari")
+
+    def search(self, q):
+        return self.client.get(f"{URL}semantic_search/", {"repository_id": 1000, "q": q}).json()
+
+    def test_related_documents_ranked_first(self):
+        self.make_document(1002, self.category, text="orchard apple pear fruit harvest season")
+        self.make_document(1003, self.category, text="lion zebra wildlife safari savanna")
+        refresh_index(1000, full=True)
+        results = [item["id"] for item in self.search("fruit orchard harvest")["data"][0]["results"]]
+        self.assertEqual(set(results[:2]), {1000, 1002})
+        self.assertEqual(self.search("apple")["code"], 2000)
+        response = self.client.get(f"{URL}semantic_search/", {"repository_id": "abc", "q": "apple"}).json()
+        self.assertEqual(response["msg"], "参数错误：repository_id 必须为整数")
+
+    def test_missing_index_built_in_background(self):
+        with mock.patch.object(tasks.update_semantic_index, "apply_async") as apply_async:
+            self.assertEqual(self.search("apple")["msg"], "语义索引构建中，请稍后重试")
+            self.search("apple")
+        # 请求中不构建索引，构建任务只提交一次
+        apply_async.assert_called_once_with((1000,), countdown=None)
+        self.assertFalse(os.path.exists(os.path.join(index_dir(1000), MANIFEST)))
+
+    def test_lock_released_only_by_holder(self):
+        lock_key = LOCK_KEY.format(repository_id=1000)
+
+        def build_index(repository_id):
+            # 模拟构建超时：锁已过期并被其他进程重新获取
+            cache.set(lock_key, "other")
+            return 0
+
+        with mock.patch.object(semantic_index, "build_index", build_index):
+            self.assertEqual(refresh_index(1000, full=True), (True, 0))
+        self.assertEqual(cache.get(lock_key), "other")
+        self.assertIsNone(refresh_index(1000))
@@ -0,0 +1,53 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils import static_site
+
+URL = "/api/system/static_site/"
+
+
+class StaticSiteTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        patcher = mock.patch.object(static_site, "SITE_ROOT", root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.repository = self.make_repository(1000, status="archived")
+        self.make_document(1000, self.make_category(1000, self.repository), "文档A", "正文A")
+        static_site.build_site(self.repository.id)
+
+    def test_manifest_returns_signed_url(self):
+        response = self.client.get(f"{URL}1000/manifest.json")
+        self.assertEqual(response.status_code, 200)
+        url = response.json()["url"]
+        self.assertTrue(url.startswith(f"{URL}1000/{response.json()['build']}/"))
+        response = self.client.get(url + "documents/1000.json")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Cache-Control"].startswith("private, max-age="))
+        # 页面之间的相对链接沿用同一签名
+        response = self.client.get(url + "index.html")
+        self.assertIn('href="documents/1000.html"', b"".join(response.streaming_content).decode())
+
+    def assertNotFound(self, response):
+        # 统一异常处理将 404 转为 code=400 的错误响应
+        self.assertEqual(response.json()["code"], 400)
+
+    def test_file_requires_valid_signature(self):
+        build = self.client.get(f"{URL}1000/manifest.json").json()["build"]
+        self.assertNotFound(self.client.get(f"{URL}1000/{build}/1-abc/index.html"))
+        token = static_site.sign_build(1000, build)
+        # 签名与知识库、版本绑定
+        self.assertNotFound(self.client.get(f"{URL}1001/{build}/{token}/index.html"))
+        expired = static_site.sign_build(1000, build, now=1)
+        self.assertNotFound(self.client.get(f"{URL}1000/{build}/{expired}/index.html"))
+        self.assertEqual(self.client.get(f"{URL}1000/{build}/{token}/index.html").status_code, 200)
+
+    def test_manifest_checks_repository_permission(self):
+        self.login("guest")
+        response = self.client.get(f"{URL}1000/manifest.json")
+        self.assertEqual(response.json()["msg"], "知识库不存在或无权访问")
@@ -0,0 +1,44 @@
+from dvadmin.system.models import Category
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils.category_tree import child_tree_path, move_category
+from dvadmin.utils.validator import CustomValidationError
+
+
+class TreePathTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.repository = self.make_repository(1000)
+
+    def test_child_tree_path_accepts_legacy_paths(self):
+        self.assertEqual(child_tree_path("", 101), ",101,")
+        self.assertEqual(child_tree_path(None, 101), ",101,")
+        self.assertEqual(child_tree_path(",100,", 101), ",100,101,")
+        # 未执行 backfill_tree_path 的旧格式路径
+        self.assertEqual(child_tree_path("100", 101), ",100,101,")
+        self.assertEqual(child_tree_path("100,", 101), ",100,101,")
+
+    def test_child_saved_under_legacy_parent(self):
+        root = self.make_category(1000, self.repository)
+        parent = self.make_category(1001, self.repository, root)
+        Category.objects.filter(id=parent.id).update(tree_path="1000")
+        parent.refresh_from_db()
+        child = self.make_category(1002, self.repository, parent)
+        self.assertEqual(child.tree_path, ",1000,1001,")
+        grandchild = self.make_category(1003, self.repository, child)
+        self.assertEqual(grandchild.tree_path, ",1000,1001,1002,")
+
+    def test_move_rejects_cycles(self):
+        first = self.make_category(1000, self.repository)
+        second = self.make_category(1001, self.repository)
+        child = self.make_category(1002, self.repository, second)
+        move_category(first, parent=child)
+        first.refresh_from_db()
+        self.assertEqual(first.tree_path, ",1001,1002,")
+        # 交叉移动的后一方基于已提交的路径重新校验：second 此时已是 first 的祖先
+        for parent in (first, second, child):
+            with self.assertRaises(CustomValidationError):
+                move_category(second, parent=parent)
+        second.refresh_from_db()
+        self.assertIsNone(second.parent_category_id)
+        self.assertEqual(second.tree_path, "")
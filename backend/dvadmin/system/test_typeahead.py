@@ -0,0 +1,45 @@
+from dvadmin.system.models import MmDocument
+from dvadmin.system.testing import KnowledgeTestCase
+from dvadmin.utils import typeahead
+
+URL = "/api/system/knowledge_category/typeahead/"
+
+
+class TypeaheadTest(KnowledgeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        typeahead._indexes.clear()
+        self.addCleanup(typeahead._indexes.clear)
+        repository = self.make_repository(1000)
+        category = self.make_category(1000, repository, name="产品")
+        self.make_document(1000, category, "产品手册")
+        self.make_document(1001, category, "开发规范")
+
+    def search(self, q, **params):
+        return self.client.get(URL, {"repository_id": 1000, "q": q, **params}).json()["data"]
+
+    def test_match_name_pinyin_and_initials(self):
+        self.assertEqual([(item["kind"], item["id"]) for item in self.search("cp")],
+                         [(typeahead.KIND_CATEGORY, 1000), (typeahead.KIND_DOCUMENT, 1000)])
+        self.assertEqual([item["name"] for item in self.search("Kai Fa")], ["开发规范"])
+        self.assertEqual([item["id"] for item in self.search("产品", kind=typeahead.KIND_DOCUMENT)], [1000])
+        self.assertEqual(self.search("产品手册")[0]["parent_id"], 1000)
+
+    def test_changes_replayed(self):
+        self.assertEqual(len(self.search("kf")), 1)
+        document = MmDocument.objects.get(id=1001)
+        document.name = "测试计划"
+        with self.captureOnCommitCallbacks(execute=True):
+            document.save()
+        self.assertEqual(self.search("kf"), [])
+        self.assertEqual([item["id"] for item in self.search("csjh")], [1001])
+        with self.captureOnCommitCallbacks(execute=True):
+            document.delete()
+        self.assertEqual(self.search("csjh"), [])
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get(URL, {"q": "cp"}).json()["msg"],
+                         "参数缺失：请提供 repository_id（所属知识库ID）")
+        self.assertEqual(self.client.get(URL, {"repository_id": 1000, "kind": "user"}).json()["msg"],
+                         "参数错误：kind 只能为 category 或 document")
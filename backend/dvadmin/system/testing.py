@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 知识库相关测试的公共基类与数据构造方法
+    - 缓存使用本地内存（测试环境不依赖 Redis），Celery 任务同步执行
+    - 运行：python manage.py makemigrations && python manage.py test dvadmin.system
+"""
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from application.celery import app
+from dvadmin.system.models import Category, MmDocument, MmRepository, Users
+from dvadmin.utils import search_engine
+from dvadmin.utils.filters import DataLevelPermissionsFilter
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KnowledgeTestCase(TestCase):
+    """知识库测试基类：self.user 为超级管理员，self.client 已登录"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._task_always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+
+    @classmethod
+    def tearDownClass(cls):
+        app.conf.task_always_eager = cls._task_always_eager
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        # 检索后端与索引结构标记为进程级状态，测试回滚会撤销建表，每个测试重新检查
+        self.reset_search_backend()
+        self.addCleanup(self.reset_search_backend)
+        self.user = Users.objects.create(username="admin", name="管理员", is_superuser=True)
+        self.client = APIClient(HTTP_USER_AGENT="Mozilla/5.0")
+        self.client.force_authenticate(self.user)
+
+    @staticmethod
+    def reset_search_backend():
+        search_engine._backend = None
+        for backend_class in search_engine.SEARCH_BACKENDS.values():
+            if hasattr(backend_class, "_schema_ready"):
+                backend_class._schema_ready = False
+
+    def login(self, username, **fields):
+        """切换为普通用户（无部门时数据权限过滤后为空）"""
+        user = Users.objects.create(username=username, name=username, is_superuser=False, **fields)
+        self.client.force_authenticate(user)
+        return user
+
+    def hide_objects(self, model, *object_ids):
+        """模拟数据权限：数据权限过滤后当前用户看不到指定的对象（可多次调用，隐藏多种对象）"""
+        if not hasattr(self, "_hidden_objects"):
+            self._hidden_objects = {}
+            hidden = self._hidden_objects
+
+            def filter_queryset(backend, request, queryset, view):
+                return queryset.exclude(id__in=hidden.get(queryset.model, ()))
+
+            patcher = mock.patch.object(DataLevelPermissionsFilter, "filter_queryset", filter_queryset)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self._hidden_objects.setdefault(model, set()).update(object_ids)
+
+    def hide_documents(self, *document_ids):
+        """模拟数据权限：数据权限过滤后当前用户看不到指定文档"""
+        self.hide_objects(MmDocument, *document_ids)
+
+    def make_repository(self, repository_id=None, name="知识库", **fields):
+        return MmRepository.objects.create(id=repository_id, name=name, type_id=1, master=self.user.id, limits=0,
+                                           **fields)
+
+    def make_category(self, category_id, repository, parent=None, name=None, **fields):
+        category = Category(id=category_id, name=name or f"目录{category_id}", repository_id=repository.id,
+                            parent_category=parent, master=self.user.id, **fields)
+        category.save()
+        return category
+
+    def make_document(self, document_id, category, name=None, text="", **fields):
+        document = MmDocument(id=document_id, name=name or f"文档{document_id}", type_id=1, category=category,
+                              master=self.user.id, detail_text=text, **fields)
+        document.save()
+        return document
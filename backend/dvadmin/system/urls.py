@@ -26,6 +26,7 @@ from dvadmin.system.views.knowledge_edit import MmRepositoryViewSet
 
 from dvadmin.system.views.knowledge_category import CategoryViewSet
 from dvadmin.system.views.doc import MmDocumentViewSet
+from dvadmin.system.views.static_site import StaticSiteFileView, StaticSiteManifestView
 
 system_url = routers.SimpleRouter()
 system_url.register(r'menu', MenuViewSet)
@@ -67,5 +68,7 @@ urlpatterns = [
     path('clause/privacy.html', PrivacyView.as_view()),
     path('clause/terms_service.html', TermsServiceView.as_view()),
     path('mmrepo/',include('mmrepo.urls')),
+    path('static_site/<int:repository_id>/manifest.json', StaticSiteManifestView.as_view()),
+    path('static_site/<int:repository_id>/<str:build>/<str:token>/<path:path>', StaticSiteFileView.as_view()),
 ]
 urlpatterns += system_url.urls
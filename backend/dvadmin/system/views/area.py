@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import pypinyin
 from django.db.models import Q
 from rest_framework import serializers
 
@@ -7,6 +6,7 @@ from dvadmin.system.models import Area
 from dvadmin.utils.field_permission import FieldPermissionMixin
 from dvadmin.utils.json_response import SuccessResponse
 from dvadmin.utils.serializers import CustomModelSerializer
+from dvadmin.utils.string_util import get_pinyin
 from dvadmin.utils.viewset import CustomModelViewSet
 
 
@@ -44,7 +44,7 @@ class AreaCreateUpdateSerializer(CustomModelSerializer):
     """
 
     def to_internal_value(self, data):
-        pinyin = ''.join([''.join(i) for i in pypinyin.pinyin(data["name"], style=pypinyin.NORMAL)])
+        pinyin = get_pinyin(data["name"])
         data["level"] = 1
         data["pinyin"] = pinyin
         data["initials"] = pinyin[0].upper() if pinyin else "#"
@@ -5,14 +5,36 @@
 @contact: QQ:2505811377
 @Remark: 文档管理
 """
+import hashlib
+
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce, Length
 from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
-from dvadmin.system.models import Users, Category  # 导入关联模型（用户表、目录表）
+from dvadmin.system.models import Users, Category, MmDocumentDerivative, MmDocumentLink, MmDocumentRevision, \
+    MmDocumentRollup  # 导入关联模型
+from dvadmin.utils.cache_registry import RegistryLockError
+from dvadmin.utils.category_tree import format_tree_path, parse_tree_path, subtree_documents_q
+from dvadmin.utils.content_response import content_response
+from dvadmin.utils.content_store import get_content_store, open_content
+from dvadmin.utils.document_derivatives import refresh_derivatives
+from dvadmin.utils.document_links import link_graph
+from dvadmin.utils.document_drafts import discard_draft, flush_draft, get_draft, save_draft
+from dvadmin.utils.document_minhash import DEFAULT_THRESHOLD, find_similar
+from dvadmin.utils.document_stats import get_document_stats, recompute_rollups
+from dvadmin.utils.document_views import POPULAR_SIZE, get_popular, record_view
+from dvadmin.utils.document_revisions import assign_revision_creator, revision_text, text_hash
 from dvadmin.utils.filters import DataLevelPermissionsFilter
 from dvadmin.utils.json_response import DetailResponse, SuccessResponse, ErrorResponse
+from dvadmin.utils import rank
+from dvadmin.utils.search_engine import MAX_SEARCH_RESULTS, get_search_backend, build_snippet, highlight, \
+    SearchBackendError
+from dvadmin.utils.semantic_index import SemanticIndexError, semantic_search
 from dvadmin.utils.serializers import CustomModelSerializer
+from dvadmin.utils.text_diff import apply_patches, diff_lines, diff_words
 from dvadmin.utils.viewset import CustomModelViewSet
 from django.utils import timezone
 
@@ -57,11 +79,10 @@ class MmDocumentSerializer(CustomModelSerializer):
         if not obj.tree_path:
             return obj.category.name  # 无路径时直接返回当前目录名
 
-        # 按路径ID查询所有父目录，拼接完整路径
-        parent_ids = list(map(int, obj.tree_path.split(",")))
-        parent_categories = Category.objects.filter(id__in=parent_ids).values("name")
-        parent_names = [cate["name"] for cate in parent_categories]
-        return " > ".join(parent_names + [obj.category.name])
+        # 按路径ID查询所有父目录，按路径顺序拼接完整路径
+        parent_ids = parse_tree_path(obj.tree_path)
+        parent_names = dict(Category.objects.filter(id__in=parent_ids).values_list("id", "name"))
+        return " > ".join([parent_names[pid] for pid in parent_ids if pid in parent_names] + [obj.category.name])
 
     class Meta:
         model = MmDocument
@@ -70,6 +91,21 @@ class MmDocumentSerializer(CustomModelSerializer):
         read_only_fields = ["id", "dimension", "tree_path", "update_time"]
 
 
+class MmDocumentListSerializer(MmDocumentSerializer):
+    """
+    文档-列表序列化器（仅返回元数据与正文长度，不返回正文，正文通过 content 接口按需获取）
+    """
+    detail_length = serializers.IntegerField(read_only=True, default=0)  # 正文字符数（查询时注解）
+    preview = serializers.CharField(read_only=True, default="")  # 纯文本预览（派生数据）
+    word_count = serializers.IntegerField(read_only=True, default=0)  # 字数（派生数据）
+    char_count = serializers.IntegerField(read_only=True, default=0)  # 字符数（派生数据）
+
+    class Meta:
+        model = MmDocument
+        exclude = ["detail_text"]
+        read_only_fields = ["id", "dimension", "tree_path", "update_time"]
+
+
 class MmDocumentImportSerializer(CustomModelSerializer):
     """
     文档-导入-序列化器（用于Excel批量导入场景）
@@ -125,19 +161,21 @@ class MmDocumentViewSet(CustomModelViewSet):
     - update: 修改文档
     - retrieve: 获取文档详情
     - destroy: 删除文档（受目录保护约束）
-    - 自定义接口：按目录路径筛选文档、文档文本预览、批量调整排序等
+    - 自定义接口：按目录路径筛选文档、全文检索、文档文本预览、批量调整排序等
     """
     # 基础查询集
     queryset = MmDocument.objects.all()
     # 不同场景的序列化器映射
     serializer_class = MmDocumentSerializer
+    list_serializer_class = MmDocumentListSerializer
+    by_category_serializer_class = MmDocumentListSerializer
     create_serializer_class = MmDocumentCreateUpdateSerializer
     update_serializer_class = MmDocumentCreateUpdateSerializer
     import_serializer_class = MmDocumentImportSerializer
     # 筛选字段（支持按多维度快速筛选）
     filter_fields = ["name", "id", "type_id", "category_id", "master", "dimension", "sort"]
-    # 搜索字段（支持按文档名、目录名模糊搜索）
-    search_fields = ["name", "category__name", "detail_text"]  # 支持跨表搜索目录名
+    # 搜索字段（支持按文档名、目录名模糊搜索；正文检索请使用 search 接口走全文索引）
+    search_fields = ["name", "category__name"]  # 支持跨表搜索目录名
     # Excel导入字段映射（用于导入时的字段校验提示）
     import_field_dict = {
         "name": "文档名称",
@@ -149,26 +187,52 @@ class MmDocumentViewSet(CustomModelViewSet):
         "sort": "排序值"
     }
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ["text_preview", "revisions", "revision", "diff", "patch_content", "draft", "publish",
+                           "similar", "backlinks", "move_between", "popular"]:
+            # 预览读取派生数据、历史版本读取修订表、草稿读写缓存，不取正文
+            queryset = queryset.defer("detail_text")
+        return queryset
+
+    @staticmethod
+    def defer_content(queryset):
+        """列表查询不取正文（SQL 层 defer），正文长度、预览、字数读取预先计算的派生数据"""
+        return queryset.select_related("category").defer("detail_text").annotate(
+            # 派生数据尚未生成（异步计算中）时退回按正文计算长度
+            detail_length=Coalesce("derivative__text_length", "content_length", Length("detail_text")),
+            preview=Coalesce("derivative__preview", Value("", output_field=models.TextField())),
+            word_count=Coalesce("derivative__word_count", Value(0)),
+            char_count=Coalesce("derivative__char_count", Value(0)),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        """获取文档详情（记录一次阅读，计数先写缓存）"""
+        response = super().retrieve(request, *args, **kwargs)
+        record_view(response.data["data"]["id"])
+        return response
+
     def list(self, request, *args, **kwargs):
         """
         重写列表查询：支持按目录路径筛选（利用冗余字段tree_path），优化查询性能
-        请求参数扩展：tree_path（可选，如“1,2”，筛选该目录及其子目录下的文档）
+        请求参数扩展：tree_path（可选，如“1,2”，即目录2的完整路径，筛选该目录及其子目录下的文档）
         """
         request.query_params._mutable = True
         params = request.query_params
         tree_path = params.get("tree_path")
 
-        # 按目录路径筛选（模糊匹配tree_path，实现“目录及其子目录”文档查询）
+        # 按目录路径筛选（tree_path 索引前缀查询，实现“目录及其子目录”文档查询）
         queryset = self.filter_queryset(self.get_queryset())
         if tree_path:
-            # 筛选条件：tree_path为空（顶级目录）或包含目标路径（子目录）
-            queryset = queryset.filter(
-                models.Q(tree_path__isnull=True, category_id=int(tree_path)) |
-                models.Q(tree_path__icontains=tree_path)
-            )
+            path_ids = parse_tree_path(tree_path)
+            if not path_ids:
+                return ErrorResponse(msg="参数错误：tree_path 格式应为以逗号分隔的目录ID，如“1,2”")
+            # 路径最后一个ID为目标目录，其余为目标目录的祖先
+            category = Category(id=path_ids[-1], tree_path=format_tree_path(path_ids[:-1]))
+            queryset = queryset.filter(subtree_documents_q(category))
 
         # 按“目录+排序值+更新时间”排序（同目录下先按sort升序，再按更新时间降序）
-        queryset = queryset.order_by("category", "sort", "-update_time")
+        queryset = self.defer_content(queryset).order_by("category", "rank", "sort", "-update_time")
 
         # 分页处理（文档列表数据可能较多，默认开启分页）
         page = self.paginate_queryset(queryset)
@@ -183,9 +247,10 @@ class MmDocumentViewSet(CustomModelViewSet):
     def by_category(self, request, *args, **kwargs):
         """
         按目录ID获取该目录下的所有文档（含排序），用于目录详情页文档展示
-        请求参数：category_id（必传，指定目录）
+        请求参数：category_id（必传，指定目录）、include_descendants（可选，为 1/true 时包含所有子目录下的文档）
         """
         category_id = request.query_params.get("category_id")
+        include_descendants = request.query_params.get("include_descendants") in ["1", "true", "True"]
         if not category_id:
             return ErrorResponse(msg="参数缺失：请提供 category_id（所属目录ID）")
 
@@ -195,65 +260,524 @@ class MmDocumentViewSet(CustomModelViewSet):
         except Category.DoesNotExist:
             return ErrorResponse(msg=f"目录ID={category_id}不存在")
 
-        # 筛选该目录下的文档，按排序值升序、更新时间降序排列
-        queryset = self.filter_queryset(self.get_queryset()).filter(
-            category=category
-        ).order_by("sort", "-update_time")
+        # 筛选该目录（或含所有子目录）下的文档，按排序值升序、更新时间降序排列
+        if include_descendants:
+            # category_id 同时是通用筛选字段，包含子目录时需移除，避免被过滤为仅当前目录
+            request.query_params._mutable = True
+            del request.query_params["category_id"]
+        queryset = self.filter_queryset(self.get_queryset())
+        if include_descendants:
+            queryset = queryset.filter(subtree_documents_q(category)).order_by("dimension", "category_id", "rank",
+                                                                               "sort", "-update_time")
+        else:
+            queryset = queryset.filter(category=category).order_by("rank", "sort", "-update_time")
 
-        serializer = self.get_serializer(queryset, many=True, request=request)
+        serializer = self.get_serializer(self.defer_content(queryset), many=True, request=request)
         return SuccessResponse(data=serializer.data, msg=f"获取目录「{category.name}」下文档成功")
 
+    @action(methods=["GET"], detail=False, permission_classes=[IsAuthenticated])
+    def search(self, request, *args, **kwargs):
+        """
+        全文检索（文档名称+正文，BM25 排序，返回高亮摘要）
+        请求参数：keyword（必传，检索关键词）、repository_id（可选，限定知识库）、page、limit
+        先按数据权限过滤相关度最高的前 MAX_SEARCH_RESULTS 条命中再分页，total 不包含无权访问的文档
+        """
+        keyword = (request.query_params.get("keyword") or "").strip()
+        if not keyword:
+            return ErrorResponse(msg="参数缺失：请提供 keyword（检索关键词）")
+        repository_id = request.query_params.get("repository_id")
+        try:
+            repository_id = int(repository_id) if repository_id else None
+        except ValueError:
+            return ErrorResponse(msg="参数错误：repository_id 必须为整数")
+        try:
+            page = max(int(request.query_params.get("page", 1)), 1)
+            limit = min(max(int(request.query_params.get("limit", 20)), 1), 100)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：page、limit 必须为整数")
+
+        try:
+            _, hits = get_search_backend().search(keyword, repository_id=repository_id, limit=MAX_SEARCH_RESULTS)
+        except SearchBackendError as e:
+            return ErrorResponse(msg=str(e))
+
+        # 按数据权限过滤命中（只查询ID），无权访问的文档既不返回也不计入 total
+        visible_ids = set(self.filter_queryset(self.get_queryset()).filter(
+            id__in=[hit.document_id for hit in hits]).values_list("id", flat=True))
+        hits = [hit for hit in hits if hit.document_id in visible_ids]
+        total = len(hits)
+        hits = hits[(page - 1) * limit:page * limit]
+
+        # 仅对当前页命中的文档取详情，用于生成摘要
+        documents = MmDocument.objects.filter(id__in=[hit.document_id for hit in hits]).select_related("category")
+        document_map = {document.id: document for document in documents}
+        data = []
+        for hit in hits:
+            document = document_map.get(hit.document_id)
+            if document is None:
+                continue
+            data.append({
+                "id": document.id,
+                "name": document.name,
+                "name_highlight": highlight(document.name, keyword),
+                "category_id": document.category_id,
+                "category_name": document.category.name,
+                "repository_id": document.category.repository_id,
+                "update_time": document.update_time,
+                "score": round(hit.score, 4),
+                "snippet": build_snippet(document.detail_text, keyword),
+            })
+        return SuccessResponse(data=data, msg="检索成功", page=page, limit=limit, total=total)
+
+    @action(methods=["GET"], detail=False, permission_classes=[IsAuthenticated])
+    def semantic_search(self, request, *args, **kwargs):
+        """
+        语义检索（TF-IDF + LSA 向量余弦相似度，可找到措辞不同但主题相近的文档）
+        请求参数：repository_id（必传）、q（必传，可传多个，一次批量查询）、limit（每个查询返回条数，默认10，最大50）
+        返回格式：[{"query": 查询文本, "results": [{"id", "name", "category_id", "category_name", "score", "preview"}]}]
+        """
+        repository_id = request.query_params.get("repository_id")
+        queries = [query.strip() for query in request.query_params.getlist("q") if query.strip()][:20]
+        if not repository_id:
+            return ErrorResponse(msg="参数缺失：请提供 repository_id（所属知识库ID）")
+        try:
+            repository_id = int(repository_id)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：repository_id 必须为整数")
+        if not queries:
+            return ErrorResponse(msg="参数缺失：请提供 q（检索内容）")
+        try:
+            limit = min(max(int(request.query_params.get("limit", 10)), 1), 50)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：limit 必须为整数")
+        # 只在当前用户有数据权限的文档中检索
+        queryset = self.filter_queryset(self.get_queryset())
+        allowed_ids = queryset.filter(category__repository_id=repository_id).values_list("id", flat=True)
+        try:
+            results = semantic_search(repository_id, queries, limit, allowed_ids=allowed_ids)
+        except SemanticIndexError as e:
+            return ErrorResponse(msg=str(e))
+
+        documents = self.defer_content(queryset).in_bulk(
+            {document_id for items in results for document_id, _ in items})
+        data = []
+        for query, items in zip(queries, results):
+            data.append({"query": query, "results": [{
+                "id": document_id,
+                "name": documents[document_id].name,
+                "category_id": documents[document_id].category_id,
+                "category_name": documents[document_id].category.name,
+                "update_time": documents[document_id].update_time,
+                "score": round(score, 4),
+                "preview": documents[document_id].preview,
+            } for document_id, score in items if document_id in documents]})
+        return DetailResponse(data=data, msg="检索成功")
+
     @action(methods=["GET"], detail=True, permission_classes=[IsAuthenticated])
     def text_preview(self, request, pk=None):
         """
         文档文本预览接口（仅返回文本内容，用于前端快速预览，避免返回完整文档数据）
         """
-        document = self.get_object()
-        # 截取前500字符作为预览（可根据业务调整长度）
-        preview_text = document.detail_text[:500] if document.detail_text else ""
-        # 标记是否有更多文本（超过500字符时显示“...”）
-        has_more = len(document.detail_text) > 500 if document.detail_text else False
+        instance = self.get_object()
+        # 读取保存时预先计算的派生数据（去除标记后的纯文本预览、字数、目录大纲），不读取正文；尚未生成时即时计算
+        derivative = MmDocumentDerivative.objects.filter(document_id=instance.id).first()
+        if derivative is None:
+            refresh_derivatives(instance, force=True)
+            derivative = MmDocumentDerivative.objects.get(document_id=instance.id)
+        # 标记是否有更多文本（纯文本超过预览长度时显示“...”）
+        has_more = derivative.plain_length > len(derivative.preview)
 
         data = {
-            "id": document.id,
-            "name": document.name,
-            "preview_text": preview_text + ("..." if has_more else ""),
+            "id": instance.id,
+            "name": instance.name,
+            "preview_text": derivative.preview + ("..." if has_more else ""),
             "has_more": has_more,
-            "full_length": len(document.detail_text) if document.detail_text else 0
+            "full_length": derivative.text_length,
+            "char_count": derivative.char_count,
+            "word_count": derivative.word_count,
+            "toc": derivative.toc,
         }
         return SuccessResponse(data=data, msg="获取文档文本预览成功")
 
+    @action(methods=["GET"], detail=True, permission_classes=[IsAuthenticated])
+    def similar(self, request, pk=None):
+        """
+        近似重复文档（MinHash + LSH，只比较同桶文档，不遍历全部正文）
+        请求参数：threshold（相似度阈值 0~1，默认0.8）、limit（返回条数，默认20，最大100）
+        """
+        instance = self.get_object()
+        try:
+            threshold = float(request.query_params.get("threshold", DEFAULT_THRESHOLD))
+            limit = min(max(int(request.query_params.get("limit", 20)), 1), 100)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：threshold 必须为数字，limit 必须为整数")
+        if not 0 < threshold <= 1:
+            return ErrorResponse(msg="参数错误：threshold 取值范围为 (0, 1]")
+        # 候选与结果均限定在当前用户有数据权限的文档内
+        queryset = self.filter_queryset(self.get_queryset())
+        results = find_similar(instance.id, threshold, limit, documents=queryset)
+        documents = queryset.select_related("category").only(
+            "id", "name", "category_id", "update_time", "category__name", "category__repository_id"
+        ).in_bulk([document_id for document_id, _ in results])
+        data = [{
+            "id": document_id,
+            "name": documents[document_id].name,
+            "category_id": documents[document_id].category_id,
+            "category_name": documents[document_id].category.name,
+            "repository_id": documents[document_id].category.repository_id,
+            "update_time": documents[document_id].update_time,
+            "similarity": round(score, 4),
+        } for document_id, score in results if document_id in documents]
+        return DetailResponse(data=data, msg="获取近似重复文档成功")
+
+    @action(methods=["GET"], detail=True, permission_classes=[IsAuthenticated])
+    def backlinks(self, request, pk=None):
+        """
+        反向链接：正文中链接到该文档的文档（读取保存时维护的链接邻接表，不解析正文）
+        返回格式：[{"id", "name", "category_id", "repository_id", "update_time", "count", "texts"}]
+        """
+        instance = self.get_object()
+        sources = {}
+        for source_id, link_text, count in MmDocumentLink.objects.filter(target_id=instance.id).values_list(
+                "source_id", "link_text", "count").order_by("source_id", "link_text"):
+            item = sources.setdefault(source_id, {"count": 0, "texts": []})
+            item["count"] += count
+            if link_text:
+                item["texts"].append(link_text)
+        # 只返回当前用户有数据权限的来源文档
+        documents = self.filter_queryset(self.get_queryset()).only(
+            "id", "name", "category_id", "update_time").in_bulk(list(sources))
+        data = [{
+            "id": source_id,
+            "name": documents[source_id].name,
+            "category_id": documents[source_id].category_id,
+            "update_time": documents[source_id].update_time,
+            **item,
+        } for source_id, item in sources.items() if source_id in documents]
+        data.sort(key=lambda item: (-item["count"], item["id"]))
+        return DetailResponse(data=data, msg="获取反向链接成功")
+
+    @action(methods=["GET"], detail=False, permission_classes=[IsAuthenticated])
+    def graph(self, request, *args, **kwargs):
+        """
+        文档链接图（读取链接邻接表）
+        请求参数：repository_id（整个知识库的链接图）或 document_id + depth（文档周围 depth 跳以内的邻域，默认1，最大3）
+        返回格式：{"nodes": [{"id", "name", "category_id"}], "edges": [{"source", "target", "count"}],
+                  "dangling": [{"source", "target", "kind", "count"}]}，dangling 为目标文档不存在的链接
+        """
+        repository_id = request.query_params.get("repository_id")
+        document_id = request.query_params.get("document_id")
+        if document_id is None and not repository_id:
+            return ErrorResponse(msg="参数缺失：请提供 repository_id（所属知识库ID）或 document_id（文档ID）")
+        try:
+            document_id = int(document_id) if document_id is not None else None
+        except ValueError:
+            return ErrorResponse(msg="参数错误：document_id 必须为整数")
+        try:
+            repository_id = int(repository_id) if document_id is None else None
+        except ValueError:
+            return ErrorResponse(msg="参数错误：repository_id 必须为整数")
+        try:
+            depth = min(max(int(request.query_params.get("depth", 1)), 1), 3)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：depth 必须为整数")
+        # 节点限定在当前用户有数据权限的文档内，连到不可见文档的边、来源不可见的悬空链接一并去掉
+        queryset = self.filter_queryset(self.get_queryset())
+        if document_id is not None:
+            if not queryset.filter(id=document_id).exists():
+                return ErrorResponse(msg="文档不存在")
+            nodes, edges, dangling = link_graph(document_id=document_id, depth=depth)
+        else:
+            nodes, edges, dangling = link_graph(repository_id=repository_id)
+        documents = queryset.only("id", "name", "category_id").in_bulk(list(nodes))
+        edges = [edge for edge in edges if edge[0] in documents and edge[1] in documents]
+        dangling = [item for item in dangling if item[0] in documents]
+        data = {
+            "nodes": [{
+                "id": node_id,
+                "name": documents[node_id].name,
+                "category_id": documents[node_id].category_id,
+            } for node_id in sorted(nodes) if node_id in documents],
+            "edges": [{"source": source_id, "target": target_id, "count": count}
+                      for source_id, target_id, count in edges],
+            "dangling": [{"source": source_id, "target": target_key, "kind": "id" if kind == 0 else "name",
+                          "count": count} for source_id, kind, target_key, count in dangling],
+        }
+        return DetailResponse(data=data, msg="获取链接图成功")
+
+    @action(methods=["GET"], detail=True, permission_classes=[IsAuthenticated])
+    def content(self, request, pk=None):
+        """
+        文档正文流式获取（编辑器按需加载大文档）
+        支持：ETag/If-None-Match 协商缓存、Range 分段读取（按 UTF-8 字节）、gzip 压缩
+        """
+        document = self.get_object()
+        # 分段读取的后续请求不重复计数
+        if request.META.get("HTTP_RANGE", "bytes=0-").startswith("bytes=0-"):
+            record_view(document.id)
+        if document.content_hash and get_content_store() is not None:
+            # 正文在内容存储中：直接映射存储对象（本地存储为 mmap），内容摘要即 ETag
+            return content_response(request, open_content(document.content_hash), etag=document.content_hash,
+                                    content_type="text/plain; charset=utf-8")
+        data = (document.detail_text or "").encode("utf-8")
+        # ETag 与内容存储摘要一致（SHA-256），可直接作为 patch_content 的 base_hash
+        return content_response(request, data, etag=hashlib.sha256(data).hexdigest(),
+                                content_type="text/plain; charset=utf-8")
+
+    @action(methods=["POST"], detail=True, permission_classes=[IsAuthenticated])
+    def patch_content(self, request, pk=None):
+        """
+        按补丁增量保存正文（长文档自动保存，避免每次提交全文；不重复执行同名校验）
+        请求体：{"base_hash": "编辑基于的正文摘要（content 接口的 ETag）",
+                "patches": [{"offset": 起始位置, "delete": 删除字符数, "insert": "插入文本"}, ...]}
+        正文已被他人修改（base_hash 与当前正文不一致）时拒绝保存，返回当前摘要
+        """
+        base_hash = request.data.get("base_hash")
+        patches = request.data.get("patches")
+        if not base_hash or not isinstance(patches, list):
+            return ErrorResponse(msg="参数错误：请提供 base_hash（正文摘要）与 patches（补丁列表）")
+        instance = self.get_object()
+        with transaction.atomic():
+            # 锁定文档行，保证“校验摘要 - 应用补丁 - 保存”原子执行
+            document = MmDocument.objects.select_for_update().select_related("category").get(id=instance.id)
+            text = document.detail_text or ""
+            current_hash = text_hash(text)
+            if current_hash != base_hash:
+                return ErrorResponse(data={"content_hash": current_hash}, code=409,
+                                     msg="文档正文已被修改，请重新获取最新内容后再保存")
+            try:
+                document.detail_text = apply_patches(text, patches)
+            except ValueError as e:
+                return ErrorResponse(msg=f"补丁应用失败：{e}")
+            document.save(update_fields=["detail_text", "content_hash", "content_length", "update_time"])
+        assign_revision_creator(document, getattr(request.user, "id", None))
+        revision = getattr(document, "_revision", None)
+        data = {
+            "id": document.id,
+            "content_hash": text_hash(document.detail_text),
+            "length": len(document.detail_text),
+            "version": revision.version if revision else None,
+            "update_time": document.update_time,
+        }
+        return DetailResponse(data=data, msg="保存成功")
+
+    @staticmethod
+    def draft_data(draft):
+        return {
+            "text": draft.get("text"),
+            "base_hash": draft.get("base_hash"),
+            "seq": draft.get("seq"),
+            "saved_at": draft.get("saved_at"),
+            "pending": draft.get("pending", False),
+            "conflict": draft.get("conflict", False),
+            "current_hash": draft.get("current_hash"),
+        }
+
+    @action(methods=["GET", "POST", "DELETE"], detail=True, permission_classes=[IsAuthenticated])
+    def draft(self, request, pk=None):
+        """
+        编辑器自动保存草稿（写入缓存，延迟 DOCUMENT_DRAFT_FLUSH_INTERVAL 秒合并落库）
+        GET：获取当前用户的草稿；POST：自动保存，请求体 {"text": "正文", "base_hash": "编辑基于的正文摘要"}；
+        DELETE：丢弃草稿
+        """
+        instance = self.get_object()
+        user_id = request.user.id
+        if request.method == "GET":
+            draft = get_draft(instance.id, user_id)
+            return DetailResponse(data=self.draft_data(draft) if draft else None)
+        if request.method == "DELETE":
+            try:
+                discard_draft(instance.id, user_id)
+            except RegistryLockError:
+                return ErrorResponse(msg="自动保存繁忙，请稍后重试")
+            return DetailResponse(data=[], msg="草稿已丢弃")
+        text = request.data.get("text")
+        if not isinstance(text, str):
+            return ErrorResponse(msg="参数错误：请提供 text（正文）")
+        draft = get_draft(instance.id, user_id)
+        if draft and draft.get("conflict"):
+            return ErrorResponse(data=self.draft_data(draft), code=409,
+                                 msg="文档正文已被他人修改，请合并最新内容后重新编辑")
+        try:
+            draft = save_draft(instance.id, user_id, text, request.data.get("base_hash"))
+        except RegistryLockError:
+            return ErrorResponse(msg="自动保存繁忙，请稍后重试")
+        return DetailResponse(data={"seq": draft["seq"], "saved_at": draft["saved_at"]}, msg="已自动保存")
+
+    @action(methods=["POST"], detail=True, permission_classes=[IsAuthenticated])
+    def publish(self, request, pk=None):
+        """发布：立即将当前用户的草稿写入数据库（不等待延迟落库）"""
+        instance = self.get_object()
+        status, draft = flush_draft(instance.id, request.user.id)
+        if status == "missing":
+            return ErrorResponse(msg="没有待发布的草稿")
+        if status == "locked":
+            return ErrorResponse(msg="草稿正在保存中，请稍后重试")
+        if status == "conflict":
+            return ErrorResponse(data=self.draft_data(draft), code=409,
+                                 msg="文档正文已被他人修改，请合并最新内容后重新发布")
+        if not draft.get("pending"):
+            # 发布期间没有新的自动保存，结束本次编辑（丢弃前又有自动保存时保留草稿）
+            try:
+                discard_draft(instance.id, request.user.id, seq=draft["seq"])
+            except RegistryLockError:
+                pass
+        return DetailResponse(data={"id": instance.id, "content_hash": draft["base_hash"]}, msg="发布成功")
+
+    def perform_create(self, serializer):
+        instance = serializer.save()
+        assign_revision_creator(instance, getattr(self.request.user, "id", None))
+
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        assign_revision_creator(instance, getattr(self.request.user, "id", None))
+
+    @action(methods=["GET"], detail=True, permission_classes=[IsAuthenticated])
+    def revisions(self, request, pk=None):
+        """
+        文档修订历史列表（不含正文）
+        请求参数：page、limit（可选，默认第1页、每页20条）
+        """
+        instance = self.get_object()
+        try:
+            page = max(int(request.query_params.get("page", 1) or 1), 1)
+            limit = min(max(int(request.query_params.get("limit", 20) or 20), 1), 100)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：page、limit 必须为整数")
+        queryset = MmDocumentRevision.objects.filter(document_id=instance.id).order_by("-version")
+        rows = list(queryset.values("version", "content_hash", "kind", "length", "creator", "create_time")[
+                    (page - 1) * limit:page * limit])
+        names = {user["id"]: user["name"] or user["username"] for user in
+                 Users.objects.filter(id__in={row["creator"] for row in rows}).values("id", "name", "username")}
+        for row in rows:
+            row["creator_name"] = names.get(row["creator"])
+        return SuccessResponse(data=rows, total=queryset.count(), page=page, limit=limit, msg="获取修订历史成功")
+
+    @action(methods=["GET"], detail=True, permission_classes=[IsAuthenticated])
+    def revision(self, request, pk=None):
+        """
+        获取指定版本的全文
+        请求参数：version（必传）
+        """
+        instance = self.get_object()
+        version = request.query_params.get("version")
+        if not version:
+            return ErrorResponse(msg="参数缺失：请提供 version（版本号）")
+        try:
+            version = int(version)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：version 必须为整数")
+        revision = MmDocumentRevision.objects.filter(document_id=instance.id, version=version).first()
+        if revision is None:
+            return ErrorResponse(msg=f"版本{version}不存在")
+        data = {
+            "version": revision.version,
+            "content_hash": revision.content_hash,
+            "creator": revision.creator,
+            "create_time": revision.create_time,
+            "detail_text": revision_text(revision),
+        }
+        return DetailResponse(data=data, msg="获取历史版本成功")
+
+    @action(methods=["GET"], detail=True, permission_classes=[IsAuthenticated])
+    def diff(self, request, pk=None):
+        """
+        比较两个版本的差异（行/词哈希后执行 Myers 差异算法）
+        请求参数：from_version（可选，默认为 to_version 的上一版本）、to_version（可选，默认最新版本）、
+                 mode（line 行级 / word 词级，默认 line）、context（行级差异保留的上下文行数，默认3，-1 不折叠）
+        """
+        instance = self.get_object()
+        params = request.query_params
+        try:
+            from_version = int(params["from_version"]) if params.get("from_version") else None
+            to_version = int(params["to_version"]) if params.get("to_version") else None
+            context = int(params.get("context", 3))
+        except ValueError:
+            return ErrorResponse(msg="参数错误：from_version、to_version、context 必须为整数")
+        revisions = MmDocumentRevision.objects.filter(document_id=instance.id)
+        to_revision = revisions.filter(version=to_version).first() if to_version is not None else \
+            revisions.order_by("-version").first()
+        if to_revision is None:
+            return ErrorResponse(msg="目标版本不存在")
+        if from_version is not None:
+            from_revision = revisions.filter(version=from_version).first()
+            if from_revision is None:
+                return ErrorResponse(msg=f"版本{from_version}不存在")
+        else:
+            from_revision = revisions.filter(version__lt=to_revision.version).order_by("-version").first()
+        old_text = revision_text(from_revision) if from_revision else ""
+        new_text = revision_text(to_revision)
+        if params.get("mode", "line") == "word":
+            changes, inserted, deleted = diff_words(old_text, new_text)
+        else:
+            changes, inserted, deleted = diff_lines(old_text, new_text, context=context)
+        data = {
+            "from_version": from_revision.version if from_revision else None,
+            "to_version": to_revision.version,
+            "inserted": inserted,
+            "deleted": deleted,
+            "changes": changes,
+        }
+        return DetailResponse(data=data, msg="获取版本差异成功")
+
     @action(methods=["POST"], detail=False, permission_classes=[IsAuthenticated])
     def batch_adjust_sort(self, request, *args, **kwargs):
         """
-        批量调整文档排序值（适配前端批量拖拽排序场景）
+        批量调整文档排序值（适配前端批量拖拽排序场景；单个文档拖拽请使用 move_between，只更新一行）
         请求体：[{"id": 1, "sort": 10}, {"id": 2, "sort": 20}, ...]
+        涉及目录已使用排序键时恢复为按整数排序值排序
         """
         sort_list = request.data.get("sort_list", [])
         if not isinstance(sort_list, list) or len(sort_list) == 0:
             return ErrorResponse(msg="参数错误：请提供 sort_list（文档ID与排序值的列表）")
 
-        # 批量更新排序值（使用bulk_update提升性能）
-        document_ids = [item["id"] for item in sort_list]
-        documents = MmDocument.objects.filter(id__in=document_ids)
-        if len(documents) != len(document_ids):
+        # 只读取ID、排序值与所属目录，不加载正文
+        id_to_sort = {item["id"]: item["sort"] for item in sort_list}
+        documents = MmDocument.objects.filter(id__in=list(id_to_sort)).only("id", "sort", "category_id")
+        if len(documents) != len(id_to_sort):
             return ErrorResponse(msg="部分文档ID不存在，请检查参数")
 
         # 匹配文档与新排序值
-        id_to_sort = {item["id"]: item["sort"] for item in sort_list}
+        now = timezone.now()
         update_list = []
         for doc in documents:
             new_sort = id_to_sort[doc.id]
             if doc.sort != new_sort:
                 doc.sort = new_sort
+                doc.update_time = now
                 update_list.append(doc)
 
         # 批量更新（仅更新sort和update_time字段）
-        if update_list:
-            MmDocument.objects.bulk_update(update_list, fields=["sort", "update_time"])
+        with transaction.atomic():
+            if update_list:
+                MmDocument.objects.bulk_update(update_list, fields=["sort", "update_time"])
+                rank.record_order_changes(rank.KIND_DOCUMENT, [doc.id for doc in update_list])
+            rank.clear_ranks(rank.KIND_DOCUMENT, {doc.category_id for doc in documents})
 
         return SuccessResponse(data=[], msg=f"成功调整 {len(update_list)} 个文档的排序值")
 
+    @action(methods=["POST"], detail=True, permission_classes=[IsAuthenticated])
+    def move_between(self, request, pk=None):
+        """
+        拖拽排序：将文档移动到同目录下 before_id 与 after_id 之间，只更新该文档的排序键
+        请求体：{"before_id": 移动后排在其前面的文档ID, "after_id": 移动后排在其后面的文档ID}
+        只传一个时另一侧取其相邻文档，都不传时移到最后
+        """
+        instance = self.get_object()
+        neighbours = []
+        for key in ("before_id", "after_id"):
+            value = request.data.get(key)
+            if value in (None, "", 0, "0"):
+                neighbours.append(None)
+                continue
+            neighbour = MmDocument.objects.filter(id=value).only("id", "category_id").first()
+            if neighbour is None:
+                return ErrorResponse(msg=f"文档ID={value}不存在")
+            neighbours.append(neighbour)
+        new_rank = rank.move_between(instance, *neighbours)
+        return DetailResponse(data={"id": instance.id, "category_id": instance.category_id, "rank": new_rank},
+                              msg="文档排序调整成功")
+
     def destroy(self, request, *args, **kwargs):
         """
         重写删除方法：适配模型PROTECT约束（若关联目录被保护，删除时返回友好提示）
@@ -268,47 +792,80 @@ class MmDocumentViewSet(CustomModelViewSet):
         except MmDocument.DoesNotExist:
             return ErrorResponse(msg="文档不存在或已被删除")
 
+    @action(methods=["GET"], detail=False, permission_classes=[IsAuthenticated])
+    def popular(self, request, *args, **kwargs):
+        """
+        阅读排行（读取定时任务预计算的排行，阅读计数每 5 分钟合并一次）
+        请求参数：repository_id（可选，限定知识库）、limit（可选，默认 10）
+        返回格式：{"popular": 最近 N 天阅读最多的文档（含 views）, "recent": 最近阅读的文档（含 last_view_time）,
+                  "days": N, "update_time": 排行计算时间}
+        """
+        repository_id = request.query_params.get("repository_id")
+        try:
+            repository_id = int(repository_id) if repository_id else None
+        except ValueError:
+            return ErrorResponse(msg="参数错误：repository_id 必须为整数")
+        try:
+            limit = min(max(int(request.query_params.get("limit", 10)), 1), POPULAR_SIZE)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：limit 必须为整数")
+        ranking = get_popular(repository_id)
+        document_ids = {item["document_id"] for key in ("popular", "recent") for item in ranking[key]}
+        # 只返回当前用户有权限且仍存在的文档
+        documents = self.filter_queryset(self.get_queryset()).filter(id__in=document_ids).select_related("category")
+        document_map = {document.id: document for document in documents}
+
+        def items(key, field):
+            data = []
+            for item in ranking[key]:
+                document = document_map.get(item["document_id"])
+                if document is None:
+                    continue
+                data.append({
+                    "id": document.id,
+                    "name": document.name,
+                    "category_id": document.category_id,
+                    "category_name": document.category.name,
+                    "repository_id": document.category.repository_id,
+                    field: item[field],
+                })
+                if len(data) >= limit:
+                    break
+            return data
+
+        data = {
+            "popular": items("popular", "views"),
+            "recent": items("recent", "last_view_time"),
+            "days": ranking["days"],
+            "update_time": ranking["update_time"],
+        }
+        return DetailResponse(data=data, msg="获取阅读排行成功")
+
     @action(methods=["GET"], detail=False, permission_classes=[IsAuthenticated])
     def document_stats(self, request, *args, **kwargs):
         """
         文档统计接口（按类型、目录维度统计文档数量，用于数据看板）
-        请求参数：repository_id（可选，按知识库筛选，需结合目录表关联）
+        直接读取增量维护的统计汇总表，不再扫描文档表；汇总表与文档表同样按数据权限过滤
+        请求参数：repository_id（可选，按知识库筛选）
         """
         repository_id = request.query_params.get("repository_id")
-        queryset = self.filter_queryset(self.get_queryset())
+        rollups = DataLevelPermissionsFilter().filter_queryset(request, MmDocumentRollup.objects.all(), self)
+        data = get_document_stats(repository_id, rollups=rollups)
+        return SuccessResponse(data=data, msg="获取文档统计数据成功")
 
-        # 按知识库筛选（通过目录表关联，目录属于指定知识库）
-        if repository_id:
-            queryset = queryset.filter(category__repository_id=repository_id)
-
-        # 1. 按文档类型统计数量
-        type_stats = queryset.values("type_id").annotate(
-            count=models.Count("id")
-        ).order_by("-count")
-        # 补充类型文本标签
-        for stat in type_stats:
+    @action(methods=["POST"], detail=False, permission_classes=[IsAuthenticated])
+    def recompute_stats(self, request, *args, **kwargs):
+        """
+        按文档表重算文档统计汇总（仅超级管理员；也可使用 python manage.py recompute_document_stats）
+        请求参数：repository_id（可选，不传则重算全部）
+        """
+        if not request.user.is_superuser:
+            return ErrorResponse(msg="仅超级管理员可重算文档统计")
+        repository_id = request.data.get("repository_id")
+        if repository_id not in (None, ""):
             try:
-                from dvadmin.system.models import SysDictData
-                dict_label = SysDictData.objects.get(
-                    dict_type="document_type", dict_value=str(stat["type_id"])
-                ).dict_label
-            except (ImportError, SysDictData.DoesNotExist):
-                dict_label = f"类型ID:{stat['type_id']}"
-            stat["type_label"] = dict_label
-
-        # 2. 按目录统计数量（前10个目录）
-        category_stats = queryset.values("category__id", "category__name").annotate(
-            count=models.Count("id")
-        ).order_by("-count")[:10]
-
-        # 3. 总数量统计
-        total_count = queryset.count()
-        latest_update = queryset.aggregate(max_time=models.Max("update_time"))["max_time"] or "无更新记录"
-
-        data = {
-            "total_count": total_count,
-            "latest_update": latest_update,
-            "type_stats": type_stats,
-            "category_stats": category_stats
-        }
-        return SuccessResponse(data=data, msg="获取文档统计数据成功")
\ No newline at end of file
+                repository_id = int(repository_id)
+            except (TypeError, ValueError):
+                return ErrorResponse(msg="参数错误：repository_id 必须为整数")
+        total = recompute_rollups(repository_id or None)
+        return DetailResponse(data={"rows": total}, msg="文档统计重算完成")
\ No newline at end of file
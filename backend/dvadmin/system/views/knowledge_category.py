@@ -5,14 +5,22 @@
 @contact: QQ:2505811377
 @Remark: 目录管理
 """
-from rest_framework import serializers
+import hashlib
+
+from django.db import transaction
+from rest_framework import serializers, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
 from dvadmin.system.models import Users, MmRepository  # 导入关联模型（用户表、知识库表）
+from dvadmin.utils.category_tree import bulk_create_tree, get_repository_tree, move_category, parse_tree_path, \
+    prune_tree
 from dvadmin.utils.filters import DataLevelPermissionsFilter
 from dvadmin.utils.json_response import DetailResponse, SuccessResponse, ErrorResponse
+from dvadmin.utils import rank
 from dvadmin.utils.serializers import CustomModelSerializer
+from dvadmin.utils.typeahead import KIND_CATEGORY, KIND_DOCUMENT, get_index
 from dvadmin.utils.viewset import CustomModelViewSet
 from django.utils import timezone
 
@@ -105,7 +113,7 @@ class CategoryViewSet(CustomModelViewSet):
     - update: 修改目录
     - retrieve: 获取目录详情
     - destroy: 删除目录（含子目录校验）
-    - 自定义接口：树形目录查询、排序调整、目录详情扩展等
+    - 自定义接口：树形目录查询、排序调整、目录移动、目录详情扩展等
     """
     # 基础查询集
     queryset = Category.objects.all()
@@ -152,7 +160,7 @@ class CategoryViewSet(CustomModelViewSet):
             queryset = self.filter_queryset(self.get_queryset()).filter(parent_category_id=parent_id)
 
         # 按排序值升序排列（确保展示顺序正确）
-        queryset = queryset.order_by("sort")
+        queryset = queryset.order_by("rank", "sort")
         # 序列化数据并返回
         serializer = self.get_serializer(queryset, many=True, request=request)
         return SuccessResponse(data=serializer.data, msg="获取目录列表成功")
@@ -162,35 +170,34 @@ class CategoryViewSet(CustomModelViewSet):
         """
         按知识库ID获取完整树形目录（一次性返回所有层级）
         请求参数：repository_id（必传，指定所属知识库）
-        返回格式：嵌套树形结构（含子目录）
+        返回格式：嵌套树形结构（含子目录），响应头 ETag 为目录树版本与当前用户可见目录的摘要
         """
         # 获取并校验知识库ID参数
         repository_id = request.query_params.get("repository_id")
         if not repository_id:
             return ErrorResponse(msg="参数缺失：请提供 repository_id（所属知识库ID）")
-
-        # 筛选指定知识库的所有目录
-        queryset = self.filter_queryset(self.get_queryset()).filter(repository_id=repository_id)
-        if not queryset.exists():
+        try:
+            repository_id = int(repository_id)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：repository_id 必须为整数")
+
+        # 按数据权限筛选可见目录
+        visible_ids = set(self.filter_queryset(self.get_queryset()).filter(repository_id=repository_id).values_list(
+            "id", flat=True))
+        if not visible_ids:
             return SuccessResponse(data=[], msg=f"知识库ID={repository_id}下无目录数据")
 
-        # 递归构建树形结构
-        def build_tree(cate_list, parent_id=None):
-            tree = []
-            for cate in cate_list:
-                if cate.parent_category_id == parent_id:
-                    # 序列化当前目录数据
-                    cate_data = self.get_serializer(cate).data
-                    # 递归查询当前目录的子目录
-                    cate_data["children"] = build_tree(cate_list, parent_id=cate.id)
-                    tree.append(cate_data)
-            return tree
-
-        # 转换为列表并按“父级ID+排序值”排序，确保构建顺序正确
-        cate_list = list(queryset.order_by("parent_category", "sort"))
-        tree_data = build_tree(cate_list)
-
-        return SuccessResponse(data=tree_data, msg=f"获取知识库ID={repository_id}树形目录成功")
+        # 读取按版本号缓存的目录树（目录变更时自动失效），客户端可通过 If-None-Match 复用本地数据
+        tree_data, version = get_repository_tree(repository_id)
+        tree_data = prune_tree(tree_data, visible_ids)
+        # 返回的树按可见目录裁剪，数据权限变化后不能复用原有缓存
+        visible_digest = hashlib.md5(",".join(map(str, sorted(visible_ids))).encode()).hexdigest()[:16]
+        etag = f'"category-tree-{repository_id}-{version}-{visible_digest}"'
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        if not tree_data:
+            return SuccessResponse(data=[], msg=f"知识库ID={repository_id}下无目录数据", headers={"ETag": etag})
+        return SuccessResponse(data=tree_data, msg=f"获取知识库ID={repository_id}树形目录成功", headers={"ETag": etag})
 
     @action(methods=["GET"], detail=False, permission_classes=[IsAuthenticated])
     def all_category(self, request, *args, **kwargs):
@@ -206,17 +213,39 @@ class CategoryViewSet(CustomModelViewSet):
         # 筛选指定知识库的目录，并按“层级+排序值”排序
         queryset = self.filter_queryset(self.get_queryset()).filter(
             repository_id=repository_id
-        ).order_by("dimension", "sort")
+        ).order_by("dimension", "rank", "sort")
 
         # 仅返回关键字段，减少数据传输量
         data = queryset.values("id", "name", "parent_category", "dimension", "master")
         return DetailResponse(data=data, msg="获取所有目录列表成功")
 
+    @action(methods=["GET"], detail=False, permission_classes=[IsAuthenticated])
+    def typeahead(self, request, *args, **kwargs):
+        """
+        快速跳转：按名称、全拼或拼音首字母前缀匹配目录和文档（服务端内存索引，替代前端全量过滤）
+        请求参数：repository_id（必传）、q（输入内容）、limit（返回条数，默认10，最大50）、
+                 kind（可选，category/document，只匹配目录或文档）
+        返回格式：[{"kind": "category/document", "id", "name", "parent_id"（上级目录ID/所属目录ID）}]
+        """
+        repository_id = request.query_params.get("repository_id")
+        if not repository_id or not str(repository_id).isdigit():
+            return ErrorResponse(msg="参数缺失：请提供 repository_id（所属知识库ID）")
+        kind = request.query_params.get("kind") or None
+        if kind not in (None, KIND_CATEGORY, KIND_DOCUMENT):
+            return ErrorResponse(msg="参数错误：kind 只能为 category 或 document")
+        try:
+            limit = min(max(int(request.query_params.get("limit", 10)), 1), 50)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：limit 必须为整数")
+        data = get_index(repository_id).search(request.query_params.get("q", ""), limit, kind)
+        return DetailResponse(data=data, msg="获取成功")
+
     @action(methods=["POST"], detail=True, permission_classes=[IsAuthenticated])
     def adjust_sort(self, request, pk=None):
         """
-        调整目录排序值（单独接口，适配前端拖拽排序场景）
+        调整目录排序值（单独接口，适配前端拖拽排序场景；拖拽到两个目录之间请使用 move_between）
         请求体：{"sort": 整数}（新的排序值）
+        同级目录已使用排序键时恢复为按整数排序值排序
         """
         # 获取当前目录实例
         category = self.get_object()
@@ -226,13 +255,136 @@ class CategoryViewSet(CustomModelViewSet):
             return ErrorResponse(msg="参数错误：请提供有效的 sort 值（整数类型）")
 
         # 更新排序值（仅更新必要字段，提升性能）
-        category.sort = new_sort
-        category.save(update_fields=["sort", "update_time"])
+        with transaction.atomic():
+            category.sort = new_sort
+            category.rank = ""
+            category.save(update_fields=["sort", "rank", "update_time"])
+            rank.clear_ranks(rank.KIND_CATEGORY, [category.parent_category_id], category.repository_id)
 
         # 返回更新后的目录数据
         serializer = self.get_serializer(category)
         return SuccessResponse(data=serializer.data, msg="目录排序调整成功")
 
+    def visible_repository(self, request, repository_id):
+        """知识库是否存在且当前用户有数据权限"""
+        return DataLevelPermissionsFilter().filter_queryset(
+            request, MmRepository.objects.filter(id=repository_id), self).exists()
+
+    @action(methods=["POST"], detail=True, permission_classes=[IsAuthenticated])
+    def move_between(self, request, pk=None):
+        """
+        拖拽排序：将目录移动到同级 before_id 与 after_id 之间，只更新该目录的排序键
+        请求体：{"before_id": 移动后排在其前面的目录ID, "after_id": 移动后排在其后面的目录ID}
+        只传一个时另一侧取其相邻目录，都不传时移到最后；相邻目录在其他父目录下时先移动到该父目录
+        """
+        category = self.get_object()
+        # 相邻目录与移入的父目录均按当前用户的数据权限查找
+        visible = self.filter_queryset(self.get_queryset())
+        neighbours = []
+        for key in ("before_id", "after_id"):
+            value = request.data.get(key)
+            if value in (None, "", 0, "0"):
+                neighbours.append(None)
+                continue
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                return ErrorResponse(msg=f"参数错误：{key} 必须为整数")
+            neighbour = visible.filter(id=value).only("id", "parent_category_id", "repository_id").first()
+            if neighbour is None:
+                return ErrorResponse(msg=f"目录ID={value}不存在或无权访问")
+            neighbours.append(neighbour)
+        target = next((item for item in neighbours if item is not None), None)
+        if target is not None and (target.parent_category_id, target.repository_id) != (
+                category.parent_category_id, category.repository_id):
+            parent = None
+            if target.parent_category_id:
+                parent = visible.filter(id=target.parent_category_id).first()
+                if parent is None:
+                    return ErrorResponse(msg=f"目录ID={target.parent_category_id}不存在或无权访问")
+            if target.repository_id != category.repository_id and not self.visible_repository(
+                    request, target.repository_id):
+                return ErrorResponse(msg=f"目标知识库ID={target.repository_id}不存在或无权访问")
+            move_category(category, parent=parent, repository_id=target.repository_id)
+            category.refresh_from_db()
+        new_rank = rank.move_between(category, *neighbours)
+        return DetailResponse(data={"id": category.id, "parent_category": category.parent_category_id,
+                                    "rank": new_rank}, msg="目录排序调整成功")
+
+    @action(methods=["POST"], detail=False, permission_classes=[IsAuthenticated])
+    def bulk_create_tree(self, request, *args, **kwargs):
+        """
+        批量创建目录树（一次请求创建整个知识库目录骨架，每一层一次批量写入）
+        请求体：{"repository_id": 知识库ID, "parent_category": 挂载的父目录ID（可选，默认为顶级）,
+                "tree": [{"name": "目录名称", "key": "客户端标识（可选）", "icon_url": "", "sort": 0, "children": [...]}]}
+        返回格式：{客户端标识: 目录ID}，未传 key 的节点以位置路径（如 "0/2/1"）为标识
+        """
+        repository_id = request.data.get("repository_id")
+        parent_id = request.data.get("parent_category")
+        try:
+            repository_id = int(repository_id)
+        except (TypeError, ValueError):
+            return ErrorResponse(msg="参数错误：请提供有效的 repository_id（所属知识库ID）")
+        if not MmRepository.objects.filter(id=repository_id).exists():
+            return ErrorResponse(msg="参数错误：请提供有效的 repository_id（所属知识库ID）")
+        parent = None
+        if parent_id not in [None, "", 0, "0"]:
+            try:
+                parent_id = int(parent_id)
+            except (TypeError, ValueError):
+                return ErrorResponse(msg="参数错误：parent_category 必须为整数")
+            parent = Category.objects.filter(id=parent_id).first()
+            if parent is None or parent.repository_id != repository_id:
+                return ErrorResponse(msg=f"父目录ID={parent_id}不存在或不属于该知识库")
+        id_map = bulk_create_tree(repository_id, request.data.get("tree"), parent=parent, master=request.user.id)
+        return DetailResponse(data=id_map, msg=f"成功创建 {len(id_map)} 个目录")
+
+    @action(methods=["POST"], detail=True, permission_classes=[IsAuthenticated])
+    def move(self, request, pk=None):
+        """
+        移动目录（支持跨知识库），整棵子树及其文档的路径在同一事务内集合式更新
+        请求体：{"parent_category": 父目录ID（0或空表示移动为顶级目录）, "repository_id": 目标知识库ID（可选）, "sort": 排序值（可选）}
+        """
+        category = self.get_object()
+        parent_id = request.data.get("parent_category")
+        repository_id = request.data.get("repository_id")
+        sort = request.data.get("sort")
+        if sort is not None and not isinstance(sort, int):
+            return ErrorResponse(msg="参数错误：sort 必须为整数")
+
+        # 目标父目录与目标知识库均按当前用户的数据权限查找
+        parent = None
+        if parent_id not in [None, "", 0, "0"]:
+            try:
+                parent_id = int(parent_id)
+            except (TypeError, ValueError):
+                return ErrorResponse(msg="参数错误：parent_category 必须为整数")
+            parent = self.filter_queryset(self.get_queryset()).filter(id=parent_id).first()
+            if parent is None:
+                return ErrorResponse(msg=f"目标父目录ID={parent_id}不存在或无权访问")
+        if repository_id not in [None, ""]:
+            try:
+                repository_id = int(repository_id)
+            except (TypeError, ValueError):
+                return ErrorResponse(msg="参数错误：repository_id 必须为整数")
+            if not self.visible_repository(request, repository_id):
+                return ErrorResponse(msg=f"目标知识库ID={repository_id}不存在或无权访问")
+
+        affected = move_category(category, parent=parent, repository_id=repository_id or None, sort=sort)
+        category.refresh_from_db()
+        serializer = self.get_serializer(category)
+        return SuccessResponse(data=serializer.data, msg=f"目录移动成功，共更新 {affected} 个目录")
+
+    def perform_update(self, serializer):
+        """修改父目录或所属知识库时，按移动处理，同步整棵子树及其文档的路径"""
+        instance = serializer.instance
+        parent = serializer.validated_data.get("parent_category", instance.parent_category)
+        repository_id = serializer.validated_data.get("repository_id", instance.repository_id)
+        if parent != instance.parent_category or repository_id != instance.repository_id:
+            move_category(instance, parent=parent, repository_id=repository_id)
+            instance.refresh_from_db()
+        serializer.save()
+
     def destroy(self, request, *args, **kwargs):
         """
         重写删除方法：先校验是否有子目录，有则禁止删除（避免子目录成为孤儿数据）
@@ -273,9 +425,11 @@ class CategoryViewSet(CustomModelViewSet):
 
         # 补充返回目录的完整路径（通过tree_path解析）
         if data.get("tree_path"):
-            parent_ids = list(map(int, data["tree_path"].split(",")))
-            parent_cates = Category.objects.filter(id__in=parent_ids).values("id", "name")
-            data["full_path"] = " > ".join([cate["name"] for cate in parent_cates] + [data["name"]])
+            parent_ids = parse_tree_path(data["tree_path"])
+            parent_names = dict(Category.objects.filter(id__in=parent_ids).values_list("id", "name"))
+            data["full_path"] = " > ".join(
+                [parent_names[pid] for pid in parent_ids if pid in parent_names] + [data["name"]]
+            )
         else:
             data["full_path"] = data["name"]  # 顶级目录无父路径，直接显示名称
 
@@ -5,12 +5,21 @@
 @contact: QQ:2505811377
 @Remark: 仓库管理
 """
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
 from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
-from dvadmin.system.models import Users
+from dvadmin.system.models import Users, MmRepositoryGitSync
 from dvadmin.utils.filters import DataLevelPermissionsFilter
+from dvadmin.utils.change_feed import read_changes
+from dvadmin.utils.git_sync import GitSyncError, local_repository, schedule_sync, validate_repo_url
+from dvadmin.utils.repository_clone import discard_clone, get_progress, schedule_clone
+from dvadmin.utils.repository_purge import PURGING, RECYCLED
+from dvadmin.utils.repository_snapshot import export_snapshot, import_snapshot
+from dvadmin.utils.static_site import remove_site, schedule_build
 from dvadmin.utils.json_response import DetailResponse, SuccessResponse, ErrorResponse
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
@@ -119,7 +128,7 @@ class MmRepositoryViewSet(CustomModelViewSet):
 
     @action(methods=['POST'], detail=True, permission_classes=[IsAuthenticated])
     def archive(self, request, pk=None):
-        """归档仓库"""
+        """归档仓库（归档后生成静态文件，见 /api/system/static_site/{id}/manifest.json）"""
         repository = self.get_object()
         if repository.status == 'archived':
             return ErrorResponse(msg="仓库已经归档")
@@ -129,6 +138,7 @@ class MmRepositoryViewSet(CustomModelViewSet):
         repository.archived_user_id = request.user.id
         repository.archived_desc = request.data.get('archived_desc', '')
         repository.save()
+        schedule_build(repository.id)
 
         serializer = self.get_serializer(repository)
         return SuccessResponse(data=serializer.data, msg="归档成功")
@@ -145,6 +155,7 @@ class MmRepositoryViewSet(CustomModelViewSet):
         repository.archived_user_id = None
         repository.archived_desc = None
         repository.save()
+        remove_site(repository.id)
 
         serializer = self.get_serializer(repository)
         return SuccessResponse(data=serializer.data, msg="恢复成功")
@@ -153,7 +164,7 @@ class MmRepositoryViewSet(CustomModelViewSet):
     def recycle(self, request, pk=None):
         """回收仓库"""
         repository = self.get_object()
-        if repository.recycle == 1:
+        if repository.recycle != 0:
             return ErrorResponse(msg="仓库已经回收")
 
         repository.recycle = 1
@@ -168,20 +179,185 @@ class MmRepositoryViewSet(CustomModelViewSet):
     def restore_recycle(self, request, pk=None):
         """恢复回收的仓库"""
         repository = self.get_object()
-        if repository.recycle != 1:
-            return ErrorResponse(msg="仓库未回收")
-
-        repository.recycle = 0
-        repository.recycle_time = None
-        repository.recycle_user_id = None
-        repository.save()
+        with transaction.atomic():
+            # 行锁内检查回收状态，与开始清理（条件更新）互斥
+            repository = MmRepository.objects.select_for_update().get(id=repository.id)
+            if repository.recycle == PURGING:
+                return ErrorResponse(msg="仓库正在从回收站清理，无法恢复")
+            if repository.recycle != RECYCLED:
+                return ErrorResponse(msg="仓库未回收")
+
+            repository.recycle = 0
+            repository.recycle_time = None
+            repository.recycle_user_id = None
+            repository.save()
 
         serializer = self.get_serializer(repository)
         return SuccessResponse(data=serializer.data, msg="恢复成功")
 
+    @action(methods=['GET', 'POST'], detail=True, permission_classes=[IsAuthenticated])
+    def git_sync(self, request, pk=None):
+        """
+        Git 同步：GET 查询同步配置与状态；POST 保存配置（repo_url、branch）并提交同步任务
+        POST 参数：repo_url（首次必传）、branch（默认master）、full（是否全量对比，默认只同步上次同步后的变更）
+        """
+        repository = self.get_object()
+        config = MmRepositoryGitSync.objects.filter(repository_id=repository.id).first()
+        if request.method == 'POST':
+            repo_url = request.data.get('repo_url') or (config.repo_url if config else None)
+            if not repo_url:
+                return ErrorResponse(msg="参数缺失：请提供 repo_url（Git仓库地址）")
+            try:
+                repo_url = validate_repo_url(repo_url)
+            except GitSyncError as e:
+                return ErrorResponse(msg=str(e))
+            branch = request.data.get('branch') or (config.branch if config else 'master')
+            if config is None:
+                config = MmRepositoryGitSync.objects.create(repository_id=repository.id, repo_url=repo_url,
+                                                            branch=branch)
+            elif (config.repo_url, config.branch) != (repo_url, branch):
+                config.repo_url, config.branch = repo_url, branch
+                config.save(update_fields=['repo_url', 'branch'])
+            full = str(request.data.get('full', '')).lower() in ('1', 'true')
+            schedule_sync(repository.id, full)
+            config.refresh_from_db()
+        elif config is None:
+            return ErrorResponse(msg="仓库未配置Git同步")
+        data = {
+            'repo_url': config.repo_url,
+            'branch': config.branch,
+            'last_commit': config.last_commit,
+            'status': config.status,
+            'message': config.message,
+            'last_sync_time': config.last_sync_time,
+        }
+        return DetailResponse(data=data, msg="获取成功" if request.method == 'GET' else "已提交同步")
+
+    @action(methods=['GET'], detail=True, permission_classes=[IsAuthenticated])
+    def git_commits(self, request, pk=None):
+        """
+        Git 同步仓库的提交记录（分页，按 HEAD 缓存）及分支、标签
+        请求参数：page（默认1）、limit（默认20，最大100）
+        """
+        repository = self.get_object()
+        config = MmRepositoryGitSync.objects.filter(repository_id=repository.id).first()
+        git = local_repository(config) if config else None
+        if git is None:
+            return ErrorResponse(msg="仓库尚未进行Git同步")
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：page、limit 必须为整数")
+        data = git.commit_history(page, limit)
+        data['branches'] = git.branches()
+        data['tags'] = git.tags()
+        return DetailResponse(data=data, msg="获取成功")
+
+    @action(methods=['GET'], detail=True, permission_classes=[IsAuthenticated])
+    def changes(self, request, pk=None):
+        """
+        增量同步：返回游标之后知识库、目录、文档的变更（同一对象只返回最新状态）
+        请求参数：since（游标，首次加载时不传）、limit（可选，默认 500，最大 2000）
+        返回格式：{"cursor": 新游标, "reset": 为 true 时需整体重新加载后从 cursor 继续同步, "has_more": 是否还有更多,
+                  "changes": [{"seq", "object_type", "object_id", "action": create/update/move/delete, "data": 对象当前字段}]}
+        """
+        repository = self.get_object()
+        try:
+            since = request.query_params.get('since')
+            since = int(since) if since not in (None, '') else None
+            limit = min(max(int(request.query_params.get('limit', 500)), 1), 2000)
+        except ValueError:
+            return ErrorResponse(msg="参数错误：since、limit 必须为整数")
+        return DetailResponse(data=read_changes(repository.id, since, limit), msg="获取成功")
+
+    @action(methods=['GET'], detail=True, permission_classes=[IsAuthenticated])
+    def export_snapshot(self, request, pk=None):
+        """
+        导出知识库快照（gzip 压缩的记录流，含目录树与文档正文，边读边输出）
+        请求参数：since（可选，如“2026-01-01 00:00:00”，只导出该时间之后的变更，用于增量同步）
+        快照头部记录导出时间，下次增量导出时作为 since 传入
+        """
+        repository = self.get_object()
+        since = request.query_params.get('since')
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                return ErrorResponse(msg="参数错误：since 应为时间格式，如“2026-01-01 00:00:00”")
+        chunks = export_snapshot(repository, since or None)
+        response = StreamingHttpResponse(chunks, content_type='application/gzip')
+        filename = f"repository_{repository.id}_{timezone.now().strftime('%Y%m%d%H%M%S')}.ksnap"
+        response["Access-Control-Expose-Headers"] = "Content-Disposition"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(methods=['POST'], detail=False, permission_classes=[IsAuthenticated])
+    def import_snapshot(self, request, *args, **kwargs):
+        """
+        导入知识库快照（multipart 上传），目录与文档批量写入，ID 在本环境重新分配
+        请求参数：file（快照文件）、repository_id（可选，导入到已有知识库，增量快照必传）、name（可选，新建知识库的名称）
+        """
+        file = request.FILES.get('file')
+        if file is None:
+            return ErrorResponse(msg="参数缺失：请上传 file（快照文件）")
+        repository = None
+        repository_id = request.data.get('repository_id')
+        if repository_id not in (None, ''):
+            try:
+                repository_id = int(repository_id)
+            except (TypeError, ValueError):
+                return ErrorResponse(msg="参数错误：repository_id 必须为整数")
+            # 只能导入到当前用户有权限访问的知识库
+            repository = self.filter_queryset(self.get_queryset()).filter(id=repository_id).first()
+            if repository is None:
+                return ErrorResponse(msg="知识库不存在或无权访问")
+        result = import_snapshot(file, repository=repository, master=request.user.id,
+                                 name=(request.data.get('name') or '').strip() or None)
+        return DetailResponse(data=result, msg="导入成功")
+
+    @action(methods=['POST'], detail=True, permission_classes=[IsAuthenticated])
+    def clone(self, request, pk=None):
+        """
+        以当前仓库为模板克隆新仓库（目录树与文档集合式复制，文档较多时异步执行）
+        请求体：{"name": 新仓库名称, "description": 描述（可选）}
+        返回：新仓库信息与克隆进度，异步执行时通过 clone_progress 接口查询进度
+        """
+        source = self.get_object()
+        name = (request.data.get('name') or '').strip()
+        if not name:
+            return ErrorResponse(msg="参数缺失：请提供 name（新仓库名称）")
+        repository = MmRepository.objects.create(
+            name=name, type_id=source.type_id, master=request.user.id, limits=source.limits,
+            icon_url=source.icon_url, description=request.data.get('description', source.description),
+        )
+        try:
+            is_async = schedule_clone(source.id, repository.id, request.user.id)
+        except Exception as e:
+            # 同步克隆失败：删除新建的知识库，不留下空仓库
+            discard_clone(repository.id)
+            return ErrorResponse(msg=f"克隆失败：{e}")
+        serializer = self.get_serializer(repository)
+        return DetailResponse(data={**serializer.data, 'async': is_async, 'progress': get_progress(repository.id)},
+                              msg="已提交克隆任务" if is_async else "克隆成功")
+
+    @action(methods=['GET'], detail=True, permission_classes=[IsAuthenticated])
+    def clone_progress(self, request, pk=None):
+        """
+        克隆进度
+        返回格式：{"status": pending/running/success/failed, "stage": 当前阶段, "done": 已复制文档数, "total": 文档总数,
+                  "source_id": 模板仓库ID, "message": 错误信息}
+        """
+        repository = self.get_object()
+        progress = get_progress(repository.id)
+        if progress is None:
+            return ErrorResponse(msg="没有该仓库的克隆记录")
+        return DetailResponse(data=progress, msg="获取成功")
+
     def destroy(self, request, *args, **kwargs):
         """重写删除方法，改为回收操作"""
         instance = self.get_object()
+        if instance.recycle != 0:
+            return SuccessResponse(data=[], msg="删除成功")
         instance.recycle = 1
         instance.recycle_time = timezone.now()
         instance.recycle_user_id = request.user.id
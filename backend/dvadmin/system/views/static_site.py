@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 归档知识库静态文件访问
+    - manifest.json：需登录且有该知识库的数据权限，返回当前版本号、文件清单与带签名的文件地址前缀（url），协商缓存
+    - 版本目录下的文件：校验地址中的签名与有效期（不查询数据库），私有缓存到签名过期；
+      配置 STATIC_SITE_ACCEL_REDIRECT 后交由 nginx 返回文件，否则由应用返回（优先返回 .gz 预压缩文件）
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from django.http import FileResponse, Http404, HttpResponse
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+
+from dvadmin.system.models import MmRepository
+from dvadmin.utils.filters import DataLevelPermissionsFilter
+from dvadmin.utils.json_response import ErrorResponse
+from dvadmin.utils.static_site import (ACCEL_REDIRECT, MANIFEST, SITE_ROOT, check_signature, read_manifest,
+                                       sign_build, site_file)
+
+re_build = re.compile(r"^[0-9a-f]{32}$")
+CONTENT_TYPES = {
+    ".json": "application/json; charset=utf-8",
+    ".html": "text/html; charset=utf-8",
+}
+
+
+class StaticSiteManifestView(APIView):
+    """
+    归档知识库静态文件清单
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, repository_id):
+        queryset = DataLevelPermissionsFilter().filter_queryset(
+            request, MmRepository.objects.filter(id=repository_id), self)
+        if not queryset.exists():
+            return ErrorResponse(msg="知识库不存在或无权访问", code=404)
+        data = read_manifest(repository_id)
+        if data is None:
+            return ErrorResponse(msg="该知识库未归档或静态文件尚未生成", code=404)
+        manifest = json.loads(data)
+        # 文件地址前缀：/{知识库ID}/{版本}/{签名}/，同一有效期时间段内不变
+        build = manifest["build"]
+        manifest["url"] = request.path[:-len(MANIFEST)] + f"{build}/{sign_build(repository_id, build)}/"
+        data = json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(data, content_type=CONTENT_TYPES[".json"])
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+
+class StaticSiteFileView(APIView):
+    """
+    归档知识库静态文件（地址带签名与有效期，私有缓存到签名过期）
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request, repository_id, build, token, path):
+        remaining = check_signature(repository_id, build, token) if re_build.match(build) else None
+        if remaining is None:
+            raise Http404("文件不存在或链接已过期")
+        full_path = site_file(repository_id, build, path)
+        if full_path is None:
+            raise Http404("文件不存在")
+        extension = os.path.splitext(full_path)[1]
+        content_type = CONTENT_TYPES.get(extension) or mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        if ACCEL_REDIRECT:
+            # nginx 内部 location 指向 STATIC_SITE_ROOT，可开启 gzip_static 返回预压缩文件
+            response = HttpResponse(content_type=content_type)
+            response["X-Accel-Redirect"] = ACCEL_REDIRECT.rstrip("/") + "/" + os.path.relpath(
+                full_path, os.path.realpath(SITE_ROOT)).replace(os.sep, "/")
+        elif "gzip" in request.headers.get("Accept-Encoding", "") and os.path.isfile(full_path + ".gz"):
+            response = FileResponse(open(full_path + ".gz", "rb"), content_type=content_type)
+            response["Content-Encoding"] = "gzip"
+        else:
+            response = FileResponse(open(full_path, "rb"), content_type=content_type)
+        response["Cache-Control"] = f"private, max-age={remaining}"
+        response["Vary"] = "Accept-Encoding"
+        return response
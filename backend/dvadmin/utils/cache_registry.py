@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 缓存中的登记表（成员 -> 登记时间），供多个进程并发登记/移除
+    - 缓存为 Redis（django_redis）时使用 Redis 哈希，HSET/HDEL 单条命令原子执行，不需要读改写
+    - 其他缓存后端（本地内存等）用带令牌的短锁保护读改写：等待超时抛出 RegistryLockError，
+      不会在未持有锁时继续写入，释放时只删除自己持有的锁
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+# 读改写锁的超时时间与最长等待时间（秒）
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 2
+
+
+class RegistryLockError(Exception):
+    """等待登记表锁超时"""
+
+
+def redis_client():
+    """缓存后端为 django_redis 时返回 Redis 连接，否则返回 None"""
+    try:
+        from django_redis import get_redis_connection
+        from django_redis.cache import RedisCache
+    except ImportError:
+        return None
+    from django.core.cache import caches
+
+    if not isinstance(caches["default"], RedisCache):
+        return None
+    return get_redis_connection("default")
+
+
+def acquire_lock(lock_key, timeout=LOCK_TIMEOUT):
+    """获取带令牌的锁：成功返回令牌，已被占用时返回 None"""
+    token = uuid.uuid4().hex
+    return token if cache.add(lock_key, token, timeout=timeout) else None
+
+
+def release_lock(lock_key, token):
+    """释放锁：只删除自己持有的锁（超时后被其他进程重新获取的锁保留）"""
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+@contextmanager
+def registry_lock(key):
+    lock_key = f"{key}:lock"
+    deadline = time.monotonic() + LOCK_WAIT
+    token = acquire_lock(lock_key)
+    while token is None:
+        if time.monotonic() > deadline:
+            raise RegistryLockError(f"等待登记表锁超时：{key}")
+        time.sleep(0.01)
+        token = acquire_lock(lock_key)
+    try:
+        yield
+    finally:
+        release_lock(lock_key, token)
+
+
+def add_members(key, members):
+    """登记成员（已登记的更新登记时间）"""
+    members = list(members)
+    if not members:
+        return
+    now = time.time()
+    client = redis_client()
+    if client is not None:
+        client.hset(cache.make_key(key), mapping={member: now for member in members})
+        return
+    with registry_lock(key):
+        registry = cache.get(key) or {}
+        registry.update({member: now for member in members})
+        cache.set(key, registry, timeout=None)
+
+
+def remove_members(key, members):
+    members = list(members)
+    if not members:
+        return
+    client = redis_client()
+    if client is not None:
+        client.hdel(cache.make_key(key), *members)
+        return
+    with registry_lock(key):
+        registry = cache.get(key) or {}
+        for member in members:
+            registry.pop(member, None)
+        cache.set(key, registry, timeout=None)
+
+
+def get_members(key):
+    """{成员: 登记时间}"""
+    client = redis_client()
+    if client is not None:
+        return {member.decode(): float(value) for member, value in client.hgetall(cache.make_key(key)).items()}
+    return dict(cache.get(key) or {})
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 知识库目录树缓存与路径维护
+    - 每个知识库的完整目录树一次查询构建（负责人、知识库名称批量查询），结果存入缓存
+    - 缓存键带版本号，目录新增/移动/排序/删除时递增版本号即可使旧树失效
+    - 目录移动/路径修复使用少量集合式 UPDATE 同步整棵子树及其文档的 tree_path/dimension
+"""
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
+
+from dvadmin.utils.validator import CustomValidationError
+
+TREE_VERSION_KEY = "category_tree_version:{repository_id}"
+TREE_CACHE_KEY = "category_tree:{repository_id}:v{version}"
+# 目录树缓存有效期（秒），版本号失效前兜底过期，避免用户姓名等关联信息长期不更新
+TREE_CACHE_TIMEOUT = 60 * 60 * 24
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def get_tree_version(repository_id):
+    """获取知识库目录树当前版本号"""
+    key = TREE_VERSION_KEY.format(repository_id=repository_id)
+    version = cache.get(key)
+    if version is None:
+        # 使用时间戳初始化，缓存被清空后不会与旧版本号重复
+        cache.add(key, int(timezone.now().timestamp() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_tree_version(*repository_ids):
+    """递增知识库目录树版本号，使已缓存的目录树失效"""
+    for repository_id in set(repository_ids):
+        if repository_id is None:
+            continue
+        key = TREE_VERSION_KEY.format(repository_id=repository_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            get_tree_version(repository_id)
+            cache.incr(key)
+
+
+def build_repository_tree(repository_id):
+    """
+    构建知识库完整目录树（字段与 CategorySerializer 输出一致）
+    目录一次查询，负责人、知识库名称各一次批量查询，按父级ID分组后一次遍历组装
+    父目录不在该知识库中的目录（及其子目录）不挂到树上
+    """
+    from dvadmin.system.models import Category, MmRepository, Users
+
+    rows = list(
+        Category.objects.filter(repository_id=repository_id).order_by("parent_category_id", "rank", "sort", "id").values(
+            "id", "name", "repository_id", "master", "update_time", "icon_url", "sort", "dimension", "tree_path",
+            "parent_category_id"
+        )
+    )
+    if not rows:
+        return []
+    master_ids = {row["master"] for row in rows}
+    master_names = {
+        user["id"]: user["name"] or user["username"]
+        for user in Users.objects.filter(id__in=master_ids).values("id", "name", "username")
+    }
+    repository_name = MmRepository.objects.filter(id=repository_id).values_list("name", flat=True).first() or "未知"
+    names = {row["id"]: row["name"] for row in rows}
+
+    children_map = {}
+    for row in rows:
+        children_map.setdefault(row["parent_category_id"], []).append(row)
+
+    nodes = {}
+    for row in rows:
+        has_children = row["id"] in children_map
+        update_time = row["update_time"]
+        nodes[row["id"]] = {
+            "id": row["id"],
+            "modifier_name": None,
+            "parent_name": names.get(row["parent_category_id"], ""),
+            "master_name": master_names.get(row["master"], "未知"),
+            "has_children": 1 if has_children else 0,
+            "hasChild": has_children,
+            "dimension_label": f"{row['dimension']}级目录",
+            "repository_name": repository_name,
+            "name": row["name"],
+            "repository_id": row["repository_id"],
+            "master": row["master"],
+            "update_time": update_time.strftime(DATETIME_FORMAT) if update_time else None,
+            "icon_url": row["icon_url"],
+            "sort": row["sort"],
+            "dimension": row["dimension"],
+            "tree_path": row["tree_path"],
+            "parent_category": row["parent_category_id"],
+            "children": [],
+        }
+    tree = []
+    for row in rows:
+        parent_id = row["parent_category_id"]
+        if parent_id is None:
+            tree.append(nodes[row["id"]])
+        elif parent_id in nodes:
+            nodes[parent_id]["children"].append(nodes[row["id"]])
+    return tree
+
+
+def prune_tree(tree, visible_ids):
+    """只保留可见的目录（不可见目录的子目录一并去掉）"""
+    pruned = []
+    for node in tree:
+        if node["id"] in visible_ids:
+            pruned.append({**node, "children": prune_tree(node["children"], visible_ids)})
+    return pruned
+
+
+def get_repository_tree(repository_id):
+    """
+    获取知识库目录树（优先读取缓存）
+    :return: (目录树, 版本号)
+    """
+    version = get_tree_version(repository_id)
+    key = TREE_CACHE_KEY.format(repository_id=repository_id, version=version)
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_repository_tree(repository_id)
+        cache.set(key, tree, TREE_CACHE_TIMEOUT)
+    return tree, version
+
+
+def child_tree_path(parent_path, parent_id):
+    """
+    子目录的 tree_path：父目录路径 + 父目录ID，首尾带分隔符（如“,101,102,”，顶级目录留空）
+    首尾分隔符保证“某目录之下”可以用前缀匹配，且“,1,2,”不会误匹配“,11,23,”
+    父目录路径先解析再格式化，未执行 backfill_tree_path 的旧格式路径（如“101”）同样得到“,101,102,”
+    """
+    return format_tree_path(parse_tree_path(parent_path) + [parent_id])
+
+
+def format_tree_path(ancestor_ids):
+    """祖先目录ID列表格式化为 tree_path"""
+    return "".join(f",{ancestor_id}" for ancestor_id in ancestor_ids) + "," if ancestor_ids else ""
+
+
+def parse_tree_path(tree_path):
+    """解析 tree_path 为祖先目录ID列表（兼容旧格式“101,102”）"""
+    return [int(item) for item in (tree_path or "").split(",") if item.strip()]
+
+
+def path_startswith_lookup():
+    """
+    前缀匹配使用的查询方式：路径只含数字和逗号，大小写无关；
+    MySQL 下 startswith 会生成 LIKE BINARY 导致无法走索引，因此改用 istartswith（LIKE 'x%'）
+    """
+    return "tree_path__istartswith" if connection.vendor == "mysql" else "tree_path__startswith"
+
+
+def subtree_path_q(self_path):
+    """
+    tree_path 位于指定路径之下的条件（即该目录的所有后代目录/文档），tree_path 索引上的前缀范围查询
+    :param self_path: 目录自身的子路径，即 child_tree_path(目录.tree_path, 目录.id)
+    """
+    return Q(**{path_startswith_lookup(): self_path})
+
+
+def subtree_documents_q(category):
+    """目录及其所有后代目录下文档的条件：本目录文档按 category_id，后代目录文档按 tree_path 前缀"""
+    return Q(category_id=category.id) | subtree_path_q(child_tree_path(category.tree_path, category.id))
+
+
+def sync_document_paths(category_ids):
+    """按所属目录集合式同步文档的冗余字段 tree_path/dimension（一条关联子查询 UPDATE）"""
+    from dvadmin.system.models import Category, MmDocument
+
+    category = Category.objects.filter(id=OuterRef("category_id"))
+    return MmDocument.objects.filter(category_id__in=category_ids).update(
+        tree_path=Subquery(category.values("tree_path")[:1]),
+        dimension=Subquery(category.values("dimension")[:1]),
+    )
+
+
+def move_category(category, parent=None, repository_id=None, sort=None):
+    """
+    移动目录（可跨知识库），在一个事务内集合式改写整棵子树及其文档的路径
+    :param category: 被移动的目录
+    :param parent: 新父目录，None 表示移动为顶级目录
+    :param repository_id: 目标知识库ID，不传则为新父目录（或原目录）所属知识库
+    :param sort: 新排序值，不传则保持不变
+    :return: 受影响的目录数
+    """
+    from dvadmin.system.models import Category, MmDocument, MmDocumentLink
+
+    if parent is not None:
+        if repository_id is not None and int(repository_id) != parent.repository_id:
+            raise CustomValidationError("目标父目录不属于目标知识库")
+        repository_id = parent.repository_id
+    elif repository_id is None:
+        repository_id = category.repository_id
+    repository_id = int(repository_id)
+
+    with transaction.atomic():
+        # 按ID顺序锁定被移动目录、新父目录及其祖先目录：交叉移动（A 移到 B 下、B 移到 A 下，
+        # 或移到对方子树中）时至少锁定一个相同的目录，后者等待前者提交后再基于最新路径校验
+        lock_ids = {category.id}
+        if parent is not None:
+            lock_ids.add(parent.id)
+            lock_ids.update(parse_tree_path(
+                Category.objects.filter(id=parent.id).values_list("tree_path", flat=True).first()
+            ))
+        locked = {item.id: item for item in Category.objects.select_for_update().filter(id__in=lock_ids).order_by("id")}
+        if category.id not in locked or (parent is not None and parent.id not in locked):
+            raise Category.DoesNotExist("目录不存在")
+        category = locked[category.id]
+        old_repository_id = category.repository_id
+        old_self_path = child_tree_path(category.tree_path, category.id)
+        if parent is not None:
+            parent = locked[parent.id]
+            if parent.id == category.id or category.id in parse_tree_path(parent.tree_path):
+                raise CustomValidationError("不能将目录移动到自身或其子目录下")
+            new_path = child_tree_path(parent.tree_path, parent.id)
+            new_dimension = parent.dimension + 1
+        else:
+            new_path = ""
+            new_dimension = 1
+        new_self_path = child_tree_path(new_path, category.id)
+        dimension_delta = new_dimension - category.dimension
+
+        # 1. 目录自身
+        fields = {
+            "parent_category": parent,
+            "repository_id": repository_id,
+            "tree_path": new_path,
+            "dimension": new_dimension,
+            "update_time": timezone.now(),
+        }
+        if sort is not None:
+            fields["sort"] = sort
+        Category.objects.filter(id=category.id).update(**fields)
+        # 2. 所有后代目录：替换路径前缀，深度整体平移
+        descendants = Category.objects.filter(subtree_path_q(old_self_path))
+        affected = 1 + descendants.update(
+            tree_path=Concat(Value(new_self_path), Substr("tree_path", len(old_self_path) + 1)),
+            dimension=F("dimension") + dimension_delta,
+            repository_id=repository_id,
+        )
+        # 3. 子树下所有文档：按所属目录同步冗余路径
+        subtree_ids = Category.objects.filter(Q(id=category.id) | subtree_path_q(new_self_path)).values("id")
+        sync_document_paths(subtree_ids)
+        if repository_id != old_repository_id:
+            from dvadmin.utils.search_engine import get_search_backend
+            get_search_backend().reassign_repository(
+                MmDocument.objects.filter(category_id__in=subtree_ids).values("id"), repository_id
+            )
+            from dvadmin.utils.document_stats import move_category_rollups
+            move_category_rollups(subtree_ids, old_repository_id, repository_id)
+            # 出链所属知识库随文档转移（名称链接仍按原解析结果，可执行 rebuild_document_links 重新解析）
+            MmDocumentLink.objects.filter(source_id__in=MmDocument.objects.filter(
+                category_id__in=subtree_ids).values("id")).update(repository_id=repository_id)
+        transaction.on_commit(lambda: bump_tree_version(old_repository_id, repository_id))
+        from dvadmin.utils import change_feed, typeahead
+        if repository_id != old_repository_id:
+            change_feed.reset_changes(old_repository_id, repository_id)
+            # 子树整体换知识库：两个知识库的快速跳转索引整体重建
+            transaction.on_commit(lambda: typeahead.reset_index(old_repository_id, repository_id))
+            from dvadmin.utils.semantic_index import schedule_update
+            transaction.on_commit(lambda: [schedule_update(item) for item in (old_repository_id, repository_id)])
+        else:
+            change_feed.record_change(repository_id, change_feed.OBJECT_CATEGORY, category.id, change_feed.ACTION_MOVE)
+            transaction.on_commit(lambda: typeahead.record_change(repository_id, typeahead.KIND_CATEGORY, category.id))
+    return affected
+
+
+def repair_repository_paths(repository_id, batch_size=1000):
+    """
+    修复整个知识库的目录路径：一次查询取出父子关系，内存中计算正确的路径/深度，
+    仅对不一致的目录按批 bulk_update，再集合式同步文档冗余字段
+    :return: (修复的目录数, 同步的文档数)
+    """
+    from dvadmin.system.models import Category
+
+    rows = list(Category.objects.filter(repository_id=repository_id).values(
+        "id", "parent_category_id", "tree_path", "dimension"
+    ))
+    children_map = {}
+    ids = {row["id"] for row in rows}
+    for row in rows:
+        # 父目录不在本知识库中的目录按顶级目录处理
+        parent_id = row["parent_category_id"] if row["parent_category_id"] in ids else None
+        children_map.setdefault(parent_id, []).append(row)
+
+    changed = []
+    stack = [(row, "", 1) for row in children_map.get(None, [])]
+    while stack:
+        row, path, dimension = stack.pop()
+        if row["tree_path"] != path or row["dimension"] != dimension:
+            changed.append(Category(id=row["id"], tree_path=path, dimension=dimension))
+        child_path = child_tree_path(path, row["id"])
+        stack.extend((child, child_path, dimension + 1) for child in children_map.get(row["id"], []))
+
+    with transaction.atomic():
+        Category.objects.bulk_update(changed, fields=["tree_path", "dimension"], batch_size=batch_size)
+        documents = sync_document_paths(Category.objects.filter(repository_id=repository_id).values("id"))
+        transaction.on_commit(lambda: bump_tree_version(repository_id))
+    return len(changed), documents
+
+
+def bulk_create_tree(repository_id, tree, parent=None, master=None, max_nodes=5000):
+    """
+    按嵌套结构批量创建目录：内存中分配ID、计算深度与路径，每一层一次 bulk_create，整体在一个事务内
+    :param tree: [{"name": 名称, "key": 客户端标识（可选）, "icon_url": 图标（可选）, "sort": 排序值（可选）,
+                   "children": [...]}]
+    :param parent: 挂载到的父目录，None 表示创建为顶级目录
+    :param master: 负责人ID
+    :return: {客户端标识: 目录ID}，未传 key 的节点以位置路径（如 "0/2/1"）为标识
+    """
+    from dvadmin.system.models import Category
+    from dvadmin.utils.id_allocator import allocate_ids
+    from dvadmin.utils.rank import key_between, last_rank, KIND_CATEGORY
+
+    if not isinstance(tree, list) or not tree:
+        raise CustomValidationError("参数错误：tree 必须为非空列表")
+    # 校验并展开为层级列表：[(节点, 标识, 父节点标识)]
+    levels, keys = [], set()
+    current = [(node, str(index), None) for index, node in enumerate(tree)]
+    total = 0
+    while current:
+        total += len(current)
+        if total > max_nodes:
+            raise CustomValidationError(f"一次最多创建 {max_nodes} 个目录")
+        following = []
+        for node, position, _ in current:
+            if not isinstance(node, dict) or not str(node.get("name") or "").strip():
+                raise CustomValidationError(f"节点 {position} 缺少目录名称")
+            if len(str(node["name"]).strip()) > 100:
+                raise CustomValidationError(f"节点 {position} 目录名称超过100个字符")
+            if not isinstance(node.get("sort", 0), int):
+                raise CustomValidationError(f"节点 {position} 排序值必须为整数")
+            key = str(node.get("key", position))
+            if key in keys:
+                raise CustomValidationError(f"节点标识 {key} 重复")
+            keys.add(key)
+            children = node.get("children") or []
+            if not isinstance(children, list):
+                raise CustomValidationError(f"节点 {position} 的 children 必须为列表")
+            following.extend((child, f"{position}/{index}", key) for index, child in enumerate(children))
+        levels.append([(node, str(node.get("key", position)), parent_key)
+                       for node, position, parent_key in current])
+        current = following
+
+    ids = iter(allocate_ids(Category, total))
+    now = timezone.now()
+    created = {}
+    with transaction.atomic():
+        # 挂载点下已使用排序键时，新目录依次排在最后
+        previous_rank = last_rank(KIND_CATEGORY, parent.id if parent else None, repository_id)
+        for depth, level in enumerate(levels):
+            objects = []
+            for index, (node, key, parent_key) in enumerate(level):
+                parent_category = created[parent_key] if parent_key is not None else parent
+                category = Category(
+                    id=next(ids), name=str(node["name"]).strip(), repository_id=repository_id,
+                    parent_category=parent_category, master=master or 0, icon_url=node.get("icon_url"),
+                    sort=node.get("sort", index), update_time=now,
+                    dimension=parent_category.dimension + 1 if parent_category else 1,
+                    tree_path=child_tree_path(parent_category.tree_path, parent_category.id) if parent_category else "",
+                )
+                if depth == 0 and previous_rank:
+                    previous_rank = category.rank = key_between(previous_rank, None)
+                created[key] = category
+                objects.append(category)
+            Category.objects.bulk_create(objects)
+        from dvadmin.utils import change_feed, typeahead
+        change_feed.record_changes([(repository_id, change_feed.OBJECT_CATEGORY, category.id, change_feed.ACTION_CREATE)
+                                    for category in created.values()])
+        transaction.on_commit(lambda: bump_tree_version(repository_id))
+        transaction.on_commit(lambda: typeahead.reset_index(repository_id))
+    return {key: category.id for key, category in created.items()}
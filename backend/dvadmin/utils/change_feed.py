@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 知识库变更日志（客户端增量同步）
+    - 知识库、目录、文档的新增/修改/移动/删除在事务提交后追加到变更日志，自增ID即变更序号（游标）
+    - 客户端首次加载时记下当前游标，之后按 changes?since=游标 拉取增量，同一对象的多次变更只返回最新状态
+    - 批量变更（Git 同步、目录跨知识库移动、克隆等）记录一条 reset，客户端整体重新加载
+    - 定时任务压缩日志：超过一定时间的日志只保留每个对象的最后一条，超过保留天数的日志删除；
+      游标早于已删除的日志时返回 reset
+    - 自增ID的分配顺序与提交顺序可能不一致（较小的序号可能晚于较大的序号提交），只返回写入超过 SAFE_LAG 秒的日志，
+      游标不会越过仍可能有未提交序号的位置
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, Max, Min, OuterRef
+from django.utils import timezone
+
+OBJECT_REPOSITORY = "repository"
+OBJECT_CATEGORY = "category"
+OBJECT_DOCUMENT = "document"
+ACTION_CREATE = "create"
+ACTION_UPDATE = "update"
+ACTION_MOVE = "move"
+ACTION_DELETE = "delete"
+ACTION_RESET = "reset"
+# 日志保留天数，游标早于保留范围时客户端需整体重新加载
+RETENTION_DAYS = getattr(settings, "REPOSITORY_CHANGE_RETENTION_DAYS", 30)
+# 超过该小时数的日志参与压缩（同一对象只保留最后一条）
+COMPACT_HOURS = 24
+BATCH_SIZE = 1000
+# 安全水位：只返回写入超过该秒数的日志（之前分配的序号已提交）
+SAFE_LAG = getattr(settings, "REPOSITORY_CHANGE_SAFE_LAG", 2)
+# 已删除日志的最大序号
+FLOOR_KEY = "repository_change_floor"
+
+SNAPSHOT_FIELDS = {
+    OBJECT_REPOSITORY: ["id", "name", "type_id", "master", "limits", "status", "recycle", "icon_url", "description"],
+    OBJECT_CATEGORY: ["id", "name", "repository_id", "parent_category_id", "sort", "rank", "dimension", "tree_path",
+                      "icon_url", "master", "update_time"],
+    OBJECT_DOCUMENT: ["id", "name", "category_id", "type_id", "master", "sort", "rank", "dimension", "tree_path",
+                      "update_time"],
+}
+
+
+def record_changes(entries):
+    """
+    事务提交后追加变更日志
+    :param entries: [(知识库ID, 对象类型, 对象ID, 变更类型)]，知识库ID为空的项忽略
+    """
+    from dvadmin.system.models import MmRepositoryChange
+
+    rows = [MmRepositoryChange(repository_id=repository_id, object_type=object_type, object_id=object_id, action=action)
+            for repository_id, object_type, object_id, action in entries if repository_id is not None]
+    if rows:
+        transaction.on_commit(lambda: MmRepositoryChange.objects.bulk_create(rows, batch_size=BATCH_SIZE))
+
+
+def record_change(repository_id, object_type, object_id, action):
+    record_changes([(repository_id, object_type, object_id, action)])
+
+
+def reset_changes(*repository_ids):
+    """批量变更后通知客户端整体重新加载"""
+    record_changes([(repository_id, OBJECT_REPOSITORY, 0, ACTION_RESET) for repository_id in set(repository_ids)])
+
+
+def get_floor():
+    """已删除日志的最大序号（缓存丢失时按现存最小序号保守估计）"""
+    from dvadmin.system.models import MmRepositoryChange
+
+    floor = cache.get(FLOOR_KEY)
+    if floor is None:
+        min_id = MmRepositoryChange.objects.aggregate(value=Min("id"))["value"]
+        floor = min_id - 1 if min_id else 0
+    return floor
+
+
+def safe_cutoff():
+    return timezone.now() - datetime.timedelta(seconds=SAFE_LAG)
+
+
+def latest_cursor():
+    """当前游标（不越过安全水位内的日志，重新加载后这些变更会再次返回，重复应用不影响结果）"""
+    from dvadmin.system.models import MmRepositoryChange
+
+    recent = MmRepositoryChange.objects.filter(create_time__gte=safe_cutoff()).aggregate(value=Min("id"))["value"]
+    if recent is not None:
+        return max(recent - 1, get_floor())
+    return MmRepositoryChange.objects.aggregate(value=Max("id"))["value"] or get_floor()
+
+
+def snapshots(repository_id, object_type, object_ids):
+    """对象当前状态 {ID: 字段}；对象已删除或已不属于该知识库时不返回"""
+    from dvadmin.system.models import Category, MmDocument, MmRepository
+
+    if object_type == OBJECT_REPOSITORY:
+        queryset = MmRepository.objects.filter(id=repository_id)
+    elif object_type == OBJECT_CATEGORY:
+        queryset = Category.objects.filter(repository_id=repository_id)
+    else:
+        queryset = MmDocument.objects.filter(category__repository_id=repository_id)
+    rows = queryset.filter(id__in=object_ids).values(*SNAPSHOT_FIELDS[object_type])
+    return {row["id"]: row for row in rows}
+
+
+def read_changes(repository_id, since=None, limit=500):
+    """
+    读取游标之后的变更
+    :return: {"cursor": 新游标, "reset": 是否需要整体重新加载, "has_more": 是否还有更多,
+              "changes": [{"seq", "object_type", "object_id", "action", "data"}]}
+    """
+    from dvadmin.system.models import MmRepositoryChange
+
+    if since is None or since < get_floor():
+        return {"cursor": latest_cursor(), "reset": True, "has_more": False, "changes": []}
+    cutoff = safe_cutoff()
+    rows = list(MmRepositoryChange.objects.filter(repository_id=repository_id, id__gt=since).order_by("id").values(
+        "id", "object_type", "object_id", "action", "create_time")[:limit + 1])
+    # 在第一条安全水位内的日志处截断，其之前可能还有未提交的序号，下次拉取时再返回
+    recent = next((index for index, row in enumerate(rows) if row["create_time"] >= cutoff), None)
+    if recent is not None:
+        rows, has_more = rows[:recent], False
+    else:
+        rows, has_more = rows[:limit], len(rows) > limit
+    reset = next((row for row in rows if row["action"] == ACTION_RESET), None)
+    if reset is not None:
+        # 重新加载后从 reset 之后继续同步（之后的变更重复应用也不影响结果）
+        return {"cursor": reset["id"], "reset": True, "has_more": True, "changes": []}
+
+    # 同一对象只保留最后一条变更
+    latest = {}
+    for row in rows:
+        key = (row["object_type"], row["object_id"])
+        latest.pop(key, None)
+        latest[key] = row
+    data = {}
+    for object_type in SNAPSHOT_FIELDS:
+        object_ids = [object_id for kind, object_id in latest if kind == object_type]
+        if object_ids:
+            data[object_type] = snapshots(repository_id, object_type, object_ids)
+    changes = []
+    for (object_type, object_id), row in latest.items():
+        snapshot = data.get(object_type, {}).get(object_id)
+        action = row["action"]
+        if snapshot is None:
+            action = ACTION_DELETE
+        elif action == ACTION_DELETE:
+            action = ACTION_UPDATE
+        changes.append({"seq": row["id"], "object_type": object_type, "object_id": object_id, "action": action,
+                        "data": snapshot})
+    return {"cursor": rows[-1]["id"] if rows else since, "reset": False, "has_more": has_more, "changes": changes}
+
+
+def compact_changes(retention_days=RETENTION_DAYS, compact_hours=COMPACT_HOURS, batch_size=BATCH_SIZE):
+    """
+    压缩变更日志：删除超过保留天数的日志；较早的日志中删除已被同一对象后续变更或知识库 reset 覆盖的记录
+    :return: (压缩删除数, 过期删除数)
+    """
+    from dvadmin.system.models import MmRepositoryChange
+
+    now = timezone.now()
+    expired = 0
+    max_id = MmRepositoryChange.objects.filter(
+        create_time__lt=now - datetime.timedelta(days=retention_days)).aggregate(value=Max("id"))["value"]
+    if max_id:
+        expired = delete_in_batches(MmRepositoryChange.objects.filter(id__lte=max_id), batch_size)
+        cache.set(FLOOR_KEY, max(max_id, cache.get(FLOOR_KEY) or 0), timeout=None)
+
+    later = MmRepositoryChange.objects.filter(repository_id=OuterRef("repository_id"), id__gt=OuterRef("id"))
+    superseded = MmRepositoryChange.objects.filter(create_time__lt=now - datetime.timedelta(hours=compact_hours)).filter(
+        Exists(later.filter(object_type=OuterRef("object_type"), object_id=OuterRef("object_id")))
+        | Exists(later.filter(action=ACTION_RESET)))
+    return delete_in_batches(superseded, batch_size), expired
+
+
+def delete_in_batches(queryset, batch_size):
+    from dvadmin.system.models import MmRepositoryChange
+
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += MmRepositoryChange.objects.filter(id__in=ids).delete()[0]
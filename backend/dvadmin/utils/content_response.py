@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 大文本/文件内容的流式响应
+    - ETag + If-None-Match 协商缓存（304）
+    - HTTP Range 单区间分段读取（206/416），支持 If-Range
+    - 客户端支持时 gzip 流式压缩
+"""
+import re
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.text import compress_sequence
+
+re_accepts_gzip = re.compile(r"\bgzip\b")
+re_range = re.compile(r"^bytes=(\d*)-(\d*)$")
+# 分块大小
+CHUNK_SIZE = 64 * 1024
+# 小于该长度的内容不压缩
+GZIP_MIN_LENGTH = 1024
+
+
+def iter_chunks(data, start=0, stop=None, chunk_size=CHUNK_SIZE):
+    """按块切片输出，data 可为 bytes / memoryview / mmap"""
+    stop = len(data) if stop is None else stop
+    for offset in range(start, stop, chunk_size):
+        yield bytes(data[offset:min(offset + chunk_size, stop)])
+
+
+def parse_range(header, size):
+    """
+    解析 Range 请求头，仅支持单区间
+    :return: (start, stop) 左闭右开；None 表示忽略该请求头；False 表示区间无法满足
+    """
+    match = re_range.match((header or "").strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # 后缀区间：最后 N 个字节
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size
+    start = int(first)
+    stop = min(int(last) + 1, size) if last else size
+    if start >= size or start >= stop:
+        return False
+    return start, stop
+
+
+def etag_matches(header, etag):
+    """If-None-Match / If-Range 是否与当前 ETag 匹配（忽略弱校验前缀与压缩后缀）"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [item.strip().replace("W/", "").replace("-gzip\"", "\"") for item in header.split(",")]
+    return etag in candidates
+
+
+def content_response(request, data, etag, content_type="text/plain; charset=utf-8", cache_control="private, no-cache"):
+    """
+    构建内容响应
+    :param request: 请求对象
+    :param data: 内容（bytes / memoryview / mmap，需支持 len 与切片）
+    :param etag: 内容摘要（不含引号）
+    :param content_type: 响应类型
+    :param cache_control: 缓存策略
+    """
+    etag = f'"{etag}"'
+    size = len(data)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        response = HttpResponse(status=304)
+        response["ETag"] = etag
+        response["Cache-Control"] = cache_control
+        return response
+
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and (not if_range or etag_matches(if_range, etag)):
+        byte_range = parse_range(range_header, size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        if byte_range is not None:
+            start, stop = byte_range
+            response = StreamingHttpResponse(iter_chunks(data, start, stop), status=206, content_type=content_type)
+            response["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+            response["Content-Length"] = stop - start
+            response["Accept-Ranges"] = "bytes"
+            response["ETag"] = etag
+            response["Cache-Control"] = cache_control
+            return response
+
+    if size >= GZIP_MIN_LENGTH and re_accepts_gzip.search(request.headers.get("Accept-Encoding", "")):
+        response = StreamingHttpResponse(compress_sequence(iter_chunks(data)), content_type=content_type)
+        response["Content-Encoding"] = "gzip"
+        # 压缩后的表示与原始内容不同，ETag 需区分
+        response["ETag"] = etag[:-1] + '-gzip"'
+    else:
+        response = StreamingHttpResponse(iter_chunks(data), content_type=content_type)
+        response["Content-Length"] = size
+        response["ETag"] = etag
+    response["Accept-Ranges"] = "bytes"
+    response["Vary"] = "Accept-Encoding"
+    response["Cache-Control"] = cache_control
+    return response
@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 文档正文内容存储（内容寻址）
+    - 正文按 SHA-256 命名存储，相同内容只存一份；可选 zlib/zstd 压缩
+    - 可插拔后端：本地文件系统（读取使用 mmap）、S3 兼容对象存储（未配置 endpoint 时使用本地模拟）
+    - 数据库仅保存内容摘要与元数据（mm_content_blob），mm_document.detail_text 置空
+    - 正文修改后旧内容不再被引用，由定时任务清理：不被任何文档、内容存储快照修订引用的内容删除；
+      保存时锁定内容元数据行直到事务提交，清理时同样先锁定再检查引用，避免删除刚被重新引用的内容
+    - 内容文件在事务提交前写入（同一事务内即可读取），事务回滚后遗留的文件没有元数据行，
+      清理任务同时扫描存储，删除没有元数据行且超过宽限期未写入的文件
+    - 开启方式：settings.DOCUMENT_CONTENT_STORE = "local" / "s3" / 自定义后端类导入路径
+"""
+import hashlib
+import logging
+import mmap
+import os
+import re
+import tempfile
+import time
+import zlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models.query_utils import DeferredAttribute
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# 小于该字节数的内容不压缩
+MIN_COMPRESS_SIZE = 4096
+# 压缩后体积不足原始体积的该比例时才保存压缩结果
+COMPRESS_RATIO = 0.9
+COMPRESSION_SUFFIX = {"": "", "zlib": ".zz", "zstd": ".zst"}
+# 没有元数据行的内容文件超过该秒数未写入时视为事务回滚遗留，由清理任务删除
+ORPHAN_GRACE_SECONDS = getattr(settings, "DOCUMENT_CONTENT_ORPHAN_GRACE", 60 * 60)
+re_blob_key = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.zz|\.zst)?$")
+
+
+class ContentStoreError(Exception):
+    """内容存储异常"""
+
+
+def compress(data, method):
+    if method == "zlib":
+        return zlib.compress(data, 6)
+    if method == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return data
+
+
+def decompress(data, method):
+    if method == "zlib":
+        return zlib.decompress(data)
+    if method == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def blob_key(digest, compression=""):
+    """对象键：两级目录散列，避免单目录文件过多"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{COMPRESSION_SUFFIX[compression]}"
+
+
+class BaseContentStore:
+    """内容存储后端基类"""
+    name = "base"
+
+    def __init__(self, compression=None):
+        compression = compression or ""
+        if compression == "zstd":
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                logger.warning("未安装 zstandard，内容存储改用 zlib 压缩")
+                compression = "zlib"
+        if compression not in COMPRESSION_SUFFIX:
+            raise ContentStoreError(f"不支持的压缩方式：{compression}")
+        self.compression = compression
+
+    def encode(self, data):
+        """
+        按配置压缩内容，压缩收益不足时保存原始内容
+        :return: (保存的内容, 压缩方式)
+        """
+        if self.compression and len(data) >= MIN_COMPRESS_SIZE:
+            packed = compress(data, self.compression)
+            if len(packed) < len(data) * COMPRESS_RATIO:
+                return packed, self.compression
+        return data, ""
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def write(self, key, data):
+        raise NotImplementedError
+
+    def read(self, key):
+        """读取全部内容（bytes）"""
+        raise NotImplementedError
+
+    def open(self, key):
+        """读取内容，返回支持 len 与切片的对象（本地存储为 mmap，避免整体载入内存）"""
+        return self.read(key)
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def iter_keys(self):
+        """遍历存储中的对象：(对象键, 最后写入时间戳)"""
+        raise NotImplementedError
+
+
+class LocalFileContentStore(BaseContentStore):
+    """本地文件系统存储：先写临时文件再原子重命名，读取时 mmap 映射"""
+    name = "local"
+
+    def __init__(self, root=None, compression=None):
+        super().__init__(compression)
+        self.root = str(root or getattr(settings, "DOCUMENT_CONTENT_ROOT", None)
+                        or os.path.join(settings.BASE_DIR, "content_store"))
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def write(self, key, data):
+        path = self.path(key)
+        if os.path.exists(path):
+            # 更新写入时间：清理任务不会把刚被重新写入的文件当作回滚遗留删除
+            os.utime(path)
+            return
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def read(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ContentStoreError(f"内容不存在：{key}")
+
+    def open(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b""
+                # 映射关闭文件句柄后仍然有效
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            raise ContentStoreError(f"内容不存在：{key}")
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def iter_keys(self):
+        for directory, _, files in os.walk(self.root):
+            prefix = os.path.relpath(directory, self.root).replace(os.sep, "/")
+            for file in files:
+                try:
+                    mtime = os.path.getmtime(os.path.join(directory, file))
+                except FileNotFoundError:
+                    continue
+                yield f"{prefix}/{file}" if prefix != "." else file, mtime
+
+
+class LocalObjectClient:
+    """
+    S3 客户端的本地模拟（开发/测试环境无 MinIO 时使用）
+    实现 put_object/get_object/head_object/delete_object/list_objects_v2，对象保存为 根目录/桶/键
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def put_object(self, Bucket, Key, Body):
+        LocalFileContentStore(root=os.path.join(self.root, Bucket)).write(Key, Body)
+        return {}
+
+    def get_object(self, Bucket, Key):
+        return {"Body": open(self.path(Bucket, Key), "rb")}
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": os.path.getsize(self.path(Bucket, Key))}
+
+    def delete_object(self, Bucket, Key):
+        LocalFileContentStore(root=os.path.join(self.root, Bucket)).delete(Key)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        from datetime import datetime, timezone
+
+        contents = [{"Key": key, "LastModified": datetime.fromtimestamp(mtime, timezone.utc)}
+                    for key, mtime in LocalFileContentStore(root=os.path.join(self.root, Bucket)).iter_keys()
+                    if key.startswith(Prefix)]
+        return {"Contents": contents, "IsTruncated": False}
+
+
+class S3ContentStore(BaseContentStore):
+    """
+    S3 兼容对象存储（MinIO 等）
+    settings.DOCUMENT_CONTENT_S3 = {"endpoint_url": "", "bucket": "", "access_key": "", "secret_key": "", "prefix": ""}
+    endpoint_url 为空时使用本地模拟客户端
+    """
+    name = "s3"
+
+    def __init__(self, options=None, compression=None, client=None):
+        super().__init__(compression)
+        options = options or getattr(settings, "DOCUMENT_CONTENT_S3", None) or {}
+        self.bucket = options.get("bucket") or "documents"
+        self.prefix = options.get("prefix") or ""
+        if client is None:
+            if options.get("endpoint_url"):
+                import boto3
+                client = boto3.client(
+                    "s3",
+                    endpoint_url=options["endpoint_url"],
+                    aws_access_key_id=options.get("access_key"),
+                    aws_secret_access_key=options.get("secret_key"),
+                )
+            else:
+                root = getattr(settings, "DOCUMENT_CONTENT_ROOT", None) or os.path.join(settings.BASE_DIR, "content_store")
+                client = LocalObjectClient(os.path.join(str(root), "s3"))
+        self.client = client
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except Exception:
+            return False
+
+    def write(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def read(self, key):
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"]
+        except Exception as e:
+            raise ContentStoreError(f"内容不存在：{key}（{e}）")
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def iter_keys(self):
+        params = {"Bucket": self.bucket, "Prefix": self.prefix}
+        while True:
+            response = self.client.list_objects_v2(**params)
+            for item in response.get("Contents", []):
+                yield item["Key"][len(self.prefix):], item["LastModified"].timestamp()
+            if not response.get("IsTruncated"):
+                return
+            params["ContinuationToken"] = response["NextContinuationToken"]
+
+
+CONTENT_STORES = {
+    LocalFileContentStore.name: LocalFileContentStore,
+    S3ContentStore.name: S3ContentStore,
+}
+_store = None
+
+
+def get_content_store():
+    """
+    获取内容存储后端，未开启时返回 None（正文仍保存在 detail_text）
+    settings.DOCUMENT_CONTENT_STORE: None / local / s3 / 自定义后端类导入路径
+    settings.DOCUMENT_CONTENT_COMPRESSION: None / zlib / zstd
+    """
+    global _store
+    store_name = getattr(settings, "DOCUMENT_CONTENT_STORE", None)
+    if not store_name:
+        return None
+    if _store is None:
+        store_class = CONTENT_STORES.get(store_name) or import_string(store_name)
+        _store = store_class(compression=getattr(settings, "DOCUMENT_CONTENT_COMPRESSION", None))
+    return _store
+
+
+@lru_cache(maxsize=4096)
+def blob_compression(digest):
+    """内容的压缩方式（内容寻址，同一摘要的元数据不会变化，可进程内缓存）"""
+    from dvadmin.system.models import MmContentBlob
+
+    compression = MmContentBlob.objects.filter(hash=digest).values_list("compression", flat=True).first()
+    if compression is None:
+        raise ContentStoreError(f"内容元数据不存在：{digest}")
+    return compression
+
+
+def store_bytes(data):
+    """
+    保存内容（已存在则直接复用）
+    需在写入引用（文档、修订）的事务内调用：内容元数据行锁定到事务提交，清理任务不会在此期间删除该内容
+    :return: 内容摘要
+    """
+    from dvadmin.system.models import MmContentBlob
+
+    store = get_content_store()
+    digest = hashlib.sha256(data).hexdigest()
+    with transaction.atomic():
+        blob = MmContentBlob.objects.select_for_update().filter(hash=digest).first()
+        if blob is not None and store.exists(blob_key(digest, blob.compression)):
+            return digest
+        packed, compression = store.encode(data)
+        store.write(blob_key(digest, compression), packed)
+        try:
+            with transaction.atomic():
+                MmContentBlob.objects.update_or_create(hash=digest, defaults={
+                    "size": len(data), "stored_size": len(packed), "compression": compression
+                })
+        except IntegrityError:
+            # 并发保存相同内容
+            pass
+    if blob is not None:
+        # 原有内容文件丢失后重新写入，压缩方式可能变化
+        blob_compression.cache_clear()
+    return digest
+
+
+def store_text(text):
+    return store_bytes((text or "").encode("utf-8"))
+
+
+def open_content(digest):
+    """读取内容：未压缩的本地内容返回 mmap，其余返回 bytes"""
+    store = get_content_store()
+    if store is None:
+        raise ContentStoreError("未开启内容存储")
+    compression = blob_compression(digest)
+    if compression:
+        return decompress(store.read(blob_key(digest, compression)), compression)
+    return store.open(blob_key(digest))
+
+
+def load_text(digest):
+    store = get_content_store()
+    if store is None:
+        raise ContentStoreError("未开启内容存储")
+    compression = blob_compression(digest)
+    return decompress(store.read(blob_key(digest, compression)), compression).decode("utf-8")
+
+
+def referenced_digests(digests):
+    """仍被文档或内容存储快照修订引用的内容摘要"""
+    from dvadmin.system.models import MmDocument, MmDocumentRevision
+
+    digests = list(digests)
+    referenced = set(MmDocument.objects.filter(content_hash__in=digests).values_list("content_hash", flat=True))
+    referenced |= set(MmDocumentRevision.objects.filter(
+        kind=MmDocumentRevision.KIND_STORED_SNAPSHOT, content_hash__in=digests).values_list("content_hash", flat=True))
+    return referenced
+
+
+def delete_unreferenced_blobs(digests):
+    """
+    删除其中已无引用的内容及其元数据
+    先锁定元数据行再检查引用：正在保存、引用同一内容的事务提交前，清理会等待其完成
+    :return: 删除的内容数
+    """
+    from dvadmin.system.models import MmContentBlob
+
+    store = get_content_store()
+    with transaction.atomic():
+        blobs = dict(MmContentBlob.objects.select_for_update().filter(hash__in=list(digests)).values_list(
+            "hash", "compression"))
+        if not blobs:
+            return 0
+        unreferenced = [digest for digest in blobs if digest not in referenced_digests(blobs)]
+        for digest in unreferenced:
+            if store is not None:
+                store.delete(blob_key(digest, blobs[digest]))
+        MmContentBlob.objects.filter(hash__in=unreferenced).delete()
+    blob_compression.cache_clear()
+    return len(unreferenced)
+
+
+def delete_orphan_files(batch_size=500, deadline=None, grace=None):
+    """
+    删除存储中没有元数据行的内容文件（保存内容的事务回滚后遗留），只删除超过宽限期未写入的文件
+    存储后端未实现 iter_keys 时跳过
+    :return: (删除的文件数, 是否检查完成)
+    """
+    store = get_content_store()
+    if store is None:
+        return 0, True
+    grace = ORPHAN_GRACE_SECONDS if grace is None else grace
+    try:
+        keys = store.iter_keys()
+    except NotImplementedError:
+        return 0, True
+    deleted = 0
+    batch = []
+    for key, mtime in keys:
+        if deadline is not None and time.monotonic() > deadline:
+            return deleted, False
+        match = re_blob_key.match(key)
+        if match and time.time() - mtime >= grace:
+            batch.append((key, match.group(1)))
+        if len(batch) >= batch_size:
+            deleted += delete_orphan_batch(store, batch, grace)
+            batch = []
+    if batch:
+        deleted += delete_orphan_batch(store, batch, grace)
+    return deleted, True
+
+
+def delete_orphan_batch(store, batch, grace):
+    """一批候选文件中删除没有对应元数据行（摘要与压缩方式一致）的文件"""
+    from dvadmin.system.models import MmContentBlob
+
+    blobs = dict(MmContentBlob.objects.filter(hash__in=[digest for _, digest in batch]).values_list(
+        "hash", "compression"))
+    deleted = 0
+    for key, digest in batch:
+        if digest in blobs and blob_key(digest, blobs[digest]) == key:
+            continue
+        # 删除前再确认一次写入时间，期间被重新保存（写入时间已更新）的文件保留
+        if isinstance(store, LocalFileContentStore):
+            try:
+                if time.time() - os.path.getmtime(store.path(key)) < grace:
+                    continue
+            except FileNotFoundError:
+                continue
+        store.delete(key)
+        deleted += 1
+    return deleted
+
+
+def collect_garbage(batch_size=500, max_seconds=None):
+    """
+    清理不再被引用的内容（正文修改、文档删除后遗留的旧内容），按摘要顺序分批检查；
+    再扫描存储，删除事务回滚后遗留的、没有元数据行的内容文件
+    :return: (检查的内容数, 删除的内容数, 是否检查完成)；超过 max_seconds 秒后停止
+    """
+    from dvadmin.system.models import MmContentBlob
+
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    checked = deleted = 0
+    last = ""
+    while True:
+        if deadline is not None and time.monotonic() > deadline:
+            return checked, deleted, False
+        digests = list(MmContentBlob.objects.filter(hash__gt=last).order_by("hash").values_list(
+            "hash", flat=True)[:batch_size])
+        if not digests:
+            orphans, finished = delete_orphan_files(batch_size, deadline)
+            return checked, deleted + orphans, finished
+        checked += len(digests)
+        deleted += delete_unreferenced_blobs(digests)
+        last = digests[-1]
+
+
+def offload_document_content(document):
+    """
+    文档保存前：开启内容存储时将正文写入存储并记录摘要，detail_text 列置空；未开启时正文保留在 detail_text
+    正文未加载（defer）或未从存储读取过时，说明本次保存未修改正文，无需处理
+    """
+    fields = document.__dict__
+    if "detail_text" not in fields:
+        return
+    text = fields["detail_text"]
+    if text is None and fields.get("content_hash"):
+        return
+    if text is not None and get_content_store() is not None:
+        document.content_hash = store_text(text)
+    else:
+        document.content_hash = None
+    document.content_length = len(text or "")
+
+
+class StoredContentDescriptor(DeferredAttribute):
+    """
+    detail_text 属性：列值为空且存在内容摘要时，从内容存储按需读取
+    实现 __set__ 成为数据描述符，保证已加载的空值也经过 __get__
+    """
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if value is None and instance.__dict__.get("content_hash"):
+            value = load_text(instance.content_hash)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+
+class StoredContentTextField(models.TextField):
+    """
+    正文字段：存在内容摘要时数据库列写入 NULL（正文在内容存储中）
+    读取时透明地从内容存储加载，业务代码仍按 detail_text 访问
+    """
+    descriptor_class = StoredContentDescriptor
+
+    def pre_save(self, model_instance, add):
+        if model_instance.__dict__.get("content_hash"):
+            return None
+        return super().pre_save(model_instance, add)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 文档派生数据（预览、字数统计、目录大纲）
+    文档保存时计算一次并存入 MmDocumentDerivative，列表/预览接口直接读取，无需再解析正文
+    纯文本不入库（避免每篇正文再存一份），近似重复签名、语义索引需要时由正文即时计算
+    大文档交给 Celery 异步计算
+"""
+import hashlib
+import html
+import logging
+import re
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# 预览长度
+PREVIEW_LENGTH = 500
+# 超过该字符数的文档异步计算派生数据
+ASYNC_THRESHOLD = getattr(settings, "DOCUMENT_DERIVATIVE_ASYNC_THRESHOLD", 200 * 1024)
+
+re_fence = re.compile(r"^\s*(```|~~~)")
+re_atx_heading = re.compile(r"^\s{0,3}(#{1,6})\s+(.+?)\s*#*\s*$")
+re_html_heading = re.compile(r"<h([1-6])[^>]*>(.*?)</h\1>", re.IGNORECASE | re.DOTALL)
+re_html_block = re.compile(r"<(script|style)[^>]*>.*?</\1>", re.IGNORECASE | re.DOTALL)
+re_html_tag = re.compile(r"<[^>]+>")
+re_html_break = re.compile(r"<(br|/?(p|div|li|ul|ol|tr|table|blockquote|pre|h[1-6]))\b[^>]*>", re.IGNORECASE)
+re_image = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+re_link = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+re_line_prefix = re.compile(r"^\s{0,3}(#{1,6}\s+|>\s?|[-*+]\s+\[[ xX]\]\s+|[-*+]\s+|\d+[.)]\s+)")
+re_emphasis = re.compile(r"(\*\*|__|\*|_|~~|`)")
+re_table_rule = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+re_horizontal_rule = re.compile(r"^\s{0,3}([-*_]\s*){3,}$")
+re_cjk_char = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]")
+re_latin_word = re.compile(r"[A-Za-z0-9\u00c0-\u024f]+(?:['\u2019-][A-Za-z0-9\u00c0-\u024f]+)*")
+re_spaces = re.compile(r"[ \t]+")
+
+
+def content_hash(text):
+    """正文摘要，用于判断派生数据是否需要重新计算"""
+    return hashlib.md5((text or "").encode("utf-8")).hexdigest()
+
+
+def strip_markup(text):
+    """去除 Markdown/HTML 标记，返回纯文本（保留代码块内容与段落换行）"""
+    text = re_html_block.sub("", text or "")
+    text = re_html_break.sub("\n", text)
+    text = re_html_tag.sub("", text)
+    text = html.unescape(text)
+    lines = []
+    in_fence = False
+    for line in text.splitlines():
+        if re_fence.match(line):
+            in_fence = not in_fence
+            continue
+        if not in_fence:
+            if re_table_rule.match(line) or re_horizontal_rule.match(line):
+                continue
+            line = re_line_prefix.sub("", line)
+            line = re_image.sub(r"\1", line)
+            line = re_link.sub(r"\1", line)
+            line = re_emphasis.sub("", line)
+            line = line.replace("|", " ")
+        lines.append(re_spaces.sub(" ", line).strip())
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def count_words(plain_text):
+    """字数统计：中日韩字符每字计 1，英文/数字按单词计"""
+    return len(re_cjk_char.findall(plain_text)) + len(re_latin_word.findall(re_cjk_char.sub(" ", plain_text)))
+
+
+def heading_anchor(title, used):
+    """生成标题锚点（同名标题追加序号）"""
+    anchor = re.sub(r"[^\w\u3400-\u9fff-]+", "-", title.strip().lower()).strip("-") or "heading"
+    count = used.get(anchor, 0)
+    used[anchor] = count + 1
+    return f"{anchor}-{count}" if count else anchor
+
+
+def extract_toc(text):
+    """
+    提取目录大纲（Markdown ATX 标题，代码块内的 # 忽略；无 Markdown 标题时识别 HTML <h1>-<h6>）
+    :return: [{"level": 1, "title": "...", "anchor": "...", "line": 行号}, ...]
+    """
+    toc, used = [], {}
+    in_fence = False
+    for number, line in enumerate((text or "").splitlines(), 1):
+        if re_fence.match(line):
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            continue
+        match = re_atx_heading.match(line)
+        if match:
+            title = re_emphasis.sub("", re_link.sub(r"\1", match.group(2))).strip()
+            toc.append({"level": len(match.group(1)), "title": title, "anchor": heading_anchor(title, used),
+                        "line": number})
+    if not toc:
+        for match in re_html_heading.finditer(text or ""):
+            title = html.unescape(re_html_tag.sub("", match.group(2))).strip()
+            if title:
+                toc.append({"level": int(match.group(1)), "title": title, "anchor": heading_anchor(title, used),
+                            "line": (text or "").count("\n", 0, match.start()) + 1})
+    return toc
+
+
+def compute_derivatives(text, plain_text=None):
+    """计算派生数据（plain_text 为已去除标记的纯文本，不传则由正文计算）"""
+    text = text or ""
+    if plain_text is None:
+        plain_text = strip_markup(text)
+    return {
+        "content_hash": content_hash(text),
+        "text_length": len(text),
+        "preview": plain_text[:PREVIEW_LENGTH],
+        "plain_length": len(plain_text),
+        "char_count": len(re.sub(r"\s", "", plain_text)),
+        "word_count": count_words(plain_text),
+        "toc": extract_toc(text),
+    }
+
+
+def refresh_derivatives(document, force=False):
+    """
+    重新计算并保存文档派生数据（正文未变化时跳过）
+    :return: 是否有更新
+    """
+    from dvadmin.system.models import MmDocumentDerivative
+
+    text = document.detail_text or ""
+    if not force:
+        current = MmDocumentDerivative.objects.filter(document_id=document.id).values_list(
+            "content_hash", flat=True).first()
+        if current == content_hash(text):
+            return False
+    plain_text = strip_markup(text)
+    derivative = compute_derivatives(text, plain_text)
+    MmDocumentDerivative.objects.update_or_create(document_id=document.id, defaults=derivative)
+    # 近似重复检测签名同样基于纯文本计算
+    from dvadmin.utils.document_minhash import refresh_signature
+    refresh_signature(document.id, plain_text, derivative["content_hash"])
+    return True
+
+
+def plain_texts(document_ids, batch_size=200):
+    """
+    按批读取文档正文并去除标记（正文可能在内容存储中，通过模型实例读取）
+    :return: 生成 (文档ID, 纯文本)
+    """
+    from dvadmin.system.models import MmDocument
+
+    document_ids = sorted(set(document_ids))
+    for start in range(0, len(document_ids), batch_size):
+        documents = MmDocument.objects.filter(id__in=document_ids[start:start + batch_size]).only(
+            "id", "detail_text", "content_hash")
+        for document in documents:
+            yield document.id, strip_markup(document.detail_text or "")
+
+
+def schedule_derivatives(document):
+    """文档保存后调度派生数据计算：小文档同步计算，大文档提交 Celery 异步任务（失败时退回同步计算）"""
+    if len(document.detail_text or "") <= ASYNC_THRESHOLD:
+        refresh_derivatives(document)
+        return
+
+    def dispatch():
+        from dvadmin.system.tasks import async_build_document_derivatives
+        try:
+            async_build_document_derivatives.delay(document.id)
+        except Exception as e:
+            logger.warning(f"文档[{document.id}]派生数据异步任务提交失败，改为同步计算: {e}")
+            refresh_derivatives(document)
+
+    transaction.on_commit(dispatch)
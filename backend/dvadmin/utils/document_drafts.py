@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 编辑器自动保存草稿缓冲（写回式）
+    - 自动保存只写缓存（按 用户+文档 区分），连续保存合并为一份草稿
+    - 每份草稿在首次变更后 FLUSH_INTERVAL 秒由 Celery 任务写入数据库，即每个用户每篇文档至多 N 秒落库一次
+    - 发布时立即落库；落库时若正文已被他人修改则标记冲突，不覆盖
+    - 待落库的草稿登记在缓存登记表中（见 cache_registry），进程/任务异常丢失时由定时任务或命令重放；
+      登记失败时自动保存返回错误（草稿不写入），由客户端重试
+    - 草稿的读改写（自动保存、落库后更新进度、发布后丢弃）由每份草稿的带令牌短锁保护，
+      不会覆盖并发写入的自动保存
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from dvadmin.utils.cache_registry import (RegistryLockError, acquire_lock, add_members, get_members, registry_lock,
+                                          release_lock, remove_members)
+from dvadmin.utils.document_revisions import text_hash
+
+logger = logging.getLogger(__name__)
+
+# 草稿落库间隔（秒）
+FLUSH_INTERVAL = getattr(settings, "DOCUMENT_DRAFT_FLUSH_INTERVAL", 30)
+# 草稿在缓存中的保留时间（秒）
+DRAFT_TIMEOUT = 60 * 60 * 24 * 7
+DRAFT_KEY = "document_draft:{document_id}:{user_id}"
+FLUSH_LOCK_KEY = "document_draft_lock:{document_id}:{user_id}"
+PENDING_KEY = "document_draft_registry"
+
+
+def draft_key(document_id, user_id):
+    return DRAFT_KEY.format(document_id=document_id, user_id=user_id)
+
+
+def update_pending(document_id, user_id, pending):
+    """
+    登记/移除待落库草稿
+    登记失败时抛出 RegistryLockError；移除失败只记录日志，残留的登记在重放时再次移除
+    """
+    member = f"{document_id}:{user_id}"
+    if pending:
+        add_members(PENDING_KEY, [member])
+        return
+    try:
+        remove_members(PENDING_KEY, [member])
+    except RegistryLockError as e:
+        logger.warning(f"文档[{document_id}]用户[{user_id}]草稿移出登记表失败: {e}")
+
+
+def get_draft(document_id, user_id):
+    return cache.get(draft_key(document_id, user_id))
+
+
+def discard_draft(document_id, user_id, seq=None):
+    """
+    丢弃草稿
+    :param seq: 只在草稿仍为该序号时丢弃（发布后结束编辑，期间有新的自动保存则保留）
+    :return: 是否已丢弃
+    """
+    key = draft_key(document_id, user_id)
+    with registry_lock(key):
+        if seq is not None and (cache.get(key) or {}).get("seq") != seq:
+            return False
+        cache.delete(key)
+    update_pending(document_id, user_id, False)
+    return True
+
+
+def save_draft(document_id, user_id, text, base_hash=None):
+    """
+    自动保存：写入缓存草稿，首次变更时登记并安排延迟落库
+    :param base_hash: 编辑基于的正文摘要，首次保存时记录，用于落库时的冲突检测
+    :return: 草稿
+    """
+    key = draft_key(document_id, user_id)
+    with registry_lock(key):
+        draft = cache.get(key) or {"seq": 0, "flushed_seq": 0, "base_hash": base_hash}
+        if draft.get("base_hash") is None:
+            draft["base_hash"] = base_hash
+        draft["text"] = text
+        draft["seq"] += 1
+        draft["saved_at"] = time.time()
+        schedule = not draft.get("pending")
+        if schedule:
+            # 先登记再写入草稿：登记失败时本次保存失败，不会留下未登记的待落库草稿
+            update_pending(document_id, user_id, True)
+        draft["pending"] = True
+        cache.set(key, draft, DRAFT_TIMEOUT)
+    # 在草稿锁外提交落库任务：提交失败时可能同步落库，落库需要再次获取草稿锁
+    if schedule:
+        schedule_flush(document_id, user_id, draft)
+    return draft
+
+
+def schedule_flush(document_id, user_id, draft):
+    """提交延迟落库任务；任务提交失败时，距上次落库已超过间隔则同步落库，否则留待重放"""
+    from dvadmin.system.tasks import flush_document_draft
+    try:
+        flush_document_draft.apply_async((document_id, user_id), countdown=FLUSH_INTERVAL)
+    except Exception as e:
+        logger.warning(f"文档[{document_id}]草稿落库任务提交失败: {e}")
+        if time.time() - draft.get("flushed_at", 0) >= FLUSH_INTERVAL:
+            flush_draft(document_id, user_id)
+
+
+def flush_draft(document_id, user_id):
+    """
+    草稿落库
+    :return: (状态, 草稿)，状态为 saved / unchanged / conflict / missing / locked
+    """
+    from dvadmin.system.models import MmDocument
+
+    lock_key = FLUSH_LOCK_KEY.format(document_id=document_id, user_id=user_id)
+    token = acquire_lock(lock_key, timeout=60)
+    if token is None:
+        return "locked", None
+    try:
+        key = draft_key(document_id, user_id)
+        draft = cache.get(key)
+        if not draft or draft.get("conflict"):
+            update_pending(document_id, user_id, False)
+            return ("conflict", draft) if draft else ("missing", None)
+        seq = draft["seq"]
+        status = "unchanged"
+        if draft["flushed_seq"] < seq:
+            with transaction.atomic():
+                document = MmDocument.objects.select_for_update().select_related("category").filter(
+                    id=document_id).first()
+                if document is None:
+                    discard_draft(document_id, user_id)
+                    return "missing", None
+                current_hash = text_hash(document.detail_text)
+                draft_hash = text_hash(draft["text"])
+                if draft["base_hash"] not in (None, current_hash) and current_hash != draft_hash:
+                    # 编辑期间正文已被他人修改，保留草稿（含期间新的自动保存）由用户处理
+                    with registry_lock(key):
+                        draft = cache.get(key) or draft
+                        draft.update(conflict=True, current_hash=current_hash, pending=False)
+                        cache.set(key, draft, DRAFT_TIMEOUT)
+                    update_pending(document_id, user_id, False)
+                    return "conflict", draft
+                if current_hash != draft_hash:
+                    document.detail_text = draft["text"]
+                    document.save(update_fields=["detail_text", "content_hash", "content_length", "update_time"])
+                    from dvadmin.utils.document_revisions import assign_revision_creator
+                    assign_revision_creator(document, user_id)
+                    status = "saved"
+            draft["base_hash"] = draft_hash
+            draft["flushed_at"] = time.time()
+
+        # 落库期间可能有新的自动保存：在草稿锁内以缓存中的最新草稿为准，仅更新落库进度
+        try:
+            with registry_lock(key):
+                latest = cache.get(key) or draft
+                latest.update(base_hash=draft["base_hash"], flushed_seq=seq, flushed_at=draft.get("flushed_at", 0))
+                latest["pending"] = latest["seq"] > seq
+                cache.set(key, latest, DRAFT_TIMEOUT)
+        except RegistryLockError as e:
+            # 正文已落库，进度未更新：草稿仍在登记表中，重放时按正文摘要判定为未变更
+            logger.warning(f"文档[{document_id}]用户[{user_id}]草稿落库进度更新失败: {e}")
+            return status, {**draft, "pending": True}
+        if latest["pending"]:
+            schedule_flush(document_id, user_id, latest)
+        else:
+            update_pending(document_id, user_id, False)
+        return status, latest
+    finally:
+        release_lock(lock_key, token)
+
+
+def replay_drafts(max_age=None):
+    """
+    重放未落库的草稿（进程重启、落库任务丢失后恢复）
+    :param max_age: 只重放登记时间早于该秒数的草稿，默认为落库间隔（尚在等待落库的草稿不处理）
+    :return: 落库的草稿数
+    """
+    max_age = FLUSH_INTERVAL if max_age is None else max_age
+    registry = get_members(PENDING_KEY)
+    now = time.time()
+    saved = 0
+    for member, registered_at in list(registry.items()):
+        if now - registered_at < max_age:
+            continue
+        document_id, user_id = (int(item) for item in member.split(":"))
+        try:
+            status, _ = flush_draft(document_id, user_id)
+        except Exception as e:
+            logger.error(f"文档[{document_id}]用户[{user_id}]草稿重放失败: {e}")
+            continue
+        saved += status == "saved"
+    return saved
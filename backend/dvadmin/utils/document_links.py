@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 文档链接关系（反向链接 / 链接图）
+    - 文档保存时解析正文中的链接，维护 文档 -> 文档 的邻接表（mm_document_link），反向链接与链接图只查询该表
+    - 支持的链接形式：
+        [[文档名称]] / [[文档名称|显示文本]]：按名称在同一知识库内解析
+        doc://文档ID、...docId=文档ID、.../document/文档ID：按文档ID解析
+    - 目标不存在的链接保存为悬空链接（target_id 为空），目标文档新建/改名后自动补全，目标删除后重新变为悬空
+"""
+import re
+from collections import Counter
+
+from django.db import transaction
+
+KIND_ID = 0
+KIND_NAME = 1
+# 链接文本最大长度
+MAX_TEXT_LENGTH = 255
+
+re_wiki_link = re.compile(r"\[\[([^\[\]|\n]{1,255})(?:\|([^\[\]\n]{0,255}))?\]\]")
+re_markdown_link = re.compile(r"\[([^\]\n]*)\]\(([^)\s]+)[^)]*\)")
+re_html_link = re.compile(r"<a\b[^>]*?href\s*=\s*[\"']([^\"']+)[\"'][^>]*>(.*?)</a>", re.IGNORECASE | re.DOTALL)
+re_bare_link = re.compile(r"doc://(\d+)")
+re_url_document_id = re.compile(r"(?:doc://|[?&]docId=|/document/)(\d+)")
+re_tag = re.compile(r"<[^>]+>")
+
+
+def extract_links(text):
+    """
+    解析正文中的链接
+    :return: Counter{(类型, 目标键, 链接文本): 出现次数}，目标键为文档ID（字符串）或文档名称
+    """
+    links = Counter()
+    text = text or ""
+    for match in re_wiki_link.finditer(text):
+        name = match.group(1).strip()
+        if name:
+            links[(KIND_NAME, name[:255], (match.group(2) or name).strip()[:MAX_TEXT_LENGTH])] += 1
+    spans = []
+    for match in re_markdown_link.finditer(text):
+        document_id = re_url_document_id.search(match.group(2))
+        if document_id:
+            links[(KIND_ID, document_id.group(1), match.group(1).strip()[:MAX_TEXT_LENGTH])] += 1
+        spans.append(match.span())
+    for match in re_html_link.finditer(text):
+        document_id = re_url_document_id.search(match.group(1))
+        if document_id:
+            label = re_tag.sub("", match.group(2)).strip()
+            links[(KIND_ID, document_id.group(1), label[:MAX_TEXT_LENGTH])] += 1
+        spans.append(match.span())
+    for match in re_bare_link.finditer(text):
+        # 不在 Markdown/HTML 链接地址中的裸链接
+        if not any(start <= match.start() < end for start, end in spans):
+            links[(KIND_ID, match.group(1), "")] += 1
+    return links
+
+
+def resolve_targets(repository_id, links):
+    """
+    解析链接目标：ID 链接校验文档是否存在，名称链接在同一知识库内按名称查找（重名时取ID最小的文档）
+    :return: {(类型, 目标键): 文档ID 或 None}
+    """
+    from dvadmin.system.models import MmDocument
+
+    ids = {int(key) for kind, key, _ in links if kind == KIND_ID}
+    names = {key for kind, key, _ in links if kind == KIND_NAME}
+    targets = {}
+    existing = set(MmDocument.objects.filter(id__in=ids).values_list("id", flat=True)) if ids else set()
+    for document_id in ids:
+        targets[(KIND_ID, str(document_id))] = document_id if document_id in existing else None
+    if names:
+        found = {}
+        for document_id, name in MmDocument.objects.filter(
+                category__repository_id=repository_id, name__in=names).order_by("-id").values_list("id", "name"):
+            found[name] = document_id
+        for name in names:
+            targets[(KIND_NAME, name)] = found.get(name)
+    return targets
+
+
+def body_loaded(document):
+    """本次保存是否可能修改了正文（正文未加载或未从内容存储读取时说明未修改，不重新解析）"""
+    fields = document.__dict__
+    return "detail_text" in fields and not (fields["detail_text"] is None and fields.get("content_hash"))
+
+
+def refresh_links(document, repository_id):
+    """
+    重新解析文档的出链并替换邻接表中该文档的记录（链接未变化时不写入）
+    需在保存文档的事务内调用
+    """
+    from dvadmin.system.models import MmDocumentLink
+
+    links = extract_links(document.detail_text)
+    targets = resolve_targets(repository_id, links)
+    rows = sorted((kind, key, text, targets[(kind, key)], count) for (kind, key, text), count in links.items())
+    current = sorted(MmDocumentLink.objects.filter(source_id=document.id).values_list(
+        "kind", "target_key", "link_text", "target_id", "count"))
+    if current == rows and not MmDocumentLink.objects.filter(source_id=document.id).exclude(
+            repository_id=repository_id).exists():
+        return False
+    MmDocumentLink.objects.filter(source_id=document.id).delete()
+    MmDocumentLink.objects.bulk_create([
+        MmDocumentLink(source_id=document.id, repository_id=repository_id, kind=kind, target_key=key,
+                       link_text=text, target_id=target_id, count=count)
+        for kind, key, text, target_id, count in rows
+    ])
+    return True
+
+
+def document_renamed(document_id, repository_id, name, old_name=None):
+    """
+    文档新建/改名/移动后：指向旧名称的名称链接变为悬空，同一知识库内指向新名称的悬空链接指向该文档
+    """
+    from dvadmin.system.models import MmDocumentLink
+
+    if old_name and old_name != name:
+        MmDocumentLink.objects.filter(kind=KIND_NAME, target_id=document_id).exclude(target_key=name).update(
+            target_id=None)
+    MmDocumentLink.objects.filter(kind=KIND_NAME, repository_id=repository_id, target_key=name,
+                                  target_id__isnull=True).update(target_id=document_id)
+    # ID 链接在文档创建前已存在时（如导入）补全
+    MmDocumentLink.objects.filter(kind=KIND_ID, target_key=str(document_id), target_id__isnull=True).update(
+        target_id=document_id)
+
+
+def document_deleted(document_id):
+    """文档删除后：出链删除，指向该文档的链接变为悬空（需在删除文档的事务内调用）"""
+    from dvadmin.system.models import MmDocumentLink
+
+    MmDocumentLink.objects.filter(source_id=document_id).delete()
+    MmDocumentLink.objects.filter(target_id=document_id).update(target_id=None)
+
+
+def rebuild_links(repository_id=None, batch_size=200):
+    """
+    按正文重建邻接表（历史文档初始化或修复；解析时目标文档均已存在，无需再补全悬空链接）
+    :return: 处理的文档数
+    """
+    from dvadmin.system.models import MmDocument
+
+    documents = MmDocument.objects.select_related("category").only(
+        "id", "detail_text", "content_hash", "category__repository_id").order_by("id")
+    if repository_id:
+        documents = documents.filter(category__repository_id=repository_id)
+    total = 0
+    for document in documents.iterator(chunk_size=batch_size):
+        with transaction.atomic():
+            refresh_links(document, document.category.repository_id)
+        total += 1
+    return total
+
+
+def link_graph(repository_id=None, document_id=None, depth=1, max_nodes=500):
+    """
+    链接图（只查询邻接表）：指定文档时取其 depth 跳以内的邻域（出链与反向链接），否则取整个知识库
+    :return: (文档ID集合, [(源文档ID, 目标文档ID, 次数)], [(源文档ID, 类型, 目标键, 次数)])
+    """
+    from django.db.models import Q, Sum
+
+    from dvadmin.system.models import MmDocumentLink
+
+    links = MmDocumentLink.objects.all()
+    if document_id is None:
+        links = links.filter(repository_id=repository_id)
+        nodes = set()
+    else:
+        nodes, frontier = {document_id}, {document_id}
+        for _ in range(depth):
+            found = set()
+            for source_id, target_id in links.filter(
+                    Q(source_id__in=frontier) | Q(target_id__in=frontier)).values_list("source_id", "target_id"):
+                found.update(item for item in (source_id, target_id) if item is not None)
+            frontier = found - nodes
+            if not frontier:
+                break
+            nodes.update(sorted(frontier)[:max(max_nodes - len(nodes), 0)])
+            frontier &= nodes
+        links = links.filter(source_id__in=nodes)
+    edges, dangling = [], []
+    for source_id, target_id, kind, target_key, count in links.values_list(
+            "source_id", "target_id", "kind", "target_key").annotate(count=Sum("count")).order_by(
+            "source_id", "target_id", "kind", "target_key"):
+        if target_id is None:
+            dangling.append((source_id, kind, target_key, count))
+        elif document_id is None or target_id in nodes:
+            edges.append((source_id, target_id, count))
+    if document_id is None:
+        nodes = {item for source_id, target_id, _ in edges for item in (source_id, target_id)}
+        nodes.update(source_id for source_id, _, _, _ in dangling)
+    merged = {}
+    for source_id, target_id, count in edges:
+        merged[(source_id, target_id)] = merged.get((source_id, target_id), 0) + count
+    return nodes, [(source_id, target_id, count) for (source_id, target_id), count in merged.items()], dangling
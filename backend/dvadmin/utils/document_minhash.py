@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 近似重复文档检测（MinHash + LSH）
+    - 正文纯文本切词后取连续 SHINGLE_SIZE 个词为一个片段，片段集合的 Jaccard 相似度即文档相似度
+    - 每个文档保存 NUM_PERM 个最小哈希值（uint32 数组，512 字节）作为签名，签名相同位置的比例即相似度估计
+    - 签名按 BANDS 段分桶（每段 ROWS 个值），任一段完全相同的文档才作为候选，查询只访问同桶文档
+    - 安装 numpy 时向量化计算签名，否则逐个计算（两种方式结果一致）
+"""
+import hashlib
+import random
+import zlib
+from array import array
+
+from django.db import transaction
+
+from dvadmin.utils.text_diff import split_words
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# 默认相似度阈值（BANDS/ROWS 对应的 LSH 阈值约为 (1/BANDS)^(1/ROWS) ≈ 0.71）
+DEFAULT_THRESHOLD = 0.8
+# 哈希函数 (a * x + b) mod PRIME，PRIME 为大于 2^32 的素数，a*x+b 不超过 uint64
+PRIME = 4294967311
+MAX_HASH = (1 << 32) - 1
+_random = random.Random(20240601)
+PERMUTATIONS = [(_random.randint(1, MAX_HASH), _random.randint(0, MAX_HASH)) for _ in range(NUM_PERM)]
+# numpy 分块计算时每块的片段数
+CHUNK_SIZE = 4096
+
+
+def shingle_hashes(plain_text):
+    """纯文本 -> 片段哈希集合（忽略空白与大小写）"""
+    words = [word.lower() for word in split_words(plain_text) if not word.isspace()]
+    if not words:
+        return set()
+    if len(words) <= SHINGLE_SIZE:
+        return {zlib.crc32("\x1f".join(words).encode("utf-8"))}
+    return {zlib.crc32("\x1f".join(words[i:i + SHINGLE_SIZE]).encode("utf-8"))
+            for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(hashes):
+    """
+    计算 MinHash 签名
+    :return: array("I")，长度 NUM_PERM；片段为空时返回 None
+    """
+    if not hashes:
+        return None
+    if numpy is not None:
+        values = numpy.fromiter(hashes, dtype=numpy.uint64, count=len(hashes))
+        a = numpy.array([item[0] for item in PERMUTATIONS], dtype=numpy.uint64)[:, None]
+        b = numpy.array([item[1] for item in PERMUTATIONS], dtype=numpy.uint64)[:, None]
+        result = numpy.full(NUM_PERM, numpy.iinfo(numpy.uint64).max, dtype=numpy.uint64)
+        for start in range(0, len(values), CHUNK_SIZE):
+            chunk = values[start:start + CHUNK_SIZE][None, :]
+            result = numpy.minimum(result, ((a * chunk + b) % PRIME).min(axis=1))
+        return array("I", (int(value) & MAX_HASH for value in result))
+    return array("I", (min((a * value + b) % PRIME for value in hashes) & MAX_HASH for a, b in PERMUTATIONS))
+
+
+def dump_signature(signature):
+    return signature.tobytes()
+
+
+def load_signature(data):
+    signature = array("I")
+    signature.frombytes(bytes(data))
+    return signature
+
+
+def band_buckets(signature):
+    """签名分段后每段的桶编号（8 字节摘要，转为有符号整数存入 BigInteger 列）"""
+    buckets = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(signature[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, "big", signed=True)))
+    return buckets
+
+
+def similarity(signature, other):
+    """签名相同位置的比例（Jaccard 相似度估计）"""
+    return sum(1 for x, y in zip(signature, other) if x == y) / NUM_PERM
+
+
+def refresh_signature(document_id, plain_text, text_hash):
+    """
+    更新文档签名与 LSH 分桶（在派生数据计算后调用，正文未变化时跳过）
+    :return: 签名，纯文本为空时返回 None
+    """
+    from dvadmin.system.models import MmDocumentLshBucket, MmDocumentSignature
+
+    current = MmDocumentSignature.objects.filter(document_id=document_id).values_list(
+        "content_hash", "signature").first()
+    if current is not None and current[0] == text_hash:
+        return load_signature(current[1])
+    hashes = shingle_hashes(plain_text)
+    signature = minhash(hashes)
+    with transaction.atomic():
+        MmDocumentLshBucket.objects.filter(document_id=document_id).delete()
+        if signature is None:
+            MmDocumentSignature.objects.filter(document_id=document_id).delete()
+            return None
+        MmDocumentSignature.objects.update_or_create(document_id=document_id, defaults={
+            "content_hash": text_hash, "shingle_count": len(hashes), "signature": dump_signature(signature)
+        })
+        MmDocumentLshBucket.objects.bulk_create([
+            MmDocumentLshBucket(document_id=document_id, band=band, bucket=bucket)
+            for band, bucket in band_buckets(signature)
+        ])
+    return signature
+
+
+def get_signature(document_id):
+    """读取文档签名，尚未计算（历史文档）时按正文的纯文本计算"""
+    from dvadmin.system.models import MmDocumentDerivative, MmDocumentSignature
+    from dvadmin.utils.document_derivatives import plain_texts
+
+    data = MmDocumentSignature.objects.filter(document_id=document_id).values_list("signature", flat=True).first()
+    if data is not None:
+        return load_signature(data)
+    text_hash = MmDocumentDerivative.objects.filter(document_id=document_id).values_list(
+        "content_hash", flat=True).first()
+    if text_hash is None:
+        return None
+    for _, plain_text in plain_texts([document_id]):
+        return refresh_signature(document_id, plain_text, text_hash)
+    return None
+
+
+def find_similar(document_id, threshold=DEFAULT_THRESHOLD, limit=20, documents=None):
+    """
+    查找近似重复文档：按 LSH 分桶取候选，再用签名估计相似度过滤
+    :param documents: 候选文档范围（文档查询集，如按数据权限过滤后的查询集），不传则不限
+    :return: [(文档ID, 相似度)]，按相似度降序
+    """
+    from django.db.models import Q
+
+    from dvadmin.system.models import MmDocumentLshBucket, MmDocumentSignature
+
+    signature = get_signature(document_id)
+    if signature is None:
+        return []
+    condition = Q()
+    for band, bucket in band_buckets(signature):
+        condition |= Q(band=band, bucket=bucket)
+    candidate_ids = set(MmDocumentLshBucket.objects.filter(condition).exclude(document_id=document_id).values_list(
+        "document_id", flat=True))
+    signatures = MmDocumentSignature.objects.filter(document_id__in=candidate_ids)
+    if documents is not None:
+        signatures = signatures.filter(document_id__in=documents.values("id"))
+    results = []
+    for candidate_id, data in signatures.values_list("document_id", "signature"):
+        score = similarity(signature, load_signature(data))
+        if score >= threshold:
+            results.append((candidate_id, score))
+    results.sort(key=lambda item: (-item[1], item[0]))
+    return results[:limit]
+
+
+def build_signatures(document_ids, batch_size=500):
+    """为缺少签名或签名已过期的文档计算签名（按正文计算纯文本）"""
+    from django.db.models import F, Q
+
+    from dvadmin.system.models import MmDocumentDerivative
+    from dvadmin.utils.document_derivatives import plain_texts
+
+    hashes = dict(MmDocumentDerivative.objects.filter(document_id__in=document_ids).filter(
+        Q(document__signature__isnull=True) | ~Q(document__signature__content_hash=F("content_hash"))
+    ).values_list("document_id", "content_hash"))
+    built = 0
+    for document_id, plain_text in plain_texts(hashes, batch_size):
+        refresh_signature(document_id, plain_text, hashes[document_id])
+        built += 1
+    return built
+
+
+def duplicate_groups(repository_id, threshold=DEFAULT_THRESHOLD):
+    """
+    知识库近似重复报告：该知识库文档与全部文档（含其他知识库）中的近似重复分组
+    同桶的文档两两校验签名相似度，相似的文档用并查集合并为一组
+    :return: [(文档ID列表, [(文档ID, 文档ID, 相似度)])]
+    """
+    from dvadmin.system.models import MmDocument, MmDocumentLshBucket, MmDocumentSignature
+
+    own = MmDocumentLshBucket.objects.filter(
+        document_id__in=MmDocument.objects.filter(category__repository_id=repository_id).values("id"))
+    keys = set(own.values_list("band", "bucket"))
+    if not keys:
+        return []
+    members = {}
+    buckets = sorted({bucket for _, bucket in keys})
+    for start in range(0, len(buckets), 500):
+        for document_id, band, bucket in MmDocumentLshBucket.objects.filter(
+                bucket__in=buckets[start:start + 500]).values_list("document_id", "band", "bucket"):
+            if (band, bucket) in keys:
+                members.setdefault((band, bucket), set()).add(document_id)
+    pairs = set()
+    for ids in members.values():
+        if len(ids) > 1:
+            ids = sorted(ids)
+            pairs.update((x, y) for index, x in enumerate(ids) for y in ids[index + 1:])
+    document_ids = {item for pair in pairs for item in pair}
+    signatures = {document_id: load_signature(data) for document_id, data in MmDocumentSignature.objects.filter(
+        document_id__in=document_ids).values_list("document_id", "signature")}
+
+    parent = {}
+
+    def find(item):
+        while parent.get(item, item) != item:
+            parent[item] = parent.get(parent[item], parent[item])
+            item = parent[item]
+        return item
+
+    edges = []
+    for x, y in sorted(pairs):
+        if x not in signatures or y not in signatures:
+            continue
+        score = similarity(signatures[x], signatures[y])
+        if score >= threshold:
+            edges.append((x, y, score))
+            parent[find(x)] = find(y)
+    groups = {}
+    for x, y, score in edges:
+        group = groups.setdefault(find(x), (set(), []))
+        group[0].update((x, y))
+        group[1].append((x, y, score))
+    return sorted(((sorted(ids), pairs) for ids, pairs in groups.values()), key=lambda group: -len(group[0]))
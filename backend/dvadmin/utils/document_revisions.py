@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 文档修订历史
+    - 每次保存正文变化时记录一个版本：定期保存全文快照，其余版本保存与上一版本的行级增量
+    - 任一版本的重建 = 最近快照 + 不超过 SNAPSHOT_INTERVAL 个增量，一次查询取出整条链
+    - 开启内容存储时快照正文写入内容存储（与文档正文共享去重）
+    - 压缩任务对较早的版本按时间抽稀，并重新生成快照/增量链
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from dvadmin.utils.text_diff import apply_delta, make_delta
+
+# 每隔多少个版本保存一次全文快照
+SNAPSHOT_INTERVAL = getattr(settings, "DOCUMENT_REVISION_SNAPSHOT_INTERVAL", 20)
+# 快照以来的增量总大小超过正文长度的该比例时提前保存快照
+SNAPSHOT_DELTA_RATIO = 0.5
+# 压缩：保留最近的版本数、超过多少天的版本按天只保留最后一个
+COMPACT_KEEP_RECENT = getattr(settings, "DOCUMENT_REVISION_KEEP_RECENT", 50)
+COMPACT_AFTER_DAYS = getattr(settings, "DOCUMENT_REVISION_COMPACT_DAYS", 30)
+
+
+def text_hash(text):
+    """正文版本摘要（SHA-256，与内容存储的摘要一致）"""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def build_revision(document_id, version, text, previous=None, previous_text=None):
+    """
+    构造版本记录（不入库）
+    :param previous: 上一版本记录，为空或链过长时保存快照
+    """
+    from dvadmin.system.models import MmDocumentRevision
+    from dvadmin.utils.content_store import get_content_store, store_text
+
+    revision = MmDocumentRevision(document_id=document_id, version=version, content_hash=text_hash(text),
+                                  length=len(text))
+    if previous is not None and previous.chain_length < SNAPSHOT_INTERVAL:
+        data = json.dumps(make_delta(previous_text, text), ensure_ascii=False, separators=(",", ":"))
+        chain_size = previous.chain_size + len(data)
+        if chain_size <= max(len(text), 1024) * SNAPSHOT_DELTA_RATIO:
+            revision.kind = MmDocumentRevision.KIND_DELTA
+            revision.data = data
+            revision.base_version = previous.base_version
+            revision.chain_length = previous.chain_length + 1
+            revision.chain_size = chain_size
+            return revision
+    if get_content_store() is not None:
+        store_text(text)
+        revision.kind = MmDocumentRevision.KIND_STORED_SNAPSHOT
+        revision.data = ""
+    else:
+        revision.kind = MmDocumentRevision.KIND_SNAPSHOT
+        revision.data = text
+    revision.base_version = version
+    revision.chain_length = 0
+    revision.chain_size = 0
+    return revision
+
+
+def record_revision(document):
+    """
+    文档保存后记录新版本（正文未变化时不记录），需在保存文档的事务内调用
+    :return: 新版本记录或 None
+    """
+    from dvadmin.system.models import MmDocumentRevision
+
+    fields = document.__dict__
+    if "detail_text" not in fields or (fields["detail_text"] is None and fields.get("content_hash")):
+        # 正文未加载，本次保存未修改正文
+        return None
+    text = document.detail_text or ""
+    latest = MmDocumentRevision.objects.filter(document_id=document.id).order_by("-version").first()
+    if latest is not None and latest.content_hash == text_hash(text):
+        return None
+    previous_text = revision_text(latest) if latest is not None else None
+    revision = build_revision(document.id, latest.version + 1 if latest else 1, text, latest, previous_text)
+    revision.save()
+    return revision
+
+
+def assign_revision_creator(document, user_id):
+    """记录本次保存产生的版本的编辑人（模型保存时无法获取请求用户，由视图在保存后补充）"""
+    from dvadmin.system.models import MmDocumentRevision
+
+    revision = getattr(document, "_revision", None)
+    if revision is not None and user_id:
+        MmDocumentRevision.objects.filter(id=revision.id).update(creator=user_id)
+
+
+def snapshot_text(revision):
+    from dvadmin.system.models import MmDocumentRevision
+    from dvadmin.utils.content_store import load_text
+
+    if revision.kind == MmDocumentRevision.KIND_STORED_SNAPSHOT:
+        return load_text(revision.content_hash) if revision.length else ""
+    return revision.data
+
+
+def revision_text(revision):
+    """重建指定版本的全文：一次查询取出“快照 → 目标版本”的整条链，依次应用增量"""
+    from dvadmin.system.models import MmDocumentRevision
+
+    if revision.kind != MmDocumentRevision.KIND_DELTA:
+        return snapshot_text(revision)
+    chain = MmDocumentRevision.objects.filter(
+        document_id=revision.document_id, version__gte=revision.base_version, version__lte=revision.version
+    ).order_by("version")
+    text = None
+    for item in chain:
+        text = snapshot_text(item) if item.kind != MmDocumentRevision.KIND_DELTA else apply_delta(
+            text, json.loads(item.data))
+    return text
+
+
+def get_revision_text(document_id, version):
+    from dvadmin.system.models import MmDocumentRevision
+
+    revision = MmDocumentRevision.objects.filter(document_id=document_id, version=version).first()
+    return None if revision is None else revision_text(revision)
+
+
+def compact_revisions(document_id, keep_recent=COMPACT_KEEP_RECENT, older_than_days=COMPACT_AFTER_DAYS):
+    """
+    压缩单个文档的修订历史：
+    最近 keep_recent 个版本及 older_than_days 天内的版本全部保留，更早的版本每天只保留最后一个；
+    删除其余版本后按保留的版本重新生成快照/增量链
+    :return: 删除的版本数
+    """
+    from dvadmin.system.models import MmDocumentRevision
+
+    with transaction.atomic():
+        revisions = list(MmDocumentRevision.objects.select_for_update().filter(
+            document_id=document_id).order_by("version"))
+        cutoff = timezone.now() - timedelta(days=older_than_days)
+        recent = {revision.version for revision in revisions[-keep_recent:]} if keep_recent else set()
+        keep, day_last = set(), {}
+        for revision in revisions:
+            if revision.version in recent or revision.create_time >= cutoff:
+                keep.add(revision.version)
+            else:
+                day_last[revision.create_time.date()] = revision.version
+        keep.update(day_last.values())
+        removed = [revision for revision in revisions if revision.version not in keep]
+        if not removed:
+            return 0
+
+        # 按原顺序重建全文，只为保留的版本重新编码
+        rebuilt, text, previous, previous_text = [], None, None, None
+        for revision in revisions:
+            text = snapshot_text(revision) if revision.kind != MmDocumentRevision.KIND_DELTA else apply_delta(
+                text, json.loads(revision.data))
+            if revision.version not in keep:
+                continue
+            item = build_revision(document_id, revision.version, text, previous, previous_text)
+            item.id, item.creator, item.create_time = revision.id, revision.creator, revision.create_time
+            rebuilt.append(item)
+            previous, previous_text = item, text
+        MmDocumentRevision.objects.filter(id__in=[revision.id for revision in removed]).delete()
+        MmDocumentRevision.objects.bulk_update(
+            rebuilt, fields=["kind", "data", "base_version", "chain_length", "chain_size"], batch_size=200
+        )
+    return len(removed)
+
+
+def compact_all_revisions(**kwargs):
+    """压缩所有文档的修订历史（只处理存在可清理版本的文档）"""
+    from django.db.models import Count
+
+    from dvadmin.system.models import MmDocumentRevision
+
+    keep_recent = kwargs.get("keep_recent", COMPACT_KEEP_RECENT)
+    cutoff = timezone.now() - timedelta(days=kwargs.get("older_than_days", COMPACT_AFTER_DAYS))
+    document_ids = MmDocumentRevision.objects.values("document_id").annotate(total=Count("id")).filter(
+        total__gt=keep_recent
+    ).values_list("document_id", flat=True)
+    candidates = MmDocumentRevision.objects.filter(document_id__in=list(document_ids), create_time__lt=cutoff).values_list(
+        "document_id", flat=True).distinct()
+    removed = 0
+    for document_id in list(candidates):
+        removed += compact_revisions(document_id, **kwargs)
+    return removed
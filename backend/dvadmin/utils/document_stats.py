@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 文档统计汇总（按知识库/目录/文档类型维护计数器）
+    - 文档新增、修改、移动、删除时在同一事务内增量更新汇总行，统计接口直接读取汇总表
+    - category_id=0 的行为知识库级汇总，其余为目录级汇总
+    - 最近更新时间新增/修改时只前移；文档移出（删除、移到其他目录/类型/知识库）时，
+      若移出的文档可能是最近更新的文档，按源数据 Max 重算受影响的汇总行
+    - recompute 按源数据集合式重算，用于修复或初始化
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Length
+
+# 知识库级汇总行的目录ID
+REPOSITORY_ROW = 0
+
+
+def document_size(document):
+    """文档正文长度；正文字段未加载（defer）时返回 None，表示本次保存不会修改正文"""
+    fields = document.__dict__
+    if "detail_text" not in fields:
+        return None
+    if fields["detail_text"] is None and fields.get("content_hash"):
+        # 正文在内容存储中且尚未读取
+        return fields.get("content_length")
+    return len(fields["detail_text"] or "")
+
+
+def size_expression():
+    """正文长度的查询表达式（正文在内容存储中时取 content_length）"""
+    return Coalesce("content_length", Length("detail_text"))
+
+
+def remember_document(document):
+    """记录加载时的统计维度，保存时据此计算增量（只读取已加载的字段，避免触发延迟加载）"""
+    fields = document.__dict__
+    document._stats_original = (fields.get("category_id"), fields.get("type_id"), document_size(document),
+                                fields.get("update_time"))
+
+
+def update_rollup(repository_id, category_id, type_id, count=0, size=0, update_time=None):
+    """更新单个汇总行（F 表达式原子增减，不存在时先创建）"""
+    from dvadmin.system.models import MmDocumentRollup
+
+    fields = {"document_count": F("document_count") + count, "total_size": F("total_size") + size}
+    if update_time is not None:
+        fields["latest_update"] = Case(
+            When(Q(latest_update__isnull=True) | Q(latest_update__lt=update_time), then=Value(update_time)),
+            default=F("latest_update"),
+        )
+    rollup, _ = MmDocumentRollup.objects.get_or_create(
+        repository_id=repository_id, category_id=category_id, type_id=type_id
+    )
+    MmDocumentRollup.objects.filter(id=rollup.id).update(**fields)
+
+
+def refresh_latest_update(repository_id, category_id, type_id, removed_time=None, exclude_id=None):
+    """
+    文档移出后重算目录级与知识库级汇总行的最近更新时间
+    :param category_id: 目录ID，为 REPOSITORY_ROW 时只重算知识库级汇总行
+    :param removed_time: 移出文档的更新时间；只重算最近更新时间不晚于它的汇总行，不传则都重算
+    :param exclude_id: 不参与重算的文档ID（删除前更新汇总时为被删除的文档）
+    """
+    from dvadmin.system.models import MmDocument, MmDocumentRollup
+
+    documents = MmDocument.objects.filter(type_id=type_id).exclude(id=exclude_id)
+    scopes = [(REPOSITORY_ROW, documents.filter(category__repository_id=repository_id))]
+    if category_id != REPOSITORY_ROW:
+        scopes.insert(0, (category_id, documents.filter(category_id=category_id)))
+    for row_category_id, scope in scopes:
+        rows = MmDocumentRollup.objects.filter(repository_id=repository_id, category_id=row_category_id,
+                                               type_id=type_id)
+        if removed_time is not None:
+            rows = rows.filter(latest_update__lte=removed_time)
+        if rows.exists():
+            rows.update(latest_update=scope.aggregate(latest=Max("update_time"))["latest"])
+
+
+def apply_delta(repository_id, category_id, type_id, count=0, size=0, update_time=None):
+    """同时更新目录级与知识库级汇总行"""
+    if not count and not size and update_time is None:
+        return
+    for row_category_id in (category_id, REPOSITORY_ROW):
+        update_rollup(repository_id, row_category_id, type_id, count, size, update_time)
+
+
+def record_document_saved(document, created):
+    """文档保存后更新汇总（需在保存文档的事务内调用）"""
+    from dvadmin.system.models import Category
+
+    size = document_size(document)
+    repository_id = document.category.repository_id
+    original = getattr(document, "_stats_original", None)
+    if created or original is None or original[0] is None:
+        apply_delta(repository_id, document.category_id, document.type_id, 1, size or 0, document.update_time)
+    else:
+        old_category_id, old_type_id, old_size, old_update_time = original
+        if size is None or old_size is None:
+            # 正文未加载即未被修改，仅在维度变化、需要转移长度时查询一次
+            size = old_size = 0
+            if (old_category_id, old_type_id) != (document.category_id, document.type_id):
+                size = old_size = type(document).objects.filter(id=document.id).annotate(
+                    size=size_expression()).values_list("size", flat=True).first() or 0
+        if (old_category_id, old_type_id) == (document.category_id, document.type_id):
+            apply_delta(repository_id, document.category_id, document.type_id, 0, size - old_size, document.update_time)
+        else:
+            old_repository_id = Category.objects.filter(id=old_category_id).values_list(
+                "repository_id", flat=True).first()
+            apply_delta(old_repository_id, old_category_id, old_type_id, -1, -old_size)
+            refresh_latest_update(old_repository_id, old_category_id, old_type_id, old_update_time)
+            apply_delta(repository_id, document.category_id, document.type_id, 1, size, document.update_time)
+    remember_document(document)
+
+
+def record_document_deleted(document, repository_id):
+    """文档删除后更新汇总（需在删除文档的事务内调用）"""
+    original = getattr(document, "_stats_original", None)
+    category_id, type_id, size, update_time = original if original and original[0] is not None else (
+        document.category_id, document.type_id, document_size(document), document.__dict__.get("update_time"))
+    if size is None:
+        size = type(document).objects.filter(id=document.id).annotate(
+            size=size_expression()).values_list("size", flat=True).first() or 0
+    apply_delta(repository_id, category_id, type_id, -1, -size)
+    refresh_latest_update(repository_id, category_id, type_id, update_time, exclude_id=document.id)
+
+
+def move_category_rollups(category_ids, old_repository_id, repository_id):
+    """目录子树跨知识库移动：目录级汇总行改挂新知识库，并在两个知识库级汇总之间转移计数"""
+    from dvadmin.system.models import MmDocumentRollup
+
+    rows = MmDocumentRollup.objects.filter(repository_id=old_repository_id, category_id__in=category_ids)
+    totals = list(rows.values("type_id").annotate(
+        count=Sum("document_count"), size=Sum("total_size"), latest=Max("latest_update")
+    ))
+    rows.update(repository_id=repository_id)
+    for total in totals:
+        update_rollup(old_repository_id, REPOSITORY_ROW, total["type_id"], -total["count"], -total["size"])
+        update_rollup(repository_id, REPOSITORY_ROW, total["type_id"], total["count"], total["size"], total["latest"])
+    # 目录级汇总行已随目录转移，原知识库只需重算知识库级汇总行
+    for total in totals:
+        refresh_latest_update(old_repository_id, REPOSITORY_ROW, total["type_id"], total["latest"])
+
+
+def recompute_rollups(repository_id=None):
+    """
+    按源数据重算汇总（集合式分组聚合后整体替换）
+    :param repository_id: 知识库ID，不传则重算全部
+    :return: 写入的汇总行数
+    """
+    from dvadmin.system.models import MmDocument, MmDocumentRollup
+
+    documents = MmDocument.objects.all()
+    rollups = MmDocumentRollup.objects.all()
+    if repository_id:
+        documents = documents.filter(category__repository_id=repository_id)
+        rollups = rollups.filter(repository_id=repository_id)
+    grouped = list(documents.values("category__repository_id", "category_id", "type_id").annotate(
+        count=Count("id"), size=Coalesce(Sum(size_expression()), 0), latest=Max("update_time")
+    ).order_by())
+    rows = {}
+    for item in grouped:
+        for category_id in (item["category_id"], REPOSITORY_ROW):
+            key = (item["category__repository_id"], category_id, item["type_id"])
+            row = rows.setdefault(key, MmDocumentRollup(
+                repository_id=key[0], category_id=category_id, type_id=key[2],
+                document_count=0, total_size=0, latest_update=None,
+            ))
+            row.document_count += item["count"]
+            row.total_size += item["size"]
+            if row.latest_update is None or (item["latest"] and item["latest"] > row.latest_update):
+                row.latest_update = item["latest"]
+    with transaction.atomic():
+        rollups.delete()
+        MmDocumentRollup.objects.bulk_create(rows.values(), batch_size=1000)
+    return len(rows)
+
+
+def get_document_stats(repository_id=None, category_limit=10, rollups=None):
+    """
+    读取统计数据（只访问汇总表）
+    :param rollups: 汇总表查询集（调用方已按数据权限过滤），不传则为全部
+    """
+    from dvadmin.system.models import Category, Dictionary, MmDocumentRollup
+
+    if rollups is None:
+        rollups = MmDocumentRollup.objects.all()
+    rollups = rollups.filter(document_count__gt=0)
+    if repository_id:
+        rollups = rollups.filter(repository_id=repository_id)
+    repository_rows = rollups.filter(category_id=REPOSITORY_ROW)
+
+    # 1. 按文档类型统计数量（类型文本取自字典 document_type）
+    type_stats = list(repository_rows.values("type_id").annotate(
+        count=Sum("document_count"), total_size=Sum("total_size")
+    ).order_by("-count"))
+    labels = dict(Dictionary.objects.filter(parent__value="document_type", status=True).values_list("value", "label"))
+    for stat in type_stats:
+        stat["type_label"] = labels.get(str(stat["type_id"]), f"类型ID:{stat['type_id']}")
+
+    # 2. 按目录统计数量（前 N 个目录）
+    category_stats = list(rollups.exclude(category_id=REPOSITORY_ROW).values("category_id").annotate(
+        count=Sum("document_count")
+    ).order_by("-count")[:category_limit])
+    names = dict(Category.objects.filter(id__in=[stat["category_id"] for stat in category_stats]).values_list(
+        "id", "name"))
+    category_stats = [
+        {"category__id": stat["category_id"], "category__name": names.get(stat["category_id"]), "count": stat["count"]}
+        for stat in category_stats
+    ]
+
+    # 3. 总数量统计
+    summary = repository_rows.aggregate(
+        total_count=Sum("document_count"), total_size=Sum("total_size"), latest_update=Max("latest_update")
+    )
+    return {
+        "total_count": summary["total_count"] or 0,
+        "total_size": summary["total_size"] or 0,
+        "latest_update": summary["latest_update"] or "无更新记录",
+        "type_stats": type_stats,
+        "category_stats": category_stats,
+    }
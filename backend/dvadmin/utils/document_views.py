@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 文档阅读计数（缓存累加、定时合并入库）
+    - 每次阅读只对缓存计数器 +1（按 日期+文档 区分），不写数据库
+    - 计数器首次创建时登记到待合并列表（见 cache_registry），之后同一天的阅读不再触碰登记表；
+      登记失败时删除刚创建的计数器，下次阅读重新登记
+    - 定时任务按批读取计数器，合并到按天统计表后从计数器中扣减已合并的数量（合并期间的新阅读不丢失）
+    - 合并后为涉及的知识库预计算“最多阅读”“最近阅读”排行，popular 接口直接读取缓存
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from dvadmin.utils.cache_registry import acquire_lock, add_members, get_members, release_lock, remove_members
+
+logger = logging.getLogger(__name__)
+
+# 排行统计的天数与保留条数
+POPULAR_DAYS = getattr(settings, "DOCUMENT_POPULAR_DAYS", 7)
+POPULAR_SIZE = getattr(settings, "DOCUMENT_POPULAR_SIZE", 50)
+# 按天统计保留的天数
+RETENTION_DAYS = getattr(settings, "DOCUMENT_VIEW_RETENTION_DAYS", 90)
+# 计数器在缓存中的保留时间（秒），需大于合并间隔
+VIEW_TIMEOUT = 60 * 60 * 24 * 3
+BATCH_SIZE = 500
+VIEW_KEY = "document_view:{day}:{document_id}"
+LAST_VIEW_KEY = "document_view_last:{day}:{document_id}"
+PENDING_KEY = "document_view_registry"
+FLUSH_LOCK_KEY = "document_view_flush_lock"
+# 合并锁超时时间（秒）
+FLUSH_LOCK_TIMEOUT = 60 * 10
+PRUNE_KEY = "document_view_prune:{day}"
+POPULAR_KEY = "document_popular:{repository_id}"
+
+
+def register_counter(key, member):
+    """登记新建的计数器；登记失败时删除计数器（本次阅读不计），下次阅读重新创建并登记"""
+    try:
+        add_members(PENDING_KEY, [member])
+    except Exception:
+        cache.delete(key)
+        raise
+
+
+def record_view(document_id):
+    """记录一次阅读：缓存计数器 +1，当天首次阅读时登记待合并"""
+    day = timezone.now().date().isoformat()
+    key = VIEW_KEY.format(day=day, document_id=document_id)
+    member = f"{day}:{document_id}"
+    try:
+        if cache.add(key, 1, VIEW_TIMEOUT):
+            register_counter(key, member)
+        else:
+            try:
+                cache.incr(key)
+            except ValueError:
+                # 计数器恰好过期或已被合并删除
+                if cache.add(key, 1, VIEW_TIMEOUT):
+                    register_counter(key, member)
+        cache.set(LAST_VIEW_KEY.format(day=day, document_id=document_id), timezone.now(), VIEW_TIMEOUT)
+    except Exception as e:
+        # 计数失败不影响阅读
+        logger.warning(f"文档[{document_id}]阅读计数失败: {e}")
+
+
+def flush_views(batch_size=BATCH_SIZE):
+    """
+    将缓存计数器合并到按天统计表，并刷新涉及知识库的排行
+    :return: 合并的阅读次数；其他进程正在合并时返回 None
+    """
+    token = acquire_lock(FLUSH_LOCK_KEY, FLUSH_LOCK_TIMEOUT)
+    if token is None:
+        return None
+    try:
+        members = sorted(get_members(PENDING_KEY))
+        today = timezone.now().date().isoformat()
+        flushed, repositories, finished = 0, set(), []
+        for start in range(0, len(members), batch_size):
+            batch = [member.split(":") for member in members[start:start + batch_size]]
+            count, batch_repositories, batch_finished = flush_batch(
+                [(day, int(document_id)) for day, document_id in batch], today)
+            flushed += count
+            repositories |= batch_repositories
+            finished += batch_finished
+        # 移除失败时抛出异常，本次合并结束，残留的成员下次合并时再次移除
+        remove_members(PENDING_KEY, finished)
+        if cache.add(PRUNE_KEY.format(day=today), 1, timeout=60 * 60 * 24):
+            prune_views()
+        for repository_id in repositories:
+            refresh_popular(repository_id)
+        if repositories:
+            refresh_popular()
+        return flushed
+    finally:
+        # 合并超过锁超时时间时锁可能已被其他进程获取，只释放自己持有的锁
+        release_lock(FLUSH_LOCK_KEY, token)
+
+
+def flush_batch(items, today):
+    """
+    合并一批计数器 [(日期, 文档ID)]
+    :return: (合并的阅读次数, 涉及的知识库ID, 可移出登记表的成员)
+    """
+    from dvadmin.system.models import MmDocument, MmDocumentViewStat
+
+    view_keys = {item: VIEW_KEY.format(day=item[0], document_id=item[1]) for item in items}
+    last_keys = {item: LAST_VIEW_KEY.format(day=item[0], document_id=item[1]) for item in items}
+    counts = cache.get_many(list(view_keys.values()))
+    last_views = cache.get_many(list(last_keys.values()))
+    document_ids = {document_id for _, document_id in items}
+    repository_map = dict(MmDocument.objects.filter(id__in=document_ids).values_list("id", "category__repository_id"))
+
+    pending = {}
+    finished = []
+    for item in items:
+        day, document_id = item
+        count = counts.get(view_keys[item]) or 0
+        if count <= 0 or document_id not in repository_map:
+            # 已无新增阅读（或文档已删除）：当天的计数器继续使用，往日的计数器清理
+            if day != today or document_id not in repository_map:
+                cache.delete_many([view_keys[item], last_keys[item]])
+                finished.append(f"{day}:{document_id}")
+            continue
+        pending[item] = count
+
+    if pending:
+        dates = {datetime.date.fromisoformat(day) for day, _ in pending}
+        with transaction.atomic():
+            existing = {(stat.date.isoformat(), stat.document_id): stat for stat in MmDocumentViewStat.objects.filter(
+                date__in=dates, document_id__in={document_id for _, document_id in pending}).select_for_update()}
+            created, updated = [], []
+            for item, count in pending.items():
+                day, document_id = item
+                last_view_time = last_views.get(last_keys[item])
+                stat = existing.get(item)
+                if stat is None:
+                    created.append(MmDocumentViewStat(
+                        document_id=document_id, repository_id=repository_map[document_id],
+                        date=datetime.date.fromisoformat(day), views=count, last_view_time=last_view_time))
+                    continue
+                stat.views += count
+                stat.repository_id = repository_map[document_id]
+                if last_view_time and (stat.last_view_time is None or last_view_time > stat.last_view_time):
+                    stat.last_view_time = last_view_time
+                updated.append(stat)
+            MmDocumentViewStat.objects.bulk_create(created, batch_size=BATCH_SIZE)
+            MmDocumentViewStat.objects.bulk_update(updated, ["views", "repository_id", "last_view_time"],
+                                                   batch_size=BATCH_SIZE)
+        # 入库后再扣减计数器：合并期间的新阅读保留到下次合并
+        for item, count in pending.items():
+            try:
+                cache.decr(view_keys[item], count)
+            except ValueError:
+                pass
+    return sum(pending.values()), {repository_map[document_id] for _, document_id in pending}, finished
+
+
+def prune_views(days=RETENTION_DAYS):
+    """删除超过保留天数的按天统计"""
+    from dvadmin.system.models import MmDocumentViewStat
+
+    since = timezone.now().date() - datetime.timedelta(days=days)
+    deleted, _ = MmDocumentViewStat.objects.filter(date__lt=since).delete()
+    return deleted
+
+
+def popular_key(repository_id=None):
+    return POPULAR_KEY.format(repository_id=repository_id or "all")
+
+
+def refresh_popular(repository_id=None):
+    """
+    预计算排行并写入缓存：最近 POPULAR_DAYS 天阅读次数最多、最近阅读的文档
+    :return: {"popular": [{"document_id", "views"}], "recent": [{"document_id", "last_view_time"}], ...}
+    """
+    from dvadmin.system.models import MmDocumentViewStat
+
+    since = timezone.now().date() - datetime.timedelta(days=POPULAR_DAYS - 1)
+    queryset = MmDocumentViewStat.objects.filter(date__gte=since)
+    if repository_id:
+        queryset = queryset.filter(repository_id=repository_id)
+    popular = queryset.values("document_id").annotate(views=Sum("views")).order_by("-views", "document_id")
+    recent = queryset.values("document_id").annotate(last_view_time=Max("last_view_time")).exclude(
+        last_view_time__isnull=True).order_by("-last_view_time", "document_id")
+    data = {
+        "popular": list(popular[:POPULAR_SIZE]),
+        "recent": list(recent[:POPULAR_SIZE]),
+        "days": POPULAR_DAYS,
+        "update_time": timezone.now(),
+    }
+    cache.set(popular_key(repository_id), data, timeout=None)
+    return data
+
+
+def get_popular(repository_id=None):
+    """读取预计算的排行（缓存不存在时现算一次）"""
+    data = cache.get(popular_key(repository_id))
+    if data is None:
+        data = refresh_popular(repository_id)
+    return data
@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: Git 仓库同步到知识库
+    - 仓库中的目录对应知识库目录，Markdown 文件对应文档（文件名去掉扩展名为文档名称），仓库根目录下的文件
+      放在与知识库同名的顶级目录中；路径与目录/文档的对应关系保存在 mm_repository_git_file
+    - 首次同步（或上次同步的提交已不存在）按 git ls-tree 全量对比 blob 哈希；之后只应用上次同步的提交与
+      最新提交之间 git diff --name-status 列出的文件（重命名保留原文档），目录与文档均批量写入
+    - 每个知识库同一时间只有一个同步在执行（缓存锁），同步期间再次触发的同步在当前同步结束后补做
+    - 仓库地址只允许 GIT_SYNC_ALLOWED_SCHEMES 中的协议（默认 https、ssh），本地路径、file://、ext:: 等一律拒绝
+"""
+import logging
+import os
+import posixpath
+import re
+import uuid
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from dvadmin.utils.category_tree import child_tree_path
+
+logger = logging.getLogger(__name__)
+
+KIND_CATEGORY = 0
+KIND_DOCUMENT = 1
+MARKDOWN_EXTENSIONS = (".md", ".markdown")
+# 本地工作区目录（每个知识库一个子目录）
+SYNC_ROOT = getattr(settings, "GIT_SYNC_ROOT", os.path.join(settings.BASE_DIR, "git_sync"))
+# 同步生成的文档类型ID
+DOCUMENT_TYPE_ID = getattr(settings, "GIT_SYNC_DOCUMENT_TYPE_ID", 1)
+# 允许的仓库地址协议
+ALLOWED_SCHEMES = getattr(settings, "GIT_SYNC_ALLOWED_SCHEMES", ("https", "ssh"))
+LOCK_KEY = "git_sync_lock:{repository_id}"
+PENDING_KEY = "git_sync_pending:{repository_id}"
+# 同步锁超时时间（秒），进程异常退出时锁自动释放
+LOCK_TIMEOUT = 60 * 60
+BATCH_SIZE = 500
+
+
+class GitSyncError(Exception):
+    """同步配置错误或 Git 操作失败"""
+
+
+def is_markdown(path):
+    """是否为需要同步的 Markdown 文件（忽略隐藏目录/文件）"""
+    return path.lower().endswith(MARKDOWN_EXTENSIONS) and not any(
+        part.startswith(".") for part in path.split("/"))
+
+
+def document_name(path):
+    return posixpath.splitext(posixpath.basename(path))[0][:255] or posixpath.basename(path)[:255]
+
+
+def unique_name(taken, category_id, path):
+    """目录下不重名的文档名称：默认去掉扩展名，重名时使用完整文件名，仍重名时追加序号"""
+    stem = document_name(path)
+    candidates = [stem, posixpath.basename(path)[:255]]
+    suffix = 2
+    while True:
+        for name in candidates:
+            if (category_id, name) not in taken:
+                return name
+        candidates = [f"{stem[:248]} ({suffix})"]
+        suffix += 1
+
+
+re_transport = re.compile(r"^([A-Za-z][A-Za-z0-9+.-]*)::")
+re_url = re.compile(r"^([A-Za-z][A-Za-z0-9+.-]*)://")
+re_scp = re.compile(r"^(?:[^@/:]+@)?([^/:]{2,}):")
+
+
+def repo_url_scheme(repo_url):
+    """
+    Git 仓库地址的协议及主机：<transport>::地址 取 transport，URL 形式取协议，
+    scp 形式（user@host:path）为 ssh，其余（本地路径）为 file
+    :return: (协议, 主机)
+    """
+    match = re_transport.match(repo_url)
+    if match:
+        return match.group(1).lower(), ""
+    match = re_url.match(repo_url)
+    if match:
+        return match.group(1).lower(), urlsplit(repo_url).hostname or ""
+    match = re_scp.match(repo_url)
+    if match:
+        return "ssh", match.group(1)
+    return "file", ""
+
+
+def validate_repo_url(repo_url):
+    """校验仓库地址协议在允许范围内（远程协议须带主机），否则抛出 GitSyncError"""
+    repo_url = (repo_url or "").strip()
+    scheme, host = repo_url_scheme(repo_url)
+    if scheme not in ALLOWED_SCHEMES:
+        raise GitSyncError(f"不支持的仓库地址：仅允许 {'、'.join(ALLOWED_SCHEMES)} 协议")
+    if repo_url.startswith("-") or host.startswith("-") or (scheme != "file" and not host):
+        raise GitSyncError("仓库地址格式错误")
+    return repo_url
+
+
+def acquire_lock(repository_id):
+    """获取知识库同步锁，已被占用时返回 None"""
+    token = uuid.uuid4().hex
+    if cache.add(LOCK_KEY.format(repository_id=repository_id), token, timeout=LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def release_lock(repository_id, token):
+    key = LOCK_KEY.format(repository_id=repository_id)
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def open_repository(config):
+    """打开（首次则克隆）知识库的本地工作区，并重置为远程分支的最新提交"""
+    from dvadmin.utils.git_utils import GitRepository
+
+    # 配置可能在限制协议之前保存，拉取前再次校验
+    validate_repo_url(config.repo_url)
+    local_path = os.path.join(SYNC_ROOT, str(config.repository_id))
+    try:
+        git = GitRepository(local_path, config.repo_url, config.branch)
+        origin = git.repo.remote("origin")
+        if origin.url != config.repo_url:
+            origin.set_url(config.repo_url)
+        git.fetch_reset(config.branch)
+    except Exception as e:
+        raise GitSyncError(f"Git仓库拉取失败: {e}")
+    return git
+
+
+def local_repository(config):
+    """已同步过的本地工作区（不拉取远程），尚未克隆时返回 None"""
+    from dvadmin.utils.git_utils import GitRepository
+
+    local_path = os.path.join(SYNC_ROOT, str(config.repository_id))
+    if not os.path.isdir(os.path.join(local_path, ".git")):
+        return None
+    return GitRepository(local_path, config.repo_url, config.branch)
+
+
+def full_changes(git, blobs):
+    """
+    全量对比：HEAD 中 blob 哈希与上次同步不同的文件需要写入，映射中存在但 HEAD 中已没有的文件需要删除
+    :return: ({路径: blob}, {删除的路径}, {原路径: 新路径})
+    """
+    files = {path: blob for path, blob in git.ls_tree().items() if is_markdown(path)}
+    upserts = {path: blob for path, blob in files.items() if blobs.get(path) != blob}
+    return upserts, {path for path in blobs if path not in files}, {}
+
+
+def incremental_changes(git, last_commit):
+    """
+    增量对比：只处理 last_commit 与 HEAD 之间变更的文件
+    :return: ({路径: blob}, {删除的路径}, {原路径: 新路径})
+    """
+    paths, deletes, renames = set(), set(), {}
+    for status, path, new_path in git.diff_name_status(last_commit, "HEAD"):
+        if status == "R":
+            if is_markdown(path) and is_markdown(new_path):
+                renames[path] = new_path
+            elif is_markdown(path):
+                deletes.add(path)
+            path = new_path
+        elif status == "C":
+            path = new_path
+        elif status == "D":
+            if is_markdown(path):
+                deletes.add(path)
+            continue
+        if is_markdown(path):
+            paths.add(path)
+    paths = sorted(paths)
+    upserts = {}
+    for start in range(0, len(paths), BATCH_SIZE):
+        upserts.update(git.ls_tree("HEAD", paths[start:start + BATCH_SIZE]))
+    return upserts, deletes - set(upserts), renames
+
+
+class SyncPlan:
+    """一次同步要写入的目录/文档（在一个事务内批量应用）"""
+
+    def __init__(self, config, git):
+        from dvadmin.system.models import MmRepository, MmRepositoryGitFile
+
+        self.config = config
+        self.git = git
+        self.repository = MmRepository.objects.get(id=config.repository_id)
+        self.mappings = {(row.kind, row.path): row for row in MmRepositoryGitFile.objects.filter(
+            repository_id=config.repository_id)}
+        self.new_mappings = []
+        self.changed_mappings = []
+        self.categories = {}
+        self.documents = []
+        self.created_ids = set()
+        self.old_names = {}
+        self.deleted_ids = set()
+
+    def mapping(self, kind, path, object_id, blob=""):
+        row = self.mappings.get((kind, path))
+        if row is None:
+            from dvadmin.system.models import MmRepositoryGitFile
+            row = MmRepositoryGitFile(repository_id=self.config.repository_id, kind=kind, path=path,
+                                      object_id=object_id, blob=blob)
+            self.mappings[(kind, path)] = row
+            self.new_mappings.append(row)
+        elif (row.object_id, row.blob) != (object_id, blob):
+            row.object_id, row.blob = object_id, blob
+            if row.id is not None:
+                self.changed_mappings.append(row)
+        return row
+
+    def apply_renames(self, renames):
+        """
+        重命名/移动的文件沿用原文档：映射改为新路径
+        :return: 新路径已有映射、需要删除原文档的路径
+        """
+        stale = set()
+        for old_path, new_path in renames.items():
+            row = self.mappings.get((KIND_DOCUMENT, old_path))
+            if row is None:
+                continue
+            if (KIND_DOCUMENT, new_path) in self.mappings:
+                stale.add(old_path)
+                continue
+            del self.mappings[(KIND_DOCUMENT, old_path)]
+            row.path = new_path
+            self.mappings[(KIND_DOCUMENT, new_path)] = row
+            self.changed_mappings.append(row)
+        return stale
+
+    def delete_documents(self, paths):
+        from dvadmin.system.models import MmDocument, MmDocumentLshBucket, MmDocumentRevision, MmRepositoryGitFile
+
+        rows = [self.mappings.pop((KIND_DOCUMENT, path)) for path in paths if (KIND_DOCUMENT, path) in self.mappings]
+        ids = [row.object_id for row in rows]
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start + BATCH_SIZE]
+            MmDocument.objects.filter(id__in=batch).delete()
+            MmDocumentRevision.objects.filter(document_id__in=batch).delete()
+            MmDocumentLshBucket.objects.filter(document_id__in=batch).delete()
+        MmRepositoryGitFile.objects.filter(id__in=[row.id for row in rows]).delete()
+        self.deleted_ids.update(ids)
+
+    def ensure_categories(self, directories):
+        """
+        按深度逐层创建缺少的目录（同一层批量写入）；已存在的同名目录直接沿用
+        :param directories: 文件所在目录路径集合（"" 为仓库根目录）
+        """
+        from dvadmin.system.models import Category
+        from dvadmin.utils.id_allocator import allocate_ids
+
+        needed = set()
+        for directory in directories:
+            needed.add(directory)
+            while directory:
+                directory = posixpath.dirname(directory)
+                if directory:
+                    needed.add(directory)
+        mapped = Category.objects.filter(repository_id=self.repository.id, id__in=[
+            self.mappings[(KIND_CATEGORY, path)].object_id for path in needed
+            if (KIND_CATEGORY, path) in self.mappings]).in_bulk()
+        by_depth = {}
+        for path in needed:
+            by_depth.setdefault(0 if not path else path.count("/") + 1, []).append(path)
+        now = timezone.now()
+        for depth in sorted(by_depth):
+            paths = sorted(by_depth[depth])
+            missing = []
+            for path in paths:
+                row = self.mappings.get((KIND_CATEGORY, path))
+                if row is not None and row.object_id in mapped:
+                    self.categories[path] = mapped[row.object_id]
+                else:
+                    missing.append(path)
+            if not missing:
+                continue
+            parents = {path: self.categories.get(posixpath.dirname(path)) if "/" in path else None
+                       for path in missing}
+            names = {path: (posixpath.basename(path) if path else self.repository.name)[:100] for path in missing}
+            existing = {}
+            for category in Category.objects.filter(repository_id=self.repository.id,
+                                                    name__in=set(names.values())):
+                existing.setdefault((category.parent_category_id, category.name), category)
+            created = []
+            for path in missing:
+                parent = parents[path]
+                category = existing.get((parent.id if parent else None, names[path]))
+                if category is None:
+                    category = Category(name=names[path], repository_id=self.repository.id, parent_category=parent,
+                                        master=self.repository.master, update_time=now,
+                                        dimension=parent.dimension + 1 if parent else 1,
+                                        tree_path=child_tree_path(parent.tree_path, parent.id) if parent else "")
+                    created.append(category)
+                self.categories[path] = category
+            for category, category_id in zip(created, allocate_ids(Category, len(created))):
+                category.id = category_id
+            Category.objects.bulk_create(created, batch_size=BATCH_SIZE)
+            for path in missing:
+                self.mapping(KIND_CATEGORY, path, self.categories[path].id)
+
+    def write_documents(self, upserts):
+        """
+        写入新增/修改的文档：已映射的文档批量更新，其余批量新增
+        同目录下同名的未映射文档（手动创建）不会被覆盖，新文档按 unique_name 改用不重名的名称
+        """
+        from dvadmin.system.models import MmDocument
+        from dvadmin.utils.content_store import get_content_store, offload_document_content
+        from dvadmin.utils.id_allocator import allocate_ids
+
+        paths = sorted(upserts)
+        self.ensure_categories({posixpath.dirname(path) for path in paths})
+        category_ids = {category.id for category in self.categories.values()}
+        existing = MmDocument.objects.filter(id__in=[
+            self.mappings[(KIND_DOCUMENT, path)].object_id for path in paths
+            if (KIND_DOCUMENT, path) in self.mappings]).defer("detail_text").in_bulk()
+        taken = {}
+        for document_id, category_id, name in MmDocument.objects.filter(category_id__in=category_ids).values_list(
+                "id", "category_id", "name"):
+            taken[(category_id, name)] = document_id
+
+        now = timezone.now()
+        updated, created = [], []
+        for path in paths:
+            category = self.categories[posixpath.dirname(path)]
+            row = self.mappings.get((KIND_DOCUMENT, path))
+            document = existing.get(row.object_id) if row is not None else None
+            if document is None:
+                document = MmDocument(type_id=DOCUMENT_TYPE_ID, master=self.repository.master, sort=0)
+                created.append(document)
+            else:
+                taken.pop((document.category_id, document.name), None)
+                updated.append(document)
+            name = unique_name(taken, category.id, path)
+            if document.id is not None and (document.name != name or document.category_id != category.id):
+                self.old_names[document.id] = document.name
+            taken[(category.id, name)] = path
+            document.name = name
+            document.category = category
+            document.dimension = category.dimension
+            document.tree_path = category.tree_path
+            document.update_time = now
+            document.detail_text = self.git.read_text(path)
+            offload_document_content(document)
+            document._git_path = path
+            self.documents.append(document)
+
+        for document, document_id in zip(created, allocate_ids(MmDocument, len(created))):
+            document.id = document_id
+            self.created_ids.add(document_id)
+        fields = ["name", "category", "dimension", "tree_path", "update_time", "content_hash", "content_length"]
+        if get_content_store() is None:
+            fields.append("detail_text")
+        MmDocument.objects.bulk_update(updated, fields, batch_size=BATCH_SIZE)
+        if get_content_store() is not None:
+            # 正文在内容存储中，列值置空（bulk_update 不经过字段的 pre_save）
+            MmDocument.objects.filter(id__in=[document.id for document in updated]).update(detail_text=None)
+        MmDocument.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        for document in self.documents:
+            self.mapping(KIND_DOCUMENT, document._git_path, document.id, upserts[document._git_path])
+
+    def save_mappings(self):
+        from dvadmin.system.models import MmRepositoryGitFile
+
+        MmRepositoryGitFile.objects.bulk_create(self.new_mappings, batch_size=BATCH_SIZE)
+        MmRepositoryGitFile.objects.bulk_update({row.id: row for row in self.changed_mappings}.values(),
+                                                ["path", "object_id", "blob"], batch_size=BATCH_SIZE)
+
+    def remove_empty_categories(self):
+        """删除不再包含任何同步文件的目录（目录下仍有其他文档或子目录时保留）"""
+        from dvadmin.system.models import Category, MmDocument, MmRepositoryGitFile
+
+        needed = set()
+        for kind, path in self.mappings:
+            if kind == KIND_DOCUMENT:
+                directory = posixpath.dirname(path)
+                needed.add(directory)
+                while directory:
+                    directory = posixpath.dirname(directory)
+                    needed.add(directory)
+        stale = sorted((row for (kind, path), row in self.mappings.items()
+                        if kind == KIND_CATEGORY and path not in needed), key=lambda row: -row.path.count("/"))
+        removed = []
+        for row in stale:
+            if not MmDocument.objects.filter(category_id=row.object_id).exists() and \
+                    not Category.objects.filter(parent_category_id=row.object_id).exists():
+                Category.objects.filter(id=row.object_id).delete()
+            removed.append(row.id)
+            del self.mappings[(row.kind, row.path)]
+        MmRepositoryGitFile.objects.filter(id__in=removed).delete()
+
+    def refresh_related(self):
+        """文档批量写入后更新修订版本、链接关系（同一事务内）及统计汇总"""
+        from dvadmin.utils.document_links import document_renamed, refresh_links
+        from dvadmin.utils.document_revisions import record_revision
+        from dvadmin.utils.document_stats import recompute_rollups
+
+        repository_id = self.repository.id
+        for document in self.documents:
+            record_revision(document)
+        for document in self.documents:
+            refresh_links(document, repository_id)
+            if document.id in self.created_ids or document.id in self.old_names:
+                document_renamed(document.id, repository_id, document.name, self.old_names.get(document.id))
+        recompute_rollups(repository_id)
+
+    def refresh_indexes(self):
+        """事务提交后更新检索索引、派生数据与缓存（同步任务本身在 Celery 中执行，直接计算）"""
+        from dvadmin.utils import typeahead
+        from dvadmin.utils.category_tree import bump_tree_version
+        from dvadmin.utils.change_feed import reset_changes
+        from dvadmin.utils.document_derivatives import refresh_derivatives
+        from dvadmin.utils.search_engine import get_search_backend
+        from dvadmin.utils.semantic_index import schedule_update
+
+        backend = get_search_backend()
+        for document_id in self.deleted_ids:
+            backend.remove_document(document_id)
+        for document in self.documents:
+            backend.index_document(document)
+            refresh_derivatives(document)
+        repository_id = self.repository.id
+        bump_tree_version(repository_id)
+        typeahead.reset_index(repository_id)
+        reset_changes(repository_id)
+        schedule_update(repository_id)
+
+
+def sync_repository(repository_id, full=False):
+    """
+    同步知识库的 Git 仓库
+    :param full: 是否强制全量对比（默认只应用上次同步后的变更）
+    :return: 同步结果 {"status", "commit", "created", "updated", "deleted"}；其他进程正在同步时返回 None
+    """
+    from dvadmin.system.models import MmRepositoryGitSync
+
+    config = MmRepositoryGitSync.objects.filter(repository_id=repository_id).first()
+    if config is None:
+        raise GitSyncError(f"知识库[{repository_id}]未配置Git同步")
+    token = acquire_lock(repository_id)
+    if token is None:
+        # 同步结束后补做一次，保证本次触发时的变更不会遗漏
+        cache.set(PENDING_KEY.format(repository_id=repository_id), 1, LOCK_TIMEOUT)
+        return None
+    try:
+        cache.delete(PENDING_KEY.format(repository_id=repository_id))
+        MmRepositoryGitSync.objects.filter(id=config.id).update(status="running", message=None)
+        try:
+            result = run_sync(config, full)
+        except Exception as e:
+            logger.error(f"知识库[{repository_id}]Git同步失败: {e}")
+            MmRepositoryGitSync.objects.filter(id=config.id).update(status="failed", message=str(e)[:2000])
+            raise
+        MmRepositoryGitSync.objects.filter(id=config.id).update(
+            status="success", last_commit=result["commit"], last_sync_time=timezone.now(),
+            message=f"新增 {result['created']}，更新 {result['updated']}，删除 {result['deleted']}")
+        return result
+    finally:
+        release_lock(repository_id, token)
+        if cache.get(PENDING_KEY.format(repository_id=repository_id)):
+            schedule_sync(repository_id)
+
+
+def run_sync(config, full=False):
+    git = open_repository(config)
+    head = git.head()
+    if not full and config.last_commit == head:
+        return {"status": "unchanged", "commit": head, "created": 0, "updated": 0, "deleted": 0}
+    plan = SyncPlan(config, git)
+    if full or not config.last_commit or not git.has_commit(config.last_commit):
+        upserts, deletes, renames = full_changes(git, {
+            path: row.blob for (kind, path), row in plan.mappings.items() if kind == KIND_DOCUMENT})
+    else:
+        upserts, deletes, renames = incremental_changes(git, config.last_commit)
+    with transaction.atomic():
+        plan.delete_documents(deletes | plan.apply_renames(renames))
+        plan.write_documents(upserts)
+        plan.save_mappings()
+        plan.remove_empty_categories()
+        plan.refresh_related()
+    plan.refresh_indexes()
+    return {
+        "status": "synced", "commit": head, "created": len(plan.created_ids),
+        "updated": len(plan.documents) - len(plan.created_ids), "deleted": len(plan.deleted_ids),
+    }
+
+
+def schedule_sync(repository_id, full=False):
+    """提交同步任务；任务提交失败时同步执行"""
+    from dvadmin.system.tasks import sync_git_repository
+    try:
+        sync_git_repository.delay(repository_id, full)
+    except Exception as e:
+        logger.warning(f"知识库[{repository_id}]Git同步任务提交失败，改为同步执行: {e}")
+        sync_repository(repository_id, full)
@@ -1,8 +1,20 @@
+import hashlib
 import os
+
+from django.core.cache import cache
+from git.exc import GitCommandError
 from git.repo import Repo
 from git.repo.fun import is_git_dir
 
 
+# 提交记录字段（单元分隔符分隔，记录之间以 NUL 分隔，提交说明中的引号、换行不影响解析）
+COMMIT_FIELDS = ('hash', 'commit', 'author', 'email', 'date', 'summary')
+COMMIT_FORMAT = '%H%x1f%h%x1f%an%x1f%ae%x1f%cd%x1f%s'
+COMMIT_CACHE_KEY = 'git_commits:{repo}:{head}:{page}:{limit}'
+COMMIT_CACHE_TIMEOUT = 60 * 60 * 24
+READ_CHUNK_SIZE = 64 * 1024
+
+
 class GitRepository(object):
     """
     git仓库管理
@@ -36,31 +48,114 @@ class GitRepository(object):
         """
         self.repo.git.pull()
 
+    def read_refs(self, prefix):
+        """
+        直接读取引用文件（松散引用 + packed-refs），不启动 git 进程
+        :param prefix: 引用前缀，如 refs/tags/
+        :return: {引用名（去掉前缀）: 提交哈希}
+        """
+        git_dir = os.path.join(self.local_path, '.git')
+        refs = {}
+        packed = os.path.join(git_dir, 'packed-refs')
+        if os.path.exists(packed):
+            with open(packed, encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith(('#', '^')):
+                        continue
+                    sha, _, name = line.strip().partition(' ')
+                    if name.startswith(prefix):
+                        refs[name[len(prefix):]] = sha
+        root = os.path.join(git_dir, *prefix.strip('/').split('/'))
+        for path, _, files in os.walk(root):
+            for file in files:
+                name = os.path.relpath(os.path.join(path, file), root).replace(os.sep, '/')
+                with open(os.path.join(path, file), encoding='utf-8') as f:
+                    refs[name] = f.read().strip()
+        return refs
+
+    def head(self):
+        """
+        当前提交的完整哈希（读取 HEAD 文件解析引用，无法解析时退回 git rev-parse）
+        :return:
+        """
+        try:
+            with open(os.path.join(self.local_path, '.git', 'HEAD'), encoding='utf-8') as f:
+                head = f.read().strip()
+        except OSError:
+            head = ''
+        if head.startswith('ref: '):
+            ref = head[5:]
+            prefix, _, name = ref.rpartition('/')
+            sha = self.read_refs(prefix + '/').get(name)
+            if sha:
+                return sha
+        elif len(head) == 40:
+            return head
+        return self.repo.git.rev_parse('HEAD')
+
     def branches(self):
         """
-        获取所有分支
+        获取所有分支（读取远程引用）
         :return:
         """
-        branches = self.repo.remote().refs
-        return [item.remote_head for item in branches if item.remote_head not in ['HEAD', ]]
+        return sorted(name for name in self.read_refs('refs/remotes/origin/') if name != 'HEAD')
 
-    def commits(self):
+    def iter_log(self, *args):
         """
-        获取所有提交记录
+        逐条读取 git log 输出（NUL 分隔的记录，按块读取进程输出，不一次性加载）
+        :return: 字段字典的迭代器
+        """
+        process = self.repo.git.log('-z', f'--pretty=format:{COMMIT_FORMAT}', '--date=format:%Y-%m-%d %H:%M',
+                                    *args, as_process=True)
+        stream = process.proc.stdout
+        buffer = b''
+        try:
+            while True:
+                chunk = stream.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                buffer += chunk
+                *records, buffer = buffer.split(b'\0')
+                for record in records:
+                    yield dict(zip(COMMIT_FIELDS, record.decode('utf-8', errors='replace').split('\x1f')))
+            if buffer:
+                yield dict(zip(COMMIT_FIELDS, buffer.decode('utf-8', errors='replace').split('\x1f')))
+        finally:
+            stream.close()
+            process.wait()
+
+    def commit_history(self, page=1, limit=50):
+        """
+        分页获取提交记录，按 (仓库, HEAD) 缓存解析结果（有新提交时 HEAD 变化，缓存自然失效）
+        :param page: 页码，从1开始
+        :param limit: 每页条数
+        :return: {"head", "page", "limit", "has_more", "results": [{"hash", "commit", "author", "email", "date", "summary"}]}
+        """
+        head = self.head()
+        key = COMMIT_CACHE_KEY.format(repo=hashlib.md5(os.path.abspath(self.local_path).encode()).hexdigest(),
+                                      head=head, page=page, limit=limit)
+        data = cache.get(key)
+        if data is None:
+            # 多取一条判断是否还有下一页
+            results = list(self.iter_log(f'--skip={(page - 1) * limit}', f'--max-count={limit + 1}', head))
+            data = {'head': head, 'page': page, 'limit': limit, 'has_more': len(results) > limit,
+                    'results': results[:limit]}
+            cache.set(key, data, COMMIT_CACHE_TIMEOUT)
+        return data
+
+    def commits(self, page=1, limit=50):
+        """
+        获取提交记录（默认最近50条）
         :return:
         """
-        commit_log = self.repo.git.log('--pretty={"commit":"%h","author":"%an","summary":"%s","date":"%cd"}',
-                                       max_count=50,
-                                       date='format:%Y-%m-%d %H:%M')
-        log_list = commit_log.split("\n")
-        return [eval(item) for item in log_list]
+        return self.commit_history(page, limit)['results']
 
     def tags(self):
         """
-        获取所有tag
+        获取所有tag（读取标签引用）
         :return:
         """
-        return [tag.name for tag in self.repo.tags]
+        return sorted(self.read_refs('refs/tags/'))
 
     def tags_exists(self, tag):
         """
@@ -95,6 +190,80 @@ class GitRepository(object):
         """
         self.repo.git.checkout(tag)
 
+    def fetch_reset(self, branch):
+        """
+        拉取远程分支与标签，并将工作区重置为远程分支最新提交（只读镜像，远程强制推送时也能同步）
+        :param branch:
+        :return:
+        """
+        self.repo.git.fetch('origin', '--tags', '--prune', '--force')
+        self.repo.git.checkout('-B', branch, f'origin/{branch}')
+        self.repo.git.reset('--hard', f'origin/{branch}')
+
+    def has_commit(self, commit):
+        """
+        本地是否存在该提交（远程强制推送、本地仓库重建后旧提交可能不存在）
+        :param commit:
+        :return:
+        """
+        try:
+            self.repo.git.cat_file('-e', f'{commit}^{{commit}}')
+            return True
+        except GitCommandError:
+            return False
+
+    def ls_tree(self, commit='HEAD', paths=None):
+        """
+        提交中的文件及其 blob 哈希（NUL 分隔输出，文件名不转义）
+        :param commit:
+        :param paths: 只列出指定路径，不传则列出全部文件
+        :return: {路径: blob哈希}
+        """
+        args = ['-r', '-z', commit]
+        if paths is not None:
+            if not paths:
+                return {}
+            args += ['--'] + list(paths)
+        files = {}
+        for item in self.repo.git.ls_tree(*args).split('\0'):
+            if not item:
+                continue
+            meta, path = item.split('\t', 1)
+            mode, kind, blob = meta.split()
+            if kind == 'blob':
+                files[path] = blob
+        return files
+
+    def diff_name_status(self, old_commit, new_commit='HEAD'):
+        """
+        两次提交之间变更的文件（git diff --name-status，检测重命名）
+        :param old_commit:
+        :param new_commit:
+        :return: [(状态, 路径, 新路径)]，状态为 A/M/D/R/C/T，非重命名/复制时新路径为 None
+        """
+        output = self.repo.git.diff('--name-status', '-z', '-M', '--no-ext-diff', old_commit, new_commit)
+        items = output.split('\0')
+        changes = []
+        index = 0
+        while index < len(items) and items[index]:
+            status = items[index][0]
+            if status in ('R', 'C'):
+                changes.append((status, items[index + 1], items[index + 2]))
+                index += 3
+            else:
+                changes.append((status, items[index + 1], None))
+                index += 2
+        return changes
+
+    def read_text(self, path):
+        """
+        读取工作区文件文本（UTF-8，无法解码的字节替换）
+        :param path:
+        :return:
+        """
+        with open(os.path.join(self.local_path, path), 'rb') as f:
+            return f.read().decode('utf-8', errors='replace')
+
 # if __name__ == '__main__':
 # local_path = os.path.join('codes', 't1')
 # repo = GitRepository(local_path, remote_path)
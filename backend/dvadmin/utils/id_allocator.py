@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 主键ID分配（目录、文档的主键为普通整数列，批量写入时需预先分配ID）
+    - 每张表在缓存中维护一个计数器，批量分配时一次递增 count，多个进程并发分配不会重复
+    - 计数器不存在（首次使用或缓存被清空）时按表中最大ID初始化；分配后再与表中最大ID校验，
+      防止其他途径写入的ID与计数器重叠
+    - 单条保存（接口、后台管理）未指定主键时同样由计数器分配；指定主键写入（导入数据、fixtures）时
+      计数器前移到该ID，之后分配的ID不会与之重叠
+"""
+from django.core.cache import cache
+from django.db.models import Max
+
+ID_KEY = "id_allocator:{table}"
+
+
+def allocate_ids(model, count):
+    """
+    为模型分配 count 个连续的新主键
+    :return: range
+    """
+    if count <= 0:
+        return range(0)
+    key = ID_KEY.format(table=model._meta.db_table)
+    while True:
+        try:
+            end = cache.incr(key, count)
+        except ValueError:
+            cache.add(key, model.objects.aggregate(max_id=Max("pk"))["max_id"] or 0, timeout=None)
+            continue
+        start = end - count + 1
+        max_id = model.objects.aggregate(max_id=Max("pk"))["max_id"] or 0
+        if start > max_id:
+            return range(start, end + 1)
+        # 表中已有更大的ID（计数器落后），跳过后重新分配
+        cache.incr(key, max_id - start + 1)
+
+
+def advance_to(model, object_id):
+    """其他途径写入了指定主键：计数器小于该ID时前移（计数器不存在时首次分配会按表中最大ID初始化）"""
+    key = ID_KEY.format(table=model._meta.db_table)
+    current = cache.get(key)
+    if current is not None and current < object_id:
+        try:
+            cache.incr(key, object_id - current)
+        except ValueError:
+            pass
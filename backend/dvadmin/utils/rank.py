@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 目录/文档的分数排序键（拖拽排序）
+    - 排序键为 36 进制数字串（数字 + 小写字母），按字典序比较；任意两个相邻键之间总能生成新键，移动一项只需更新该项一行
+    - 不使用大写字母：MySQL 默认的大小写不敏感排序规则（utf8mb4_0900_ai_ci）下 'a' 与 'A' 相等，
+      只用一种大小写才能保证数据库排序与字典序一致；早期的 62 进制键在使用时自动重新平衡
+    - 同级（同一父目录下的目录、同一目录下的文档）全部未设置排序键时按原有整数 sort 排序；
+      首次拖拽时为该级一次性生成均匀分布的排序键，之后按排序键排序
+    - 同一位置反复插入会使键变长，超过 REBALANCE_LENGTH 时提交后台任务为该级重新生成均匀分布的排序键
+"""
+import logging
+
+from django.db import transaction
+
+from dvadmin.utils.validator import CustomValidationError
+
+logger = logging.getLogger(__name__)
+
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+# 排序键超过该长度时后台重新生成
+REBALANCE_LENGTH = 24
+KIND_CATEGORY = "category"
+KIND_DOCUMENT = "document"
+
+
+def key_between(a, b):
+    """
+    生成位于 a 与 b 之间的排序键（a 为空表示最前，b 为 None 表示最后）
+    键不以最小数字 “0” 结尾，保证任意两个键之间都有空间
+    """
+    if b is not None and a >= b:
+        raise ValueError(f"排序键顺序错误: {a!r} >= {b!r}")
+    if a.endswith(DIGITS[0]) or (b or "").endswith(DIGITS[0]):
+        raise ValueError("排序键不能以 0 结尾")
+    if b:
+        # 公共前缀保留，只在第一个不同的位置上取中间值
+        n = 0
+        while (a[n] if n < len(a) else DIGITS[0]) == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + key_between(a[n:], b[n:])
+    digit_a = DIGITS.index(a[0]) if a else 0
+    digit_b = DIGITS.index(b[0]) if b is not None else BASE
+    if digit_b - digit_a > 1:
+        return DIGITS[(digit_a + digit_b + 1) // 2]
+    if b and len(b) > 1:
+        return b[0]
+    return DIGITS[digit_a] + key_between(a[1:], None)
+
+
+def even_keys(count):
+    """生成 count 个等长、均匀分布的排序键（用于首次排序与重新平衡）"""
+    width = 1
+    while BASE ** width <= count * 2:
+        width += 1
+    step = BASE ** width // (count + 1)
+    keys = []
+    for index in range(1, count + 1):
+        value, digits = index * step, []
+        for _ in range(width):
+            value, digit = divmod(value, BASE)
+            digits.append(DIGITS[digit])
+        keys.append("".join(reversed(digits)).rstrip(DIGITS[0]))
+    return keys
+
+
+def is_legacy_key(key):
+    """早期 62 进制排序键（含大写字母），需重新平衡"""
+    return any(char not in DIGITS for char in key or "")
+
+
+def siblings(kind, parent_id, repository_id=None):
+    """同级的目录/文档：目录为知识库下同一父目录的子目录，文档为同一目录下的文档"""
+    from dvadmin.system.models import Category, MmDocument
+
+    if kind == KIND_CATEGORY:
+        return Category.objects.filter(repository_id=repository_id, parent_category_id=parent_id).order_by(
+            "rank", "sort", "id")
+    return MmDocument.objects.filter(category_id=parent_id).order_by("rank", "sort", "-update_time", "id")
+
+
+def sibling_scope(instance):
+    """实例所在的同级范围 (类型, 父ID, 知识库ID)"""
+    from dvadmin.system.models import Category
+
+    if isinstance(instance, Category):
+        return KIND_CATEGORY, instance.parent_category_id, instance.repository_id
+    return KIND_DOCUMENT, instance.category_id, None
+
+
+def rebalance(kind, parent_id, repository_id=None):
+    """
+    按当前顺序为同级重新生成均匀分布的排序键（一次批量更新）
+    :return: 更新的行数
+    """
+    with transaction.atomic():
+        rows = list(siblings(kind, parent_id, repository_id).select_for_update().values_list("id", "rank"))
+        # 按二进制字典序重新排列（数据库排序规则不区分大小写时，早期排序键的顺序可能不正确；稳定排序保留同键的原顺序）
+        rows.sort(key=lambda row: row[1])
+        keys = even_keys(len(rows))
+        model = siblings(kind, parent_id, repository_id).model
+        changed = [model(id=row_id, rank=key) for (row_id, rank), key in zip(rows, keys) if rank != key]
+        model.objects.bulk_update(changed, ["rank"], batch_size=1000)
+        record_order_changes(kind, [item.id for item in changed], repository_id)
+    if kind == KIND_CATEGORY and changed:
+        from dvadmin.utils.category_tree import bump_tree_version
+        bump_tree_version(repository_id)
+    return len(changed)
+
+
+def clear_ranks(kind, parent_ids, repository_id=None):
+    """同级恢复为按整数 sort 排序（调整整数排序值的旧接口使用）"""
+    from dvadmin.system.models import Category, MmDocument
+
+    if kind == KIND_CATEGORY:
+        queryset = Category.objects.filter(repository_id=repository_id, parent_category_id__in=parent_ids)
+    else:
+        queryset = MmDocument.objects.filter(category_id__in=parent_ids)
+    ids = list(queryset.exclude(rank="").values_list("id", flat=True))
+    record_order_changes(kind, ids, repository_id)
+    return queryset.model.objects.filter(id__in=ids).update(rank="")
+
+
+def record_order_changes(kind, ids, repository_id=None):
+    """排序变化（排序键、整数排序值）记入变更日志，文档按所属目录取知识库ID"""
+    from dvadmin.system.models import MmDocument
+    from dvadmin.utils import change_feed
+
+    if not ids:
+        return
+    if kind == KIND_CATEGORY:
+        entries = [(repository_id, change_feed.OBJECT_CATEGORY, item_id, change_feed.ACTION_UPDATE) for item_id in ids]
+    else:
+        entries = [(repository, change_feed.OBJECT_DOCUMENT, item_id, change_feed.ACTION_UPDATE) for item_id, repository
+                   in MmDocument.objects.filter(id__in=ids).values_list("id", "category__repository_id")]
+    change_feed.record_changes(entries)
+
+
+def last_rank(kind, parent_id, repository_id=None):
+    """同级最后的排序键（早期排序键先重新平衡），未使用排序键时返回 None"""
+    queryset = siblings(kind, parent_id, repository_id).exclude(rank="").order_by("-rank").values_list(
+        "rank", flat=True)
+    last = queryset.first()
+    if last and is_legacy_key(last):
+        rebalance(kind, parent_id, repository_id)
+        last = queryset.first()
+    return last
+
+
+def append_rank(instance):
+    """新建的目录/文档：同级已使用排序键时排在最后，否则保持为空（按整数 sort 排序）"""
+    kind, parent_id, repository_id = sibling_scope(instance)
+    last = last_rank(kind, parent_id, repository_id)
+    return key_between(last, None) if last else ""
+
+
+def rebalance_legacy_ranks(batch_size=2000):
+    """
+    重新平衡仍使用早期 62 进制排序键的同级（升级后执行一次）
+    :return: 重新平衡的同级数
+    """
+    from dvadmin.system.models import Category, MmDocument
+
+    scopes = set()
+    rows = Category.objects.exclude(rank="").values_list("parent_category_id", "repository_id", "rank")
+    for parent_id, repository_id, rank in rows.iterator(chunk_size=batch_size):
+        if is_legacy_key(rank):
+            scopes.add((KIND_CATEGORY, parent_id, repository_id))
+    rows = MmDocument.objects.exclude(rank="").values_list("category_id", "rank")
+    for parent_id, rank in rows.iterator(chunk_size=batch_size):
+        if is_legacy_key(rank):
+            scopes.add((KIND_DOCUMENT, parent_id, None))
+    for kind, parent_id, repository_id in scopes:
+        rebalance(kind, parent_id, repository_id)
+    return len(scopes)
+
+
+def schedule_rebalance(kind, parent_id, repository_id=None):
+    """提交重新平衡任务；任务提交失败时同步执行"""
+    from dvadmin.system.tasks import rebalance_sibling_ranks
+    try:
+        rebalance_sibling_ranks.delay(kind, parent_id, repository_id)
+    except Exception as e:
+        logger.warning(f"排序键重新平衡任务提交失败，改为同步执行: {e}")
+        rebalance(kind, parent_id, repository_id)
+
+
+def neighbour_ranks(others, before, after):
+    """移动位置两侧的排序键 (lower, upper)，只传一侧时另一侧取其相邻项"""
+    ranks = dict(others.filter(pk__in=[item.pk for item in (before, after) if item]).values_list("pk", "rank"))
+    lower = ranks[before.pk] if before else None
+    upper = ranks[after.pk] if after else None
+    if before is None:
+        lower = others.filter(rank__lt=upper).order_by("-rank").values_list("rank", flat=True).first() \
+            if upper is not None else others.order_by("-rank").values_list("rank", flat=True).first()
+    elif after is None:
+        upper = others.filter(rank__gt=lower).order_by("rank").values_list("rank", flat=True).first()
+    return lower, upper
+
+
+def move_between(instance, before=None, after=None):
+    """
+    将目录/文档移动到同级的 before 与 after 之间（只传一个时另一侧取其相邻项，都不传时移到最后）
+    只更新被移动项的排序键
+    :return: 新排序键
+    """
+    kind, parent_id, repository_id = sibling_scope(instance)
+    for neighbour in (before, after):
+        if neighbour is not None and sibling_scope(neighbour) != (kind, parent_id, repository_id):
+            raise CustomValidationError("相邻项不在同一级")
+        if neighbour is not None and neighbour.pk == instance.pk:
+            raise CustomValidationError("相邻项不能是自身")
+    with transaction.atomic():
+        queryset = siblings(kind, parent_id, repository_id)
+        if queryset.filter(rank="").exists():
+            rebalance(kind, parent_id, repository_id)
+        lower, upper = neighbour_ranks(queryset.exclude(pk=instance.pk), before, after)
+        if is_legacy_key(lower) or is_legacy_key(upper):
+            rebalance(kind, parent_id, repository_id)
+            lower, upper = neighbour_ranks(queryset.exclude(pk=instance.pk), before, after)
+        if upper is not None and (lower or "") >= upper:
+            raise CustomValidationError("before 必须排在 after 之前")
+        rank = key_between(lower or "", upper)
+        queryset.model.objects.filter(pk=instance.pk).update(rank=rank)
+        record_order_changes(kind, [instance.pk], repository_id)
+    instance.rank = rank
+    if kind == KIND_CATEGORY:
+        from dvadmin.utils.category_tree import bump_tree_version
+        transaction.on_commit(lambda: bump_tree_version(repository_id))
+    if len(rank) > REBALANCE_LENGTH:
+        transaction.on_commit(lambda: schedule_rebalance(kind, parent_id, repository_id))
+    return rank
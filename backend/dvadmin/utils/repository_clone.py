@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 知识库克隆（从模板知识库复制目录树与文档）
+    - 目录、文档用 INSERT ... SELECT 集合式复制，不经过 Python 逐行读写
+    - 新ID = 原ID + 偏移量：按模板知识库的ID跨度一次分配连续ID，父目录、所属目录同样加偏移量
+    - 目录 tree_path 一次取出父子关系在内存中重新计算后批量更新（MySQL 不允许 UPDATE 的子查询读取同一张表），
+      文档冗余路径再集合式同步
+    - 派生数据、近似重复签名随文档一并复制；全文索引、链接关系、统计汇总按新知识库重建
+    - 文档较多时由 Celery 异步执行，进度写入缓存
+"""
+import datetime
+import logging
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_KEY = "repository_clone:{repository_id}"
+PROGRESS_TIMEOUT = 60 * 60 * 24
+# 文档数超过该值时异步克隆
+ASYNC_THRESHOLD = 500
+# 每批复制的文档ID跨度
+BATCH_SIZE = 1000
+
+
+def set_progress(repository_id, **fields):
+    key = PROGRESS_KEY.format(repository_id=repository_id)
+    progress = cache.get(key) or {}
+    progress.update(fields)
+    cache.set(key, progress, PROGRESS_TIMEOUT)
+    return progress
+
+
+def get_progress(repository_id):
+    return cache.get(PROGRESS_KEY.format(repository_id=repository_id))
+
+
+def insert_select(model, overrides, where, params=()):
+    """
+    INSERT INTO 表 (列...) SELECT 表达式... FROM 表 WHERE 条件
+    :param overrides: {列名: (SQL 表达式, 参数)}，未指定的列原样复制，自增主键不复制
+    :return: 插入的行数
+    """
+    quote = connection.ops.quote_name
+    columns, expressions, values = [], [], []
+    for field in model._meta.concrete_fields:
+        if field.primary_key and field.get_internal_type() in ("AutoField", "BigAutoField"):
+            continue
+        columns.append(quote(field.column))
+        expression, expression_params = overrides.get(field.column, (quote(field.column), ()))
+        expressions.append(expression)
+        values.extend(expression_params)
+    table = quote(model._meta.db_table)
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(expressions)} FROM {table} WHERE {where}"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, values + list(params))
+        return cursor.rowcount
+
+
+def id_offset(model, queryset):
+    """按源数据的ID跨度分配连续ID，返回 (偏移量, 最小ID, 最大ID)；源数据为空时返回 None"""
+    from django.db.models import Max, Min
+
+    from dvadmin.utils.id_allocator import allocate_ids
+
+    bounds = queryset.aggregate(min_id=Min("id"), max_id=Max("id"))
+    if bounds["min_id"] is None:
+        return None
+    ids = allocate_ids(model, bounds["max_id"] - bounds["min_id"] + 1)
+    return ids.start - bounds["min_id"], bounds["min_id"], bounds["max_id"]
+
+
+def rewrite_category_paths(repository_id):
+    """
+    按新ID重新计算目录的 tree_path/dimension：一次查询取出父子关系，内存中计算后按批 bulk_update
+    （不使用读取本表的关联子查询 UPDATE，MySQL 会报 1093 错误）
+    :return: 更新的目录数
+    """
+    from dvadmin.utils.category_tree import repair_repository_paths
+
+    categories, _ = repair_repository_paths(repository_id, batch_size=BATCH_SIZE)
+    return categories
+
+
+def clone_repository(source_id, repository_id, master):
+    """
+    将模板知识库的目录与文档复制到已创建的新知识库
+    :return: {"categories": 目录数, "documents": 文档数}
+    """
+    from dvadmin.system.models import (Category, MmDocument, MmDocumentDerivative, MmDocumentLshBucket,
+                                       MmDocumentSignature)
+    from dvadmin.utils.category_tree import bump_tree_version, sync_document_paths
+
+    set_progress(repository_id, status="running", stage="categories", done=0, total=0, source_id=source_id,
+                 message=None)
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            source_categories = Category.objects.filter(repository_id=source_id)
+            category_offset = id_offset(Category, source_categories)
+            categories = 0
+            if category_offset is not None:
+                offset = category_offset[0]
+                categories = insert_select(Category, {
+                    "id": ("id + %s", (offset,)),
+                    "repository_id": ("%s", (repository_id,)),
+                    "parent_category_id": ("parent_category_id + %s", (offset,)),
+                    "master": ("%s", (master,)),
+                    "update_time": ("%s", (now,)),
+                }, "repository_id = %s", (source_id,))
+                rewrite_category_paths(repository_id)
+
+            quote = connection.ops.quote_name
+            source_documents = MmDocument.objects.filter(category__repository_id=source_id)
+            document_offset = id_offset(MmDocument, source_documents)
+            documents = 0
+            if document_offset is not None:
+                offset, min_id, max_id = document_offset
+                total = source_documents.count()
+                set_progress(repository_id, stage="documents", done=0, total=total)
+                in_source = (f"{quote('category_id')} IN (SELECT {quote('id')} FROM {quote(Category._meta.db_table)} "
+                             f"WHERE {quote('repository_id')} = %s)")
+                document_ids = f"{quote('document_id')} IN (SELECT {quote('id')} FROM " \
+                               f"{quote(MmDocument._meta.db_table)} WHERE {quote('id')} BETWEEN %s AND %s AND {in_source})"
+                for start in range(min_id, max_id + 1, BATCH_SIZE):
+                    end = min(start + BATCH_SIZE - 1, max_id)
+                    documents += insert_select(MmDocument, {
+                        "id": ("id + %s", (offset,)),
+                        "category_id": ("category_id + %s", (category_offset[0],)),
+                        "master": ("%s", (master,)),
+                        "update_time": ("%s", (now,)),
+                    }, f"id BETWEEN %s AND %s AND {in_source}", (start, end, source_id))
+                    # 派生数据与近似重复签名只与正文有关，直接复制
+                    for model in (MmDocumentDerivative, MmDocumentSignature, MmDocumentLshBucket):
+                        insert_select(model, {"document_id": ("document_id + %s", (offset,))},
+                                      document_ids, (start, end, source_id))
+                    set_progress(repository_id, done=documents)
+                sync_document_paths(Category.objects.filter(repository_id=repository_id).values("id"))
+        set_progress(repository_id, stage="index")
+        refresh_clone(repository_id)
+    except Exception as e:
+        logger.error(f"知识库[{source_id}]克隆到[{repository_id}]失败: {e}")
+        set_progress(repository_id, status="failed", message=str(e))
+        raise
+    bump_tree_version(repository_id)
+    set_progress(repository_id, status="success", stage="done")
+    return {"categories": categories, "documents": documents}
+
+
+def discard_clone(repository_id):
+    """
+    克隆失败时删除新知识库及已复制的数据
+    目录与文档在事务内复制，但重建索引等在提交后执行，失败时可能已有数据，按回收站清理流程整体删除
+    """
+    from dvadmin.system.models import MmRepository
+    from dvadmin.utils.repository_purge import RECYCLED, purge_repository
+
+    MmRepository.objects.filter(id=repository_id).update(
+        recycle=RECYCLED, recycle_time=timezone.now() - datetime.timedelta(seconds=1))
+    purge_repository(repository_id, retention_days=0, pause=0)
+
+
+def refresh_clone(repository_id):
+    """重建新知识库的全文索引、链接关系与统计汇总"""
+    from dvadmin.system.models import MmDocument
+    from dvadmin.utils.change_feed import reset_changes
+    from dvadmin.utils.document_links import rebuild_links
+    from dvadmin.utils.document_stats import recompute_rollups
+    from dvadmin.utils.search_engine import get_search_backend
+
+    get_search_backend().rebuild(MmDocument.objects.filter(category__repository_id=repository_id))
+    rebuild_links(repository_id)
+    recompute_rollups(repository_id)
+    reset_changes(repository_id)
+
+
+def schedule_clone(source_id, repository_id, master):
+    """
+    文档较少时直接克隆，否则提交异步任务（提交失败时同步执行）
+    :return: 是否异步执行
+    """
+    from dvadmin.system.models import MmDocument
+    from dvadmin.system.tasks import clone_repository_task
+
+    set_progress(repository_id, status="pending", stage="queued", done=0, total=0, source_id=source_id,
+                 message=None)
+    if MmDocument.objects.filter(category__repository_id=source_id).count() > ASYNC_THRESHOLD:
+        try:
+            clone_repository_task.delay(source_id, repository_id, master)
+            return True
+        except Exception as e:
+            logger.warning(f"知识库克隆任务提交失败，改为同步执行: {e}")
+    clone_repository(source_id, repository_id, master)
+    return False
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 回收站知识库清理（定时彻底删除回收超过保留天数的知识库）
+    - 按批删除文档及其修订历史、派生数据、相似度签名、检索索引、链接、阅读统计，每批一个事务，批次之间暂停，降低对线上库的压力
+    - 批量删除不触发逐行信号，知识库级的缓存、索引、变更日志在知识库删除完成后统一处理
+    - 内容存储中的正文可能被其他文档（克隆、快照导入）或修订历史共用，每批删除后确认已无引用再删除；
+      中断时遗留的内容由内容清理定时任务兜底
+    - 每次执行有时间上限，未完成的知识库下次继续（已删除的数据不再出现，天然可续跑）；
+      开始清理时知识库的回收状态原子地改为“清理中”（recycle=2），此后不可再恢复，下次执行时不论回收时间继续清理
+"""
+import datetime
+import logging
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# 回收站保留天数
+RETENTION_DAYS = getattr(settings, "REPOSITORY_RECYCLE_RETENTION_DAYS", 30)
+# 每批删除的文档/目录数
+BATCH_SIZE = getattr(settings, "REPOSITORY_PURGE_BATCH_SIZE", 500)
+# 批次之间暂停的秒数
+BATCH_PAUSE = getattr(settings, "REPOSITORY_PURGE_PAUSE", 0.5)
+# 每次执行的时间上限（秒），超时后剩余部分下次继续
+MAX_SECONDS = getattr(settings, "REPOSITORY_PURGE_MAX_SECONDS", 60 * 10)
+LOCK_KEY = "repository_purge_lock"
+# 回收状态：已回收、清理中
+RECYCLED = 1
+PURGING = 2
+
+
+def expired_repositories(retention_days=RETENTION_DAYS):
+    """回收超过保留天数、或已开始清理的知识库"""
+    from dvadmin.system.models import MmRepository
+
+    cutoff = timezone.now() - datetime.timedelta(days=retention_days)
+    return MmRepository.objects.filter(Q(recycle=RECYCLED, recycle_time__lt=cutoff) | Q(recycle=PURGING))
+
+
+def start_purge(repository_id, retention_days=RETENTION_DAYS):
+    """
+    将知识库标记为清理中（条件更新，与恢复操作互斥：恢复在行锁内检查状态）
+    :return: 知识库是否处于清理中
+    """
+    from dvadmin.system.models import MmRepository
+
+    expired_repositories(retention_days).filter(id=repository_id, recycle=RECYCLED).update(recycle=PURGING)
+    return MmRepository.objects.filter(id=repository_id, recycle=PURGING).exists()
+
+
+def raw_delete(queryset):
+    """集合式删除（不逐行加载、不触发信号与级联收集）"""
+    return queryset._raw_delete(queryset.db)
+
+
+def purge_documents(document_ids):
+    """删除一批文档及其关联数据（调用方负责事务）"""
+    from dvadmin.system.models import (MmDocument, MmDocumentDerivative, MmDocumentLink, MmDocumentLshBucket,
+                                       MmDocumentRevision, MmDocumentSignature, MmDocumentViewStat)
+    from dvadmin.utils.search_engine import get_search_backend
+
+    digests = set(MmDocument.objects.filter(id__in=document_ids).exclude(content_hash__isnull=True).values_list(
+        "content_hash", flat=True))
+    digests |= set(MmDocumentRevision.objects.filter(
+        document_id__in=document_ids, kind=MmDocumentRevision.KIND_STORED_SNAPSHOT).values_list("content_hash", flat=True))
+    for model in (MmDocumentRevision, MmDocumentLshBucket, MmDocumentSignature, MmDocumentDerivative,
+                  MmDocumentViewStat):
+        raw_delete(model.objects.filter(document_id__in=document_ids))
+    get_search_backend().remove_documents(document_ids)
+    # 出链删除，其他知识库指向这些文档的链接变为悬空
+    raw_delete(MmDocumentLink.objects.filter(source_id__in=document_ids))
+    MmDocumentLink.objects.filter(target_id__in=document_ids).update(target_id=None)
+    return raw_delete(MmDocument.objects.filter(id__in=document_ids)), digests
+
+
+def purge_categories(category_ids):
+    """删除一批目录（先断开子目录的父目录引用，避免外键约束）"""
+    from dvadmin.system.models import Category
+
+    Category.objects.filter(parent_category_id__in=category_ids).update(parent_category=None)
+    return raw_delete(Category.objects.filter(id__in=category_ids)), set()
+
+
+def purge_repository(repository_id, retention_days=RETENTION_DAYS, batch_size=BATCH_SIZE, pause=BATCH_PAUSE,
+                     deadline=None):
+    """
+    分批彻底删除回收站中的知识库
+    :param deadline: time.monotonic() 截止时间，超时后返回，剩余部分下次继续
+    :return: (是否删除完成, 删除的文档数, 删除的目录数)；超时或知识库已恢复时未完成
+    """
+    from dvadmin.system.models import (Category, MmDocument, MmDocumentRollup, MmRepository, MmRepositoryChange,
+                                       MmRepositoryGitFile, MmRepositoryGitSync, MmRepositorySnapshotMap)
+    from dvadmin.utils import change_feed, semantic_index, static_site, typeahead
+    from dvadmin.utils.category_tree import bump_tree_version
+    from dvadmin.utils.content_store import delete_unreferenced_blobs
+    from dvadmin.utils.document_views import popular_key
+    from dvadmin.utils.git_sync import SYNC_ROOT
+
+    documents = categories = 0
+    # 开始清理前知识库仍在回收站中且已过保留期（已在清理中的继续）
+    if not start_purge(repository_id, retention_days):
+        return False, documents, categories
+    stages = (
+        (lambda: MmDocument.objects.filter(category__repository_id=repository_id).order_by("id"), purge_documents),
+        (lambda: Category.objects.filter(repository_id=repository_id).order_by("-dimension", "id"), purge_categories),
+    )
+    for stage, (queryset, purge) in enumerate(stages):
+        while True:
+            if deadline is not None and time.monotonic() > deadline:
+                return False, documents, categories
+            ids = list(queryset().values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                deleted, digests = purge(ids)
+            if stage == 0:
+                documents += deleted
+                # 文档删除提交后删除已无引用的正文内容
+                delete_unreferenced_blobs(digests)
+            else:
+                categories += deleted
+            if pause:
+                time.sleep(pause)
+
+    with transaction.atomic():
+        for model in (MmDocumentRollup, MmRepositoryGitSync, MmRepositoryGitFile, MmRepositorySnapshotMap):
+            raw_delete(model.objects.filter(repository_id=repository_id))
+        change_feed.delete_in_batches(MmRepositoryChange.objects.filter(repository_id=repository_id), batch_size)
+        # 触发 post_delete 信号，变更日志中记录知识库删除
+        MmRepository.objects.filter(id=repository_id).delete()
+    shutil.rmtree(os.path.join(SYNC_ROOT, str(repository_id)), ignore_errors=True)
+    semantic_index.remove_index(repository_id)
+    static_site.remove_site(repository_id)
+    typeahead.reset_index(repository_id)
+    bump_tree_version(repository_id)
+    cache.delete(popular_key(repository_id))
+    logger.info(f"回收站知识库[{repository_id}]已清理：文档 {documents}，目录 {categories}")
+    return True, documents, categories
+
+
+def purge_recycled(retention_days=RETENTION_DAYS, batch_size=BATCH_SIZE, pause=BATCH_PAUSE, max_seconds=MAX_SECONDS):
+    """
+    清理回收超过保留天数的知识库（按回收时间先后，超过时间上限后停止，下次继续）
+    :return: {"repositories": 删除完成的知识库ID, "documents": 删除的文档数, "categories": 删除的目录数, "finished": 是否全部完成}；
+             其他进程正在清理时返回 None
+    """
+    from dvadmin.utils.document_views import refresh_popular
+
+    if not cache.add(LOCK_KEY, 1, timeout=max_seconds + 60 * 5):
+        return None
+    try:
+        deadline = time.monotonic() + max_seconds
+        result = {"repositories": [], "documents": 0, "categories": 0, "finished": True}
+        # 已开始清理的优先完成
+        repository_ids = expired_repositories(retention_days).order_by("-recycle", "recycle_time", "id").values_list(
+            "id", flat=True)
+        for repository_id in list(repository_ids):
+            finished, documents, categories = purge_repository(repository_id, retention_days, batch_size, pause,
+                                                               deadline)
+            result["documents"] += documents
+            result["categories"] += categories
+            if finished:
+                result["repositories"].append(repository_id)
+            elif time.monotonic() > deadline:
+                result["finished"] = False
+                break
+        if result["documents"]:
+            refresh_popular()
+        return result
+    finally:
+        cache.delete(LOCK_KEY)
@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 知识库快照（跨环境批量导出/导入）
+    - 快照为 gzip 压缩的记录流，每条记录为 1 字节类型 + 4 字节长度（大端）+ 内容：
+      H 头部（知识库信息、增量起点、导出时间）、R 已删除的目录/文档ID、C 目录、D 文档（元数据长度 + 元数据 + 正文）、E 结束（各类记录数）
+    - 导出按批读取、边压缩边输出，不在内存中拼接整个快照
+    - 导入在一个事务内：目录一次分配ID、按层级批量写入，文档按批分配ID批量写入；
+      源ID与本环境ID的映射保存在映射表中，之后的增量快照据此更新已导入的目录/文档
+    - 增量快照包含 since 之后修改过的目录/文档（按更新时间与变更日志）以及变更日志中记录的删除
+"""
+import datetime
+import json
+import struct
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from dvadmin.utils.validator import CustomValidationError
+
+MAGIC = b"KSNAP"
+VERSION = 1
+RECORD = struct.Struct(">cI")
+RECORD_HEADER = b"H"
+RECORD_REMOVED = b"R"
+RECORD_CATEGORY = b"C"
+RECORD_DOCUMENT = b"D"
+RECORD_END = b"E"
+KIND_CATEGORY = 0
+KIND_DOCUMENT = 1
+BATCH_SIZE = 500
+# 输出的压缩块大小
+CHUNK_SIZE = 64 * 1024
+
+REPOSITORY_FIELDS = ["name", "type_id", "limits", "icon_url", "description"]
+CATEGORY_FIELDS = ["id", "name", "parent_category_id", "sort", "rank", "icon_url", "update_time"]
+DOCUMENT_FIELDS = ["id", "name", "category_id", "type_id", "sort", "rank", "update_time"]
+
+
+def pack(kind, payload):
+    return RECORD.pack(kind, len(payload)) + payload
+
+
+def pack_json(kind, data):
+    return pack(kind, json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False).encode("utf-8"))
+
+
+def check_since(since):
+    """增量起点不能早于变更日志的保留范围（否则无法得知期间删除的目录/文档）"""
+    from dvadmin.utils.change_feed import RETENTION_DAYS
+
+    if since is not None and since < timezone.now() - datetime.timedelta(days=RETENTION_DAYS):
+        raise CustomValidationError(f"增量起点超过变更日志保留天数（{RETENTION_DAYS} 天），请导出全量快照")
+
+
+def changed_ids(repository_id, object_type, since):
+    """变更日志中 since 之后新增/修改/移动过的对象ID（排序键等不更新修改时间的变更）"""
+    from dvadmin.system.models import MmRepositoryChange
+    from dvadmin.utils.change_feed import ACTION_DELETE
+
+    return MmRepositoryChange.objects.filter(repository_id=repository_id, object_type=object_type,
+                                             create_time__gte=since).exclude(action=ACTION_DELETE).values("object_id")
+
+
+def removed_ids(repository_id, object_type, since, queryset):
+    """变更日志中 since 之后删除、且当前不在知识库中的对象ID"""
+    from dvadmin.system.models import MmRepositoryChange
+    from dvadmin.utils.change_feed import ACTION_DELETE
+
+    ids = set(MmRepositoryChange.objects.filter(repository_id=repository_id, object_type=object_type,
+                                                action=ACTION_DELETE, create_time__gte=since).values_list(
+        "object_id", flat=True))
+    return sorted(ids - set(queryset.filter(id__in=ids).values_list("id", flat=True)))
+
+
+def export_records(repository, since=None, batch_size=BATCH_SIZE):
+    """生成快照记录流（未压缩）"""
+    from dvadmin.system.models import Category, MmDocument
+    from dvadmin.utils.change_feed import OBJECT_CATEGORY, OBJECT_DOCUMENT
+
+    categories = Category.objects.filter(repository_id=repository.id)
+    documents = MmDocument.objects.filter(category__repository_id=repository.id)
+    yield MAGIC + bytes([VERSION])
+    yield pack_json(RECORD_HEADER, {
+        "version": VERSION,
+        "repository_id": repository.id,
+        "repository": {field: getattr(repository, field) for field in REPOSITORY_FIELDS},
+        "since": since,
+        "exported_at": timezone.now(),
+    })
+    counts = {"categories": 0, "documents": 0}
+    if since is not None:
+        yield pack_json(RECORD_REMOVED, {
+            "categories": removed_ids(repository.id, OBJECT_CATEGORY, since, categories),
+            "documents": removed_ids(repository.id, OBJECT_DOCUMENT, since, documents),
+        })
+        categories = categories.filter(Q(update_time__gte=since) | Q(id__in=changed_ids(
+            repository.id, OBJECT_CATEGORY, since)))
+        documents = documents.filter(Q(update_time__gte=since) | Q(id__in=changed_ids(
+            repository.id, OBJECT_DOCUMENT, since)))
+
+    # 按深度输出，导入时父目录总在子目录之前
+    for row in categories.order_by("dimension", "id").values(*CATEGORY_FIELDS).iterator(chunk_size=batch_size):
+        counts["categories"] += 1
+        yield pack_json(RECORD_CATEGORY, row)
+
+    document_ids = list(documents.order_by("id").values_list("id", flat=True))
+    for start in range(0, len(document_ids), batch_size):
+        batch = MmDocument.objects.filter(id__in=document_ids[start:start + batch_size]).only(
+            *DOCUMENT_FIELDS, "detail_text", "content_hash").order_by("id")
+        for document in batch:
+            meta = json.dumps({field: getattr(document, field) for field in DOCUMENT_FIELDS}, cls=DjangoJSONEncoder,
+                              ensure_ascii=False).encode("utf-8")
+            body = (document.detail_text or "").encode("utf-8")
+            counts["documents"] += 1
+            yield pack(RECORD_DOCUMENT, struct.pack(">I", len(meta)) + meta + body)
+    yield pack_json(RECORD_END, counts)
+
+
+def compress_stream(records, level=6):
+    """gzip 压缩记录流，按 CHUNK_SIZE 输出"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    buffer = []
+    size = 0
+    for record in records:
+        data = compressor.compress(record)
+        if data:
+            buffer.append(data)
+            size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    buffer.append(compressor.flush())
+    yield b"".join(buffer)
+
+
+def export_snapshot(repository, since=None):
+    """导出快照：返回压缩后的字节块迭代器"""
+    check_since(since)
+    return compress_stream(export_records(repository, since))
+
+
+class SnapshotReader:
+    """边读取边解压快照文件，逐条返回记录"""
+
+    def __init__(self, fileobj, chunk_size=CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.decompressor = zlib.decompressobj(31)
+        self.buffer = bytearray()
+
+    def fill(self, size):
+        while len(self.buffer) < size:
+            chunk = self.fileobj.read(self.chunk_size)
+            if not chunk:
+                self.buffer += self.decompressor.flush()
+                return len(self.buffer) >= size
+            try:
+                self.buffer += self.decompressor.decompress(chunk)
+            except zlib.error as e:
+                raise CustomValidationError(f"快照文件解压失败: {e}")
+        return True
+
+    def read(self, size):
+        if not self.fill(size):
+            raise CustomValidationError("快照文件不完整")
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def records(self):
+        if self.read(len(MAGIC) + 1) != MAGIC + bytes([VERSION]):
+            raise CustomValidationError("快照文件格式错误或版本不支持")
+        while self.fill(RECORD.size):
+            kind, length = RECORD.unpack(self.read(RECORD.size))
+            yield kind, self.read(length)
+
+
+class SnapshotImport:
+    """将快照记录写入知识库"""
+
+    def __init__(self, repository, header, master):
+        from dvadmin.system.models import MmRepositorySnapshotMap
+
+        self.repository = repository
+        self.header = header
+        self.master = master
+        self.mappings = {(row.kind, row.source_id): row for row in MmRepositorySnapshotMap.objects.filter(
+            repository_id=repository.id)}
+        self.new_mappings = []
+        self.changed_mappings = []
+        self.pending_categories = []
+        self.categories_written = False
+        self.category_paths = {}
+        self.seen = {KIND_CATEGORY: set(), KIND_DOCUMENT: set()}
+        self.removed = {KIND_CATEGORY: [], KIND_DOCUMENT: []}
+        self.document_ids = []
+        self.deleted_document_ids = []
+        self.counts = {"categories": 0, "documents": 0}
+        self.skipped = 0
+
+    def object_id(self, kind, source_id):
+        row = self.mappings.get((kind, source_id))
+        return row.object_id if row is not None else None
+
+    def mapping(self, kind, source_id, object_id):
+        from dvadmin.system.models import MmRepositorySnapshotMap
+
+        row = self.mappings.get((kind, source_id))
+        if row is None:
+            row = MmRepositorySnapshotMap(repository_id=self.repository.id, kind=kind, source_id=source_id,
+                                          object_id=object_id)
+            self.new_mappings.append(row)
+            self.mappings[(kind, source_id)] = row
+        elif row.object_id != object_id:
+            row.object_id = object_id
+            self.changed_mappings.append(row)
+
+    def add(self, kind, payload):
+        if kind == RECORD_REMOVED:
+            data = json.loads(payload)
+            self.removed[KIND_CATEGORY] += data.get("categories", [])
+            self.removed[KIND_DOCUMENT] += data.get("documents", [])
+            self.delete_documents(self.removed[KIND_DOCUMENT])
+        elif kind == RECORD_CATEGORY:
+            self.pending_categories.append(json.loads(payload))
+        elif kind == RECORD_END:
+            self.write_categories()
+            expected = json.loads(payload)
+            if expected != self.counts:
+                raise CustomValidationError(f"快照记录数不一致：{expected} / {self.counts}")
+
+    def document(self, payload):
+        """解析文档记录（元数据长度 + 元数据 + 正文）；第一条文档记录前先写入全部目录"""
+        self.write_categories()
+        meta_length = struct.unpack(">I", payload[:4])[0]
+        meta = json.loads(payload[4:4 + meta_length])
+        meta["detail_text"] = payload[4 + meta_length:].decode("utf-8")
+        self.counts["documents"] += 1
+        return meta
+
+    def write_categories(self):
+        """目录一次分配ID、批量写入，再修复路径与深度"""
+        from dvadmin.system.models import Category
+        from dvadmin.utils.category_tree import repair_repository_paths
+        from dvadmin.utils.id_allocator import allocate_ids
+
+        if self.categories_written:
+            return
+        self.categories_written = True
+        rows = self.pending_categories
+        self.pending_categories = []
+        existing = Category.objects.filter(repository_id=self.repository.id, id__in=[
+            self.object_id(KIND_CATEGORY, row["id"]) for row in rows]).in_bulk()
+        missing = [row for row in rows if self.object_id(KIND_CATEGORY, row["id"]) not in existing]
+        new_ids = iter(allocate_ids(Category, len(missing)))
+        for row in missing:
+            self.mapping(KIND_CATEGORY, row["id"], next(new_ids))
+
+        created, updated = [], []
+        for row in rows:
+            category_id = self.object_id(KIND_CATEGORY, row["id"])
+            category = existing.get(category_id)
+            if category is None:
+                category = Category(id=category_id, repository_id=self.repository.id, master=self.master, dimension=1,
+                                    tree_path="")
+                created.append(category)
+            else:
+                updated.append(category)
+            parent_id = row["parent_category_id"]
+            category.parent_category_id = self.object_id(KIND_CATEGORY, parent_id) if parent_id else None
+            category.name = row["name"]
+            category.sort = row["sort"]
+            category.rank = row["rank"]
+            category.icon_url = row["icon_url"]
+            category.update_time = parse_datetime(row["update_time"]) if row["update_time"] else timezone.now()
+            self.seen[KIND_CATEGORY].add(row["id"])
+        Category.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        Category.objects.bulk_update(updated, ["parent_category", "name", "sort", "rank", "icon_url", "update_time"],
+                                     batch_size=BATCH_SIZE)
+        self.counts["categories"] += len(rows)
+        if rows:
+            repair_repository_paths(self.repository.id)
+        self.category_paths = {row[0]: row[1:] for row in Category.objects.filter(
+            repository_id=self.repository.id).values_list("id", "tree_path", "dimension")}
+
+    def write_documents(self, rows):
+        """一批文档：已映射的批量更新，目录下同名的未映射文档直接沿用，其余批量新增"""
+        from dvadmin.system.models import MmDocument
+        from dvadmin.utils.content_store import get_content_store, offload_document_content
+        from dvadmin.utils.document_revisions import record_revision
+        from dvadmin.utils.id_allocator import allocate_ids
+
+        # 所属目录不在快照与已导入数据中的文档跳过
+        total = len(rows)
+        rows = [row for row in rows if self.object_id(KIND_CATEGORY, row["category_id"]) in self.category_paths]
+        self.skipped += total - len(rows)
+        if not rows:
+            return
+        category_ids = {self.object_id(KIND_CATEGORY, row["category_id"]) for row in rows}
+        existing = MmDocument.objects.filter(category__repository_id=self.repository.id, id__in=[
+            self.object_id(KIND_DOCUMENT, row["id"]) for row in rows]).defer("detail_text").in_bulk()
+        mapped_ids = {row.object_id for (kind, _), row in self.mappings.items() if kind == KIND_DOCUMENT}
+        taken = {(category_id, name): document_id for document_id, category_id, name in MmDocument.objects.filter(
+            category_id__in=category_ids).values_list("id", "category_id", "name")}
+
+        created, updated = [], []
+        for row in rows:
+            category_id = self.object_id(KIND_CATEGORY, row["category_id"])
+            document = existing.get(self.object_id(KIND_DOCUMENT, row["id"]))
+            owner = taken.get((category_id, row["name"]))
+            if document is None and owner is not None and owner not in mapped_ids:
+                # 目录下已有同名文档（本环境手动创建）：沿用该文档
+                document = MmDocument.objects.defer("detail_text").get(id=owner)
+            if document is None:
+                document = MmDocument(master=self.master)
+                created.append(document)
+            else:
+                taken.pop((document.category_id, document.name), None)
+                updated.append(document)
+            name, suffix = row["name"], 2
+            while (category_id, name) in taken:
+                name = f"{row['name'][:248]} ({suffix})"
+                suffix += 1
+            # 本批已占用的名称不参与沿用
+            taken[(category_id, name)] = None
+            document.name = name
+            document.category_id = category_id
+            document.type_id = row["type_id"]
+            document.sort = row["sort"]
+            document.rank = row["rank"]
+            document.tree_path, document.dimension = self.category_paths[category_id]
+            document.update_time = parse_datetime(row["update_time"]) if row["update_time"] else timezone.now()
+            document.detail_text = row["detail_text"]
+            offload_document_content(document)
+            document._source_id = row["id"]
+
+        for document, document_id in zip(created, allocate_ids(MmDocument, len(created))):
+            document.id = document_id
+        fields = ["name", "category", "type_id", "sort", "rank", "tree_path", "dimension", "update_time",
+                  "content_hash", "content_length"]
+        if get_content_store() is None:
+            fields.append("detail_text")
+        MmDocument.objects.bulk_update(updated, fields, batch_size=BATCH_SIZE)
+        if get_content_store() is not None:
+            # 正文在内容存储中，列值置空（bulk_update 不经过字段的 pre_save）
+            MmDocument.objects.filter(id__in=[document.id for document in updated]).update(detail_text=None)
+        MmDocument.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        for document in created + updated:
+            self.mapping(KIND_DOCUMENT, document._source_id, document.id)
+            self.seen[KIND_DOCUMENT].add(document._source_id)
+            self.document_ids.append(document.id)
+            record_revision(document)
+
+    def delete_documents(self, source_ids):
+        from dvadmin.system.models import MmDocument
+
+        ids = [self.object_id(KIND_DOCUMENT, source_id) for source_id in source_ids]
+        ids = list(MmDocument.objects.filter(category__repository_id=self.repository.id, id__in=[
+            item for item in ids if item is not None]).values_list("id", flat=True))
+        for start in range(0, len(ids), BATCH_SIZE):
+            MmDocument.objects.filter(id__in=ids[start:start + BATCH_SIZE]).delete()
+        self.deleted_document_ids += ids
+
+    def finish(self):
+        """删除快照中已删除（全量快照中不存在）的目录/文档，保存ID映射"""
+        from dvadmin.system.models import Category, MmDocument, MmRepositorySnapshotMap
+
+        if self.header.get("since") is None:
+            # 全量快照：之前导入、但快照中已不存在的目录/文档一并删除
+            for kind in (KIND_CATEGORY, KIND_DOCUMENT):
+                self.removed[kind] = [source_id for (row_kind, source_id) in self.mappings
+                                      if row_kind == kind and source_id not in self.seen[kind]]
+            self.delete_documents(self.removed[KIND_DOCUMENT])
+        category_ids = [self.object_id(KIND_CATEGORY, source_id) for source_id in self.removed[KIND_CATEGORY]]
+        # 从深到浅删除，目录下仍有文档（快照之外的文档）时保留
+        keep = set(MmDocument.objects.filter(category_id__in=category_ids).values_list("category_id", flat=True))
+        categories = Category.objects.filter(repository_id=self.repository.id, id__in=category_ids).exclude(
+            id__in=keep).order_by("-dimension")
+        for category in categories:
+            category.delete()
+        removed = {(KIND_CATEGORY, source_id) for source_id in self.removed[KIND_CATEGORY]} | {
+            (KIND_DOCUMENT, source_id) for source_id in self.removed[KIND_DOCUMENT]}
+        for kind, source_id in removed:
+            row = self.mappings.pop((kind, source_id), None)
+            if row is not None and row.id is not None:
+                MmRepositorySnapshotMap.objects.filter(id=row.id).delete()
+        MmRepositorySnapshotMap.objects.bulk_create([row for row in self.new_mappings if (
+            row.kind, row.source_id) in self.mappings], batch_size=BATCH_SIZE)
+        MmRepositorySnapshotMap.objects.bulk_update([row for row in self.changed_mappings if row.id is not None],
+                                                    ["object_id"], batch_size=BATCH_SIZE)
+
+    def refresh(self):
+        """事务提交后更新检索索引、派生数据、链接关系、统计汇总与缓存"""
+        from dvadmin.system.models import MmDocument
+        from dvadmin.utils import typeahead
+        from dvadmin.utils.category_tree import bump_tree_version
+        from dvadmin.utils.change_feed import reset_changes
+        from dvadmin.utils.document_derivatives import refresh_derivatives
+        from dvadmin.utils.document_links import rebuild_links
+        from dvadmin.utils.document_stats import recompute_rollups
+        from dvadmin.utils.search_engine import get_search_backend
+        from dvadmin.utils.semantic_index import schedule_update
+
+        backend = get_search_backend()
+        for document_id in self.deleted_document_ids:
+            backend.remove_document(document_id)
+        for start in range(0, len(self.document_ids), BATCH_SIZE):
+            for document in MmDocument.objects.filter(id__in=self.document_ids[start:start + BATCH_SIZE]):
+                backend.index_document(document)
+                refresh_derivatives(document)
+        repository_id = self.repository.id
+        rebuild_links(repository_id)
+        recompute_rollups(repository_id)
+        bump_tree_version(repository_id)
+        typeahead.reset_index(repository_id)
+        reset_changes(repository_id)
+        schedule_update(repository_id)
+
+
+def repository_fields(header):
+    """快照头部中的知识库信息：只取可导入的字段并校验类型（状态、回收等字段不从快照导入）"""
+    from dvadmin.system.models import MmRepository
+
+    data = header.get("repository")
+    if not isinstance(data, dict):
+        raise CustomValidationError("快照文件格式错误：缺少知识库信息")
+    fields = {}
+    for field in REPOSITORY_FIELDS:
+        value = data.get(field)
+        if field in ("type_id", "limits"):
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise CustomValidationError(f"快照文件格式错误：知识库 {field} 应为整数")
+        elif field == "name":
+            if not isinstance(value, str) or not value.strip():
+                raise CustomValidationError("快照文件格式错误：知识库名称不能为空")
+        elif value is not None and not isinstance(value, str):
+            raise CustomValidationError(f"快照文件格式错误：知识库 {field} 应为字符串")
+        fields[field] = value
+    if fields["limits"] not in dict(MmRepository.LIMITS_CHOICES):
+        raise CustomValidationError("快照文件格式错误：知识库 limits 取值无效")
+    return fields
+
+
+def import_snapshot(fileobj, repository=None, master=None, name=None):
+    """
+    导入快照
+    :param repository: 导入到已有知识库（增量快照必须指定，调用方负责权限校验）；不指定时按快照信息新建知识库
+    :return: {"repository_id", "categories", "documents", "skipped_documents", "deleted_categories", "deleted_documents"}
+    """
+    from dvadmin.system.models import MmRepository
+
+    records = SnapshotReader(fileobj).records()
+    kind, payload = next(records, (None, None))
+    if kind != RECORD_HEADER:
+        raise CustomValidationError("快照文件格式错误：缺少头部")
+    header = json.loads(payload)
+    if not isinstance(header, dict):
+        raise CustomValidationError("快照文件格式错误：头部无效")
+    with transaction.atomic():
+        if repository is None:
+            if header.get("since"):
+                raise CustomValidationError("增量快照需指定导入的知识库（repository_id）")
+            fields = repository_fields(header)
+            if name:
+                fields["name"] = name
+            repository = MmRepository.objects.create(master=master, **fields)
+        importer = SnapshotImport(repository, header, master)
+        batch, finished = [], False
+        for kind, payload in records:
+            if kind == RECORD_DOCUMENT:
+                batch.append(importer.document(payload))
+                if len(batch) >= BATCH_SIZE:
+                    importer.write_documents(batch)
+                    batch = []
+                continue
+            if batch:
+                importer.write_documents(batch)
+                batch = []
+            importer.add(kind, payload)
+            if kind == RECORD_END:
+                finished = True
+                break
+        if not finished:
+            raise CustomValidationError("快照文件不完整：缺少结束记录")
+        importer.finish()
+    importer.refresh()
+    return {
+        "repository_id": repository.id,
+        "categories": importer.counts["categories"],
+        "documents": importer.counts["documents"],
+        "skipped_documents": importer.skipped,
+        "deleted_categories": len(importer.removed[KIND_CATEGORY]),
+        "deleted_documents": len(importer.deleted_document_ids),
+    }
@@ -0,0 +1,533 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 文档全文检索引擎
+    - 中文按二元分词(bigram)、英文/数字按整词切分
+    - 可插拔后端：SQLite 使用 FTS5，MySQL 使用 FULLTEXT(ngram)，其余数据库使用内置倒排索引
+    - 统一使用 BM25 排序，并返回高亮摘要
+"""
+import html
+import math
+import re
+import unicodedata
+from collections import Counter, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connection, transaction
+from django.db.models import Avg, Case, Count, ExpressionWrapper, F, FloatField, Sum, Value, When
+from django.utils.module_loading import import_string
+
+# CJK 统一表意文字、扩展A、兼容表意文字、日文假名、韩文音节
+CJK_RANGES = r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af"
+TOKEN_PATTERN = re.compile(rf"[{CJK_RANGES}]+|[a-z0-9_]+")
+CJK_PATTERN = re.compile(rf"^[{CJK_RANGES}]")
+# 单个词条最大长度（与索引表字段长度一致）
+MAX_TERM_LENGTH = 64
+# 文档名称中的词条权重（标题命中比正文命中更重要）
+NAME_BOOST = 3
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 摘要长度
+SNIPPET_LENGTH = 160
+# 单次检索最多参与数据权限过滤与分页的命中数（按相关度取前 N 条）
+MAX_SEARCH_RESULTS = 1000
+
+SearchHit = namedtuple("SearchHit", ["document_id", "score"])
+
+
+class SearchBackendError(Exception):
+    """检索后端不可用（如未建立索引）"""
+    pass
+
+
+def normalize(text):
+    """统一全半角、大小写"""
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def tokenize(text):
+    """
+    分词：中文连续片段切成重叠的二元词（单字片段保留单字），英文/数字按整词切分
+    :param text: 原始文本
+    :return: 词条列表（保留重复，用于统计词频）
+    """
+    tokens = []
+    for run in TOKEN_PATTERN.findall(normalize(text)):
+        if CJK_PATTERN.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(a + b for a, b in zip(run, run[1:]))
+        else:
+            tokens.append(run[:MAX_TERM_LENGTH])
+    return tokens
+
+
+def query_terms(keyword):
+    """查询词去重（保持顺序）"""
+    return list(dict.fromkeys(tokenize(keyword)))
+
+
+def document_term_frequency(name, text):
+    """计算文档词频，名称中的词条按 NAME_BOOST 加权"""
+    counter = Counter(tokenize(text))
+    for term in tokenize(name):
+        counter[term] += NAME_BOOST
+    return counter
+
+
+def highlight_pattern(keyword):
+    """命中片段的正则：原始查询片段优先，其次是二元词条"""
+    surfaces = TOKEN_PATTERN.findall(normalize(keyword))
+    surfaces += [term for term in query_terms(keyword) if term not in surfaces]
+    if not surfaces:
+        return None
+    return re.compile("|".join(re.escape(s) for s in sorted(surfaces, key=len, reverse=True)), re.IGNORECASE)
+
+
+def highlight(text, keyword, pattern=None):
+    """用 <em> 标记全部命中片段，返回已做 HTML 转义的文本"""
+    text = text or ""
+    pattern = pattern or highlight_pattern(keyword)
+    if pattern is None:
+        return html.escape(text)
+    parts, last = [], 0
+    for m in pattern.finditer(text):
+        parts.append(html.escape(text[last:m.start()]))
+        parts.append(f"<em>{html.escape(m.group())}</em>")
+        last = m.end()
+    parts.append(html.escape(text[last:]))
+    return "".join(parts)
+
+
+def build_snippet(text, keyword, length=SNIPPET_LENGTH):
+    """
+    生成高亮摘要：定位第一个命中位置，截取前后文并标记所有命中片段
+    :param text: 正文
+    :param keyword: 查询关键词
+    :param length: 摘要长度
+    :return: 已做 HTML 转义的摘要
+    """
+    text = text or ""
+    pattern = highlight_pattern(keyword)
+    match = pattern.search(text) if pattern else None
+    if not match:
+        return html.escape(text[:length]) + ("..." if len(text) > length else "")
+    start = max(0, match.start() - length // 4)
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if start + length < len(text) else ""
+    return prefix + highlight(text[start:start + length], keyword, pattern) + suffix
+
+
+class BaseSearchBackend(object):
+    """
+    检索后端基类
+    子类需实现 index_document / remove_document / search
+    """
+    name = "base"
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def ensure_schema(self):
+        """创建后端所需的索引结构（重建索引命令中调用）"""
+        pass
+
+    def with_schema(self, operation):
+        """
+        执行依赖索引结构的操作
+        进程内的“已建立”标记可能失效（事务回滚撤销建表、切换数据库、手动删除），
+        操作失败时清除标记、重新检查索引结构后重试一次
+        """
+        self.ensure_schema()
+        try:
+            with transaction.atomic():
+                return operation()
+        except OperationalError:
+            type(self)._schema_ready = False
+            self.ensure_schema()
+            return operation()
+
+    def index_document(self, document):
+        raise NotImplementedError
+
+    def remove_document(self, document_id):
+        raise NotImplementedError
+
+    def search(self, keyword, repository_id=None, offset=0, limit=20):
+        """
+        :return: (命中总数, [SearchHit, ...]) 按相关度降序
+        """
+        raise NotImplementedError
+
+    def remove_documents(self, document_ids):
+        """批量删除文档的索引（如回收站清理）"""
+        for document_id in document_ids:
+            self.remove_document(document_id)
+
+    def reassign_repository(self, document_ids, repository_id):
+        """
+        文档随目录跨知识库移动后，同步索引中冗余的知识库ID
+        :param document_ids: 文档ID列表或 values("id") 子查询
+        """
+        pass
+
+    def rebuild(self, queryset, batch_size=500):
+        """按批次重建索引，返回处理的文档数"""
+        self.ensure_schema()
+        total = 0
+        queryset = queryset.select_related("category").order_by("id")
+        last_id = None
+        while True:
+            batch_qs = queryset if last_id is None else queryset.filter(id__gt=last_id)
+            batch = list(batch_qs[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                for document in batch:
+                    self.index_document(document)
+            total += len(batch)
+            last_id = batch[-1].id
+        return total
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    """
+    内置倒排索引：词条表 mm_document_search_term + 文档长度表 mm_document_search_stat
+    BM25 打分在数据库中聚合完成，适用于任意数据库
+    """
+    name = "inverted"
+    stats_cache_key = "document_search_stats"
+
+    def index_document(self, document):
+        from dvadmin.system.models import MmDocumentSearchTerm, MmDocumentSearchStat
+
+        repository_id = document.category.repository_id
+        frequencies = document_term_frequency(document.name, document.detail_text)
+        doc_length = sum(frequencies.values())
+        existing = {
+            posting.term: posting for posting in MmDocumentSearchTerm.objects.filter(
+                document_id=document.id).only("id", "term", "tf")
+        }
+        stat, created = MmDocumentSearchStat.objects.get_or_create(
+            document_id=document.id, defaults={"repository_id": repository_id, "length": doc_length}
+        )
+        # 只做增量：删除消失的词条、更新词频变化的词条、插入新增词条
+        removed = [term for term in existing if term not in frequencies]
+        if removed:
+            MmDocumentSearchTerm.objects.filter(document_id=document.id, term__in=removed).delete()
+        if not created and (stat.repository_id != repository_id or stat.length != doc_length):
+            MmDocumentSearchStat.objects.filter(document_id=document.id).update(
+                repository_id=repository_id, length=doc_length
+            )
+            MmDocumentSearchTerm.objects.filter(document_id=document.id).update(
+                repository_id=repository_id, doc_length=doc_length
+            )
+        changed = []
+        for term, tf in frequencies.items():
+            posting = existing.get(term)
+            if posting is not None and posting.tf != tf:
+                posting.tf = tf
+                changed.append(posting)
+        MmDocumentSearchTerm.objects.bulk_update(changed, ["tf"], batch_size=1000)
+        MmDocumentSearchTerm.objects.bulk_create([
+            MmDocumentSearchTerm(term=term, document_id=document.id, repository_id=repository_id,
+                                 tf=tf, doc_length=doc_length)
+            for term, tf in frequencies.items() if term not in existing
+        ], batch_size=1000)
+        cache.delete(self.stats_cache_key)
+
+    def remove_document(self, document_id):
+        from dvadmin.system.models import MmDocumentSearchTerm, MmDocumentSearchStat
+
+        MmDocumentSearchTerm.objects.filter(document_id=document_id).delete()
+        MmDocumentSearchStat.objects.filter(document_id=document_id).delete()
+        cache.delete(self.stats_cache_key)
+
+    def remove_documents(self, document_ids):
+        from dvadmin.system.models import MmDocumentSearchTerm, MmDocumentSearchStat
+
+        MmDocumentSearchTerm.objects.filter(document_id__in=document_ids).delete()
+        MmDocumentSearchStat.objects.filter(document_id__in=document_ids).delete()
+        cache.delete(self.stats_cache_key)
+
+    def reassign_repository(self, document_ids, repository_id):
+        from dvadmin.system.models import MmDocumentSearchTerm, MmDocumentSearchStat
+
+        MmDocumentSearchTerm.objects.filter(document_id__in=document_ids).update(repository_id=repository_id)
+        MmDocumentSearchStat.objects.filter(document_id__in=document_ids).update(repository_id=repository_id)
+
+    def corpus_stats(self):
+        """文档总数与平均长度（短时缓存，避免每次检索全表聚合）"""
+        from dvadmin.system.models import MmDocumentSearchStat
+
+        stats = cache.get(self.stats_cache_key)
+        if stats is None:
+            stats = MmDocumentSearchStat.objects.aggregate(total=Count("document_id"), avg_length=Avg("length"))
+            cache.set(self.stats_cache_key, stats, 60)
+        return stats["total"] or 0, stats["avg_length"] or 1.0
+
+    def search(self, keyword, repository_id=None, offset=0, limit=20):
+        from dvadmin.system.models import MmDocumentSearchTerm
+
+        terms = query_terms(keyword)
+        if not terms:
+            return 0, []
+        total_docs, avg_length = self.corpus_stats()
+        postings = MmDocumentSearchTerm.objects.filter(term__in=terms)
+        if repository_id:
+            postings = postings.filter(repository_id=repository_id)
+        document_frequency = dict(
+            MmDocumentSearchTerm.objects.filter(term__in=terms).values("term")
+            .annotate(df=Count("document_id")).values_list("term", "df")
+        )
+        idf = {
+            term: math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+        if not idf:
+            return 0, []
+        idf_case = Case(*[When(term=term, then=Value(value)) for term, value in idf.items()],
+                        default=Value(0.0), output_field=FloatField())
+        tf_norm = ExpressionWrapper(
+            F("tf") * (BM25_K1 + 1) /
+            (F("tf") + BM25_K1 * (1 - BM25_B + BM25_B * F("doc_length") / float(avg_length))),
+            output_field=FloatField()
+        )
+        ranked = postings.values("document_id").annotate(
+            matched=Count("term"), score=Sum(ExpressionWrapper(idf_case * tf_norm, output_field=FloatField()))
+        ).order_by("-matched", "-score", "document_id")
+        total = postings.values("document_id").distinct().count()
+        hits = [SearchHit(row["document_id"], row["score"]) for row in ranked[offset:offset + limit]]
+        return total, hits
+
+
+def mark_schema_ready(backend_class):
+    """
+    记录索引结构已建立：在事务提交后才置位，事务回滚（建表随之撤销）时不会留下已建立的标记
+    不在事务中时立即置位
+    """
+    transaction.on_commit(lambda: setattr(backend_class, "_schema_ready", True))
+
+
+class SqliteFts5Backend(BaseSearchBackend):
+    """
+    SQLite FTS5 虚拟表：写入预分词后的文本（空格分隔），由 FTS5 内置 bm25() 排序
+    """
+    name = "fts5"
+    table = "mm_document_fts"
+    _schema_ready = False
+
+    @classmethod
+    def is_available(cls):
+        if connection.vendor != "sqlite":
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA compile_options")
+            return any("FTS5" in row[0] for row in cursor.fetchall())
+
+    def schema_exists(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+            return cursor.fetchone() is not None
+
+    def ensure_schema(self):
+        if SqliteFts5Backend._schema_ready:
+            return
+        if not self.schema_exists():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+                    f"USING fts5(name, body, repository_id UNINDEXED, tokenize='unicode61')"
+                )
+        mark_schema_ready(SqliteFts5Backend)
+
+    def index_document(self, document):
+        def write():
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [document.id])
+                cursor.execute(
+                    f"INSERT INTO {self.table} (rowid, name, body, repository_id) VALUES (%s, %s, %s, %s)",
+                    [document.id, " ".join(tokenize(document.name)), " ".join(tokenize(document.detail_text)),
+                     document.category.repository_id]
+                )
+
+        self.with_schema(write)
+
+    def remove_document(self, document_id):
+        def delete():
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [document_id])
+
+        self.with_schema(delete)
+
+    def remove_documents(self, document_ids):
+        ids = list(document_ids)
+
+        def delete():
+            with connection.cursor() as cursor:
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({', '.join(['%s'] * len(batch))})",
+                                   batch)
+
+        self.with_schema(delete)
+
+    def reassign_repository(self, document_ids, repository_id):
+        from dvadmin.system.models import MmDocument
+
+        ids = list(MmDocument.objects.filter(id__in=document_ids).values_list("id", flat=True))
+
+        def update():
+            with connection.cursor() as cursor:
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    cursor.execute(
+                        f"UPDATE {self.table} SET repository_id = %s "
+                        f"WHERE rowid IN ({', '.join(['%s'] * len(batch))})",
+                        [repository_id] + batch
+                    )
+
+        self.with_schema(update)
+
+    def search(self, keyword, repository_id=None, offset=0, limit=20):
+        terms = query_terms(keyword)
+        if not terms:
+            return 0, []
+        match = " OR ".join('"%s"' % term.replace('"', '""') for term in terms)
+        where, params = f"{self.table} MATCH %s", [match]
+        if repository_id:
+            where += " AND repository_id = %s"
+            params.append(int(repository_id))
+
+        def query():
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM {self.table} WHERE {where}", params)
+                total = cursor.fetchone()[0]
+                # bm25() 越小越相关，取负数作为得分
+                cursor.execute(
+                    f"SELECT rowid, -bm25({self.table}, {float(NAME_BOOST)}, 1.0) AS score FROM {self.table} "
+                    f"WHERE {where} ORDER BY score DESC, rowid LIMIT %s OFFSET %s",
+                    params + [limit, offset]
+                )
+                return total, [SearchHit(row[0], row[1]) for row in cursor.fetchall()]
+
+        return self.with_schema(query)
+
+
+class MysqlFulltextBackend(BaseSearchBackend):
+    """
+    MySQL FULLTEXT 索引（ngram 解析器，ngram_token_size 默认为2，即二元分词）
+    索引由数据库自动维护，保存/删除文档时无需额外操作
+    """
+    name = "mysql_fulltext"
+    index_name = "mm_document_fulltext"
+    _schema_ready = False
+
+    @classmethod
+    def is_available(cls):
+        # 开启内容存储后正文不在 mm_document 表中，FULLTEXT 索引无法覆盖正文
+        from dvadmin.utils.content_store import get_content_store
+        return connection.vendor == "mysql" and get_content_store() is None
+
+    def schema_exists(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'mm_document' AND INDEX_NAME = %s",
+                [self.index_name]
+            )
+            return cursor.fetchone()[0] > 0
+
+    def ensure_schema(self):
+        if not self.schema_exists():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"ALTER TABLE mm_document ADD FULLTEXT INDEX {self.index_name} (name, detail_text) WITH PARSER ngram"
+                )
+        mark_schema_ready(MysqlFulltextBackend)
+
+    def check_schema(self):
+        """检索前确认索引存在（检索不自动建索引，大表加索引耗时较长，需通过命令执行）"""
+        if MysqlFulltextBackend._schema_ready:
+            return
+        if not self.schema_exists():
+            raise SearchBackendError("全文索引尚未建立，请先执行 python manage.py rebuild_search_index")
+        mark_schema_ready(MysqlFulltextBackend)
+
+    def rebuild(self, queryset, batch_size=500):
+        self.ensure_schema()
+        return queryset.count()
+
+    def index_document(self, document):
+        pass
+
+    def remove_document(self, document_id):
+        pass
+
+    def search(self, keyword, repository_id=None, offset=0, limit=20):
+        terms = query_terms(keyword)
+        if not terms:
+            return 0, []
+        match = "MATCH(d.name, d.detail_text) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+        where, params = match, [" ".join(terms)]
+        if repository_id:
+            where += " AND c.repository_id = %s"
+            params.append(int(repository_id))
+        join = "FROM mm_document d INNER JOIN category c ON c.id = d.category_id"
+        self.check_schema()
+        try:
+            return self.run_search(join, match, where, params, offset, limit)
+        except OperationalError:
+            # 索引已被删除（如切换数据库、手动删除）：清除标记后重新确认
+            MysqlFulltextBackend._schema_ready = False
+            self.check_schema()
+            return self.run_search(join, match, where, params, offset, limit)
+
+    @staticmethod
+    def run_search(join, match, where, params, offset, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) {join} WHERE {where}", params)
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                f"SELECT d.id, {match} AS score {join} WHERE {where} ORDER BY score DESC, d.id LIMIT %s OFFSET %s",
+                [params[0]] + params + [limit, offset]
+            )
+            return total, [SearchHit(row[0], row[1]) for row in cursor.fetchall()]
+
+
+SEARCH_BACKENDS = {
+    SqliteFts5Backend.name: SqliteFts5Backend,
+    MysqlFulltextBackend.name: MysqlFulltextBackend,
+    InvertedIndexBackend.name: InvertedIndexBackend,
+}
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    获取检索后端
+    settings.DOCUMENT_SEARCH_BACKEND:
+        auto（默认）: 按数据库自动选择原生全文索引，不支持时使用内置倒排索引
+        fts5 / mysql_fulltext / inverted: 指定内置后端
+        其他: 自定义后端类的导入路径
+    """
+    global _backend
+    if _backend is None:
+        backend_name = getattr(settings, "DOCUMENT_SEARCH_BACKEND", "auto")
+        if backend_name == "auto":
+            backend_class = InvertedIndexBackend
+            for candidate in (SqliteFts5Backend, MysqlFulltextBackend):
+                if candidate.is_available():
+                    backend_class = candidate
+                    break
+        elif backend_name in SEARCH_BACKENDS:
+            backend_class = SEARCH_BACKENDS[backend_name]
+        else:
+            backend_class = import_string(backend_name)
+        _backend = backend_class()
+    return _backend
@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 文档语义检索（TF-IDF + 截断 SVD / LSA，纯 NumPy 计算，不依赖外部模型与网络）
+    - 每个知识库一个索引目录：词表、IDF、SVD 投影矩阵（模型），以及若干文档向量分段（.npy，查询时 mmap 映射）
+    - 全量构建：纯文本切词（英文单词 + 中日韩字符二元组）→ TF-IDF 稀疏矩阵 → 随机化截断 SVD → 文档向量归一化后写入分段
+    - 增量更新：按派生数据更新时间找出变更文档，旧向量记入删除列表，新向量用已有模型折叠（fold-in）后追加为新分段；
+      分段过多或变更文档超过拟合文档数的一定比例时整体重建（重新拟合词表与 SVD）
+    - 查询：分段按块计算余弦相似度（向量已归一化，即点积），多个查询一次矩阵乘法，argpartition 取 top-k
+"""
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from dvadmin.utils.cache_registry import acquire_lock, release_lock
+
+logger = logging.getLogger(__name__)
+
+# 向量维度
+DIMENSIONS = getattr(settings, "DOCUMENT_SEMANTIC_DIMENSIONS", 100)
+# 词表上限（按文档频率保留）
+MAX_FEATURES = 50000
+# 文档频率低于该值的词不进入词表
+MIN_DF = 2
+# 随机化 SVD 的过采样数与幂迭代次数
+OVERSAMPLES = 10
+POWER_ITERATIONS = 2
+# 分段数超过该值、或增量文档数超过拟合文档数的该比例时整体重建
+MAX_SEGMENTS = 8
+REFIT_RATIO = 0.3
+# 查询时每次计算的向量行数
+QUERY_BLOCK = 65536
+# 文档变更后延迟更新索引的秒数（期间的多次变更合并为一次更新）
+UPDATE_DELAY = 60
+# 构建/更新锁的超时时间
+LOCK_TIMEOUT = 60 * 30
+LOCK_KEY = "semantic_index_lock:{repository_id}"
+PENDING_KEY = "semantic_index_pending:{repository_id}"
+MANIFEST = "manifest.json"
+
+re_latin_token = re.compile(r"[a-z0-9][a-z0-9_\-']*[a-z0-9]|[a-z]")
+re_cjk_run = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]+")
+
+_states = {}
+_lock = threading.Lock()
+
+
+class SemanticIndexError(Exception):
+    """语义索引异常"""
+
+
+def get_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise SemanticIndexError("语义检索需要安装 numpy")
+    return numpy
+
+
+def index_root():
+    return str(getattr(settings, "DOCUMENT_SEMANTIC_INDEX_ROOT", None)
+               or os.path.join(settings.BASE_DIR, "semantic_index"))
+
+
+def index_dir(repository_id):
+    return os.path.join(index_root(), str(int(repository_id)))
+
+
+def tokenize(text):
+    """切词：英文/数字单词（小写），中日韩连续字符切为二元组（单字成词时保留单字）"""
+    text = (text or "").lower()
+    tokens = re_latin_token.findall(text)
+    for run in re_cjk_run.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def document_text(name, plain_text):
+    """参与向量化的文本：名称重复两次以提高权重"""
+    return f"{name} {name} {plain_text}"
+
+
+def write_json(path, data):
+    """先写临时文件再原子替换，读取方不会看到写了一半的文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def save_array(directory, name, array):
+    numpy = get_numpy()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".npy")
+    with os.fdopen(fd, "wb") as f:
+        numpy.save(f, array)
+    os.replace(tmp_path, os.path.join(directory, name))
+
+
+class SparseMatrix:
+    """
+    坐标格式稀疏矩阵（只实现 SVD 所需的 X @ M 与 X.T @ M）
+    非零元素按行、按列各排序一次，乘法时分块取出对应行向量加权后 reduceat 分段求和，内存只与块大小有关
+    """
+    CHUNK = 1 << 16
+
+    def __init__(self, rows, cols, data, shape):
+        numpy = get_numpy()
+        self.shape = shape
+        self.by_row = (rows, cols, data)
+        order = numpy.argsort(cols, kind="stable")
+        self.by_col = (cols[order], rows[order], data[order])
+
+    def accumulate(self, entries, matrix, size):
+        numpy = get_numpy()
+        index, other, data = entries
+        result = numpy.zeros((size, matrix.shape[1]), dtype=numpy.float64)
+        for start in range(0, len(index), self.CHUNK):
+            chunk_index = index[start:start + self.CHUNK]
+            weighted = matrix[other[start:start + self.CHUNK]] * data[start:start + self.CHUNK, None]
+            starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(chunk_index)) + 1))
+            result[chunk_index[starts]] += numpy.add.reduceat(weighted, starts, axis=0)
+        return result
+
+    def dot(self, matrix):
+        return self.accumulate(self.by_row, matrix, self.shape[0])
+
+    def tdot(self, matrix):
+        return self.accumulate(self.by_col, matrix, self.shape[1])
+
+
+def tfidf_rows(token_lists, vocabulary, idf):
+    """
+    文档词列表 -> TF-IDF 稀疏矩阵（次线性词频 1+log(tf)，行 L2 归一化）
+    :return: SparseMatrix
+    """
+    numpy = get_numpy()
+    rows, cols, data = [], [], []
+    for row, tokens in enumerate(token_lists):
+        counts = Counter(vocabulary[token] for token in tokens if token in vocabulary)
+        if not counts:
+            continue
+        weights = {col: (1 + math.log(count)) * idf[col] for col, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        for col, weight in weights.items():
+            rows.append(row)
+            cols.append(col)
+            data.append(weight / norm)
+    return SparseMatrix(numpy.array(rows, dtype=numpy.int64), numpy.array(cols, dtype=numpy.int64),
+                        numpy.array(data, dtype=numpy.float64), (len(token_lists), len(vocabulary)))
+
+
+def randomized_svd(matrix, rank, seed=0):
+    """
+    随机化截断 SVD（Halko 等）：只需矩阵乘法，适用于稀疏矩阵
+    :return: 右奇异向量组成的投影矩阵（词数 × rank）
+    """
+    numpy = get_numpy()
+    size = min(rank + OVERSAMPLES, min(matrix.shape))
+    omega = numpy.random.default_rng(seed).standard_normal((matrix.shape[1], size))
+    q, _ = numpy.linalg.qr(matrix.dot(omega))
+    for _ in range(POWER_ITERATIONS):
+        z, _ = numpy.linalg.qr(matrix.tdot(q))
+        q, _ = numpy.linalg.qr(matrix.dot(z))
+    # B = Q^T X（size × 词数，稠密但很小）
+    b = matrix.tdot(q).T
+    _, _, vt = numpy.linalg.svd(b, full_matrices=False)
+    return vt[:rank].T
+
+
+def normalize_rows(vectors):
+    numpy = get_numpy()
+    norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def load_documents(repository_id, document_ids=None, changed_after=None):
+    """
+    读取知识库文档的名称与纯文本（由正文计算），返回 [(文档ID, 文本)]
+    :param changed_after: 只读取派生数据（正文）或文档（名称等）在该时间之后更新的文档
+    """
+    from django.db.models import Q
+
+    from dvadmin.system.models import MmDocumentDerivative
+    from dvadmin.utils.document_derivatives import plain_texts
+
+    queryset = MmDocumentDerivative.objects.filter(document__category__repository_id=repository_id)
+    if document_ids is not None:
+        queryset = queryset.filter(document_id__in=list(document_ids))
+    if changed_after is not None:
+        queryset = queryset.filter(Q(update_time__gt=changed_after) | Q(document__update_time__gt=changed_after))
+    names = dict(queryset.values_list("document_id", "document__name"))
+    return [(document_id, document_text(names[document_id], plain_text))
+            for document_id, plain_text in plain_texts(names)]
+
+
+def read_manifest(repository_id):
+    try:
+        with open(os.path.join(index_dir(repository_id), MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def build_index(repository_id):
+    """
+    全量构建知识库语义索引（重新拟合词表、IDF 与 SVD 投影）
+    新一代文件写完后替换 manifest，再删除上一代文件（已映射旧文件的进程不受影响）
+    :return: 索引的文档数
+    """
+    numpy = get_numpy()
+    from django.utils import timezone
+
+    started = timezone.now()
+    documents = load_documents(repository_id)
+    token_lists = [tokenize(text) for _, text in documents]
+    df = Counter(token for tokens in token_lists for token in set(tokens))
+    min_df = MIN_DF if len(documents) >= 10 else 1
+    terms = [term for term, count in df.most_common(MAX_FEATURES) if count >= min_df]
+    vocabulary = {term: col for col, term in enumerate(terms)}
+    idf = numpy.array([math.log((1 + len(documents)) / (1 + df[term])) + 1 for term in terms], dtype=numpy.float64)
+
+    directory = index_dir(repository_id)
+    os.makedirs(directory, exist_ok=True)
+    previous = read_manifest(repository_id)
+    generation = (previous or {}).get("generation", 0) + 1
+    prefix = f"g{generation}"
+    ids = numpy.array([document_id for document_id, _ in documents], dtype=numpy.int64)
+    if terms and len(documents) > 1:
+        matrix = tfidf_rows(token_lists, vocabulary, idf)
+        rank = max(1, min(DIMENSIONS, len(documents) - 1, len(terms)))
+        components = randomized_svd(matrix, rank)
+        vectors = normalize_rows(matrix.dot(components)).astype(numpy.float32)
+    else:
+        components = numpy.zeros((len(terms), 1))
+        vectors = numpy.zeros((len(documents), 1), dtype=numpy.float32)
+    save_array(directory, f"{prefix}-components.npy", components.astype(numpy.float32))
+    save_array(directory, f"{prefix}-idf.npy", idf.astype(numpy.float32))
+    write_json(os.path.join(directory, f"{prefix}-vocabulary.json"), terms)
+    save_array(directory, f"{prefix}-s0-vectors.npy", vectors)
+    save_array(directory, f"{prefix}-s0-ids.npy", ids)
+    write_json(os.path.join(directory, MANIFEST), {
+        "generation": generation,
+        "built_at": started.isoformat(),
+        "fitted_count": len(documents),
+        "added_count": 0,
+        "segments": [{"name": f"{prefix}-s0", "count": len(documents)}],
+        # 分段名 -> 已作废的文档ID（文档修改后新向量追加到新分段，旧分段中的向量作废）
+        "deleted": {},
+    })
+    for name in os.listdir(directory):
+        if name.startswith("g") and not name.startswith(prefix + "-"):
+            os.remove(os.path.join(directory, name))
+    return len(documents)
+
+
+def update_index(repository_id):
+    """
+    增量更新：派生数据在上次构建/更新后变化的文档、新移入的文档重新计算向量追加为新分段，
+    其旧向量及已删除/移出文档的向量记入所在分段的删除列表；需要时整体重建
+    :return: (是否整体重建, 更新的文档数)
+    """
+    numpy = get_numpy()
+    from django.utils import timezone
+    from django.utils.dateparse import parse_datetime
+
+    from dvadmin.system.models import MmDocument
+
+    manifest = read_manifest(repository_id)
+    if manifest is None:
+        return True, build_index(repository_id)
+    directory = index_dir(repository_id)
+    started = timezone.now()
+    # 文档ID -> 有效向量所在分段
+    locations = {}
+    for segment in manifest["segments"]:
+        deleted = set(manifest["deleted"].get(segment["name"], []))
+        ids = numpy.load(os.path.join(directory, f"{segment['name']}-ids.npy"), mmap_mode="r")
+        locations.update((document_id, segment["name"]) for document_id in ids.tolist() if document_id not in deleted)
+    current = set(MmDocument.objects.filter(category__repository_id=repository_id).values_list("id", flat=True))
+    documents = dict(load_documents(repository_id, changed_after=parse_datetime(manifest["built_at"])))
+    documents.update(load_documents(repository_id, document_ids=current - set(locations) - set(documents)))
+    removed = {document_id for document_id in locations if document_id not in current or document_id in documents}
+    if not documents and not removed:
+        return False, 0
+    added_count = manifest["added_count"] + len(documents)
+    if len(manifest["segments"]) >= MAX_SEGMENTS or added_count > max(manifest["fitted_count"], 10) * REFIT_RATIO:
+        return True, build_index(repository_id)
+
+    for document_id in removed:
+        manifest["deleted"].setdefault(locations[document_id], []).append(document_id)
+    if documents:
+        prefix = f"g{manifest['generation']}"
+        segment_name = f"{prefix}-s{len(manifest['segments'])}"
+        with open(os.path.join(directory, f"{prefix}-vocabulary.json"), encoding="utf-8") as f:
+            vocabulary = {term: col for col, term in enumerate(json.load(f))}
+        idf = numpy.load(os.path.join(directory, f"{prefix}-idf.npy"))
+        components = numpy.load(os.path.join(directory, f"{prefix}-components.npy")).astype(numpy.float64)
+        ids = numpy.array(list(documents), dtype=numpy.int64)
+        matrix = tfidf_rows([tokenize(documents[document_id]) for document_id in ids.tolist()], vocabulary, idf)
+        # 折叠：新文档按已有模型投影（与全量构建时的文档向量同一空间）
+        vectors = normalize_rows(matrix.dot(components)).astype(numpy.float32)
+        save_array(directory, f"{segment_name}-vectors.npy", vectors)
+        save_array(directory, f"{segment_name}-ids.npy", ids)
+        manifest["segments"].append({"name": segment_name, "count": len(ids)})
+    manifest["added_count"] = added_count
+    manifest["built_at"] = started.isoformat()
+    write_json(os.path.join(directory, MANIFEST), manifest)
+    return False, len(documents)
+
+
+class IndexState:
+    """进程内已加载的索引（分段向量 mmap 映射），manifest 变化时重新加载"""
+
+    def __init__(self, repository_id, mtime, manifest):
+        numpy = get_numpy()
+        directory = index_dir(repository_id)
+        prefix = f"g{manifest['generation']}"
+        self.mtime = mtime
+        with open(os.path.join(directory, f"{prefix}-vocabulary.json"), encoding="utf-8") as f:
+            self.vocabulary = {term: col for col, term in enumerate(json.load(f))}
+        self.idf = numpy.load(os.path.join(directory, f"{prefix}-idf.npy"))
+        self.components = numpy.load(os.path.join(directory, f"{prefix}-components.npy"), mmap_mode="r")
+        self.segments = []
+        for segment in manifest["segments"]:
+            vectors = numpy.load(os.path.join(directory, f"{segment['name']}-vectors.npy"), mmap_mode="r")
+            ids = numpy.load(os.path.join(directory, f"{segment['name']}-ids.npy"))
+            deleted = manifest["deleted"].get(segment["name"])
+            live = ~numpy.isin(ids, deleted) if deleted else None
+            self.segments.append((vectors, ids, live))
+
+    def embed(self, queries):
+        """查询文本 -> 归一化的查询向量矩阵（查询数 × 维度）"""
+        numpy = get_numpy()
+        matrix = tfidf_rows([tokenize(query) for query in queries], self.vocabulary, self.idf)
+        return normalize_rows(matrix.dot(numpy.asarray(self.components, dtype=numpy.float64))).astype(numpy.float32)
+
+    def search(self, queries, top_k=10, allowed_ids=None):
+        """
+        批量余弦 top-k：各分段按块做一次矩阵乘法，块内 argpartition 取前 k，最后合并
+        :param allowed_ids: 只在这些文档中检索（如数据权限范围内的文档ID），不传则不限
+        :return: 每个查询一个 [(文档ID, 分数)] 列表
+        """
+        numpy = get_numpy()
+        query_vectors = self.embed(queries)
+        if allowed_ids is not None:
+            allowed_ids = numpy.fromiter(allowed_ids, dtype=numpy.int64)
+        best_scores = numpy.full((len(queries), 0), -numpy.inf, dtype=numpy.float32)
+        best_ids = numpy.empty((len(queries), 0), dtype=numpy.int64)
+        for vectors, ids, live in self.segments:
+            for start in range(0, len(ids), QUERY_BLOCK):
+                scores = query_vectors @ numpy.asarray(vectors[start:start + QUERY_BLOCK]).T
+                if live is not None:
+                    scores[:, ~live[start:start + QUERY_BLOCK]] = -numpy.inf
+                block_ids = ids[start:start + QUERY_BLOCK]
+                if allowed_ids is not None:
+                    scores[:, ~numpy.isin(block_ids, allowed_ids)] = -numpy.inf
+                if scores.shape[1] > top_k:
+                    top = numpy.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+                    scores = numpy.take_along_axis(scores, top, axis=1)
+                    block_ids = block_ids[top]
+                else:
+                    block_ids = numpy.broadcast_to(block_ids, scores.shape)
+                best_scores = numpy.concatenate([best_scores, scores], axis=1)
+                best_ids = numpy.concatenate([best_ids, block_ids], axis=1)
+        results = []
+        for row in range(len(queries)):
+            order = numpy.argsort(-best_scores[row])[:top_k]
+            # 查询词都不在词表中时查询向量为零向量，分数全为 0，不返回结果
+            results.append([(int(best_ids[row, index]), float(best_scores[row, index])) for index in order
+                            if numpy.isfinite(best_scores[row, index]) and best_scores[row, index] > 0])
+        return results
+
+
+def get_state(repository_id):
+    """获取进程内索引（manifest 修改时间变化时重新加载；索引不存在时提交后台构建任务）"""
+    repository_id = int(repository_id)
+    path = os.path.join(index_dir(repository_id), MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        # 全量构建需对整个知识库做 SVD，不在请求中执行
+        submit_update(repository_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            raise SemanticIndexError("语义索引构建中，请稍后重试")
+    state = _states.get(repository_id)
+    if state is None or state.mtime != mtime:
+        with _lock:
+            state = _states.get(repository_id)
+            if state is None or state.mtime != mtime:
+                state = IndexState(repository_id, mtime, read_manifest(repository_id))
+                _states[repository_id] = state
+    return state
+
+
+def semantic_search(repository_id, queries, top_k=10, allowed_ids=None):
+    return get_state(repository_id).search(queries, top_k, allowed_ids)
+
+
+def refresh_index(repository_id, full=False):
+    """更新/重建知识库语义索引（加锁，同一知识库同时只有一个更新）"""
+    lock_key = LOCK_KEY.format(repository_id=repository_id)
+    token = acquire_lock(lock_key, timeout=LOCK_TIMEOUT)
+    if token is None:
+        return None
+    try:
+        if full:
+            return True, build_index(repository_id)
+        return update_index(repository_id)
+    finally:
+        release_lock(lock_key, token)
+
+
+def submit_update(repository_id, countdown=None):
+    """提交索引更新任务（索引不存在时任务中全量构建），合并标记有效期内不重复提交"""
+    pending_key = PENDING_KEY.format(repository_id=repository_id)
+    if not cache.add(pending_key, 1, timeout=UPDATE_DELAY):
+        return
+    from dvadmin.system.tasks import update_semantic_index
+    try:
+        update_semantic_index.apply_async((repository_id,), countdown=countdown)
+    except Exception as e:
+        logger.warning(f"知识库[{repository_id}]语义索引更新任务提交失败: {e}")
+        cache.delete(pending_key)
+
+
+def schedule_update(repository_id):
+    """
+    文档变更后调度索引更新：仅对已建立索引的知识库，UPDATE_DELAY 秒内的多次变更合并为一次 Celery 任务
+    """
+    if repository_id is None or not os.path.exists(os.path.join(index_dir(repository_id), MANIFEST)):
+        return
+    submit_update(repository_id, countdown=UPDATE_DELAY)
+
+
+def remove_index(repository_id):
+    shutil.rmtree(index_dir(repository_id), ignore_errors=True)
+    _states.pop(int(repository_id), None)
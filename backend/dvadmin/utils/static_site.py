@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 归档知识库静态化（归档后内容不再变化，预先生成静态文件，访问时不查询数据库）
+    - 归档时后台生成：目录树 JSON、文档列表 JSON、每篇文档的 JSON/HTML、前端检索用的倒排索引 JSON、首页 HTML
+    - 每次生成写入随机命名的版本目录（生成完成后整体改名），manifest.json 指向当前版本；旧版本目录在新版本生效后删除
+    - 文件通过带签名、有效期的地址访问（/{知识库ID}/{版本}/{签名}/文件路径），签名由 manifest 接口在校验知识库访问权限后下发；
+      签名放在路径中，页面之间的相对链接无需额外处理
+    - 恢复归档时删除该知识库的全部静态文件
+    - 文本文件同时生成 .gz 预压缩文件，由 nginx（X-Accel-Redirect + gzip_static）或应用直接返回
+"""
+import gzip
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+# 静态文件根目录（每个知识库一个子目录）
+SITE_ROOT = getattr(settings, "STATIC_SITE_ROOT", os.path.join(settings.BASE_DIR, "static_site"))
+# nginx 内部 location 前缀（如 "/static_site_internal/"），配置后由 nginx 直接返回文件
+ACCEL_REDIRECT = getattr(settings, "STATIC_SITE_ACCEL_REDIRECT", None)
+# 文件访问地址的有效期（秒），有效期内签名不变，浏览器缓存可复用
+URL_MAX_AGE = getattr(settings, "STATIC_SITE_URL_MAX_AGE", 60 * 60)
+MANIFEST = "manifest.json"
+BATCH_SIZE = 500
+# 小于该大小的文件不生成预压缩文件
+GZIP_MIN_SIZE = 1024
+# 检索索引中每个词条最多保留的文档数（按词频）
+MAX_POSTINGS = 200
+
+
+def site_dir(repository_id):
+    return os.path.join(SITE_ROOT, str(int(repository_id)))
+
+
+def write_file(path, data):
+    """写入文件（文本较大时同时写入 .gz 预压缩文件）"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    if len(data) >= GZIP_MIN_SIZE:
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(data, 6, mtime=0))
+
+
+def write_json(path, data):
+    write_file(path, json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(",", ":")))
+
+
+def flatten_tree(tree, documents_by_category, depth=0):
+    """目录树展开为带缩进层级的列表（首页 HTML 使用）"""
+    items = []
+    for node in tree:
+        items.append({"depth": depth, "name": node["name"], "href": None})
+        for document in documents_by_category.get(node["id"], []):
+            items.append({"depth": depth + 1, "name": document["name"], "href": f"documents/{document['id']}.html"})
+        items += flatten_tree(node["children"], documents_by_category, depth + 1)
+    return items
+
+
+def build_site(repository_id):
+    """
+    生成归档知识库的静态文件
+    :return: manifest；知识库不存在或未归档时返回 None
+    """
+    from dvadmin.system.models import Category, MmDocument, MmDocumentDerivative, MmRepository
+    from dvadmin.utils.category_tree import build_repository_tree, parse_tree_path
+    from dvadmin.utils.search_engine import document_term_frequency
+
+    repository = MmRepository.objects.filter(id=repository_id).first()
+    if repository is None or repository.status != "archived":
+        return None
+    build = uuid.uuid4().hex
+    root = site_dir(repository_id)
+    temp_dir = os.path.join(root, f"{build}.tmp")
+    repository_data = {"id": repository.id, "name": repository.name, "description": repository.description,
+                       "archived_time": repository.archived_time, "archived_desc": repository.archived_desc}
+    try:
+        tree = build_repository_tree(repository_id)
+        write_json(os.path.join(temp_dir, "tree.json"), {"repository": repository_data, "tree": tree})
+
+        category_names = dict(Category.objects.filter(repository_id=repository_id).values_list("id", "name"))
+        document_ids = list(MmDocument.objects.filter(category__repository_id=repository_id).order_by(
+            "category_id", "rank", "sort", "-update_time", "id").values_list("id", flat=True))
+        documents, documents_by_category = [], {}
+        postings = {}
+        for start in range(0, len(document_ids), BATCH_SIZE):
+            batch = document_ids[start:start + BATCH_SIZE]
+            derivatives = {row["document_id"]: row for row in MmDocumentDerivative.objects.filter(
+                document_id__in=batch).values("document_id", "word_count", "char_count", "toc")}
+            loaded = MmDocument.objects.filter(id__in=batch).select_related("category").in_bulk()
+            for document_id in batch:
+                document = loaded[document_id]
+                category_path = [category_names.get(item, "") for item in parse_tree_path(document.tree_path)]
+                meta = {
+                    "id": document.id,
+                    "name": document.name,
+                    "type_id": document.type_id,
+                    "category_id": document.category_id,
+                    "category_name": document.category.name,
+                    "master": document.master,
+                    "update_time": document.update_time,
+                    "sort": document.sort,
+                    "rank": document.rank,
+                }
+                text = document.detail_text or ""
+                derivative = derivatives.get(document.id, {})
+                write_json(os.path.join(temp_dir, "documents", f"{document.id}.json"), {
+                    **meta,
+                    "category_path": category_path + [document.category.name],
+                    "word_count": derivative.get("word_count"),
+                    "char_count": derivative.get("char_count"),
+                    "toc": derivative.get("toc", []),
+                    "detail_text": text,
+                })
+                write_file(os.path.join(temp_dir, "documents", f"{document.id}.html"), render_to_string(
+                    "static_site/document.html",
+                    {"repository": repository_data, "document": meta, "category_path": category_path, "text": text}))
+                index = len(documents)
+                documents.append(meta)
+                documents_by_category.setdefault(document.category_id, []).append(meta)
+                for term, frequency in document_term_frequency(document.name, text).items():
+                    postings.setdefault(term, []).append((frequency, index))
+
+        write_json(os.path.join(temp_dir, "documents.json"), documents)
+        # 检索索引：词条 -> [[文档序号, 词频]]（文档序号对应 documents 数组下标），前端按词频累加排序
+        write_json(os.path.join(temp_dir, "search.json"), {
+            "documents": [[item["id"], item["name"], item["category_id"]] for item in documents],
+            "terms": {term: [[index, frequency] for frequency, index in sorted(items, reverse=True)[:MAX_POSTINGS]]
+                      for term, items in postings.items()},
+        })
+        write_file(os.path.join(temp_dir, "index.html"), render_to_string("static_site/index.html", {
+            "repository": repository_data, "items": flatten_tree(tree, documents_by_category),
+            "count": len(documents)}))
+
+        os.rename(temp_dir, os.path.join(root, build))
+        manifest = {
+            "repository_id": repository.id,
+            "build": build,
+            "built_at": timezone.now(),
+            "documents": len(documents),
+            "categories": len(category_names),
+            "files": {"tree": "tree.json", "documents": "documents.json", "search": "search.json",
+                      "index": "index.html", "document": "documents/{id}.json", "document_html": "documents/{id}.html"},
+        }
+        manifest_path = os.path.join(root, MANIFEST)
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, cls=DjangoJSONEncoder, ensure_ascii=False)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # 生成期间已恢复归档：丢弃本次结果
+    if not MmRepository.objects.filter(id=repository_id, status="archived").exists():
+        remove_site(repository_id)
+        return None
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name != build and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+    return manifest
+
+
+def remove_site(repository_id):
+    """删除知识库的全部静态文件"""
+    shutil.rmtree(site_dir(repository_id), ignore_errors=True)
+
+
+def read_manifest(repository_id):
+    try:
+        with open(os.path.join(site_dir(repository_id), MANIFEST), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def sign_build(repository_id, build, now=None):
+    """
+    版本目录的访问签名：{过期时间戳}-{签名}
+    过期时间按有效期取整，同一时间段内签名相同（剩余有效期不少于一个有效期）
+    """
+    now = int(now or time.time())
+    expires = (now // URL_MAX_AGE + 2) * URL_MAX_AGE
+    signature = signing.Signer(salt="static_site").signature(f"{int(repository_id)}:{build}:{expires}")
+    return f"{expires}-{signature}"
+
+
+def check_signature(repository_id, build, token):
+    """校验访问签名，返回剩余有效秒数；签名无效或已过期时返回 None"""
+    expires, _, signature = token.partition("-")
+    if not expires.isdigit():
+        return None
+    expected = signing.Signer(salt="static_site").signature(f"{int(repository_id)}:{build}:{expires}")
+    remaining = int(expires) - int(time.time())
+    if not constant_time_compare(signature, expected) or remaining <= 0:
+        return None
+    return remaining
+
+
+def site_file(repository_id, build, path):
+    """版本目录下文件的绝对路径（防止越出版本目录），不存在时返回 None"""
+    base = os.path.realpath(os.path.join(site_dir(repository_id), build))
+    full_path = os.path.realpath(os.path.join(base, path))
+    if not full_path.startswith(base + os.sep) or not os.path.isfile(full_path):
+        return None
+    return full_path
+
+
+def schedule_build(repository_id):
+    """提交静态化任务；任务提交失败时同步执行"""
+    from dvadmin.system.tasks import build_static_site
+    try:
+        build_static_site.delay(repository_id)
+    except Exception as e:
+        logger.warning(f"知识库[{repository_id}]静态化任务提交失败，改为同步执行: {e}")
+        build_site(repository_id)
@@ -9,6 +9,8 @@
 import hashlib
 import random
 
+import pypinyin
+
 CHAR_SET = ("2", "3", "4", "5",
             "6", "7", "8", "9", "A", "B", "C", "D", "E", "F", "G", "H",
             "J", "K", "L", "M", "N", "P", "Q", "R", "S", "T", "U", "V",
@@ -40,3 +42,21 @@ def has_md5(str, salt='123456'):
     md.update(str.encode())
     res = md.hexdigest()
     return res
+
+
+def get_pinyin(text):
+    """
+    全拼（不带声调，非汉字原样保留），如 “重庆” -> “chongqing”
+    :param text:
+    :return:
+    """
+    return ''.join([''.join(i) for i in pypinyin.pinyin(text, style=pypinyin.NORMAL)])
+
+
+def get_pinyin_initials(text):
+    """
+    拼音首字母（非汉字原样保留），如 “重庆abc” -> “cqabc”
+    :param text:
+    :return:
+    """
+    return ''.join([''.join(i) for i in pypinyin.pinyin(text, style=pypinyin.FIRST_LETTER)])
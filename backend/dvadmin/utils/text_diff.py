@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 文本差异计算
+    - 行/词先映射为整数（相同内容共享同一编号），再在整数序列上执行 Myers O(ND) 差异算法
+    - 行级差异编码为紧凑的增量（delta），用于修订历史存储与重建
+"""
+import difflib
+import re
+
+# 编辑距离超过该值时不再继续 Myers 搜索（避免大范围改写时耗时/内存过高）
+MAX_EDIT_DISTANCE = 4000
+re_word = re.compile(r"\s+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]|\w+|[^\w\s]")
+
+
+def split_lines(text):
+    """按行切分并保留换行符，保证可以无损还原"""
+    return (text or "").splitlines(keepends=True)
+
+
+def split_words(text):
+    """按词切分：空白、单个中日韩字符、连续字母数字、单个符号各为一个单位"""
+    return re_word.findall(text or "")
+
+
+def hash_sequences(a, b):
+    """将两个序列的元素映射为整数编号，后续比较只做整数比较"""
+    ids = {}
+    return [ids.setdefault(item, len(ids)) for item in a], [ids.setdefault(item, len(ids)) for item in b]
+
+
+def myers_edits(a, b, max_distance=MAX_EDIT_DISTANCE):
+    """
+    Myers 差异算法
+    :return: 编辑序列 [(操作, a下标, b下标)]，操作为 equal/delete/insert；超过最大编辑距离时返回 None
+    """
+    n, m = len(a), len(b)
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_distance) + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x, y = x + 1, y + 1
+            v[k] = x
+            if x >= n and y >= m:
+                return backtrack(trace, n, m)
+    return None
+
+
+def backtrack(trace, x, y):
+    edits = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v.get(k - 1, -1) < v.get(k + 1, -1)):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v.get(prev_k, 0)
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x, y = x - 1, y - 1
+            edits.append(("equal", x, y))
+        if d > 0:
+            if x == prev_x:
+                edits.append(("insert", x, prev_y))
+            else:
+                edits.append(("delete", prev_x, y))
+        x, y = prev_x, prev_y
+    edits.reverse()
+    return edits
+
+
+def opcodes(a, b, max_distance=MAX_EDIT_DISTANCE):
+    """
+    计算差异操作码（与 difflib.SequenceMatcher.get_opcodes 格式一致，不含 replace）
+    先去掉公共前缀/后缀，再对中间部分做哈希 + Myers；编辑距离过大时退回 difflib
+    :return: [(操作, i1, i2, j1, j2)]
+    """
+    prefix = 0
+    limit = min(len(a), len(b))
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    middle_a, middle_b = hash_sequences(a[prefix:len(a) - suffix], b[prefix:len(b) - suffix])
+
+    edits = myers_edits(middle_a, middle_b, max_distance)
+    if edits is None:
+        result = []
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, middle_a, middle_b, autojunk=False).get_opcodes():
+            if tag == "replace":
+                result.extend([("delete", i1, i2, j1, j1), ("insert", i2, i2, j1, j2)])
+            else:
+                result.append((tag, i1, i2, j1, j2))
+    else:
+        result = []
+        for tag, i, j in edits:
+            last = result[-1] if result else None
+            if last and last[0] == tag:
+                result[-1] = (tag, last[1], i + (tag != "insert"), last[3], j + (tag != "delete"))
+            else:
+                result.append((tag, i, i + (tag != "insert"), j, j + (tag != "delete")))
+
+    shifted = [(tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix) for tag, i1, i2, j1, j2 in result]
+    if prefix:
+        shifted.insert(0, ("equal", 0, prefix, 0, prefix))
+    if suffix:
+        shifted.append(("equal", len(a) - suffix, len(a), len(b) - suffix, len(b)))
+    return shifted
+
+
+def make_delta(old_text, new_text):
+    """
+    行级增量：整数 n 表示保留旧文本 n 行，-n 表示删除旧文本 n 行，字符串列表表示插入的行
+    """
+    old_lines, new_lines = split_lines(old_text), split_lines(new_text)
+    delta = []
+    for tag, i1, i2, j1, j2 in opcodes(old_lines, new_lines):
+        if tag == "equal":
+            delta.append(i2 - i1)
+        elif tag == "delete":
+            delta.append(i1 - i2)
+        elif delta and isinstance(delta[-1], list):
+            delta[-1].extend(new_lines[j1:j2])
+        else:
+            delta.append(new_lines[j1:j2])
+    return delta
+
+
+def apply_delta(old_text, delta):
+    """按增量由旧文本还原新文本"""
+    old_lines = split_lines(old_text)
+    result = []
+    position = 0
+    for op in delta:
+        if isinstance(op, list):
+            result.extend(op)
+        elif op >= 0:
+            result.extend(old_lines[position:position + op])
+            position += op
+        else:
+            position -= op
+    return "".join(result)
+
+
+def diff_lines(old_text, new_text, context=3):
+    """
+    行级差异（用于展示），相同内容超过上下文行数时折叠为 skip
+    :return: (差异块列表, 新增行数, 删除行数)
+    """
+    old_lines, new_lines = split_lines(old_text), split_lines(new_text)
+    codes = opcodes(old_lines, new_lines)
+    blocks, inserted, deleted = [], 0, 0
+    for index, (tag, i1, i2, j1, j2) in enumerate(codes):
+        if tag == "insert":
+            inserted += j2 - j1
+            blocks.append({"op": "insert", "old_start": i1 + 1, "new_start": j1 + 1, "lines": new_lines[j1:j2]})
+        elif tag == "delete":
+            deleted += i2 - i1
+            blocks.append({"op": "delete", "old_start": i1 + 1, "new_start": j1 + 1, "lines": old_lines[i1:i2]})
+        else:
+            head = context if index > 0 else 0
+            tail = context if index < len(codes) - 1 else 0
+            if context < 0 or i2 - i1 <= head + tail:
+                blocks.append({"op": "equal", "old_start": i1 + 1, "new_start": j1 + 1, "lines": old_lines[i1:i2]})
+                continue
+            if head:
+                blocks.append({"op": "equal", "old_start": i1 + 1, "new_start": j1 + 1, "lines": old_lines[i1:i1 + head]})
+            blocks.append({"op": "skip", "old_start": i1 + head + 1, "new_start": j1 + head + 1,
+                           "count": i2 - i1 - head - tail})
+            if tail:
+                blocks.append({"op": "equal", "old_start": i2 - tail + 1, "new_start": j2 - tail + 1,
+                               "lines": old_lines[i2 - tail:i2]})
+    return blocks, inserted, deleted
+
+
+def diff_words(old_text, new_text):
+    """
+    词级差异（用于展示），相邻同类操作合并为一段文本
+    :return: (差异片段列表, 新增词数, 删除词数)
+    """
+    old_words, new_words = split_words(old_text), split_words(new_text)
+    parts, inserted, deleted = [], 0, 0
+    for tag, i1, i2, j1, j2 in opcodes(old_words, new_words):
+        if tag == "insert":
+            inserted += sum(1 for word in new_words[j1:j2] if not word.isspace())
+            parts.append({"op": "insert", "text": "".join(new_words[j1:j2])})
+        elif tag == "delete":
+            deleted += sum(1 for word in old_words[i1:i2] if not word.isspace())
+            parts.append({"op": "delete", "text": "".join(old_words[i1:i2])})
+        else:
+            parts.append({"op": "equal", "text": "".join(old_words[i1:i2])})
+    return parts, inserted, deleted
+
+
+def apply_patches(text, patches):
+    """
+    按字符偏移应用编辑补丁
+    :param patches: [{"offset": 起始位置, "delete": 删除字符数, "insert": 插入文本}]，偏移均相对于原文，区间不能重叠
+    :return: 新文本；补丁不合法时抛出 ValueError
+    """
+    edits = []
+    for patch in patches:
+        if not isinstance(patch, dict):
+            raise ValueError("补丁格式错误")
+        try:
+            offset, delete = int(patch.get("offset", 0)), int(patch.get("delete", 0))
+        except (TypeError, ValueError):
+            raise ValueError("补丁 offset/delete 必须为整数")
+        insert = patch.get("insert") or ""
+        if not isinstance(insert, str):
+            raise ValueError("补丁 insert 必须为字符串")
+        if offset < 0 or delete < 0 or offset + delete > len(text):
+            raise ValueError(f"补丁位置超出正文范围：offset={offset}, delete={delete}")
+        edits.append((offset, delete, insert))
+    edits.sort(key=lambda edit: edit[0])
+    parts, position = [], 0
+    for offset, delete, insert in edits:
+        if offset < position:
+            raise ValueError(f"补丁区间重叠：offset={offset}")
+        parts.append(text[position:offset])
+        parts.append(insert)
+        position = offset + delete
+    parts.append(text[position:])
+    return "".join(parts)
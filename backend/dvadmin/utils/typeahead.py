@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 目录/文档名称快速跳转（输入联想）索引
+    - 每个知识库一份进程内索引：（匹配键, 类型, ID）按匹配键排序的数组，前缀查询为一次二分查找 + 顺序扫描
+    - 匹配键包含名称、全拼、拼音首字母（均转小写并去除空白），如 “重庆” 可由 “重”、“chong”、“cq” 匹配
+    - 增量更新：目录/文档新增、改名、移动、删除时在缓存中递增知识库的变更序号并记录变更项，
+      各进程查询时按序号差只重新加载变更项；序号差过大、变更记录过期或缓存被清空时整体重建
+    - 整体构建的结果（名称与匹配键）保存到缓存，新进程从快照加载后重放变更，避免重复计算拼音
+"""
+import logging
+import threading
+from bisect import bisect_left, insort
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from dvadmin.utils.string_util import get_pinyin, get_pinyin_initials
+
+KIND_CATEGORY = "category"
+KIND_DOCUMENT = "document"
+SEQ_KEY = "typeahead_seq:{repository_id}"
+CHANGE_KEY = "typeahead_change:{repository_id}:{seq}"
+SNAPSHOT_KEY = "typeahead_snapshot:{repository_id}"
+CHANGE_TIMEOUT = 60 * 60
+SNAPSHOT_TIMEOUT = 60 * 60 * 24
+# 单次最多重放的变更数，超过时整体重建
+MAX_REPLAY = 500
+# 参与排序的候选数（返回条数的倍数）
+CANDIDATE_FACTOR = 5
+
+logger = logging.getLogger(__name__)
+_indexes = {}
+_lock = threading.Lock()
+
+
+def normalize(text):
+    return "".join((text or "").lower().split())
+
+
+@lru_cache(maxsize=100000)
+def name_keys(name):
+    """名称的匹配键：名称、全拼、拼音首字母（拼音计算较慢，按名称缓存）"""
+    keys = {normalize(name), normalize(get_pinyin(name)), normalize(get_pinyin_initials(name))}
+    keys.discard("")
+    return tuple(keys)
+
+
+class TypeaheadIndex:
+    """单个知识库的前缀索引"""
+
+    def __init__(self, repository_id, seq):
+        self.repository_id = repository_id
+        self.seq = seq
+        self.rows = []
+        self.items = {}
+
+    def copy(self):
+        """复制索引（重放在副本上进行，完成后整体替换，查询无需加锁）"""
+        index = TypeaheadIndex(self.repository_id, self.seq)
+        index.rows = list(self.rows)
+        index.items = dict(self.items)
+        return index
+
+    def add(self, kind, item_id, name, parent_id, insert=True):
+        keys = name_keys(name)
+        self.items[(kind, item_id)] = {"name": name, "parent_id": parent_id, "keys": keys}
+        if insert:
+            for key in keys:
+                insort(self.rows, (key, kind, item_id))
+
+    def remove(self, kind, item_id):
+        item = self.items.pop((kind, item_id), None)
+        if item is None:
+            return
+        for key in item["keys"]:
+            position = bisect_left(self.rows, (key, kind, item_id))
+            if position < len(self.rows) and self.rows[position] == (key, kind, item_id):
+                del self.rows[position]
+
+    def load(self, category_ids=None, document_ids=None, insert=True):
+        """从数据库加载目录/文档名称（不传ID则加载整个知识库）"""
+        from dvadmin.system.models import Category, MmDocument
+
+        categories = Category.objects.filter(repository_id=self.repository_id)
+        documents = MmDocument.objects.filter(category__repository_id=self.repository_id)
+        if category_ids is not None:
+            categories = categories.filter(id__in=category_ids)
+        if document_ids is not None:
+            documents = documents.filter(id__in=document_ids)
+        if category_ids is None or category_ids:
+            for item_id, name, parent_id in categories.values_list("id", "name", "parent_category_id"):
+                self.add(KIND_CATEGORY, item_id, name, parent_id, insert)
+        if document_ids is None or document_ids:
+            for item_id, name, parent_id in documents.values_list("id", "name", "category_id"):
+                self.add(KIND_DOCUMENT, item_id, name, parent_id, insert)
+
+    def build(self):
+        """整体构建：先生成全部匹配键再一次排序（比逐条插入快）"""
+        self.load(insert=False)
+        self.rows = sorted((key, kind, item_id) for (kind, item_id), item in self.items.items()
+                           for key in item["keys"])
+
+    def snapshot(self):
+        return self.seq, [(kind, item_id, item["name"], item["parent_id"], item["keys"])
+                          for (kind, item_id), item in self.items.items()]
+
+    @classmethod
+    def from_snapshot(cls, repository_id, snapshot):
+        seq, items = snapshot
+        index = cls(repository_id, seq)
+        index.items = {(kind, item_id): {"name": name, "parent_id": parent_id, "keys": keys}
+                       for kind, item_id, name, parent_id, keys in items}
+        index.rows = sorted((key, kind, item_id) for kind, item_id, _, _, keys in items for key in keys)
+        return index
+
+    def replay(self, changes):
+        """重新加载变更项：先移除，数据库中仍存在的再加入"""
+        category_ids = {item_id for kind, item_id in changes if kind == KIND_CATEGORY}
+        document_ids = {item_id for kind, item_id in changes if kind == KIND_DOCUMENT}
+        for kind, item_id in changes:
+            self.remove(kind, item_id)
+        self.load(list(category_ids), list(document_ids))
+
+    def search(self, query, limit=10, kind=None):
+        """
+        前缀查询：名称完全匹配优先，其次名称前缀匹配，再按名称长度排序
+        :return: [{"kind", "id", "name", "parent_id"}]
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        position = bisect_left(self.rows, (query,))
+        seen, candidates = set(), []
+        while position < len(self.rows) and len(candidates) < limit * CANDIDATE_FACTOR:
+            key, row_kind, item_id = self.rows[position]
+            if not key.startswith(query):
+                break
+            position += 1
+            if (kind and row_kind != kind) or (row_kind, item_id) in seen:
+                continue
+            seen.add((row_kind, item_id))
+            candidates.append((row_kind, item_id))
+        results = []
+        for row_kind, item_id in candidates:
+            item = self.items[(row_kind, item_id)]
+            name = normalize(item["name"])
+            results.append(((name != query, not name.startswith(query), len(name)), {
+                "kind": row_kind, "id": item_id, "name": item["name"], "parent_id": item["parent_id"],
+            }))
+        results.sort(key=lambda result: result[0])
+        return [result for _, result in results[:limit]]
+
+
+def get_seq(repository_id):
+    """知识库的变更序号（使用时间戳初始化，缓存被清空后不会与旧序号重复）"""
+    key = SEQ_KEY.format(repository_id=repository_id)
+    seq = cache.get(key)
+    if seq is None:
+        cache.add(key, int(timezone.now().timestamp() * 1000), timeout=None)
+        seq = cache.get(key)
+    return seq
+
+
+def incr_seq(repository_id, delta=1):
+    key = SEQ_KEY.format(repository_id=repository_id)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        get_seq(repository_id)
+        return cache.incr(key, delta)
+
+
+def record_change(repository_id, kind, item_id):
+    """记录目录/文档的变更（需在事务提交后调用）"""
+    if repository_id is None:
+        return
+    seq = incr_seq(repository_id)
+    cache.set(CHANGE_KEY.format(repository_id=repository_id, seq=seq), (kind, item_id), CHANGE_TIMEOUT)
+
+
+def reset_index(*repository_ids):
+    """批量修改（如目录跨知识库移动）后使索引整体重建：序号跳过超过最大重放数"""
+    for repository_id in set(repository_ids):
+        if repository_id is not None:
+            incr_seq(repository_id, MAX_REPLAY + 1)
+
+
+def get_changes(repository_id, start_seq, end_seq):
+    """读取 (start_seq, end_seq] 之间的变更项，变更过多或记录已过期时返回 None"""
+    if not start_seq < end_seq <= start_seq + MAX_REPLAY:
+        return None
+    keys = [CHANGE_KEY.format(repository_id=repository_id, seq=seq) for seq in range(start_seq + 1, end_seq + 1)]
+    changes = cache.get_many(keys)
+    return set(changes.values()) if len(changes) == len(keys) else None
+
+
+def get_index(repository_id):
+    """获取知识库的最新索引（本进程已有索引时只重放变更，没有时优先从缓存快照加载）"""
+    repository_id = int(repository_id)
+    seq = get_seq(repository_id)
+    index = _indexes.get(repository_id)
+    if index is not None and index.seq == seq:
+        return index
+    with _lock:
+        index = _indexes.get(repository_id)
+        if index is not None and index.seq == seq:
+            return index
+        if index is None:
+            snapshot = cache.get(SNAPSHOT_KEY.format(repository_id=repository_id))
+            if snapshot is not None and snapshot[0] <= seq:
+                index = TypeaheadIndex.from_snapshot(repository_id, snapshot)
+        changes = get_changes(repository_id, index.seq, seq) if index is not None else None
+        if changes is not None:
+            index = index.copy()
+            index.replay(changes)
+            index.seq = seq
+        elif index is None or index.seq != seq:
+            # 先取序号再读数据库：构建期间发生的变更会在下次查询时重放
+            index = TypeaheadIndex(repository_id, seq)
+            index.build()
+            try:
+                cache.set(SNAPSHOT_KEY.format(repository_id=repository_id), index.snapshot(), SNAPSHOT_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"知识库[{repository_id}]快速跳转索引快照保存失败: {e}")
+        _indexes[repository_id] = index
+        return index